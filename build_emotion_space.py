@@ -1,22 +1,27 @@
 # /build_emotion_space.py
 # タイトル: Emotion Space Builder Script
-# 役割: 感情とSAE特徴のマッピングファイル(emotion_mapping.json)を生成するためのワンタイムスクリプト。
+# 役割: 感情とSAE特徴のマッピングファイル(emotion_mapping.safetensors)を生成するためのワンタイムスクリプト。
 
 import json
 import logging
 import sys
 from llm_api.emotion_core.sae_manager import SAEManager
 from llm_api.emotion_core.emotion_space import EmotionSpace
+from llm_api.emotion_core.steering_manager import EmotionSteeringManager
+from llm_api.config import settings
 from llm_api.providers import get_provider
 from dotenv import load_dotenv
 
 # 注: このスクリプトはLLMへのAPIコールを多数行い、計算に時間がかかります。
+#     単語の特徴はバッチ単位で抽出し、チェックポイントに保存するため、中断しても途中から再開できます。
 
 # --- 設定 ---
 SAE_RELEASE = "gemma-scope-2b-pt-att"
 SAE_ID = "layer_9/width_16k/average_l0_34"
 CONCEPT_SETS_PATH = "data/emotion_concepts/english.json" # このファイルが別途必要
-OUTPUT_MAPPING_PATH = "config/emotion_mapping.json"
+OUTPUT_MAPPING_PATH = "config/emotion_mapping.safetensors" # 単語ごとの特徴も保存され、再構築時に再利用される
+OUTPUT_STEERING_CACHE_PATH = "config/emotion_steering_vectors.safetensors"
+WORD_FEATURES_CHECKPOINT_DIR = "./.cache/emotion_word_features" # 中断した場合、抽出済みの単語を再利用して再開する
 PROVIDER_NAME = "ollama" # LLMへの単語入力に使用
 
 # ロギング設定
@@ -62,17 +67,30 @@ async def main():
                 import torch
                 # SAEの入力次元に合わせる (仮: 2048)
                 return torch.randn(1, 1, 2048)
+            def get_hidden_states_for_texts(self, texts):
+                # 複数の単語をパディングして1回の順伝播で処理する想定（ここではダミー）
+                import torch
+                return torch.randn(len(texts), 1, 2048)
 
         llm_engine_dummy = SimpleLLMEngineWrapper(llm_provider)
 
-        sae_manager = SAEManager(release=SAE_RELEASE, sae_id=SAE_ID)
+        sae_manager = SAEManager(release=SAE_RELEASE, sae_id=SAE_ID, weights_path=settings.SAE_WEIGHTS_PATH, dtype=settings.SAE_DTYPE)
         emotion_space = EmotionSpace(llm_engine_dummy, sae_manager)
         
+        # 既存のマッピングファイルに同じSAEで抽出した単語の特徴があれば再利用する
+        emotion_space.load_word_features(OUTPUT_MAPPING_PATH)
+
         # 感情空間を構築
-        emotion_space.build_space(CONCEPT_SETS_PATH)
+        emotion_space.build_space(CONCEPT_SETS_PATH, checkpoint_dir=WORD_FEATURES_CHECKPOINT_DIR)
         
         # 結果をファイルに保存
         emotion_space.save_mapping(OUTPUT_MAPPING_PATH)
+
+        # ステアリングベクトル（合計・NMF）を事前計算し、推論時の再計算を省く
+        steering_manager = EmotionSteeringManager(sae_manager, emotion_space, cache_path=OUTPUT_STEERING_CACHE_PATH)
+        steering_manager.precompute_steering_vectors(save=False)
+        count = steering_manager.precompute_steering_vectors(use_nmf=True)
+        logger.info(f"ステアリングベクトルを事前計算しました: {OUTPUT_STEERING_CACHE_PATH} (NMF {count}件)")
         
         logger.info("感情空間マッピングの構築が完了しました！")
 
@@ -0,0 +1,170 @@
+# /cli/batch_runner.py
+# タイトル: JSONL Batch Runner
+# 役割: JSONL形式のリクエストファイルを逐次読み込み、プロバイダーごとの同時実行数制限の下で並行処理する。
+#       結果は完了順にNDJSONとして追記し、中断後はリクエストIDを基に完了済みのものをスキップして再開できる。
+
+import asyncio
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Set, Tuple
+
+from llm_api.config import settings
+
+logger = logging.getLogger(__name__)
+
+ProcessFn = Callable[..., Awaitable[Dict[str, Any]]]
+
+# リクエスト行のうち、処理オプションとして扱わないキー
+RESERVED_KEYS = {"id", "request_id", "prompt", "provider", "options"}
+
+
+def load_completed_ids(output_path: Path) -> Set[str]:
+    """既存の出力ファイルから、エラーなく完了したリクエストIDの集合を返す。"""
+    completed: Set[str] = set()
+    if not output_path.exists():
+        return completed
+    with output_path.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 中断時に書きかけだった最終行などは無視する
+                continue
+            if record.get("status") == "ok" and record.get("id") is not None:
+                completed.add(str(record["id"]))
+    return completed
+
+
+def iter_requests(input_path: Path) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """入力ファイルを一行ずつ読み込み、(行番号, リクエスト) を返す。ファイル全体はメモリに載せない。"""
+    with input_path.open("r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.error(f"{input_path}:{line_no} のJSONを解析できません: {e}")
+                request = {"_parse_error": str(e)}
+            if not isinstance(request, dict):
+                request = {"_parse_error": "リクエストはJSONオブジェクトである必要があります。"}
+            yield line_no, request
+
+
+class BatchRunner:
+    """JSONLバッチ実行を担当するクラス"""
+
+    def __init__(
+        self,
+        process_fn: ProcessFn,
+        default_provider: Optional[str] = None,
+        default_options: Optional[Dict[str, Any]] = None,
+        concurrency_per_provider: Optional[int] = None,
+        provider_limits: Optional[Dict[str, int]] = None,
+        max_in_flight: Optional[int] = None
+    ):
+        """
+        Args:
+            process_fn: process_request(provider_name, prompt, **options) 互換の非同期関数。
+            default_provider: リクエストにproviderが無い場合に使うプロバイダー。
+            default_options: 全リクエストに適用する既定のオプション（リクエスト側の指定が優先）。
+            concurrency_per_provider: 全プロバイダーに適用する同時実行数。Noneの場合はプロバイダーごとの設定
+                                      （settings.concurrency_limit_for）に従う。
+            provider_limits: プロバイダー名ごとの同時実行数の個別指定（上記より優先）。
+            max_in_flight: 入力ファイルから先読みして保持するリクエスト数の上限。
+        """
+        self.process_fn = process_fn
+        self.default_provider = default_provider
+        self.default_options = default_options or {}
+        self.concurrency_per_provider = concurrency_per_provider
+        self.provider_limits: Dict[str, int] = dict(provider_limits or {})
+        self.max_in_flight = max_in_flight or settings.BATCH_MAX_IN_FLIGHT
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _semaphore_for(self, provider_name: str) -> asyncio.Semaphore:
+        if provider_name not in self._semaphores:
+            if provider_name in self.provider_limits:
+                limit = self.provider_limits[provider_name]
+            else:
+                limit = self.concurrency_per_provider or settings.concurrency_limit_for(provider_name)
+            self._semaphores[provider_name] = asyncio.Semaphore(max(1, limit))
+        return self._semaphores[provider_name]
+
+    async def _run_one(self, request_id: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """一件のリクエストを実行し、出力レコードを返す。例外は記録に変換し、バッチ全体は止めない。"""
+        started = time.time()
+        record: Dict[str, Any] = {"id": request_id}
+        if "_parse_error" in request:
+            return {**record, "status": "error", "error": f"不正なリクエスト行: {request['_parse_error']}"}
+
+        provider_name = request.get("provider") or self.default_provider
+        prompt = request.get("prompt")
+        if not provider_name or not prompt:
+            return {**record, "status": "error", "error": "'prompt' とプロバイダーの指定が必要です。"}
+
+        options = {**self.default_options}
+        options.update(request.get("options") or {})
+        options.update({k: v for k, v in request.items() if k not in RESERVED_KEYS})
+        record.update({"provider": provider_name, "mode": options.get("mode")})
+
+        async with self._semaphore_for(provider_name):
+            try:
+                response = await self.process_fn(provider_name, prompt, **options)
+            except Exception as e:
+                logger.error(f"リクエスト '{request_id}' の処理中に例外が発生: {e}", exc_info=True)
+                response = {"text": "", "error": str(e)}
+
+        record["status"] = "error" if response.get("error") else "ok"
+        record["elapsed"] = round(time.time() - started, 3)
+        record["response"] = response
+        return record
+
+    async def run(self, input_path: str, output_path: str, resume: bool = True) -> Dict[str, Any]:
+        """
+        バッチを実行し、集計結果を返す。
+        resumeがTrueの場合は出力ファイルに追記し、完了済み(status=ok)のIDをスキップする。
+        """
+        input_file, output_file = Path(input_path), Path(output_path)
+        completed_ids = load_completed_ids(output_file) if resume else set()
+        if completed_ids:
+            logger.info(f"{len(completed_ids)}件の完了済みリクエストをスキップして再開します。")
+
+        summary = {"total": 0, "skipped": 0, "succeeded": 0, "failed": 0}
+        start_time = time.time()
+        pending: Set["asyncio.Task[Dict[str, Any]]"] = set()
+        seen_ids: Set[str] = set()
+
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        with output_file.open("a" if resume else "w", encoding="utf-8") as out:
+
+            def write_finished(done: Set["asyncio.Task[Dict[str, Any]]"]) -> None:
+                for task in done:
+                    record = task.result()
+                    summary["succeeded" if record["status"] == "ok" else "failed"] += 1
+                    out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                out.flush()
+
+            for line_no, request in iter_requests(input_file):
+                summary["total"] += 1
+                request_id = str(request.get("id", request.get("request_id", f"line-{line_no}")))
+                if request_id in completed_ids:
+                    summary["skipped"] += 1
+                    continue
+                if request_id in seen_ids:
+                    logger.warning(f"リクエストID '{request_id}' が重複しています ({input_file}:{line_no})。")
+                seen_ids.add(request_id)
+
+                pending.add(asyncio.create_task(self._run_one(request_id, request)))
+                if len(pending) >= self.max_in_flight:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    write_finished(done)
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                write_finished(done)
+
+        summary["elapsed"] = round(time.time() - start_time, 3)
+        logger.info(f"バッチ処理完了: {summary}")
+        return summary
@@ -0,0 +1,64 @@
+# /cli/client.py
+# タイトル: Thin Client for the Resident Server
+# 役割: CLIの引数を常駐サーバー (cli/server.py) へ転送し、結果を受け取る。重いモジュールは一切インポートしない。
+
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def _resolve_server_url(server_url: str) -> Tuple[str, Optional[str]]:
+    """
+    サーバーURLを (HTTPのベースURL, Unixソケットパス) に変換する。
+    'unix:///path/to/sock' 形式の場合はUnixドメインソケット経由で接続する。
+    """
+    if server_url.startswith("unix://"):
+        return "http://localhost", server_url[len("unix://"):]
+    return server_url.rstrip("/"), None
+
+
+async def forward_request(
+    server_url: str,
+    provider_name: str,
+    prompt: str,
+    stream_callback: Optional[Callable[[str], Awaitable[None]]] = None,
+    timeout: Optional[float] = None,
+    **kwargs: Any
+) -> Dict[str, Any]:
+    """
+    常駐サーバーへリクエストを転送する。stream_callbackが指定された場合はNDJSONストリームを受信し、
+    チャンクごとにコールバックを呼び出す。戻り値はMetaIntelligenceCLIHandler.process_requestと同じ形式。
+    """
+    base_url, uds = _resolve_server_url(server_url)
+    transport = httpx.AsyncHTTPTransport(uds=uds) if uds else None
+    payload = {**kwargs, "provider": provider_name, "prompt": prompt, "stream": stream_callback is not None}
+
+    try:
+        async with httpx.AsyncClient(base_url=base_url, transport=transport, timeout=timeout) as client:
+            if stream_callback is None:
+                response = await client.post("/v1/solve", json=payload)
+                if response.status_code != 200:
+                    return {"text": "", "error": f"サーバーエラー ({response.status_code}): {response.json().get('error')}"}
+                return response.json()
+
+            result: Dict[str, Any] = {"text": "", "error": "サーバーから最終結果を受信できませんでした。"}
+            async with client.stream("POST", "/v1/solve", json=payload) as response:
+                if response.status_code != 200:
+                    body = json.loads(await response.aread() or b"{}")
+                    return {"text": "", "error": f"サーバーエラー ({response.status_code}): {body.get('error')}"}
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    event = json.loads(line)
+                    if event.get("type") == "chunk":
+                        await stream_callback(event.get("text", ""))
+                    elif event.get("type") == "result":
+                        result = event.get("response", {})
+            return result
+    except httpx.TransportError as e:
+        logger.error(f"常駐サーバー '{server_url}' への接続に失敗しました: {e}")
+        return {"text": "", "error": f"常駐サーバー '{server_url}' に接続できません: {e}"}
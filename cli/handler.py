@@ -3,20 +3,23 @@
 # 役割: CLIの初期化と、各専門クラスへの処理の委譲を行う。依存性注入を最終修正。
 
 import logging
-from typing import Any, Dict, Optional
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Optional
 
+from llm_api.config import settings
 from llm_api.providers import get_provider
 from .request_processor import RequestProcessor
-from llm_api.emotion_core.sae_manager import SAEManager
-from llm_api.emotion_core.emotion_space import EmotionSpace
-from llm_api.emotion_core.steering_manager import EmotionSteeringManager
-from llm_api.emotion_core.monitoring_module import EmotionMonitor
-from llm_api.autonomous_action.trigger import EmotionActionTrigger
-from llm_api.autonomous_action.orchestrator import ActionOrchestrator
-from llm_api.tool_integrations.web_search_tool import search as web_search_tool
-from llm_api.value_evolution.evolution_engine import ValueEvolutionEngine
-from llm_api.memory_consolidation.engine import ConsolidationEngine
-from llm_api.rag.knowledge_base import KnowledgeBase
+
+# torch/sae_lens/langchainに依存するモジュールは、各サブシステムの初期化時にインポートする
+if TYPE_CHECKING:
+    from llm_api.emotion_core.sae_manager import SAEManager
+    from llm_api.emotion_core.emotion_space import EmotionSpace
+    from llm_api.emotion_core.steering_manager import EmotionSteeringManager
+    from llm_api.emotion_core.monitoring_module import EmotionMonitor
+    from llm_api.autonomous_action.trigger import EmotionActionTrigger
+    from llm_api.autonomous_action.orchestrator import ActionOrchestrator
+    from llm_api.value_evolution.evolution_engine import ValueEvolutionEngine
+    from llm_api.memory_consolidation.engine import ConsolidationEngine
 
 logger = logging.getLogger(__name__)
 
@@ -25,14 +28,14 @@ class MetaIntelligenceCLIHandler:
     CLIのロジックを統合し、各専門クラスに処理を委譲するハンドラ。
     """
     def __init__(self):
-        self.sae_manager: Optional[SAEManager] = None
-        self.emotion_space: Optional[EmotionSpace] = None
-        self.emotion_steering_manager: Optional[EmotionSteeringManager] = None
-        self.emotion_monitor: Optional[EmotionMonitor] = None
-        self.action_trigger: Optional[EmotionActionTrigger] = None
-        self.action_orchestrator: Optional[ActionOrchestrator] = None
-        self.value_evolution_engine: Optional[ValueEvolutionEngine] = None
-        self.consolidation_engine: Optional[ConsolidationEngine] = None
+        self.sae_manager: Optional["SAEManager"] = None
+        self.emotion_space: Optional["EmotionSpace"] = None
+        self.emotion_steering_manager: Optional["EmotionSteeringManager"] = None
+        self.emotion_monitor: Optional["EmotionMonitor"] = None
+        self.action_trigger: Optional["EmotionActionTrigger"] = None
+        self.action_orchestrator: Optional["ActionOrchestrator"] = None
+        self.value_evolution_engine: Optional["ValueEvolutionEngine"] = None
+        self.consolidation_engine: Optional["ConsolidationEngine"] = None
 
         self._initialize_emotion_system()
         self._initialize_memory_system()
@@ -49,18 +52,31 @@ class MetaIntelligenceCLIHandler:
     def _initialize_emotion_system(self):
         """感情関連システムの初期化を試みる。失敗しても全体は停止しない。"""
         try:
+            from llm_api.emotion_core.sae_manager import SAEManager
+            from llm_api.emotion_core.emotion_space import EmotionSpace
+            from llm_api.emotion_core.steering_manager import EmotionSteeringManager
+            from llm_api.emotion_core.monitoring_module import EmotionMonitor
+            from llm_api.autonomous_action.trigger import EmotionActionTrigger
+            from llm_api.autonomous_action.orchestrator import ActionOrchestrator
+            from llm_api.tool_integrations.web_search_tool import search as web_search_tool
+            from llm_api.value_evolution.evolution_engine import ValueEvolutionEngine
+
             release = "gemma-scope-2b-pt-att"
             sae_id = "layer_9/width_16k/average_l0_34"
-            emotion_map_path = "config/emotion_mapping.json"
+            # バイナリ形式のマッピングを優先し、無い場合は従来のJSONファイルを使用する
+            emotion_map_path = "config/emotion_mapping.safetensors"
+            legacy_emotion_map_path = "config/emotion_mapping.json"
             
-            self.sae_manager = SAEManager(release=release, sae_id=sae_id)
+            # SAEは感情機能の初回使用時にロードされる
+            self.sae_manager = SAEManager(release=release, sae_id=sae_id, weights_path=settings.SAE_WEIGHTS_PATH, dtype=settings.SAE_DTYPE)
             llm_engine_dummy = None
             self.emotion_space = EmotionSpace(llm_engine_dummy, self.sae_manager)
-            if not self.emotion_space.load_mapping(emotion_map_path):
+            if not any(self.emotion_space.load_mapping(path) for path in (emotion_map_path, legacy_emotion_map_path) if Path(path).exists()):
                logger.warning(f"感情マッピングファイル '{emotion_map_path}' が見つからないため、ダミーデータで初期化します。")
                self.emotion_space.emotion_to_features = {"interest": list(range(10)), "joy": list(range(10, 20))}
             
-            self.emotion_steering_manager = EmotionSteeringManager(self.sae_manager, self.emotion_space)
+            steering_cache_path = str(Path(emotion_map_path).with_name("emotion_steering_vectors.safetensors"))
+            self.emotion_steering_manager = EmotionSteeringManager(self.sae_manager, self.emotion_space, cache_path=steering_cache_path)
             self.emotion_monitor = EmotionMonitor(self.sae_manager, self.emotion_space)
             self.action_trigger = EmotionActionTrigger()
 
@@ -82,6 +98,9 @@ class MetaIntelligenceCLIHandler:
     def _initialize_memory_system(self):
         """記憶関連システムの初期化"""
         try:
+            from llm_api.memory_consolidation.engine import ConsolidationEngine
+            from llm_api.rag.knowledge_base import KnowledgeBase
+
             provider_for_memory = get_provider("ollama", enhanced=False)
             # --- ▼▼▼ ここから修正 ▼▼▼ ---
             # KnowledgeBaseのインスタンスを生成し、正しい引数名 `knowledge_graph` で渡す
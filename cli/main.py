@@ -14,7 +14,7 @@ if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
 from llm_api.config import settings
-from cli.handler import MetaIntelligenceCLIHandler
+from llm_api.providers import close_all_providers
 from cli.command_runner import CLICommandRunner
 from llm_api.utils.helper_functions import format_json_output, read_from_pipe_or_file
 from llm_api.emotion_core.types import EmotionCategory
@@ -47,9 +47,11 @@ def create_parser() -> argparse.ArgumentParser:
     parser.add_argument("--temperature", type=float, help="生成の多様性")
     parser.add_argument("--max-tokens", type=int, help="最大トークン数")
     parser.add_argument("--json", action="store_true", help="JSON出力")
+    parser.add_argument("--stream", dest="stream_output", action="store_true", help="最終回答を生成しながら逐次出力（--jsonとは併用不可）")
 
     perf_group = parser.add_argument_group('Performance Options')
     perf_group.add_argument("--n-gpu-layers", type=int, help="GPUにオフロードするレイヤー数")
+    perf_group.add_argument("--no-response-cache", dest="use_response_cache", action="store_false", help="応答キャッシュ (RESPONSE_CACHE_ENABLED) を使わずに必ず推論を実行する")
 
     admin_group = parser.add_argument_group('Admin Commands')
     admin_group.add_argument("--list-providers", action="store_true", help="プロバイダー一覧表示")
@@ -73,9 +75,66 @@ def create_parser() -> argparse.ArgumentParser:
     rag_group.add_argument("--rag", dest="use_rag", action="store_true", help="RAG機能を有効化")
     rag_group.add_argument("--knowledge-base", dest="knowledge_base_path", help="RAGが使用するナレッジベースのパス")
     rag_group.add_argument("--wikipedia", dest="use_wikipedia", action="store_true", help="RAGでWikipediaを使用")
+
+    server_group = parser.add_argument_group('Resident Server Options')
+    server_group.add_argument("--serve", action="store_true", help="常駐サーバーとして起動し、HTTP経由でリクエストを受け付ける")
+    server_group.add_argument("--host", help=f"待ち受けるホスト (デフォルト: {settings.SERVER_HOST})")
+    server_group.add_argument("--port", type=int, help=f"待ち受けるポート (デフォルト: {settings.SERVER_PORT})")
+    server_group.add_argument("--unix-socket", help="Unixドメインソケットのパスで待ち受ける")
+    server_group.add_argument("--server-url", help="リクエストを常駐サーバーへ転送する (例: http://127.0.0.1:8765, unix:///tmp/luca.sock)")
+
+    batch_group = parser.add_argument_group('Batch Options')
+    batch_group.add_argument("--batch", dest="batch_input", help="JSONLファイルの各行 ({\"id\", \"prompt\", \"provider\", \"mode\", \"options\"}) を一括処理する")
+    batch_group.add_argument("--batch-output", help="結果を追記するNDJSONファイル (デフォルト: <入力>.results.jsonl)")
+    batch_group.add_argument("--batch-concurrency", type=int, help="プロバイダーごとの同時実行数 (デフォルト: PROVIDER_CONCURRENCY_LIMITS などのプロバイダーごとの設定)")
+    batch_group.add_argument("--no-resume", dest="batch_resume", action="store_false", help="出力ファイルを上書きし、完了済みリクエストもすべて再実行する")
     
     return parser
 
+# リクエスト処理へ渡さない、実行方法を制御するための引数
+NON_REQUEST_ARGS = [
+    'serve', 'host', 'port', 'unix_socket', 'server_url',
+    'batch_input', 'batch_output', 'batch_concurrency', 'batch_resume',
+]
+
+async def run_batch(args: argparse.Namespace) -> None:
+    """JSONLファイルのリクエストを一括処理し、集計結果を表示する。"""
+    from cli.batch_runner import BatchRunner
+
+    if args.server_url:
+        from functools import partial
+        from cli.client import forward_request
+        process_fn = partial(forward_request, args.server_url)
+    else:
+        from cli.handler import MetaIntelligenceCLIHandler
+        process_fn = MetaIntelligenceCLIHandler().process_request
+
+    default_options = {
+        k: v for k, v in vars(args).items()
+        if k not in ['provider', 'prompt', 'stream_output', 'json'] + NON_REQUEST_ARGS and v is not None
+    }
+    output_path = args.batch_output or f"{args.batch_input}.results.jsonl"
+    runner = BatchRunner(
+        process_fn,
+        default_provider=args.provider,
+        default_options=default_options,
+        concurrency_per_provider=args.batch_concurrency,
+    )
+    try:
+        summary = await runner.run(args.batch_input, output_path, resume=args.batch_resume)
+        if args.json:
+            print(format_json_output(summary))
+        else:
+            print_colored(
+                f"バッチ処理完了: 合計 {summary['total']}件 / 成功 {summary['succeeded']}件 / "
+                f"失敗 {summary['failed']}件 / スキップ {summary['skipped']}件 ({summary['elapsed']:.1f}秒) -> {output_path}",
+                "green" if summary['failed'] == 0 else "yellow"
+            )
+    finally:
+        from llm_api.memory_consolidation.worker_pool import drain_all_consolidation_pools
+        await drain_all_consolidation_pools()
+        await close_all_providers()
+
 async def main():
     """CLIのメイン非同期関数"""
     parser = create_parser()
@@ -98,6 +157,14 @@ async def main():
     if args.troubleshooting:
         command_runner.run_troubleshooting_guide()
         return
+    if args.serve:
+        from cli.server import run_server
+        await run_server(host=args.host, port=args.port, unix_socket=args.unix_socket)
+        return
+
+    if args.batch_input:
+        await run_batch(args)
+        return
 
     # 通常実行時の必須引数をチェック
     if not args.provider:
@@ -107,11 +174,31 @@ async def main():
     if not prompt:
         parser.error("プロンプトが指定されていません (--prompt <text> または --file <path>)。")
 
-    try:
-        cli_handler = MetaIntelligenceCLIHandler()
-        kwargs_for_handler = {k: v for k, v in vars(args).items() if k not in ['provider', 'prompt']}
+    if args.stream_output and args.json:
+        parser.error("--stream と --json は同時に指定できません。")
 
-        response = await cli_handler.process_request(args.provider, prompt, **kwargs_for_handler)
+    try:
+        kwargs_for_handler = {
+            k: v for k, v in vars(args).items()
+            if k not in ['provider', 'prompt', 'stream_output'] + NON_REQUEST_ARGS
+        }
+
+        streamed_any = False
+        if args.stream_output:
+            async def print_chunk(chunk: str) -> None:
+                nonlocal streamed_any
+                streamed_any = True
+                print(chunk, end='', flush=True)
+            kwargs_for_handler['stream_callback'] = print_chunk
+
+        if args.server_url:
+            # 常駐サーバーへ転送し、このプロセスでは重い初期化を行わない
+            from cli.client import forward_request
+            response = await forward_request(args.server_url, args.provider, prompt, **kwargs_for_handler)
+        else:
+            from cli.handler import MetaIntelligenceCLIHandler
+            cli_handler = MetaIntelligenceCLIHandler()
+            response = await cli_handler.process_request(args.provider, prompt, **kwargs_for_handler)
         
         if args.json:
             print(format_json_output(response))
@@ -122,6 +209,8 @@ async def main():
                     print("\n提案:")
                     for suggestion in response["suggestions"]:
                         print(f"- {suggestion}")
+            elif streamed_any:
+                print()
             else:
                 print(response.get("text", ""), end='')
 
@@ -134,6 +223,10 @@ async def main():
     finally:
         logger.debug("シャットダウン前の待機処理...")
         await asyncio.sleep(0.1)
+        # 未処理の記憶統合を処理しきってから、プロバイダーのリソースを解放する
+        from llm_api.memory_consolidation.worker_pool import drain_all_consolidation_pools
+        await drain_all_consolidation_pools()
+        await close_all_providers()
         logger.debug("待機処理完了。")
 
 
@@ -4,33 +4,49 @@
 
 import logging
 import time
-from typing import Any, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional
 
 from llm_api.providers import get_provider
 from llm_api.providers.base import EnhancedLLMProvider
-from llm_api.core_engine.engine import MetaIntelligenceEngine
-from llm_api.core_engine.learner import ComplexityLearner
+from llm_api.core_engine.registry import EngineRegistry, engine_registry as default_engine_registry
 from llm_api.core_engine.enums import ComplexityRegime
 from .utils import convert_kwargs_for_standard, generate_error_suggestions
 from llm_api.emotion_core.types import EmotionCategory
-from llm_api.emotion_core.steering_manager import EmotionSteeringManager
-from llm_api.autonomous_action.trigger import EmotionActionTrigger
-from llm_api.autonomous_action.orchestrator import ActionOrchestrator
-from llm_api.value_evolution.evolution_engine import ValueEvolutionEngine
-from llm_api.memory_consolidation.engine import ConsolidationEngine
+
+# 依存関係は型注釈にのみ使用する（実体はCLIハンドラーが必要に応じて生成して注入する）
+if TYPE_CHECKING:
+    from llm_api.emotion_core.steering_manager import EmotionSteeringManager
+    from llm_api.autonomous_action.trigger import EmotionActionTrigger
+    from llm_api.autonomous_action.orchestrator import ActionOrchestrator
+    from llm_api.value_evolution.evolution_engine import ValueEvolutionEngine
+    from llm_api.memory_consolidation.engine import ConsolidationEngine
 
 logger = logging.getLogger(__name__)
 
+
+class _TrackedStreamCallback:
+    """stream_callbackをラップし、チャンクを1つでも通知したかどうかを記録する"""
+
+    def __init__(self, callback: Callable[[str], Awaitable[None]]):
+        self.callback = callback
+        self.emitted = False
+
+    async def __call__(self, chunk: str) -> None:
+        self.emitted = True
+        await self.callback(chunk)
+
+
 class RequestProcessor:
     """リクエスト処理のコアロジックを担当するクラス"""
 
     def __init__(
         self,
-        emotion_steering_manager: Optional[EmotionSteeringManager],
-        action_trigger: Optional[EmotionActionTrigger],
-        action_orchestrator: Optional[ActionOrchestrator],
-        value_evolution_engine: Optional[ValueEvolutionEngine],
-        consolidation_engine: Optional[ConsolidationEngine]
+        emotion_steering_manager: Optional["EmotionSteeringManager"],
+        action_trigger: Optional["EmotionActionTrigger"],
+        action_orchestrator: Optional["ActionOrchestrator"],
+        value_evolution_engine: Optional["ValueEvolutionEngine"],
+        consolidation_engine: Optional["ConsolidationEngine"],
+        engine_registry: Optional[EngineRegistry] = None
     ):
         self.v2_modes = {
             'efficient', 'balanced', 'decomposed', 'adaptive', 'paper_optimized', 'parallel',
@@ -42,7 +58,13 @@ class RequestProcessor:
         self.value_evolution_engine = value_evolution_engine
         self.consolidation_engine = consolidation_engine
         self.emotion_system_enabled = all([emotion_steering_manager, action_trigger, action_orchestrator])
-        self.learner = ComplexityLearner()
+        # エンジンはプロバイダーとモデルパラメータごとに再利用し、学習器はレジストリ内の全エンジンと共有する
+        self.engine_registry = engine_registry or default_engine_registry
+        self.learner = self.engine_registry.learner
+
+    def invalidate_engines(self, provider_name: Optional[str] = None) -> int:
+        """再利用中のエンジンを破棄する。設定やモデルを変更した後に呼び出す。"""
+        return self.engine_registry.invalidate(provider_name)
 
     async def process_request(self, provider_name: str, prompt: str, **kwargs: Any) -> Dict[str, Any]:
         """
@@ -55,6 +77,11 @@ class RequestProcessor:
         errors_encountered: List[str] = []
 
         final_kwargs = await self._apply_emotion_steering(kwargs)
+        # コールバックはモデルパラメータではないため、プロバイダーへ渡すkwargsから除外する
+        stream_callback = final_kwargs.pop('stream_callback', None)
+        # 出力を開始した後に失敗した場合は、続けて別の回答を出力しないようフォールバックしない
+        if stream_callback is not None:
+            stream_callback = _TrackedStreamCallback(stream_callback)
 
         if use_v2:
             try:
@@ -68,7 +95,8 @@ class RequestProcessor:
                 standard_provider = enhanced_provider.standard_provider
                 base_model_kwargs = enhanced_provider._get_optimized_params(mode, final_kwargs)
                 
-                engine = MetaIntelligenceEngine(
+                engine = self.engine_registry.get_engine(
+                    provider_name,
                     standard_provider,
                     base_model_kwargs,
                     consolidation_engine=self.consolidation_engine
@@ -81,7 +109,9 @@ class RequestProcessor:
                     'knowledge_base_path': final_kwargs.get('knowledge_base_path'),
                     'use_wikipedia': final_kwargs.get('use_wikipedia', False),
                     'real_time_adjustment': final_kwargs.get('real_time_adjustment', True),
-                    'mode': mode
+                    'mode': mode,
+                    'stream_callback': stream_callback,
+                    'use_cache': final_kwargs.get('use_response_cache', True)
                 }
                 response = await engine.solve_problem(
                     prompt,
@@ -125,6 +155,10 @@ class RequestProcessor:
                 logger.error(error_msg, exc_info=True)
                 errors_encountered.append(error_msg)
 
+        if stream_callback is not None and stream_callback.emitted:
+            logger.warning("V2拡張モードの回答を出力した後に失敗したため、フォールバックせずに処理を終了します。")
+            return {'text': "", 'error': "V2拡張モードでの回答の出力中に失敗しました。", 'all_errors': errors_encountered}
+
         if no_fallback:
             logger.warning("フォールバックが無効化されているため、処理を終了します。")
             return {'text': "", 'error': "V2拡張モードでの処理に失敗し、フォールバックは無効です。", 'all_errors': errors_encountered}
@@ -133,7 +167,8 @@ class RequestProcessor:
         try:
             provider = get_provider(provider_name, enhanced=False)
             standard_kwargs = convert_kwargs_for_standard(final_kwargs)
-            response = await provider.call(prompt, **standard_kwargs)
+            system_prompt = standard_kwargs.pop('system_prompt', None) or ""
+            response = await provider.call_streaming(prompt, system_prompt, stream_callback, **standard_kwargs)
             if not response.get('error'):
                  return response
             else:
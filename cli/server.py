@@ -0,0 +1,288 @@
+# /cli/server.py
+# タイトル: Resident MetaIntelligence Server
+# 役割: MetaIntelligenceCLIHandlerを常駐させ、HTTP (TCP / Unixドメインソケット) 経由でリクエストを受け付ける。
+#       重い初期化（SAE、プロバイダー、エンジン、spaCyモデル等）をプロセス起動時の一度だけに抑える。
+
+import asyncio
+import json
+import logging
+import signal
+import time
+from typing import Any, Dict, Optional, Protocol, Set, Tuple
+
+from llm_api.config import settings
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_BYTES = 64 * 1024
+REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+
+class RequestHandler(Protocol):
+    async def process_request(self, provider_name: str, prompt: str, **kwargs: Any) -> Dict[str, Any]: ...
+
+
+class HTTPError(Exception):
+    """クライアントへステータスコード付きで返すエラー"""
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class MetaIntelligenceServer:
+    """
+    asyncioベースの軽量HTTPサーバー。
+
+    エンドポイント:
+        GET  /health    : 稼働状態と処理中リクエスト数を返す。
+        POST /v1/solve  : {"provider", "prompt", ...CLIと同じオプション} を受け取り結果を返す。
+                          "stream": true の場合はNDJSONをチャンク転送で逐次返す
+                          （{"type": "chunk", "text": ...} の後に {"type": "result", "response": ...}）。
+    """
+
+    def __init__(
+        self,
+        handler: Optional[RequestHandler] = None,
+        max_concurrent_requests: Optional[int] = None,
+        shutdown_timeout: Optional[float] = None,
+        max_body_bytes: int = 10 * 1024 * 1024
+    ):
+        self.handler = handler
+        self.max_concurrent_requests = max_concurrent_requests or settings.SERVER_MAX_CONCURRENT_REQUESTS
+        self.shutdown_timeout = shutdown_timeout if shutdown_timeout is not None else settings.SERVER_SHUTDOWN_TIMEOUT
+        self.max_body_bytes = max_body_bytes
+        self._semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        self._servers: list = []
+        self._connections: Set["asyncio.Task[None]"] = set()
+        self._active_requests = 0
+        self._total_requests = 0
+        self._started_at = time.time()
+        self._shutting_down = False
+        self._stopped = asyncio.Event()
+
+    async def start(self, host: Optional[str] = None, port: Optional[int] = None, unix_socket: Optional[str] = None) -> None:
+        """ハンドラーを初期化し、TCPおよび/またはUnixドメインソケットで待ち受けを開始する。"""
+        if self.handler is None:
+            from .handler import MetaIntelligenceCLIHandler
+            logger.info("MetaIntelligenceCLIHandlerを初期化しています...")
+            self.handler = MetaIntelligenceCLIHandler()
+
+        if unix_socket:
+            server = await asyncio.start_unix_server(self._on_connection, path=unix_socket)
+            self._servers.append(server)
+            logger.info(f"Unixドメインソケット '{unix_socket}' で待ち受けを開始しました。")
+        if port is not None or not unix_socket:
+            bind_host = host or settings.SERVER_HOST
+            bind_port = port if port is not None else settings.SERVER_PORT
+            server = await asyncio.start_server(self._on_connection, host=bind_host, port=bind_port)
+            self._servers.append(server)
+            logger.info(f"http://{bind_host}:{bind_port} で待ち受けを開始しました。")
+
+    @property
+    def sockets(self) -> list:
+        return [sock for server in self._servers for sock in (server.sockets or [])]
+
+    async def serve_forever(self) -> None:
+        """シャットダウンが要求されるまで待機する。SIGINT/SIGTERMで正常終了する。"""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, lambda: asyncio.ensure_future(self.shutdown()))
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows等ではシグナルハンドラを登録できない
+        await self._stopped.wait()
+
+    async def shutdown(self) -> None:
+        """新規接続の受付を停止し、処理中のリクエストの完了を待ってからリソースを解放する。"""
+        if self._shutting_down:
+            return
+        self._shutting_down = True
+        logger.info("シャットダウンを開始します。新規リクエストの受付を停止しました。")
+        for server in self._servers:
+            server.close()
+
+        if self._connections:
+            logger.info(f"処理中の {len(self._connections)} 件の接続の完了を待機します (最大 {self.shutdown_timeout} 秒)...")
+            _, pending = await asyncio.wait(set(self._connections), timeout=self.shutdown_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+                logger.warning(f"タイムアウトのため {len(pending)} 件の接続を中断しました。")
+        for server in self._servers:
+            await server.wait_closed()
+
+        from llm_api.memory_consolidation.worker_pool import drain_all_consolidation_pools
+        from llm_api.providers import close_all_providers
+        await drain_all_consolidation_pools()
+        await close_all_providers()
+        logger.info("サーバーを停止しました。")
+        self._stopped.set()
+
+    async def _on_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        if task is not None:
+            self._connections.add(task)
+        try:
+            await self._handle_connection(reader, writer)
+        finally:
+            if task is not None:
+                self._connections.discard(task)
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            method, path, headers, body = await self._read_request(reader)
+        except HTTPError as e:
+            await self._write_json(writer, e.status, {"error": e.message})
+            return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return
+
+        try:
+            if path == "/health":
+                if method != "GET":
+                    raise HTTPError(405, "GETのみ対応しています。")
+                await self._write_json(writer, 200, self.get_status())
+            elif path == "/v1/solve":
+                if method != "POST":
+                    raise HTTPError(405, "POSTのみ対応しています。")
+                if self._shutting_down:
+                    raise HTTPError(503, "サーバーはシャットダウン中です。")
+                await self._handle_solve(body, writer)
+            else:
+                raise HTTPError(404, f"不明なパスです: {path}")
+        except HTTPError as e:
+            await self._write_json(writer, e.status, {"error": e.message})
+        except ConnectionError:
+            logger.info("クライアントが応答の受信前に切断しました。")
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+        """HTTP/1.1リクエストを読み取り、(メソッド, パス, ヘッダー, ボディ) を返す。"""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HTTPError(413, "リクエストヘッダーが大きすぎます。")
+        if len(head) > MAX_HEADER_BYTES:
+            raise HTTPError(413, "リクエストヘッダーが大きすぎます。")
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "不正なリクエスト行です。")
+        headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length", "0") or 0)
+        except ValueError:
+            raise HTTPError(400, "Content-Lengthが不正です。")
+        if length > self.max_body_bytes:
+            raise HTTPError(413, "リクエストボディが大きすぎます。")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target.split("?", 1)[0], headers, body
+
+    async def _handle_solve(self, body: bytes, writer: asyncio.StreamWriter) -> None:
+        try:
+            payload = json.loads(body or b"{}")
+        except json.JSONDecodeError as e:
+            raise HTTPError(400, f"JSONの解析に失敗しました: {e}")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "リクエストボディはJSONオブジェクトである必要があります。")
+
+        provider_name = payload.pop("provider", None)
+        prompt = payload.pop("prompt", None)
+        stream = bool(payload.pop("stream", False))
+        if not provider_name or not prompt:
+            raise HTTPError(400, "'provider' と 'prompt' は必須です。")
+        payload.pop("stream_callback", None)
+
+        assert self.handler is not None
+        async with self._semaphore:
+            self._active_requests += 1
+            self._total_requests += 1
+            try:
+                if not stream:
+                    response = await self._process(provider_name, prompt, payload)
+                    await self._write_json(writer, 200, response)
+                    return
+
+                await self._write_head(writer, 200, "application/x-ndjson", chunked=True)
+                client_connected = True
+
+                async def send_event(event: Dict[str, Any]) -> None:
+                    nonlocal client_connected
+                    if not client_connected:
+                        return
+                    data = (json.dumps(event, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+                    try:
+                        writer.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                        await writer.drain()
+                    except (ConnectionError, OSError):
+                        # 切断後も処理は最後まで続け、結果（学習・記憶統合など）は失わない
+                        client_connected = False
+                        logger.info("ストリーミング中にクライアントが切断しました。")
+
+                async def on_chunk(chunk: str) -> None:
+                    await send_event({"type": "chunk", "text": chunk})
+
+                payload["stream_callback"] = on_chunk
+                response = await self._process(provider_name, prompt, payload)
+                await send_event({"type": "result", "response": response})
+                if client_connected:
+                    writer.write(b"0\r\n\r\n")
+                    await writer.drain()
+            finally:
+                self._active_requests -= 1
+
+    async def _process(self, provider_name: str, prompt: str, options: Dict[str, Any]) -> Dict[str, Any]:
+        assert self.handler is not None
+        try:
+            return await self.handler.process_request(provider_name, prompt, **options)
+        except Exception as e:
+            logger.error(f"リクエスト処理中に予期しないエラー: {e}", exc_info=True)
+            return {"text": "", "error": f"サーバー内部エラー: {e}"}
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "status": "shutting_down" if self._shutting_down else "ok",
+            "active_requests": self._active_requests,
+            "total_requests": self._total_requests,
+            "max_concurrent_requests": self.max_concurrent_requests,
+            "uptime": time.time() - self._started_at,
+        }
+
+    async def _write_head(self, writer: asyncio.StreamWriter, status: int, content_type: str,
+                          content_length: Optional[int] = None, chunked: bool = False) -> None:
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {content_type}", "Connection: close"]
+        if chunked:
+            lines.append("Transfer-Encoding: chunked")
+        elif content_length is not None:
+            lines.append(f"Content-Length: {content_length}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+    async def _write_json(self, writer: asyncio.StreamWriter, status: int, data: Dict[str, Any]) -> None:
+        body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        await self._write_head(writer, status, "application/json; charset=utf-8", content_length=len(body))
+        writer.write(body)
+        await writer.drain()
+
+
+async def run_server(host: Optional[str] = None, port: Optional[int] = None, unix_socket: Optional[str] = None) -> None:
+    """サーバーを起動し、シグナルを受け取るまで稼働させる。"""
+    server = MetaIntelligenceServer()
+    await server.start(host=host, port=port, unix_socket=unix_socket)
+    await server.serve_forever()
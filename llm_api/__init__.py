@@ -36,5 +36,9 @@ def get_settings() -> Any:
     from llm_api.config import settings
     return settings
 
-# memory_consolidationパッケージをインポートして初期化時に利用可能にする
-import llm_api.memory_consolidation
\ No newline at end of file
+# サブパッケージは初回アクセス時に読み込む（`import llm_api` でtorch/langchain等を読み込まないため）
+def __getattr__(name: str) -> Any:
+    import importlib
+    if name in {"memory_consolidation", "core_engine", "providers", "rag", "emotion_core"}:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
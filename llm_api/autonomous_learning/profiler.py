@@ -9,6 +9,7 @@ from collections import defaultdict
 from typing import Any, Dict, List, Tuple
 
 from ..providers.base import LLMProvider
+from ..providers.memoization import memoized_call
 
 logger = logging.getLogger(__name__)
 
@@ -85,7 +86,7 @@ class InterestProfiler:
         評価スコアの数値のみを返答してください。例: 0.75
         """
         try:
-            response = await self.provider.call(interest_prompt, "")
+            response = await memoized_call(self.provider, interest_prompt, "", cacheable=True)
             score_text = response.get("text", "0.0").strip()
             return max(0.0, min(1.0, float(score_text)))
         except (ValueError, TypeError) as e:
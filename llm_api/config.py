@@ -2,7 +2,7 @@
 # タイトル: Centralized Settings Management (Complete Provider Support)
 # 役割: プロジェクト全体の設定を管理する。全プロバイダーのデフォルト設定を含む。
 
-from typing import Optional
+from typing import Dict, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -26,10 +26,20 @@ class Settings(BaseSettings):
     OLLAMA_API_BASE_URL: str = "http://localhost:11434"
     OLLAMA_TIMEOUT: float = 1200.0
     # OLLAMA_MAX_RETRIES, OLLAMA_BACKOFF_FACTOR は削除し、共通設定に移行
+    # プロバイダーごとに共有するHTTP接続プールの設定
+    OLLAMA_MAX_CONNECTIONS: int = 10
+    OLLAMA_MAX_KEEPALIVE_CONNECTIONS: int = 5
+    OLLAMA_KEEPALIVE_EXPIRY: float = 30.0
+    OLLAMA_HTTP2: bool = False # 有効化には `h2` パッケージが必要
 
     # --- Llama.cpp Server Settings ---
     LLAMACPP_API_BASE_URL: Optional[str] = "http://localhost:8000"
     LLAMACPP_DEFAULT_MODEL_PATH: Optional[str] = "./models/Meta-Llama-3.1-8B-Instruct-Q4_K_M.gguf"
+    LLAMACPP_N_CTX: int = 4096
+    LLAMACPP_VERBOSE: bool = False
+    # 同時推論用のモデルレプリカ数と、推論キューの上限（0は無制限）
+    LLAMACPP_NUM_REPLICAS: int = 1
+    LLAMACPP_MAX_QUEUE_SIZE: int = 0
     
     # --- Retry Settings (New) ---
     RETRY_MAX_ATTEMPTS: int = 3
@@ -37,6 +47,10 @@ class Settings(BaseSettings):
     RETRY_BACKOFF_FACTOR: float = 2.0
     RETRY_MAX_WAIT: float = 60.0
 
+    # --- Default Generation Parameters ---
+    LLM_TEMPERATURE: float = 0.7
+    LLM_MAX_TOKENS: int = 2048
+
     # --- Default Models ---
     OPENAI_DEFAULT_MODEL: str = "gpt-4o-mini"
     CLAUDE_DEFAULT_MODEL: str = "claude-3-haiku-20240307"
@@ -49,9 +63,107 @@ class Settings(BaseSettings):
     V2_DEFAULT_MODE: str = "adaptive"
     # 修正: Ollamaの同時リクエスト数制限を追加
     OLLAMA_CONCURRENCY_LIMIT: int = 2
+    # 高複雑性推論における部分解の統合方式 ("tree": k分木で並列に統合 / "sequential": 先頭から逐次統合)
+    HIGH_COMPLEXITY_INTEGRATION_MODE: str = "tree"
+    # tree方式で一度の統合呼び出しにまとめる部分解の数
+    HIGH_COMPLEXITY_INTEGRATION_FAN_IN: int = 2
+    # 問題分解時にサブ問題間の依存関係を出力させ、DAGとして依存順に解決する
+    HIGH_COMPLEXITY_DEPENDENCY_SCHEDULING: bool = True
+    # 複雑性分析結果のLRUキャッシュのサイズ（0で無効）
+    COMPLEXITY_ANALYSIS_CACHE_SIZE: int = 1024
+    # analyze_manyでnlp.pipeに渡すプロセス数とバッチサイズ
+    COMPLEXITY_NLP_N_PROCESS: int = 1
+    COMPLEXITY_NLP_BATCH_SIZE: int = 64
+    # ComplexityLearnerが保持する学習結果の上限（0で無制限）
+    COMPLEXITY_LEARNER_MAX_ENTRIES: int = 100000
+    # 完全一致が無い場合に、埋め込みの近傍検索で言い換えられたプロンプトの学習結果を再利用する
+    COMPLEXITY_LEARNER_SEMANTIC_ENABLED: bool = False
+    COMPLEXITY_LEARNER_SIMILARITY_THRESHOLD: float = 0.9
+    COMPLEXITY_LEARNER_MAX_NEIGHBOURS: int = 5000
+    # プロバイダーごとの同時リクエスト数（例: '{"openai": 8, "ollama": 2}'）。未指定のプロバイダーは下記の既定値に従う
+    PROVIDER_CONCURRENCY_LIMITS: Dict[str, int] = {}
+    PROVIDER_DEFAULT_CONCURRENCY: int = 3
+    # 並列パイプラインの戦略 ("best_of": 全レジームの完了を待って選択 / "race": 品質ゲートを通過した最初の解を採用)
+    PARALLEL_PIPELINE_STRATEGY: str = "best_of"
+    # race戦略の品質ゲート: 採用する解の最小文字数
+    PARALLEL_RACE_MIN_LENGTH: int = 50
+
+    # --- RAG Settings ---
+    RAG_EMBEDDING_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
+    # 構築済みFAISSインデックスの保存先（ソースパスと内容ハッシュをキーに再利用する）
+    RAG_INDEX_CACHE_DIR: str = "./.cache/rag_index"
+    # URLソースのインデックスの有効期間（秒）。過ぎた場合は再取得して再構築する（0以下で無期限）
+    RAG_URL_INDEX_TTL: float = 86400.0
+
+    # --- Response Cache Settings ---
+    # solve_problemの応答をキャッシュする（同一・類似プロンプトの再計算を省く）
+    RESPONSE_CACHE_ENABLED: bool = False
+    RESPONSE_CACHE_PATH: str = "./.cache/response_cache.sqlite3"
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1024
+    RESPONSE_CACHE_MAX_PERSISTENT_ENTRIES: int = 10000
+    RESPONSE_CACHE_TTL: float = 86400.0
+    # 埋め込み類似度による近似一致（RAG_EMBEDDING_MODELを使用）
+    RESPONSE_CACHE_SEMANTIC_ENABLED: bool = False
+    RESPONSE_CACHE_SIMILARITY_THRESHOLD: float = 0.95
+
+    # --- LLM Call Memoization Settings ---
+    # cacheable=True またはtemperature=0の補助的なLLM呼び出し（分類・判定など）の結果を再利用する
+    LLM_CALL_MEMO_ENABLED: bool = True
+    LLM_CALL_MEMO_MAX_ENTRIES: int = 4096
+    # 空文字の場合はメモリのみで保持する（例: "./.cache/llm_calls.sqlite3"）
+    LLM_CALL_MEMO_PATH: str = ""
+    LLM_CALL_MEMO_MAX_PERSISTENT_ENTRIES: int = 10000
+    # 結果の有効期間（秒）。0以下の場合は期限なし
+    LLM_CALL_MEMO_TTL: float = 604800.0
+
+    # --- Memory Consolidation Settings ---
+    # バックグラウンドで記憶統合を行うワーカー数と待ち行列の上限
+    CONSOLIDATION_WORKERS: int = 1
+    CONSOLIDATION_QUEUE_SIZE: int = 64
+    # 待ち行列が満杯の場合の方針: "drop"（新規性の低いセッションを破棄）または "coalesce"（新規性の低いセッションをまとめて1件として処理）
+    CONSOLIDATION_BACKPRESSURE: str = "coalesce"
+    CONSOLIDATION_COALESCE_MAX: int = 8
+    # 複数セッションを1回のLLM呼び出しでまとめて分析する際の入力トークン数（推定）とセッション数の上限
+    CONSOLIDATION_BATCH_TOKEN_BUDGET: int = 6000
+    CONSOLIDATION_BATCH_MAX_SESSIONS: int = 16
+    # 終了時に未処理のセッションを処理しきるまで待機する最大秒数
+    CONSOLIDATION_DRAIN_TIMEOUT: float = 30.0
+    # 抽出したエンティティ・関係性を保存するナレッジグラフ（空文字の場合は保存しない）
+    KNOWLEDGE_GRAPH_PATH: str = "./.cache/knowledge_graph.sqlite3"
+    # ナレッジグラフに登録する項目の信頼度の下限
+    KNOWLEDGE_GRAPH_MIN_CONFIDENCE: float = 0.3
+    # RAGでプロンプトに加えるナレッジグラフのコンテキスト（起点とするエンティティ数、探索するホップ数、関係性の上限）
+    KNOWLEDGE_GRAPH_RAG_MAX_ENTITIES: int = 5
+    KNOWLEDGE_GRAPH_RAG_DEPTH: int = 1
+    KNOWLEDGE_GRAPH_RAG_MAX_RELATIONS: int = 20
+
+    # --- Emotion Core Settings ---
+    # ローカルのSAE重み（safetensors形式）。存在する場合はメモリマップして使用し、無い場合はsae-lensからロードする
+    SAE_WEIGHTS_PATH: str = "./models/sae/gemma_layer9_16k.safetensors"
+    # SAE重みを保持する型 ("float32" / "float16" / "bfloat16")。空文字の場合はファイルに保存された型のまま使用する
+    SAE_DTYPE: str = ""
+
+    # --- Resident Server Settings ---
+    SERVER_HOST: str = "127.0.0.1"
+    SERVER_PORT: int = 8765
+    SERVER_MAX_CONCURRENT_REQUESTS: int = 8
+    SERVER_SHUTDOWN_TIMEOUT: float = 30.0
+
+    # --- Batch Runner Settings ---
+    BATCH_MAX_IN_FLIGHT: int = 64
 
     # --- Logging ---
     LOG_LEVEL: str = "INFO"
 
+    def concurrency_limit_for(self, provider_name: str) -> int:
+        """プロバイダーの同時リクエスト数の上限を返す。個別指定が無い場合、ローカル実行のプロバイダーは既存の設定に従う。"""
+        if provider_name in self.PROVIDER_CONCURRENCY_LIMITS:
+            return max(1, self.PROVIDER_CONCURRENCY_LIMITS[provider_name])
+        if provider_name == 'ollama':
+            return max(1, self.OLLAMA_CONCURRENCY_LIMIT)
+        if provider_name == 'llamacpp':
+            return max(1, self.LLAMACPP_NUM_REPLICAS)
+        return max(1, self.PROVIDER_DEFAULT_CONCURRENCY)
+
 
 settings = Settings()
\ No newline at end of file
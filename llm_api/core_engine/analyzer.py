@@ -2,9 +2,11 @@
 # Title: Multi-Language and Edge-Aware Complexity Analyzer (PCM-Enabled)
 # Role: 複雑性分析に「予測誤差」の概念を追加し、予測的統合モデル（PCM）の予測フィルターとして機能する。
 
+import hashlib
 import logging
-import spacy
-from typing import Tuple, Optional, Dict, Any, cast
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Tuple, Optional, Dict, Any, List, Sequence, cast
 
 try:
     from langdetect import detect, LangDetectException as LangDetectOriginalException
@@ -17,18 +19,31 @@ except ImportError:
 
 from .enums import ComplexityRegime
 from .learner import ComplexityLearner
+from ..config import settings
 
 logger = logging.getLogger(__name__)
 
+# ロード済みspaCyモデルはプロセス内の全アナライザーで共有する（言語コード -> モデル or None）
+_shared_nlp_models: Dict[str, Any] = {}
+
+def clear_nlp_model_cache() -> None:
+    """共有しているspaCyモデルを破棄し、次回の分析時に再ロードさせる。"""
+    _shared_nlp_models.clear()
+
 class AdaptiveComplexityAnalyzer:
     """
     プロンプトの言語を自動検出し、その言語に最適化された複雑性分析を行う。
     Edgeモードに対応し、リソース消費を抑制する。
     PCMの予測フィルターとして、情報の新規性（予測誤差）も評価に加える。
     """
-    def __init__(self, learner: Optional[ComplexityLearner] = None):
+    def __init__(self, learner: Optional[ComplexityLearner] = None, cache_size: Optional[int] = None):
         self.learner = learner
-        self.nlp_models: Dict[str, Any] = {}
+        self.nlp_models: Dict[str, Any] = _shared_nlp_models
+        # (プロンプトのハッシュ, モード) -> (スコア, レジーム)。学習済みの提案は変化し得るため、キャッシュより先に参照する
+        self.cache_size = cache_size if cache_size is not None else settings.COMPLEXITY_ANALYSIS_CACHE_SIZE
+        self._analysis_cache: "OrderedDict[Tuple[str, str], Tuple[float, ComplexityRegime]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_stats = {"hits": 0, "misses": 0}
         self.keyword_sets = {
             'en': {
                 'conditional': ['if', 'when', 'unless', 'provided', 'given'],
@@ -58,18 +73,17 @@ class AdaptiveComplexityAnalyzer:
     def analyze_complexity(self, prompt: str, mode: str = 'adaptive') -> Tuple[float, ComplexityRegime]:
         """
         多言語とEdgeモードに対応した複雑性分析。
+        同じプロンプトとモードの分析結果はLRUキャッシュから返す。
         """
-        if mode == 'edge':
-            logger.info("エッジモードのため、軽量なキーワード分析を実行し、低複雑性レジームに固定します。")
-            return 10.0, ComplexityRegime.LOW
+        early_result = self._early_result(prompt, mode)
+        if early_result is not None:
+            return early_result
 
-        if self.learner:
-            suggestion = self.learner.get_suggestion(prompt)
-            if suggestion:
-                logger.info(f"学習済みの提案が見つかりました: 複雑性レジームを '{suggestion.value}' に設定します。")
-                if suggestion == ComplexityRegime.LOW: return 15.0, suggestion
-                if suggestion == ComplexityRegime.MEDIUM: return 50.0, suggestion
-                if suggestion == ComplexityRegime.HIGH: return 85.0, suggestion
+        cache_key = self._cache_key(prompt, mode)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            logger.info(f"複雑性分析のキャッシュを使用します: レジーム '{cached[1].value}'")
+            return cached
 
         lang = self._detect_language(prompt)
         
@@ -81,17 +95,103 @@ class AdaptiveComplexityAnalyzer:
             base_complexity_score = self._keyword_based_analysis(prompt, lang)
         else:
             try:
-                doc = nlp(prompt)
-                if len(doc) > 5:
-                    logger.info(f"'{lang}'言語のNLPベース高度分析を実行します。")
-                    base_complexity_score = self._nlp_enhanced_analysis(doc)
-                else:
-                    logger.info(f"トークン数が少ないため、'{lang}'言語のキーワードベース分析にフォールバックします。")
-                    base_complexity_score = self._keyword_based_analysis(prompt, lang)
+                base_complexity_score = self._doc_based_analysis(nlp(prompt), prompt, lang)
             except Exception as e:
                 logger.warning(f"NLP分析でエラーが発生: {e}。キーワードベース分析にフォールバックします。")
                 base_complexity_score = self._keyword_based_analysis(prompt, lang)
 
+        result = self._finalize_score(prompt, base_complexity_score)
+        self._cache_put(cache_key, result)
+        return result
+
+    def analyze_many(
+        self,
+        prompts: Sequence[str],
+        mode: str = 'adaptive',
+        n_process: Optional[int] = None,
+        batch_size: Optional[int] = None
+    ) -> List[Tuple[float, ComplexityRegime]]:
+        """
+        複数のプロンプトをまとめて分析し、入力と同じ順序で (スコア, レジーム) のリストを返す。
+        言語ごとにグループ化し、spaCyのnlp.pipeでまとめて解析することで、バッチ評価時の解析コストを償却する。
+
+        Args:
+            prompts: 分析するプロンプトのリスト。
+            mode: 分析モード（analyze_complexityと同じ）。
+            n_process: nlp.pipeのプロセス数。未指定の場合は settings.COMPLEXITY_NLP_N_PROCESS。
+            batch_size: nlp.pipeのバッチサイズ。未指定の場合は settings.COMPLEXITY_NLP_BATCH_SIZE。
+        """
+        n_process = n_process or settings.COMPLEXITY_NLP_N_PROCESS
+        batch_size = batch_size or settings.COMPLEXITY_NLP_BATCH_SIZE
+        results: List[Optional[Tuple[float, ComplexityRegime]]] = [None] * len(prompts)
+
+        # キャッシュ・学習済み提案で解決できないプロンプトのみを、重複を除いて言語ごとにまとめる
+        pending: Dict[str, List[int]] = {}
+        for i, prompt in enumerate(prompts):
+            result = self._early_result(prompt, mode) or self._cache_get(self._cache_key(prompt, mode))
+            if result is not None:
+                results[i] = result
+            else:
+                pending.setdefault(prompt, []).append(i)
+
+        by_language: Dict[str, List[str]] = defaultdict(list)
+        for prompt in pending:
+            by_language[self._detect_language(prompt)].append(prompt)
+
+        base_scores: Dict[str, float] = {}
+        for lang, lang_prompts in by_language.items():
+            nlp = self._get_spacy_model(lang)
+            parse_targets = [p for p in lang_prompts if nlp is not None and len(p) > 30]
+            parse_target_set = set(parse_targets)
+            for prompt in lang_prompts:
+                if prompt not in parse_target_set:
+                    base_scores[prompt] = self._keyword_based_analysis(prompt, lang)
+            if not parse_targets:
+                continue
+
+            logger.info(f"'{lang}'言語の{len(parse_targets)}件のプロンプトをnlp.pipeで一括解析します。")
+            try:
+                docs = nlp.pipe(parse_targets, n_process=n_process, batch_size=batch_size)
+                for prompt, doc in zip(parse_targets, docs):
+                    base_scores[prompt] = self._doc_based_analysis(doc, prompt, lang)
+            except Exception as e:
+                logger.warning(f"NLP一括分析でエラーが発生: {e}。未解析のプロンプトはキーワードベース分析にフォールバックします。")
+                for prompt in parse_targets:
+                    if prompt not in base_scores:
+                        base_scores[prompt] = self._keyword_based_analysis(prompt, lang)
+
+        for prompt, indices in pending.items():
+            result = self._finalize_score(prompt, base_scores[prompt])
+            self._cache_put(self._cache_key(prompt, mode), result)
+            for i in indices:
+                results[i] = result
+        return cast(List[Tuple[float, ComplexityRegime]], results)
+
+    def _early_result(self, prompt: str, mode: str) -> Optional[Tuple[float, ComplexityRegime]]:
+        """解析を行わずに結果が決まる場合（エッジモード・学習済みの提案）はその結果を返す。"""
+        if mode == 'edge':
+            logger.info("エッジモードのため、軽量なキーワード分析を実行し、低複雑性レジームに固定します。")
+            return 10.0, ComplexityRegime.LOW
+
+        if self.learner:
+            suggestion = self.learner.get_suggestion(prompt)
+            if suggestion:
+                logger.info(f"学習済みの提案が見つかりました: 複雑性レジームを '{suggestion.value}' に設定します。")
+                if suggestion == ComplexityRegime.LOW: return 15.0, suggestion
+                if suggestion == ComplexityRegime.MEDIUM: return 50.0, suggestion
+                if suggestion == ComplexityRegime.HIGH: return 85.0, suggestion
+        return None
+
+    def _doc_based_analysis(self, doc: Any, prompt: str, lang: str) -> float:
+        """解析済みのDocから基本複雑性を求める。トークン数が少ない場合はキーワードベース分析を使う。"""
+        if len(doc) > 5:
+            logger.info(f"'{lang}'言語のNLPベース高度分析を実行します。")
+            return self._nlp_enhanced_analysis(doc)
+        logger.info(f"トークン数が少ないため、'{lang}'言語のキーワードベース分析にフォールバックします。")
+        return self._keyword_based_analysis(prompt, lang)
+
+    def _finalize_score(self, prompt: str, base_complexity_score: float) -> Tuple[float, ComplexityRegime]:
+        """基本複雑性に新規性スコアを加味し、最終スコアとレジームを決定する。"""
         # 予測誤差に基づく新規性スコアを加味 (PCMのPredictive Filterの簡易実装)
         novelty_score = self._predictive_filtering_analysis(prompt)
         
@@ -113,6 +213,36 @@ class AdaptiveComplexityAnalyzer:
         logger.info(f"決定された複雑性レジーム: {regime.value}")
         return final_complexity_score, regime
 
+    @staticmethod
+    def _cache_key(prompt: str, mode: str) -> Tuple[str, str]:
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest(), mode
+
+    def _cache_get(self, key: Tuple[str, str]) -> Optional[Tuple[float, ComplexityRegime]]:
+        if self.cache_size <= 0:
+            return None
+        with self._cache_lock:
+            result = self._analysis_cache.get(key)
+            if result is None:
+                self.cache_stats["misses"] += 1
+                return None
+            self._analysis_cache.move_to_end(key)
+            self.cache_stats["hits"] += 1
+            return result
+
+    def _cache_put(self, key: Tuple[str, str], result: Tuple[float, ComplexityRegime]) -> None:
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._analysis_cache[key] = result
+            self._analysis_cache.move_to_end(key)
+            while len(self._analysis_cache) > self.cache_size:
+                self._analysis_cache.popitem(last=False)
+
+    def clear_cache(self) -> None:
+        """分析結果のキャッシュを破棄する。"""
+        with self._cache_lock:
+            self._analysis_cache.clear()
+
     def _detect_language(self, text: str) -> str:
         """プロンプトの言語を検出する。"""
         try:
@@ -139,6 +269,8 @@ class AdaptiveComplexityAnalyzer:
             return None
             
         try:
+            # spaCyは読み込みに時間がかかるため、モデルが初めて必要になった時点でインポートする
+            import spacy
             if not spacy.util.is_package(model_name):
                 logger.info(f"spaCyモデル '{model_name}' のパッケージが見つかりません。")
                 self.nlp_models[lang] = None
@@ -2,10 +2,13 @@
 # タイトル: MetaIntelligence Core Engine (Refactored)
 # 役割: 各推論パイプラインを管理し、問題のモードに応じて処理を振り分ける中核エンジン。
 
+import asyncio
 import logging
-from typing import Any, Dict, Optional
+from typing import Any, Awaitable, Callable, Dict, Optional
 
 from .enums import ComplexityRegime
+from .learner import ComplexityLearner
+from .response_cache import ResponseCache
 from .pipelines import (
     AdaptivePipeline,
     ParallelPipeline,
@@ -24,7 +27,14 @@ class MetaIntelligenceEngine:
     """MetaIntelligence V2 メインエンジン"""
 
     # --- ▼▼▼ ここから修正 ▼▼▼ ---
-    def __init__(self, provider: LLMProvider, base_model_kwargs: Dict[str, Any], consolidation_engine: Optional[ConsolidationEngine] = None):
+    def __init__(
+        self,
+        provider: LLMProvider,
+        base_model_kwargs: Dict[str, Any],
+        consolidation_engine: Optional[ConsolidationEngine] = None,
+        learner: Optional[ComplexityLearner] = None,
+        response_cache: Optional[ResponseCache] = None
+    ):
     # --- ▲▲▲ ここまで修正 ▲▲▲ ---
         logger.info("MetaIntelligence Engine V2を初期化中")
         if not provider:
@@ -32,9 +42,10 @@ class MetaIntelligenceEngine:
 
         self.provider = provider
         self.base_model_kwargs = base_model_kwargs
+        self.response_cache = response_cache
 
         # パイプライン初期化
-        self.adaptive_pipeline = AdaptivePipeline(provider, base_model_kwargs)
+        self.adaptive_pipeline = AdaptivePipeline(provider, base_model_kwargs, learner=learner)
         # --- ▼▼▼ ここから修正 ▼▼▼ ---
         if consolidation_engine:
             self.adaptive_pipeline.set_consolidation_engine(consolidation_engine)
@@ -43,7 +54,9 @@ class MetaIntelligenceEngine:
             provider, base_model_kwargs, shared_adaptive_pipeline=self.adaptive_pipeline
         )
         self.quantum_pipeline = QuantumInspiredPipeline(provider, base_model_kwargs)
-        self.speculative_pipeline = SpeculativePipeline(provider, base_model_kwargs)
+        self.speculative_pipeline = SpeculativePipeline(
+            provider, base_model_kwargs, shared_adaptive_pipeline=self.adaptive_pipeline
+        )
         self.self_discover_pipeline = SelfDiscoverPipeline(provider, base_model_kwargs)
 
         logger.info("MetaIntelligence Engine V2の初期化完了 - 全パイプライン利用可能")
@@ -58,8 +71,58 @@ class MetaIntelligenceEngine:
         use_wikipedia: bool = False,
         real_time_adjustment: bool = True,
         mode: str = "adaptive",
+        stream_callback: Optional[Callable[[str], Awaitable[None]]] = None,
+        use_cache: bool = True,
+    ) -> Dict[str, Any]:
+        """
+        問題解決のメインエントリーポイント。
+        stream_callbackが指定された場合、最終的な統合・改善ステップの出力をチャンク単位で通知する。
+        最終ステップを逐次生成できないパイプラインでは、完成した最終解を一度に通知する。
+        応答キャッシュが設定されている場合、同一（または十分に類似した）条件の成功結果を再利用する。
+        """
+        cache_key = None
+        if self.response_cache is not None and use_cache:
+            cache_key = self.response_cache.make_key(prompt, {
+                "provider": self.provider.provider_name, "model_kwargs": self.base_model_kwargs,
+                "mode": mode, "system_prompt": system_prompt,
+                "force_regime": force_regime.value if force_regime else None,
+                "use_rag": use_rag, "knowledge_base_path": knowledge_base_path, "use_wikipedia": use_wikipedia,
+                "real_time_adjustment": real_time_adjustment,
+            })
+        if cache_key is not None:
+            assert self.response_cache is not None
+            cached = await asyncio.to_thread(self.response_cache.get, cache_key)
+            if cached is not None:
+                logger.info(f"応答キャッシュにヒットしました（{cached['cache']['hit']}）。パイプラインの実行を省略します。")
+                return await self._emit_final_solution(cached, stream_callback)
+
+        result = await self._dispatch(
+            prompt, system_prompt, force_regime, use_rag, knowledge_base_path, use_wikipedia,
+            real_time_adjustment, mode, stream_callback,
+        )
+        if cache_key is not None and self._is_cacheable(result):
+            assert self.response_cache is not None
+            await asyncio.to_thread(self.response_cache.put, cache_key, result)
+        return result
+
+    @staticmethod
+    def _is_cacheable(result: Dict[str, Any]) -> bool:
+        """エラーが無く、最終解を含む結果のみをキャッシュする。"""
+        return bool(result.get('final_solution')) and not result.get('error') and result.get('success', True) is not False
+
+    async def _dispatch(
+        self,
+        prompt: str,
+        system_prompt: str,
+        force_regime: Optional[ComplexityRegime],
+        use_rag: bool,
+        knowledge_base_path: Optional[str],
+        use_wikipedia: bool,
+        real_time_adjustment: bool,
+        mode: str,
+        stream_callback: Optional[Callable[[str], Awaitable[None]]],
     ) -> Dict[str, Any]:
-        """問題解決のメインエントリーポイント"""
+        """モードに応じてパイプラインを選択し、実行する。"""
         logger.info(
             f"問題解決プロセス開始（MetaIntelligence V2, モード: {mode}）: {prompt[:80]}..."
         )
@@ -70,36 +133,50 @@ class MetaIntelligenceEngine:
                     prompt=prompt, system_prompt=system_prompt, force_regime=force_regime,
                     use_rag=use_rag, knowledge_base_path=knowledge_base_path, use_wikipedia=use_wikipedia,
                     real_time_adjustment=real_time_adjustment, mode=mode,
+                    stream_callback=stream_callback,
                 )
             elif mode == "parallel":
                 logger.info("並列パイプラインを選択")
-                return await self.parallel_pipeline.execute(
+                result = await self.parallel_pipeline.execute(
                     prompt=prompt, system_prompt=system_prompt, use_rag=use_rag,
                     knowledge_base_path=knowledge_base_path, use_wikipedia=use_wikipedia,
                 )
+                return await self._emit_final_solution(result, stream_callback)
             elif mode == "quantum_inspired":
                 logger.info("量子インスパイアードパイプラインを選択")
-                return await self.quantum_pipeline.execute(
+                result = await self.quantum_pipeline.execute(
                     prompt=prompt, system_prompt=system_prompt, use_rag=use_rag,
                     knowledge_base_path=knowledge_base_path, use_wikipedia=use_wikipedia,
                 )
+                return await self._emit_final_solution(result, stream_callback)
             elif mode == "speculative_thought":
                 logger.info("投機的思考パイプラインを選択")
                 return await self.speculative_pipeline.execute(
                     prompt=prompt, system_prompt=system_prompt, use_rag=use_rag,
                     knowledge_base_path=knowledge_base_path, use_wikipedia=use_wikipedia,
+                    stream_callback=stream_callback,
                 )
             elif mode == "self_discover":
                 logger.info("自己発見パイプラインを選択")
-                return await self.self_discover_pipeline.execute(
+                result = await self.self_discover_pipeline.execute(
                     prompt=prompt, system_prompt=system_prompt, use_rag=use_rag,
                     knowledge_base_path=knowledge_base_path, use_wikipedia=use_wikipedia,
                 )
+                return await self._emit_final_solution(result, stream_callback)
             else:
                 logger.warning(f"モード '{mode}' はV2専用ではないか未知のモードです。適応型パイプラインにフォールバックします。")
                 return await self.adaptive_pipeline.execute(
-                    prompt=prompt, system_prompt=system_prompt, mode="adaptive"
+                    prompt=prompt, system_prompt=system_prompt, mode="adaptive",
+                    stream_callback=stream_callback,
                 )
         except Exception as e:
             logger.error(f"パイプライン実行中にエラー（モード: {mode}）: {e}", exc_info=True)
-            return {"success": False, "error": str(e)}
\ No newline at end of file
+            return {"success": False, "error": str(e)}
+
+    async def _emit_final_solution(
+        self, result: Dict[str, Any], stream_callback: Optional[Callable[[str], Awaitable[None]]]
+    ) -> Dict[str, Any]:
+        """逐次生成に対応しないパイプラインの最終解を、ストリーム先へ一括で通知する。"""
+        if stream_callback and not result.get('error') and result.get('final_solution'):
+            await stream_callback(result['final_solution'])
+        return result
@@ -1,9 +1,20 @@
 # /llm_api/core_engine/learner.py
+# タイトル: Complexity Learner
+# 役割: プロンプトごとに適切だった複雑性レジームをSQLiteに記録し、次回以降の分析で再利用する。
+#       書き込みは一件ごとのUPSERTで完結し、WALモードにより複数プロセスからの同時書き込みにも耐える。
+#       完全一致が無い場合は、旧形式（先頭100文字）のキーや、任意で有効化できる埋め込みの近傍検索にフォールバックする。
+
+import hashlib
 import json
 import logging
-from typing import Dict, Optional, cast
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Sequence
 from pathlib import Path
+
 from .enums import ComplexityRegime
+from ..config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -11,36 +22,104 @@ logger = logging.getLogger(__name__)
 # ファイルの場所をこのファイルからの相対パスで固定する
 STORAGE_FILE = Path(__file__).parent.parent.parent / "complexity_learning.json"
 
+# 旧形式のキー（プロンプトの先頭100文字）の長さ
+LEGACY_KEY_LENGTH = 100
+
+EmbedFn = Callable[[str], Sequence[float]]
+
+
+def _hash_key(text: str) -> str:
+    return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+
+
 class ComplexityLearner:
     """プロンプトの複雑性レジームに関する過去の結果を学習するクラス"""
-    def __init__(self, storage_path: Optional[str] = None):
+    def __init__(
+        self,
+        storage_path: Optional[str] = None,
+        semantic: Optional[bool] = None,
+        similarity_threshold: Optional[float] = None,
+        embed_fn: Optional[EmbedFn] = None
+    ):
+        """
+        Args:
+            storage_path: SQLiteファイルのパス。".json" で終わるパス（旧形式）が渡された場合は、
+                          同じ場所の ".sqlite3" を使い、JSONの内容を初回のみ取り込む。
+            semantic: 完全一致が無い場合に、埋め込みの近傍検索で類似プロンプトの学習結果を使うか。
+            similarity_threshold: 近傍検索でヒットとみなすコサイン類似度の下限。
+            embed_fn: テキストを埋め込みベクトルへ変換する関数（未指定時はRAG用の埋め込みモデルを使用）。
+        """
         # 修正: 引数で渡されなければ、定義済みのSTORAGE_FILEを使う
-        self.storage_path = Path(storage_path) if storage_path else STORAGE_FILE
-        self.suggestions = self._load_suggestions()
+        path = Path(storage_path) if storage_path else STORAGE_FILE
+        self.legacy_path = path if path.suffix == ".json" else None
+        self.storage_path = path.with_suffix(".sqlite3") if self.legacy_path else path
+        self.semantic = semantic if semantic is not None else settings.COMPLEXITY_LEARNER_SEMANTIC_ENABLED
+        self.similarity_threshold = (
+            similarity_threshold if similarity_threshold is not None else settings.COMPLEXITY_LEARNER_SIMILARITY_THRESHOLD
+        )
+        self._embed_fn = embed_fn
+        self._lock = threading.Lock()
+        self._db = self._open_db()
+        self._import_legacy_json()
+        # 保持件数（書き込みのたびにテーブルを数えないよう、開いた時点の件数から増分で管理する）
+        self._row_count = self._count_rows()
 
-    def _load_suggestions(self) -> Dict[str, str]:
-        """学習済みの提案をファイルから読み込む"""
-        if not self.storage_path.exists():
-            return {}
-        try:
-            with self.storage_path.open('r', encoding='utf-8') as f:
-                return cast(Dict[str, str], json.load(f))
-        except (json.JSONDecodeError, IOError) as e:
-            logger.error(f"学習データの読み込みに失敗: {e}")
-            return {}
+    def _count_rows(self) -> int:
+        with self._lock:
+            (count,) = self._db.execute("SELECT COUNT(*) FROM suggestions").fetchone()
+        return int(count)
 
-    def _save_suggestions(self) -> None:
-        """現在の提案をファイルに保存する"""
+    def _open_db(self) -> sqlite3.Connection:
+        self.storage_path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(self.storage_path), check_same_thread=False, isolation_level=None, timeout=30.0)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS suggestions ("
+            "key TEXT PRIMARY KEY, kind TEXT NOT NULL, prompt TEXT NOT NULL, regime TEXT NOT NULL, "
+            "embedding BLOB, updated_at REAL NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_suggestions_updated ON suggestions (updated_at)")
+        return db
+
+    def _import_legacy_json(self) -> None:
+        """旧形式のJSONファイルの内容を、データベースが空の場合に限り取り込む。"""
+        if not self.legacy_path or not self.legacy_path.exists():
+            return
         try:
-            with self.storage_path.open('w', encoding='utf-8') as f:
-                json.dump(self.suggestions, f, indent=4, ensure_ascii=False)
-        except IOError as e:
-            logger.error(f"学習データの保存に失敗: {e}")
+            with self.legacy_path.open('r', encoding='utf-8') as f:
+                legacy: Dict[str, str] = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.error(f"旧形式の学習データの読み込みに失敗: {e}")
+            return
+        if not legacy:
+            return
+        with self._lock:
+            (count,) = self._db.execute("SELECT COUNT(*) FROM suggestions").fetchone()
+            if count:
+                return
+            now = time.time()
+            # 他プロセスと同時に取り込んでも重複しないよう、INSERT OR IGNOREで一括登録する
+            self._db.executemany(
+                "INSERT OR IGNORE INTO suggestions (key, kind, prompt, regime, embedding, updated_at) VALUES (?, 'prefix', ?, ?, NULL, ?)",
+                [(_hash_key(prefix[:LEGACY_KEY_LENGTH]), prefix, regime, now) for prefix, regime in legacy.items()]
+            )
+        logger.info(f"旧形式の学習データ {len(legacy)} 件を '{self.storage_path}' に取り込みました。")
 
     def get_suggestion(self, prompt: str) -> Optional[ComplexityRegime]:
         """プロンプトに基づいて推奨レジームを返す"""
-        prompt_key = prompt[:100] # プロンプトの最初の100文字をキーとして使用
-        regime_str = self.suggestions.get(prompt_key)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT regime FROM suggestions WHERE key = ? AND kind = 'prompt'", (_hash_key(prompt),)
+            ).fetchone()
+            if row is None:
+                row = self._db.execute(
+                    "SELECT regime FROM suggestions WHERE key = ? AND kind = 'prefix'",
+                    (_hash_key(prompt[:LEGACY_KEY_LENGTH]),)
+                ).fetchone()
+        regime_str = row[0] if row else None
+        if regime_str is None and self.semantic:
+            regime_str = self._nearest_neighbour_regime(prompt)
         if regime_str:
             try:
                 return ComplexityRegime(regime_str)
@@ -50,6 +129,92 @@ class ComplexityLearner:
 
     def record_outcome(self, prompt: str, successful_regime: ComplexityRegime) -> None:
         """成功した結果を記録する"""
-        prompt_key = prompt[:100]
-        self.suggestions[prompt_key] = successful_regime.value
-        self._save_suggestions()
\ No newline at end of file
+        embedding = self._embed(prompt) if self.semantic else None
+        try:
+            with self._lock:
+                key = _hash_key(prompt)
+                is_new = self._db.execute("SELECT 1 FROM suggestions WHERE key = ?", (key,)).fetchone() is None
+                self._db.execute(
+                    "INSERT INTO suggestions (key, kind, prompt, regime, embedding, updated_at) VALUES (?, 'prompt', ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET regime = excluded.regime, "
+                    "embedding = COALESCE(excluded.embedding, suggestions.embedding), updated_at = excluded.updated_at",
+                    (key, prompt.strip(), successful_regime.value,
+                     embedding.tobytes() if embedding is not None else None, time.time())
+                )
+                if is_new:
+                    self._row_count += 1
+                self._trim()
+        except sqlite3.Error as e:
+            logger.error(f"学習データの保存に失敗: {e}")
+
+    def _trim(self) -> None:
+        """
+        保持件数の上限を超えた場合、更新が古いものから削除する。
+        件数はメモリ上の値で判定し、上限を超えた場合にのみ実際の件数を数え直す（他プロセスの書き込みもここで反映される）。
+        """
+        max_entries = settings.COMPLEXITY_LEARNER_MAX_ENTRIES
+        if max_entries <= 0 or self._row_count <= max_entries:
+            return
+        (count,) = self._db.execute("SELECT COUNT(*) FROM suggestions").fetchone()
+        if count > max_entries:
+            self._db.execute(
+                "DELETE FROM suggestions WHERE key IN (SELECT key FROM suggestions ORDER BY updated_at ASC LIMIT ?)",
+                (count - max_entries,)
+            )
+            count = max_entries
+        self._row_count = int(count)
+
+    def _embed(self, text: str) -> Optional[Any]:
+        import numpy as np
+
+        try:
+            if self._embed_fn is None:
+                from .response_cache import _default_embed_fn
+                self._embed_fn = _default_embed_fn()
+            vector = np.asarray(self._embed_fn(text), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"学習器の埋め込み計算に失敗したため、近傍検索を無効化します: {e}")
+            self.semantic = False
+            return None
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else vector
+
+    def _nearest_neighbour_regime(self, prompt: str) -> Optional[str]:
+        """埋め込みが最も近い学習済みプロンプトのレジームを返す。類似度が閾値未満の場合はNone。"""
+        import numpy as np
+
+        query = self._embed(prompt)
+        if query is None:
+            return None
+        with self._lock:
+            # 走査件数を制限し、学習データが増えてもメモリ使用量と検索時間を一定に保つ
+            rows = self._db.execute(
+                "SELECT regime, embedding FROM suggestions WHERE embedding IS NOT NULL ORDER BY updated_at DESC LIMIT ?",
+                (settings.COMPLEXITY_LEARNER_MAX_NEIGHBOURS,)
+            ).fetchall()
+        rows = [(regime, blob) for regime, blob in rows if len(blob) == query.nbytes]
+        if not rows:
+            return None
+        matrix = np.frombuffer(b"".join(blob for _, blob in rows), dtype=np.float32).reshape(len(rows), -1)
+        similarities = matrix @ query
+        best = int(np.argmax(similarities))
+        if float(similarities[best]) < self.similarity_threshold:
+            return None
+        logger.info(f"類似プロンプトの学習結果を使用します (類似度: {float(similarities[best]):.3f})。")
+        return str(rows[best][0])
+
+    def reload(self) -> None:
+        """他プロセスによる変更を含め、ストレージの最新状態を参照し直す。"""
+        with self._lock:
+            self._db.close()
+            self._db = self._open_db()
+        self._row_count = self._count_rows()
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute("SELECT kind, COUNT(*) FROM suggestions GROUP BY kind").fetchall()
+        return {kind: count for kind, count in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -3,7 +3,7 @@
 # 役割: 推論結果の最終的な評価・改善と、学習結果の記録を担当する。
 
 import logging
-from typing import Any, Dict, Optional, cast
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, cast
 
 from ..enums import ComplexityRegime
 from ..learner import ComplexityLearner
@@ -22,18 +22,23 @@ async def finalize_and_learn(
     initial_regime: ComplexityRegime,
     complexity_score: float,
     rag_source: Optional[str],
-    mode: str
+    mode: str,
+    stream_callback: Optional[Callable[[str], Awaitable[None]]] = None,
+    record_learning: bool = True
 ) -> Dict[str, Any]:
     """
     学習を記録し、最終的な解を生成・整形して返す。
+    stream_callbackが指定された場合、最終解をチャンク単位で逐次通知する。
+    record_learningがFalseの場合（並列実行の分岐など）、学習の記録は呼び出し元に任せる。
     """
-    if final_regime != initial_regime:
+    if record_learning and final_regime != initial_regime:
         learner.record_outcome(original_prompt, final_regime)
 
-    final_solution = await _evaluate_and_refine(
+    final_solution, refine_error = await _evaluate_and_refine(
         provider, base_model_kwargs,
         reasoning_result.get('solution', ''),
-        original_prompt, system_prompt, final_regime
+        original_prompt, system_prompt, final_regime,
+        stream_callback=stream_callback
     )
 
     thought_process = {
@@ -57,6 +62,9 @@ async def finalize_and_learn(
         'is_edge_optimized': mode == 'edge',
     }
 
+    if refine_error:
+        # 出力の途中で失敗した解は不完全なため、成功として扱わない（キャッシュもされない）
+        return _format_response(final_solution, thought_process, v2_improvements, success=False, error=refine_error)
     return _format_response(final_solution, thought_process, v2_improvements)
 
 
@@ -66,13 +74,18 @@ async def _evaluate_and_refine(
     solution: str,
     original_prompt: str,
     system_prompt: str,
-    regime: ComplexityRegime
-) -> str:
+    regime: ComplexityRegime,
+    stream_callback: Optional[Callable[[str], Awaitable[None]]] = None
+) -> Tuple[str, Optional[str]]:
     """
-    生成された解を評価し、必要であれば改善する。
+    生成された解を評価し、必要であれば改善する。(解, エラー) を返す。
+    stream_callbackが指定された場合、改善後の解を生成しながら逐次通知する。
+    改善後の解の一部を通知した後に失敗した場合は、通知済みの不完全な解とエラーを返す。
     """
     if regime == ComplexityRegime.LOW or not solution:
-        return solution
+        if stream_callback and solution:
+            await stream_callback(solution)
+        return solution, None
     
     logger.info("解の限定的改善プロセスを開始...")
     refinement_prompt = f"""以下の「元の質問」に対する「回答案」です。内容をレビューし、明確さ、正確性、完全性の観点で改善してください。改善した最終版の回答のみを出力してください。
@@ -85,12 +98,28 @@ async def _evaluate_and_refine(
     call_kwargs = base_model_kwargs.copy()
     call_kwargs.pop('system_prompt', None)
 
+    if stream_callback:
+        response = await provider.call_streaming(
+            refinement_prompt, system_prompt, stream_callback, **call_kwargs
+        )
+        if response.get('error'):
+            if not response.get('text'):
+                # 何も出力されないまま失敗した場合は、改善前の解をそのまま通知する
+                await stream_callback(solution)
+                return solution, None
+            logger.error(f"解の改善の出力中にエラーが発生しました: {response['error']}")
+            return cast(str, response['text']), f"解の改善の出力中にエラーが発生しました: {response['error']}"
+        return cast(str, response.get('text', solution)), None
+
     response = await provider.call(
         prompt=refinement_prompt,
         system_prompt=system_prompt,
         **call_kwargs
     )
-    return cast(str, response.get('text', solution))
+    if response.get('error') or not response.get('text'):
+        logger.warning(f"解の改善に失敗したため、改善前の解を使用します: {response.get('error')}")
+        return solution, None
+    return cast(str, response['text']), None
 
 
 def _format_response(
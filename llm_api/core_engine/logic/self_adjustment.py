@@ -9,6 +9,7 @@ from typing import Any, Dict, Optional, Tuple
 from ..reasoner import EnhancedReasoningEngine
 from ..enums import ComplexityRegime
 from ...providers.base import LLMProvider
+from ...providers.memoization import memoized_call
 
 logger = logging.getLogger(__name__)
 
@@ -104,7 +105,8 @@ async def _llm_self_evaluate_solution(
 """
         call_kwargs = base_model_kwargs.copy()
         call_kwargs.pop('system_prompt', None)
-        is_trivial_res = await provider.call(is_trivial_prompt, "", **call_kwargs)
+        # 同じ質問に対する判定結果は変わらないため、再評価のループや同一プロンプトの再実行ではキャッシュを使う
+        is_trivial_res = await memoized_call(provider, is_trivial_prompt, "", cacheable=True, **call_kwargs)
         if "yes" in is_trivial_res.get("text", "no").lower() and len(solution) < 200:
              return {"is_sufficient": True, "reason": "単純な質問に簡潔な回答が生成されたため。"}
 
@@ -3,6 +3,7 @@
 # 役割: 全てのパイプラインの統一インターフェース
 
 from .adaptive import AdaptivePipeline
+from .context import ExecutionContext
 from .parallel import ParallelPipeline
 from .quantum_inspired import QuantumInspiredPipeline
 from .speculative import SpeculativePipeline
@@ -10,6 +11,7 @@ from .self_discover import SelfDiscoverPipeline # ★★★ 追加 ★★★
 
 __all__ = [
     "AdaptivePipeline",
+    "ExecutionContext",
     "ParallelPipeline", 
     "QuantumInspiredPipeline",
     "SpeculativePipeline",
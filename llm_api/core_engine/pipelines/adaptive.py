@@ -4,19 +4,18 @@
 
 import logging
 import time
-import asyncio
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
 
 # --- ▼▼▼ ここから修正 ▼▼▼ ---
 # 誤っていた相対インポートパスを修正 (.. -> ...)
 from ...providers.base import LLMProvider
 # --- ▲▲▲ ここまで修正 ▲▲▲ ---
-from ...rag import RAGManager
 from ..analyzer import AdaptiveComplexityAnalyzer
 from ..reasoner import EnhancedReasoningEngine
 from ..enums import ComplexityRegime
 from ..learner import ComplexityLearner
 from ..logic import self_adjustment, finalization
+from .context import ExecutionContext
 
 # MemoryConsolidationEngineの循環参照を避けるため、型ヒントとして文字列を使用
 if False: # TYPE_CHECKING
@@ -27,10 +26,11 @@ logger = logging.getLogger(__name__)
 class AdaptivePipeline:
     """適応型パイプライン処理を担当するクラス（リファクタリング・PCM対応版）"""
 
-    def __init__(self, provider: LLMProvider, base_model_kwargs: Dict[str, Any]):
+    def __init__(self, provider: LLMProvider, base_model_kwargs: Dict[str, Any], learner: Optional[ComplexityLearner] = None):
         self.provider = provider
         self.base_model_kwargs = base_model_kwargs
-        self.learner = ComplexityLearner()
+        # 学習結果をリクエスト間・エンジン間で共有する場合は外部から渡す
+        self.learner = learner or ComplexityLearner()
         self.complexity_analyzer = AdaptiveComplexityAnalyzer(learner=self.learner)
         self.reasoning_engine = EnhancedReasoningEngine(provider, base_model_kwargs) 
         self.consolidation_engine: Optional['ConsolidationEngine'] = None 
@@ -51,9 +51,15 @@ class AdaptivePipeline:
         knowledge_base_path: Optional[str] = None,
         use_wikipedia: bool = False,
         real_time_adjustment: bool = True,
-        mode: str = 'adaptive'
+        mode: str = 'adaptive',
+        stream_callback: Optional[Callable[[str], Awaitable[None]]] = None,
+        execution_context: Optional[ExecutionContext] = None
     ) -> Dict[str, Any]:
-        """適応型パイプラインの実行（オーケストレーション）"""
+        """
+        適応型パイプラインの実行（オーケストレーション）
+        execution_contextが渡された場合は、共有コンテキストのRAG結果と複雑性分析を再利用し、
+        記憶統合と学習の記録は行わない（呼び出し元が complete_shared_execution で一度だけ行う）。
+        """
         logger.info(f"適応型パイプライン開始 (モード: {mode}): {prompt[:80]}...")
 
         try:
@@ -63,11 +69,16 @@ class AdaptivePipeline:
                 use_rag, use_wikipedia, real_time_adjustment = False, False, False
                 force_regime = ComplexityRegime.LOW
 
-            # 1. RAGのセットアップ
-            current_prompt, rag_source = await self._setup_rag(prompt, use_rag, knowledge_base_path, use_wikipedia)
+            if execution_context is not None:
+                # 1-2. 共有コンテキストのRAG結果と分析結果を再利用
+                current_prompt, rag_source = execution_context.prompt, execution_context.rag_source
+                complexity_score, initial_regime = execution_context.complexity_score, execution_context.initial_regime
+            else:
+                # 1. RAGのセットアップ
+                current_prompt, rag_source = await self._setup_rag(prompt, use_rag, knowledge_base_path, use_wikipedia)
 
-            # 2. 複雑性分析 (PCM対応済み)
-            complexity_score, initial_regime = self.complexity_analyzer.analyze_complexity(current_prompt, mode=mode)
+                # 2. 複雑性分析 (PCM対応済み)
+                complexity_score, initial_regime = self.complexity_analyzer.analyze_complexity(current_prompt, mode=mode)
             current_regime = force_regime or initial_regime
 
             # 3. 推論ループの実行
@@ -88,12 +99,14 @@ class AdaptivePipeline:
 
             # --- ▼▼▼ ここからPCM対応の修正 ▼▼▼ ---
             # 4. 記憶統合エンジンへの連携 (海馬から新皮質へ)
-            self._trigger_memory_consolidation(
-                prompt=prompt,
-                final_reasoning_result=final_reasoning_result,
-                novelty_score=complexity_score,
-                final_regime=final_regime
-            )
+            # 共有コンテキストで実行される分岐では、最終的な解が決まった後に一度だけ行う
+            if execution_context is None:
+                self._trigger_memory_consolidation(
+                    prompt=prompt,
+                    final_reasoning_result=final_reasoning_result,
+                    novelty_score=complexity_score,
+                    final_regime=final_regime
+                )
             # --- ▲▲▲ ここまでPCM対応の修正 ▲▲▲ ---
 
             # 5. 学習と最終化
@@ -108,13 +121,64 @@ class AdaptivePipeline:
                 initial_regime=initial_regime,
                 complexity_score=complexity_score,
                 rag_source=rag_source,
-                mode=mode
+                mode=mode,
+                stream_callback=stream_callback,
+                record_learning=execution_context is None
             )
 
         except Exception as e:
             logger.error(f"適応型パイプライン実行中に予期せぬエラー: {e}", exc_info=True)
             return self._format_error_response(str(e))
     
+    async def prepare_context(
+        self,
+        prompt: str,
+        use_rag: bool = False,
+        knowledge_base_path: Optional[str] = None,
+        use_wikipedia: bool = False,
+        mode: str = 'adaptive'
+    ) -> ExecutionContext:
+        """RAGと複雑性分析をリクエストにつき一度だけ行い、分岐間で共有する実行コンテキストを作成する。"""
+        current_prompt, rag_source = await self._setup_rag(prompt, use_rag, knowledge_base_path, use_wikipedia)
+        complexity_score, initial_regime = self.complexity_analyzer.analyze_complexity(current_prompt, mode=mode)
+        return ExecutionContext(
+            original_prompt=prompt,
+            prompt=current_prompt,
+            rag_source=rag_source,
+            complexity_score=complexity_score,
+            initial_regime=initial_regime,
+            mode=mode,
+            consolidate=self.consolidation_engine is not None
+        )
+
+    def complete_shared_execution(self, context: ExecutionContext, result: Dict[str, Any]) -> None:
+        """
+        共有コンテキストで実行した分岐のうち、採用された結果について記憶統合と学習の記録を一度だけ行う。
+        同じコンテキストで二度呼ばれた場合は何もしない。
+        """
+        if context.side_effects_done or not result.get('success'):
+            return
+        context.side_effects_done = True
+
+        regime_value = (result.get('v2_improvements') or {}).get('regime')
+        try:
+            final_regime = ComplexityRegime(regime_value) if regime_value else context.initial_regime
+        except ValueError:
+            final_regime = context.initial_regime
+
+        if context.consolidate:
+            self._trigger_memory_consolidation(
+                prompt=context.original_prompt,
+                final_reasoning_result={
+                    'solution': result.get('final_solution'),
+                    'thought_process': result.get('thought_process') or {},
+                },
+                novelty_score=context.complexity_score,
+                final_regime=final_regime
+            )
+        if final_regime != context.initial_regime:
+            self.learner.record_outcome(context.original_prompt, final_regime)
+
     # --- ▼▼▼ 新規追加メソッド ▼▼▼ ---
     def _trigger_memory_consolidation(
         self,
@@ -123,7 +187,7 @@ class AdaptivePipeline:
         novelty_score: float,
         final_regime: ComplexityRegime
     ) -> None:
-        """非同期で記憶統合プロセスをトリガーする"""
+        """記憶統合エンジンの待ち行列にセッションを追加し、バックグラウンドで統合させる"""
         if self.consolidation_engine:
             session_data = {
                 "prompt": prompt,
@@ -135,8 +199,8 @@ class AdaptivePipeline:
                 "timestamp": time.time()
             }
             logger.info(f"セッション情報を記憶統合エンジンに送信します。新規性スコア: {novelty_score:.2f}")
-            # 非同期タスクとして実行し、パイプラインの応答をブロックしない
-            asyncio.create_task(self.consolidation_engine.consolidate_memories(session_data))
+            # 上限付きのワーカープールで実行し、パイプラインの応答をブロックしない
+            self.consolidation_engine.enqueue(session_data)
         else:
             logger.warning("ConsolidationEngineが設定されていないため、セッション記憶は保存されません。")
     # --- ▲▲▲ 新規追加メソッド ▲▲▲ ---
@@ -148,7 +212,12 @@ class AdaptivePipeline:
         if not (use_rag or use_wikipedia):
             return prompt, None
 
-        rag_manager = RAGManager(provider=self.provider, use_wikipedia=use_wikipedia, knowledge_base_path=knowledge_base_path)
+        from ...rag import RAGManager
+        graph_store = getattr(self.consolidation_engine, 'graph_store', None)
+        rag_manager = RAGManager(
+            provider=self.provider, use_wikipedia=use_wikipedia,
+            knowledge_base_path=knowledge_base_path, graph_store=graph_store
+        )
         augmented_prompt = await rag_manager.retrieve_and_augment(prompt)
         rag_source = 'wikipedia' if use_wikipedia else 'knowledge_base'
         return augmented_prompt, rag_source
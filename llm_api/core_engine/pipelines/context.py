@@ -0,0 +1,24 @@
+# /llm_api/core_engine/pipelines/context.py
+# タイトル: Shared Execution Context
+# 役割: 1つのリクエストから複数の分岐（並列レジーム等）を実行する際に、RAGの検索結果・複雑性分析・
+#       記憶統合と学習の実施状況を共有し、分岐ごとに同じ処理を繰り返さないようにする。
+
+from dataclasses import dataclass
+from typing import Optional
+
+from ..enums import ComplexityRegime
+
+
+@dataclass
+class ExecutionContext:
+    """リクエスト単位で分岐間に共有される実行コンテキスト"""
+    original_prompt: str
+    prompt: str                                     # RAGで拡張済みのプロンプト（RAG無効時は元のプロンプト）
+    rag_source: Optional[str]
+    complexity_score: float
+    initial_regime: ComplexityRegime
+    mode: str = 'adaptive'
+    # 記憶統合を行うか（Edgeモード等では行わない）
+    consolidate: bool = True
+    # 記憶統合と学習の記録が実施済みか。分岐ではなく、最終的な解が決まった時点で一度だけ行う
+    side_effects_done: bool = False
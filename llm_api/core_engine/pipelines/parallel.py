@@ -4,23 +4,41 @@
 
 import asyncio
 import logging
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from .adaptive import AdaptivePipeline
+from .context import ExecutionContext
 from ..enums import ComplexityRegime
-from ...rag import RAGManager
+from ...config import settings
 from ...providers.base import LLMProvider
 
 logger = logging.getLogger(__name__)
 
+QualityGate = Callable[[Dict[str, Any]], bool]
+
+# 実行するレジーム（race戦略では軽いものから順に開始する）
+REGIMES: List[Tuple[str, str, ComplexityRegime]] = [
+    ("low", "低複雑性", ComplexityRegime.LOW),
+    ("medium", "中複雑性", ComplexityRegime.MEDIUM),
+    ("high", "高複雑性", ComplexityRegime.HIGH),
+]
+
 class ParallelPipeline:
     """並列推論パイプライン処理を担当するクラス"""
     
-    def __init__(self, provider: LLMProvider, base_model_kwargs: Dict[str, Any], shared_adaptive_pipeline: Optional[AdaptivePipeline] = None):
+    def __init__(
+        self,
+        provider: LLMProvider,
+        base_model_kwargs: Dict[str, Any],
+        shared_adaptive_pipeline: Optional[AdaptivePipeline] = None,
+        quality_gate: Optional[QualityGate] = None
+    ):
         self.provider = provider
         self.base_model_kwargs = base_model_kwargs
         # 共有パイプラインがあれば使用、なければ新規作成
         self.adaptive_pipeline = shared_adaptive_pipeline or AdaptivePipeline(provider, base_model_kwargs)
+        # race戦略で候補を採用してよいかを判定する関数（候補の辞書を受け取る）
+        self.quality_gate = quality_gate or self._default_quality_gate
         logger.info("ParallelPipeline を初期化しました")
     
     async def execute(
@@ -29,85 +47,57 @@ class ParallelPipeline:
         system_prompt: str = "",
         use_rag: bool = False,
         knowledge_base_path: Optional[str] = None,
-        use_wikipedia: bool = False
+        use_wikipedia: bool = False,
+        strategy: Optional[str] = None
     ) -> Dict[str, Any]:
-        """並列推論パイプラインの実行"""
-        logger.info(f"並列推論パイプライン実行開始: {prompt[:80]}...")
+        """
+        並列推論パイプラインの実行。
+        strategyが "race" の場合、品質ゲートを通過した最初の解を採用し、実行中の他のレジームをキャンセルする。
+        未指定の場合は settings.PARALLEL_PIPELINE_STRATEGY に従う。
+        """
+        strategy = strategy or settings.PARALLEL_PIPELINE_STRATEGY
+        logger.info(f"並列推論パイプライン実行開始 (戦略: {strategy}): {prompt[:80]}...")
         
-        # RAG処理
-        final_prompt = prompt
-        rag_source = None
-        if use_rag or use_wikipedia:
-            rag_manager = RAGManager(provider=self.provider, use_wikipedia=use_wikipedia, knowledge_base_path=knowledge_base_path)
-            final_prompt = await rag_manager.retrieve_and_augment(prompt)
-            rag_source = 'wikipedia' if use_wikipedia else 'knowledge_base'
+        # RAG処理と複雑性分析はリクエストにつき一度だけ行い、各レジームの分岐で共有する
+        try:
+            context = await self.adaptive_pipeline.prepare_context(
+                prompt, use_rag=use_rag, knowledge_base_path=knowledge_base_path,
+                use_wikipedia=use_wikipedia, mode='parallel'
+            )
+        except Exception as e:
+            logger.error(f"並列実行の準備中にエラー: {e}")
+            return self._format_error_response(str(e))
+        rag_source = context.rag_source
         
         # 3つの異なる複雑性レジームで並列実行（改善版）
         logger.info("3つの複雑性レジーム（低・中・高）で並列実行します")
         
         try:
-            # 並列実行のタスクを作成
-            tasks = [
-                self._execute_regime_safely("low", final_prompt, system_prompt, ComplexityRegime.LOW),
-                self._execute_regime_safely("medium", final_prompt, system_prompt, ComplexityRegime.MEDIUM),
-                self._execute_regime_safely("high", final_prompt, system_prompt, ComplexityRegime.HIGH),
-            ]
-            
-            # セマフォで同時実行数を制限（Ollamaサーバーの負荷軽減）
-            semaphore = asyncio.Semaphore(2)  # 最大2つの同時実行
-            
-            async def limited_task(task: asyncio.Task, regime_name: str) -> Any:
-                async with semaphore:
-                    logger.info(f"{regime_name}レジーム実行開始")
-                    result = await task
-                    logger.info(f"{regime_name}レジーム実行完了")
-                    return result
-            
-            limited_tasks = [
-                limited_task(asyncio.create_task(tasks[0]), "低複雑性"),
-                limited_task(asyncio.create_task(tasks[1]), "中複雑性"), 
-                limited_task(asyncio.create_task(tasks[2]), "高複雑性")
-            ]
-            
-            results = await asyncio.gather(*limited_tasks, return_exceptions=True)
-            
+            valid_solutions, race_winner, cancelled_regimes = await self._run_regimes(
+                context, system_prompt, race=(strategy == "race")
+            )
         except Exception as e:
             logger.error(f"並列実行中にエラー: {e}")
             return self._format_error_response(str(e))
         
-        # 有効な結果をフィルタリング
-        valid_solutions: List[Dict[str, Any]] = []
-        for i, res in enumerate(results):
-            regime_names = ["低複雑性", "中複雑性", "高複雑性"]
-            # Exceptionインスタンスかどうかを最初にチェック
-            if isinstance(res, BaseException):
-                logger.warning(f"{regime_names[i]}レジームで例外が発生: {res}")
-                continue
-                
-            if res and res.get('success') and not res.get('error') and res.get('final_solution'):
-                valid_solutions.append({
-                    'solution': res.get('final_solution'),
-                    'complexity_regime': res.get('v2_improvements', {}).get('regime'),
-                    'reasoning_approach': res.get('v2_improvements', {}).get('reasoning_approach'),
-                    'regime_name': regime_names[i],
-                    'full_response': res
-                })
-            else:
-                error_msg = res.get('error', '不明なエラー') if res else '空の結果'
-                logger.warning(f"{regime_names[i]}レジームが無効な結果を返しました: {error_msg}")
-        
         if not valid_solutions:
             return self._format_error_response("全ての並列パイプラインが失敗しました。")
         
-        logger.info(f"{len(valid_solutions)}/3 のレジームが成功しました")
+        logger.info(f"{len(valid_solutions)}/{len(REGIMES)} のレジームが成功しました")
             
-        # 最良解選択（改善版）
-        best_solution_info = await self._select_best_solution(valid_solutions, prompt)
+        if race_winner is not None:
+            best_solution_info = {**race_winner, 'selection_reason': f"品質ゲートを最初に通過した解（{race_winner['regime_name']}）"}
+        else:
+            # 最良解選択（改善版）
+            best_solution_info = await self._select_best_solution(valid_solutions, prompt)
         final_solution = best_solution_info['solution']
+
+        # 記憶統合と学習の記録は、採用した解についてのみ一度だけ行う
+        self.adaptive_pipeline.complete_shared_execution(context, best_solution_info['full_response'])
         
         # レスポンス構築
         thought_process = {
-            'reasoning_approach': f"parallel_best_of_{len(valid_solutions)}",
+            'reasoning_approach': "parallel_race" if race_winner is not None else f"parallel_best_of_{len(valid_solutions)}",
             'candidates_considered': len(valid_solutions),
             'selected_regime': best_solution_info.get('complexity_regime'),
             'selection_reason': best_solution_info.get('selection_reason', 'First valid solution'),
@@ -117,13 +107,15 @@ class ParallelPipeline:
                     'approach': sol['reasoning_approach'],
                     'length': len(sol['solution']) if sol.get('solution') else 0
                 } for sol in valid_solutions
-            ]
+            ],
+            'cancelled_regimes': cancelled_regimes,
         }
         
         v2_improvements = {
             'rag_enabled': use_rag or use_wikipedia,
             'rag_source': rag_source,
             'parallel_execution': True,
+            'parallel_strategy': strategy,
             'regimes_tested': len(valid_solutions),
             'selected_regime': best_solution_info.get('complexity_regime'),
         }
@@ -137,15 +129,98 @@ class ParallelPipeline:
             'version': 'v2'
         }
     
-    async def _execute_regime_safely(self, regime_name: str, prompt: str, system_prompt: str, force_regime: ComplexityRegime) -> Dict[str, Any]:
+    async def _run_regimes(
+        self, context: ExecutionContext, system_prompt: str, race: bool
+    ) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]], List[str]]:
+        """
+        各レジームをプロバイダーごとの同時実行数の上限の下で実行し、(有効な候補, race戦略の勝者, キャンセルしたレジーム) を返す。
+        race戦略では完了した順に品質ゲートを判定し、通過した時点で残りのタスクをキャンセルする
+        （キャンセルはプロバイダー呼び出しまで伝播し、実行中のリクエストも中断される）。
+        """
+        # セマフォで同時実行数を制限（Ollamaサーバー等の負荷軽減）。上限はプロバイダーごとの設定に従う
+        semaphore = asyncio.Semaphore(settings.concurrency_limit_for(getattr(self.provider, 'provider_name', '')))
+
+        async def limited_task(regime_key: str, regime_name: str, regime: ComplexityRegime) -> Dict[str, Any]:
+            async with semaphore:
+                logger.info(f"{regime_name}レジーム実行開始")
+                result = await self._execute_regime_safely(regime_key, context, system_prompt, regime)
+                logger.info(f"{regime_name}レジーム実行完了")
+                return result
+
+        tasks: Dict["asyncio.Task[Dict[str, Any]]", str] = {
+            asyncio.create_task(limited_task(key, name, regime)): name for key, name, regime in REGIMES
+        }
+        valid_solutions: List[Dict[str, Any]] = []
+        winner: Optional[Dict[str, Any]] = None
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # 同時に完了した場合も低複雑性のレジームを優先する
+                for task in sorted(done, key=lambda t: list(tasks).index(t)):
+                    candidate = self._to_candidate(task, tasks[task])
+                    if candidate is None:
+                        continue
+                    valid_solutions.append(candidate)
+                    if race and winner is None and self.quality_gate(candidate):
+                        winner = candidate
+                if winner is not None:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        cancelled = [tasks[task] for task in pending]
+        if cancelled:
+            logger.info(f"品質ゲートを通過した解が得られたため、{', '.join(cancelled)}レジームをキャンセルしました。")
+        # 候補の順序はレジームの順序に揃える
+        order = [name for _, name, _ in REGIMES]
+        valid_solutions.sort(key=lambda sol: order.index(sol['regime_name']))
+        return valid_solutions, winner, cancelled
+
+    @staticmethod
+    def _to_candidate(task: "asyncio.Task[Dict[str, Any]]", regime_name: str) -> Optional[Dict[str, Any]]:
+        """完了したタスクの結果を候補に変換する。失敗・無効な結果の場合はNone。"""
+        # Exceptionインスタンスかどうかを最初にチェック
+        if task.exception() is not None:
+            logger.warning(f"{regime_name}レジームで例外が発生: {task.exception()}")
+            return None
+        res = task.result()
+        if res and res.get('success') and not res.get('error') and res.get('final_solution'):
+            return {
+                'solution': res.get('final_solution'),
+                'complexity_regime': res.get('v2_improvements', {}).get('regime'),
+                'reasoning_approach': res.get('v2_improvements', {}).get('reasoning_approach'),
+                'regime_name': regime_name,
+                'full_response': res
+            }
+        error_msg = res.get('error', '不明なエラー') if res else '空の結果'
+        logger.warning(f"{regime_name}レジームが無効な結果を返しました: {error_msg}")
+        return None
+
+    @staticmethod
+    def _default_quality_gate(candidate: Dict[str, Any]) -> bool:
+        """既定の品質ゲート: 一定の長さがあり、自己評価で不十分と判定されていない解を採用する。"""
+        solution = candidate.get('solution') or ''
+        if len(solution.strip()) < settings.PARALLEL_RACE_MIN_LENGTH:
+            return False
+        evaluation = (candidate.get('full_response', {}).get('thought_process') or {}).get('self_evaluation')
+        if isinstance(evaluation, dict) and evaluation.get('is_sufficient') is False:
+            return False
+        return True
+
+    async def _execute_regime_safely(self, regime_name: str, context: ExecutionContext, system_prompt: str, force_regime: ComplexityRegime) -> Dict[str, Any]:
         """安全な個別レジーム実行"""
         try:
             result = await self.adaptive_pipeline.execute(
-                prompt=prompt,
+                prompt=context.original_prompt,
                 system_prompt=system_prompt,
                 force_regime=force_regime,
                 real_time_adjustment=False,  # 並列実行時は調整を無効化
-                mode='parallel'
+                mode='parallel',
+                execution_context=context
             )
             return result
         except Exception as e:
@@ -6,7 +6,6 @@ import logging
 from typing import Any, Dict, Optional
 
 from ...quantum_engine import QuantumReasoningEngine
-from ...rag import RAGManager
 from ...providers.base import LLMProvider
 
 logger = logging.getLogger(__name__)
@@ -40,6 +39,7 @@ class QuantumInspiredPipeline:
         final_prompt = prompt
         rag_source = None
         if use_rag or use_wikipedia:
+            from ...rag import RAGManager
             rag_manager = RAGManager(provider=self.provider, use_wikipedia=use_wikipedia, knowledge_base_path=knowledge_base_path)
             final_prompt = await rag_manager.retrieve_and_augment(prompt)
             rag_source = 'wikipedia' if use_wikipedia else 'knowledge_base'
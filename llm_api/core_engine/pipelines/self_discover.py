@@ -7,9 +7,9 @@ import time
 from typing import Any, Dict, List, Optional, Tuple, cast
 
 from ...providers.base import LLMProvider
+from ...providers.memoization import memoized_call
 from ...reasoning.strategy_hub import ThinkingStrategyHub, Strategy
 from ...reasoning.atomic_modules import get_atomic_module_prompt, ATOMIC_REASONING_MODULES
-from ...rag import RAGManager
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +39,7 @@ class SelfDiscoverPipeline:
         current_prompt = prompt
         rag_source = None
         if use_rag or use_wikipedia:
+            from ...rag import RAGManager
             rag_manager = RAGManager(provider=self.provider, use_wikipedia=use_wikipedia, knowledge_base_path=knowledge_base_path)
             current_prompt = await rag_manager.retrieve_and_augment(prompt)
             rag_source = 'wikipedia' if use_wikipedia else 'knowledge_base'
@@ -91,9 +92,11 @@ class SelfDiscoverPipeline:
         call_kwargs = self.base_model_kwargs.copy()
         call_kwargs.pop('system_prompt', None)  # 重複を避ける
         
-        response = await self.provider.call(
+        response = await memoized_call(
+            self.provider,
             prompt=classify_prompt,
             system_prompt=system_prompt,
+            cacheable=True,
             **call_kwargs
         )
 
@@ -3,12 +3,11 @@
 # Role: Implements thinking-level speculative decoding with corrected provider calls.
 
 import logging
-from typing import Any, Dict, Optional, List, cast
+from typing import Any, Awaitable, Callable, Dict, Optional, List, cast
 import httpx
 import asyncio
 
 from .adaptive import AdaptivePipeline
-from ...rag import RAGManager
 from ...providers import get_provider
 from ...providers.base import LLMProvider
 
@@ -17,10 +16,11 @@ logger = logging.getLogger(__name__)
 class SpeculativePipeline:
     """思考レベルの投機的デコーディングを実装したパイプライン"""
     
-    def __init__(self, provider: LLMProvider, base_model_kwargs: Dict[str, Any]):
+    def __init__(self, provider: LLMProvider, base_model_kwargs: Dict[str, Any], shared_adaptive_pipeline: Optional[AdaptivePipeline] = None):
         self.provider = provider # 検証・統合用の高機能プロバイダー
         self.base_model_kwargs = base_model_kwargs
-        self.adaptive_pipeline = AdaptivePipeline(provider, base_model_kwargs)
+        # 共有パイプラインがあれば使用、なければ新規作成
+        self.adaptive_pipeline = shared_adaptive_pipeline or AdaptivePipeline(provider, base_model_kwargs)
         logger.info("SpeculativePipeline (Thinking-level Speculative Decoding) を初期化しました")
     
     async def execute(
@@ -29,7 +29,8 @@ class SpeculativePipeline:
         system_prompt: str = "",
         use_rag: bool = False,
         knowledge_base_path: Optional[str] = None,
-        use_wikipedia: bool = False
+        use_wikipedia: bool = False,
+        stream_callback: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Dict[str, Any]:
         """投機的思考パイプラインの実行"""
         logger.info(f"思考レベルの投機的デコーディングパイプライン開始: {prompt[:80]}...")
@@ -37,6 +38,7 @@ class SpeculativePipeline:
         current_prompt = prompt
         rag_source = None
         if use_rag or use_wikipedia:
+            from ...rag import RAGManager
             rag_manager = RAGManager(provider=self.provider, use_wikipedia=use_wikipedia, knowledge_base_path=knowledge_base_path)
             current_prompt = await rag_manager.retrieve_and_augment(prompt)
             rag_source = 'wikipedia' if use_wikipedia else 'knowledge_base'
@@ -46,7 +48,7 @@ class SpeculativePipeline:
         
         if not draft_model_name:
             logger.warning("適切な軽量ドラフトモデルが見つかりませんでした。適応型パイプラインにフォールバックします。")
-            return await self.adaptive_pipeline.execute(current_prompt, system_prompt, mode='balanced')
+            return await self.adaptive_pipeline.execute(current_prompt, system_prompt, mode='balanced', stream_callback=stream_callback)
         
         try:
             # 2. 軽量モデルで複数の思考ドラフトを並列生成
@@ -57,7 +59,7 @@ class SpeculativePipeline:
                 return self._format_error_response("ドラフト生成に失敗しました。")
             
             # 3. 高機能モデルで検証と統合
-            final_solution = await self._verify_and_integrate(current_prompt, drafts, system_prompt)
+            final_solution = await self._verify_and_integrate(current_prompt, drafts, system_prompt, stream_callback)
             
             if not final_solution:
                 logger.error("検証・統合に失敗しました。")
@@ -148,7 +150,13 @@ class SpeculativePipeline:
             logger.error(f"ドラフト生成中にエラー: {e}")
             return []
     
-    async def _verify_and_integrate(self, original_prompt: str, drafts: List[str], system_prompt: str) -> Optional[str]:
+    async def _verify_and_integrate(
+        self,
+        original_prompt: str,
+        drafts: List[str],
+        system_prompt: str,
+        stream_callback: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> Optional[str]:
         """高機能モデルでドラフトを検証・統合する"""
         try:
             drafts_context = "\n\n---\n\n".join(f"思考ドラフト {i+1}:\n{draft}" for i, draft in enumerate(drafts))
@@ -173,10 +181,8 @@ class SpeculativePipeline:
             call_kwargs.pop('model', None)  # --model引数を削除してプロバイダーのデフォルトを使用
             call_kwargs.pop('system_prompt', None)  # 重複を避ける
             
-            response = await self.provider.call(
-                prompt=verification_prompt,
-                system_prompt=system_prompt,
-                **call_kwargs
+            response = await self.provider.call_streaming(
+                verification_prompt, system_prompt, stream_callback, **call_kwargs
             )
             
             if response.get('error'):
@@ -6,7 +6,7 @@ import asyncio
 import json
 import logging
 import re
-from typing import Any, Dict, List, Union, cast
+from typing import Any, Dict, List, Optional, Tuple, Union, cast
 
 from ...config import settings
 from ...providers.base import LLMProvider
@@ -24,7 +24,7 @@ async def execute_high_complexity_reasoning(
 ) -> Dict[str, Any]:
     """
     高複雑性問題の推論（崩壊回避戦略）。
-    問題をサブ問題に分解し、並列解決したのち、逐次的に統合して最終解を生成します。
+    問題をサブ問題に分解し、並列解決したのち、それらを統合して最終解を生成します。
 
     Args:
         provider: 使用するLLMプロバイダー。
@@ -40,13 +40,15 @@ async def execute_high_complexity_reasoning(
     sub_problems_result = await _decompose_complex_problem(provider, prompt, system_prompt, base_model_kwargs)
     if isinstance(sub_problems_result, dict) and sub_problems_result.get('error'):
         return {'solution': '', 'error': sub_problems_result['error']}
-    sub_problems = cast(List[str], sub_problems_result)
+    sub_problems, dependencies = _build_dependency_graph(cast(List[Any], sub_problems_result))
 
     if not sub_problems:
         logger.warning("問題の分解に失敗。中複雑性モードにフォールバックします。")
         return await execute_medium_complexity_reasoning(provider, prompt, system_prompt, base_model_kwargs)
 
-    staged_solutions = await _solve_decomposed_problems(provider, sub_problems, prompt, system_prompt, base_model_kwargs)
+    staged_solutions = await _solve_decomposed_problems(
+        provider, sub_problems, prompt, system_prompt, base_model_kwargs, dependencies=dependencies
+    )
     if any(s.get('error') for s in staged_solutions):
         logger.warning("一部のサブ問題の解決中にエラーが発生しました。")
 
@@ -61,6 +63,7 @@ async def execute_high_complexity_reasoning(
         'complexity_regime': ComplexityRegime.HIGH.value,
         'reasoning_approach': 'decomposition_parallel_solve_integration',
         'decomposition': sub_problems,
+        'dependencies': dependencies,
         'sub_solutions': staged_solutions,
         'collapse_prevention': True
     }
@@ -68,12 +71,23 @@ async def execute_high_complexity_reasoning(
 
 async def _decompose_complex_problem(
     provider: LLMProvider, prompt: str, system_prompt: str, base_model_kwargs: Dict[str, Any]
-) -> Union[List[str], Dict[str, Any]]:
-    """複雑な問題を解決可能なサブ問題のJSONリストに分解します。"""
-    decomposition_prompt = (
-        f"Decompose the following complex problem: {prompt}. "
-        "Output a JSON array of sub-problems."
-    )
+) -> Union[List[Any], Dict[str, Any]]:
+    """
+    複雑な問題を解決可能なサブ問題のJSONリストに分解します。
+    依存関係の出力が有効な場合、各要素は {"id", "problem", "depends_on"} 形式の辞書になることがあります。
+    """
+    if settings.HIGH_COMPLEXITY_DEPENDENCY_SCHEDULING:
+        decomposition_prompt = (
+            f"Decompose the following complex problem: {prompt}. "
+            'Output a JSON object of the form {"sub_problems": [{"id": 1, "problem": "...", "depends_on": []}]}, '
+            "where 'depends_on' lists the ids of sub-problems whose answers are required before solving it. "
+            "Leave 'depends_on' empty for sub-problems that can be solved independently."
+        )
+    else:
+        decomposition_prompt = (
+            f"Decompose the following complex problem: {prompt}. "
+            "Output a JSON array of sub-problems."
+        )
     
     # 修正: provider.callに渡す引数を整理し、重複を避ける
     call_kwargs = base_model_kwargs.copy()
@@ -97,8 +111,15 @@ async def _decompose_complex_problem(
                 return list_match
             raise json.JSONDecodeError("No JSON or list found", response_text, 0)
 
-        parsed_json = json.loads(json_match.group(0))
-        sub_problems = parsed_json.get("sub_problems", [])
+        try:
+            parsed_json = json.loads(json_match.group(0))
+        except json.JSONDecodeError:
+            # 辞書を要素とするトップレベルの配列は、最初の'{'から最後の'}'までを切り出すと壊れるため配列として再解析する
+            array_match = re.search(r'\[.*\]', response_text, re.DOTALL)
+            if not array_match:
+                raise
+            parsed_json = {"sub_problems": json.loads(array_match.group(0))}
+        sub_problems = parsed_json.get("sub_problems", []) if isinstance(parsed_json, dict) else parsed_json
         if not isinstance(sub_problems, list):
             logger.error(f"'sub_problems'がリスト形式ではありません: {sub_problems}")
             return []
@@ -109,21 +130,102 @@ async def _decompose_complex_problem(
         return []
 
 
+def _build_dependency_graph(raw_sub_problems: List[Any]) -> Tuple[List[str], List[List[int]]]:
+    """
+    分解結果をサブ問題の文字列リストと、各サブ問題が依存するサブ問題のインデックスのリストに正規化します。
+    依存先はidで解決し、idが一致しない整数は1始まりの番号として扱います。
+    不明な依存先・自己依存は無視し、循環が検出された場合はその循環に含まれる依存関係を破棄します。
+    """
+    sub_problems: List[str] = []
+    ids: List[Any] = []
+    raw_dependencies: List[List[Any]] = []
+    for item in raw_sub_problems:
+        if isinstance(item, dict):
+            text = item.get('problem') or item.get('sub_problem') or item.get('description') or ''
+            depends_on = item.get('depends_on') or item.get('dependencies') or []
+            item_id = item.get('id', len(sub_problems) + 1)
+        else:
+            text, depends_on, item_id = item, [], len(sub_problems) + 1
+        text = str(text).strip()
+        if not text:
+            continue
+        sub_problems.append(text)
+        ids.append(str(item_id))
+        raw_dependencies.append(depends_on if isinstance(depends_on, list) else [depends_on])
+
+    index_by_id = {item_id: i for i, item_id in enumerate(ids)}
+    dependencies: List[List[int]] = []
+    for i, depends_on in enumerate(raw_dependencies):
+        parents: List[int] = []
+        for dep in depends_on:
+            parent = index_by_id.get(str(dep))
+            if parent is None and isinstance(dep, int) and 1 <= dep <= len(sub_problems):
+                parent = dep - 1
+            if parent is None or parent == i or parent in parents:
+                continue
+            parents.append(parent)
+        dependencies.append(parents)
+
+    # Kahnのアルゴリズムで処理できずに残ったノードは循環に含まれるため、それらの間の依存を取り除く
+    remaining = {i: set(parents) for i, parents in enumerate(dependencies)}
+    while True:
+        ready = [i for i, parents in remaining.items() if not parents & remaining.keys()]
+        if not ready:
+            break
+        for i in ready:
+            del remaining[i]
+    if remaining:
+        logger.warning(f"サブ問題の依存関係に循環が検出されました。該当する依存を無視します: {sorted(remaining)}")
+        for i in remaining:
+            dependencies[i] = [p for p in dependencies[i] if p not in remaining]
+
+    return sub_problems, dependencies
+
+
 async def _solve_decomposed_problems(
-    provider: LLMProvider, sub_problems: List[str], original_prompt: str, system_prompt: str, base_model_kwargs: Dict[str, Any]
+    provider: LLMProvider,
+    sub_problems: List[str],
+    original_prompt: str,
+    system_prompt: str,
+    base_model_kwargs: Dict[str, Any],
+    dependencies: Optional[List[List[int]]] = None
 ) -> List[Dict[str, Any]]:
-    """分解されたサブ問題を並列で解決します。"""
-    logger.info(f"{len(sub_problems)}個のサブ問題を並列解決します。")
-    semaphore = asyncio.Semaphore(settings.OLLAMA_CONCURRENCY_LIMIT)
+    """
+    分解されたサブ問題を並列で解決します。
+    dependenciesが与えられた場合はDAGとして扱い、依存先がすべて解決されたサブ問題から順に並列実行し、
+    依存先の解決策を子のプロンプトに渡します。同時実行数はプロバイダーごとの上限（settings.concurrency_limit_for）で制限されます。
+    """
+    dependencies = dependencies or [[] for _ in sub_problems]
+    if any(dependencies):
+        logger.info(f"{len(sub_problems)}個のサブ問題を依存関係に従って並列解決します。")
+    else:
+        logger.info(f"{len(sub_problems)}個のサブ問題を並列解決します。")
+    semaphore = asyncio.Semaphore(settings.concurrency_limit_for(provider.provider_name))
+
+    # 修正: provider.callに渡す引数を整理し、重複を避ける
+    call_kwargs = base_model_kwargs.copy()
+    call_kwargs.pop('system_prompt', None)
+
+    tasks: Dict[int, "asyncio.Task[Dict[str, Any]]"] = {}
 
     async def solve_task(sub_problem: str, index: int) -> Dict[str, Any]:
+        parent_indices = dependencies[index]
+        # 依存先の完了を待つ間はセマフォを保持しないため、実行可能なサブ問題が枠を使える
+        parent_results = [await tasks[p] for p in parent_indices]
         async with semaphore:
             staged_prompt = f"""Given the original problem: "{original_prompt}", solve the following sub-problem: "{sub_problem}"."""
+            solved_parents = [r for r in parent_results if r.get('solution') and not r.get('error')]
+            if solved_parents:
+                prerequisites = "\n\n".join(
+                    f"## {r['sub_problem']}\n{r['solution']}" for r in solved_parents
+                )
+                staged_prompt += f"""
+
+Use the solutions to the prerequisite sub-problems below.
+
+# Prerequisite Solutions:
+{prerequisites}"""
             logger.debug(f"サブ問題 {index+1}/{len(sub_problems)} の解決を開始...")
-            
-            # 修正: provider.callに渡す引数を整理し、重複を避ける
-            call_kwargs = base_model_kwargs.copy()
-            call_kwargs.pop('system_prompt', None)
 
             response = await provider.call(
                 prompt=staged_prompt,
@@ -131,16 +233,40 @@ async def _solve_decomposed_problems(
                 **call_kwargs
             )
             logger.debug(f"サブ問題 {index+1}/{len(sub_problems)} の解決が完了。")
-            return {'sub_problem': sub_problem, 'solution': response.get('text', ''), 'error': response.get('error')}
+            return {
+                'sub_problem': sub_problem,
+                'solution': response.get('text', ''),
+                'error': response.get('error'),
+                'depends_on': parent_indices
+            }
 
-    tasks = [solve_task(sp, i) for i, sp in enumerate(sub_problems)]
-    return await asyncio.gather(*tasks)
+    # _build_dependency_graphで循環は除去済みのため、全タスクを先に生成しても待ち合わせは必ず解決する
+    for i, sp in enumerate(sub_problems):
+        tasks[i] = asyncio.create_task(solve_task(sp, i))
+    try:
+        return list(await asyncio.gather(*(tasks[i] for i in range(len(sub_problems)))))
+    finally:
+        for task in tasks.values():
+            task.cancel()
 
 
 async def _integrate_staged_solutions(
-    provider: LLMProvider, staged_solutions: List[Dict[str, Any]], original_prompt: str, system_prompt: str, base_model_kwargs: Dict[str, Any]
+    provider: LLMProvider,
+    staged_solutions: List[Dict[str, Any]],
+    original_prompt: str,
+    system_prompt: str,
+    base_model_kwargs: Dict[str, Any],
+    mode: Optional[str] = None,
+    fan_in: Optional[int] = None
 ) -> Union[str, Dict[str, Any]]:
-    """段階的解決策を統合します。"""
+    """
+    段階的解決策を統合し、最後に仕上げ（polish）を行います。
+
+    Args:
+        mode: "tree"（k分木による並列統合）または "sequential"（先頭からの逐次統合）。
+              未指定の場合は settings.HIGH_COMPLEXITY_INTEGRATION_MODE を使用します。
+        fan_in: tree方式で一度に統合する部分解の数。未指定の場合は settings.HIGH_COMPLEXITY_INTEGRATION_FAN_IN。
+    """
     valid_solutions = [s['solution'] for s in staged_solutions if s.get('solution') and not s.get('error')]
     if not valid_solutions:
         return {"error": "統合する有効なサブ問題の解決策がありません。"}
@@ -149,8 +275,37 @@ async def _integrate_staged_solutions(
     call_kwargs = base_model_kwargs.copy()
     call_kwargs.pop('system_prompt', None)
 
-    integrated_solution = valid_solutions[0]
-    for i, next_solution in enumerate(valid_solutions[1:]):
+    mode = (mode or settings.HIGH_COMPLEXITY_INTEGRATION_MODE).lower()
+    if mode == "sequential":
+        integrated_solution = await _integrate_sequentially(provider, valid_solutions, system_prompt, call_kwargs)
+    else:
+        if mode != "tree":
+            logger.warning(f"未知の統合方式 '{mode}' が指定されました。tree方式で統合します。")
+        integrated_solution = await _integrate_as_tree(
+            provider, valid_solutions, system_prompt, call_kwargs,
+            fan_in or settings.HIGH_COMPLEXITY_INTEGRATION_FAN_IN
+        )
+
+    final_polish_prompt = f"""Polish the following integrated text for the question: "{original_prompt}".
+
+# Integrated Text:
+{integrated_solution}
+
+# Polished Final Report:"""
+    final_response = await provider.call(
+        prompt=final_polish_prompt,
+        system_prompt=system_prompt,
+        **call_kwargs
+    )
+    return cast(str, final_response.get('text', integrated_solution))
+
+
+async def _integrate_sequentially(
+    provider: LLMProvider, solutions: List[str], system_prompt: str, call_kwargs: Dict[str, Any]
+) -> str:
+    """部分解を先頭から一つずつ逐次的に統合します（N-1回の直列呼び出し）。"""
+    integrated_solution = solutions[0]
+    for next_solution in solutions[1:]:
         integration_prompt = f"""Integrate the 'New Information' into the 'Previous Integrated Result'.
 
 # Previous Integrated Result:
@@ -166,18 +321,47 @@ async def _integrate_staged_solutions(
             **call_kwargs
         )
         if response.get('error'):
-            return cast(str, integrated_solution)
+            return integrated_solution
         integrated_solution = response.get('text', integrated_solution)
+    return integrated_solution
 
-    final_polish_prompt = f"""Polish the following integrated text for the question: "{original_prompt}".
 
-# Integrated Text:
-{integrated_solution}
+async def _integrate_as_tree(
+    provider: LLMProvider, solutions: List[str], system_prompt: str, call_kwargs: Dict[str, Any], fan_in: int
+) -> str:
+    """
+    部分解をfan_in個ずつのグループに分けて統合し、結果が一つになるまで繰り返します。
+    同じ段のグループは互いに独立しているため、プロバイダーの同時実行数制限の下で並列に統合します（段数はO(log N)）。
+    """
+    fan_in = max(2, fan_in)
+    semaphore = asyncio.Semaphore(settings.concurrency_limit_for(provider.provider_name))
 
-# Polished Final Report:"""
-    final_response = await provider.call(
-        prompt=final_polish_prompt,
-        system_prompt=system_prompt,
-        **call_kwargs
-    )
-    return cast(str, final_response.get('text', integrated_solution))
\ No newline at end of file
+    async def merge_group(group: List[str]) -> str:
+        if len(group) == 1:
+            return group[0]
+        sections = "\n\n".join(f"# Partial Result {i + 1}:\n{text}" for i, text in enumerate(group))
+        integration_prompt = f"""Integrate the following partial results into a single coherent result without losing any information.
+
+{sections}
+
+# Integrated Result:"""
+        async with semaphore:
+            response = await provider.call(
+                prompt=integration_prompt,
+                system_prompt=system_prompt,
+                **call_kwargs
+            )
+        if response.get('error') or not response.get('text'):
+            # 統合に失敗したグループは内容を失わないよう連結して次の段へ渡す
+            logger.warning(f"部分解の統合に失敗したため、連結して処理を継続します: {response.get('error')}")
+            return "\n\n".join(group)
+        return cast(str, response['text'])
+
+    level = list(solutions)
+    depth = 0
+    while len(level) > 1:
+        groups = [level[i:i + fan_in] for i in range(0, len(level), fan_in)]
+        level = list(await asyncio.gather(*(merge_group(g) for g in groups)))
+        depth += 1
+        logger.debug(f"統合ツリーの第{depth}段が完了しました（残り {len(level)} 件）。")
+    return level[0]
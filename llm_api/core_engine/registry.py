@@ -0,0 +1,152 @@
+# /llm_api/core_engine/registry.py
+# タイトル: MetaIntelligence Engine Registry
+# 役割: プロバイダーとモデルパラメータごとにMetaIntelligenceEngineを保持し、リクエスト間で再利用する。
+#       パイプライン・複雑性アナライザー・ComplexityLearnerの再構築を避け、長時間稼働プロセスでの初期化コストを削減する。
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from .engine import MetaIntelligenceEngine
+from .learner import ComplexityLearner
+from .response_cache import ResponseCache
+from .analyzer import clear_nlp_model_cache
+from ..config import settings
+from ..providers.base import LLMProvider
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENGINES = 8
+
+
+def _freeze(value: Any) -> Hashable:
+    """キャッシュキー用に値をハッシュ可能な形へ変換する。"""
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [_freeze(v) for v in value]
+        return tuple(sorted(items, key=repr)) if isinstance(value, (set, frozenset)) else tuple(items)
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        # テンソル等のハッシュ不可能なオブジェクトは同一性で区別する
+        return (type(value).__name__, id(value))
+
+
+class EngineRegistry:
+    """
+    MetaIntelligenceEngineのインスタンスを (プロバイダー名, モデルパラメータ, 記憶統合エンジン) をキーに保持するレジストリ。
+    全エンジンで一つのComplexityLearnerを共有するため、フィードバックによる学習結果は即座に全エンジンへ反映される。
+    応答キャッシュも全エンジンで共有する（キーにプロバイダーとモデルパラメータを含むため、エンジン間で混ざることはない）。
+    """
+
+    def __init__(
+        self,
+        max_engines: int = DEFAULT_MAX_ENGINES,
+        learner: Optional[ComplexityLearner] = None,
+        response_cache: Optional[ResponseCache] = None
+    ):
+        self.max_engines = max_engines
+        # 学習器はSQLiteファイルを開くため、最初に必要になるまで生成しない（インポート時にファイルを作らない）
+        self._learner = learner
+        if response_cache is None and settings.RESPONSE_CACHE_ENABLED:
+            response_cache = ResponseCache()
+        self.response_cache = response_cache
+        self._engines: "OrderedDict[Tuple[Hashable, ...], MetaIntelligenceEngine]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @property
+    def learner(self) -> ComplexityLearner:
+        """全エンジンで共有するComplexityLearner（初回参照時に生成する）"""
+        if self._learner is None:
+            with self._lock:
+                if self._learner is None:
+                    self._learner = ComplexityLearner()
+        return self._learner
+
+    def _make_key(
+        self, provider_name: str, base_model_kwargs: Dict[str, Any], consolidation_engine: Optional[Any]
+    ) -> Tuple[Hashable, ...]:
+        consolidation_id = id(consolidation_engine) if consolidation_engine is not None else None
+        return (provider_name, _freeze(base_model_kwargs), consolidation_id)
+
+    def get_engine(
+        self,
+        provider_name: str,
+        provider: LLMProvider,
+        base_model_kwargs: Dict[str, Any],
+        consolidation_engine: Optional[Any] = None
+    ) -> MetaIntelligenceEngine:
+        """
+        条件に一致するエンジンを返す。存在しない場合、または保持しているエンジンが
+        別のプロバイダーインスタンス（プロバイダーキャッシュの再生成後など）を参照している場合は新規に構築する。
+        """
+        key = self._make_key(provider_name, base_model_kwargs, consolidation_engine)
+        learner = self.learner
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is not None and engine.provider is provider:
+                self._engines.move_to_end(key)
+                self._stats["hits"] += 1
+                logger.debug(f"プロバイダー '{provider_name}' のキャッシュ済みエンジンを再利用します。")
+                return engine
+
+            self._stats["misses"] += 1
+            logger.info(f"プロバイダー '{provider_name}' 用のMetaIntelligenceEngineを新規に構築します。")
+            engine = MetaIntelligenceEngine(
+                provider,
+                base_model_kwargs,
+                consolidation_engine=consolidation_engine,
+                learner=learner,
+                response_cache=self.response_cache
+            )
+            self._engines[key] = engine
+            self._engines.move_to_end(key)
+            while len(self._engines) > self.max_engines:
+                self._engines.popitem(last=False)
+                self._stats["evictions"] += 1
+            return engine
+
+    def invalidate(self, provider_name: Optional[str] = None) -> int:
+        """
+        保持しているエンジンを破棄する。provider_nameを指定した場合はそのプロバイダーのエンジンのみを対象とする。
+        破棄したエンジン数を返す。
+        """
+        with self._lock:
+            if provider_name is None:
+                removed = len(self._engines)
+                self._engines.clear()
+            else:
+                keys = [key for key in self._engines if key[0] == provider_name]
+                for key in keys:
+                    del self._engines[key]
+                removed = len(keys)
+        if removed:
+            logger.info(f"{removed}個のMetaIntelligenceEngineを破棄しました (対象: {provider_name or '全プロバイダー'})。")
+        return removed
+
+    def clear(self, include_nlp_models: bool = False) -> None:
+        """
+        全エンジンを破棄し、学習データをストレージから読み直す。
+        include_nlp_modelsがTrueの場合は共有しているspaCyモデルも破棄する。
+        """
+        self.invalidate()
+        if self._learner is not None:
+            self._learner.reload()
+        if include_nlp_models:
+            clear_nlp_model_cache()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """キャッシュのヒット数・ミス数・追い出し数と現在のエンジン数を返す。応答キャッシュが有効な場合はその統計も含める。"""
+        with self._lock:
+            stats: Dict[str, Any] = {**self._stats, "engines": len(self._engines)}
+        if self.response_cache is not None:
+            stats["response_cache"] = self.response_cache.get_stats()
+        return stats
+
+
+# プロセス内で共有するデフォルトのレジストリ
+engine_registry = EngineRegistry()
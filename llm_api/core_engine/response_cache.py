@@ -0,0 +1,337 @@
+# /llm_api/core_engine/response_cache.py
+# タイトル: Semantic Response Cache
+# 役割: MetaIntelligenceEngine.solve_problemの結果を、正規化したプロンプトと実行条件をキーにキャッシュする。
+#       完全一致（ハッシュ）層と、任意で有効化できる埋め込み類似度層の二段構成で、TTL・LRU追い出し・SQLiteへの永続化・ヒット率の計測を備える。
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, NamedTuple, Optional, Sequence, Tuple
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+EmbedFn = Callable[[str], Sequence[float]]
+
+# 生成結果に影響しないため、キャッシュキーから除外するリクエストオプション
+NON_GENERATION_KEYS = {"feedback", "use_response_cache", "no_fallback", "force_v2", "stream_callback"}
+
+
+def _strip_non_generation_keys(value: Any) -> Any:
+    """生成結果に影響しない項目を、入れ子の辞書（model_kwargs等）も含めて取り除く。"""
+    if isinstance(value, dict):
+        return {k: _strip_non_generation_keys(v) for k, v in value.items() if k not in NON_GENERATION_KEYS}
+    return value
+
+
+class CacheKey(NamedTuple):
+    """完全一致用のキーと、類似度検索の対象を絞り込むための実行条件キー"""
+    key: str
+    context_key: str
+    prompt: str
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Unicode正規化と空白の畳み込みを行い、表記揺れによるキャッシュミスを減らす。"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", prompt)).strip()
+
+
+def _default_embed_fn() -> EmbedFn:
+    """RAGと同じ埋め込みモデルを共有して使う。"""
+    from ..rag.knowledge_base import _get_embeddings
+    return _get_embeddings(settings.RAG_EMBEDDING_MODEL).embed_query
+
+
+class ResponseCache:
+    """
+    solve_problemの応答キャッシュ。
+    メモリ上のLRUを一次層とし、persist_pathが指定された場合はSQLiteへ書き込み、プロセス再起動後も再利用する。
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+        persist_path: Optional[str] = None,
+        max_persistent_entries: Optional[int] = None,
+        semantic: Optional[bool] = None,
+        similarity_threshold: Optional[float] = None,
+        embed_fn: Optional[EmbedFn] = None
+    ):
+        """
+        Args:
+            max_entries: メモリ上に保持するエントリ数の上限。
+            ttl: エントリの有効期間（秒）。0以下の場合は期限なし。
+            persist_path: SQLiteファイルのパス。空文字の場合は永続化しない。
+            max_persistent_entries: SQLiteに保持するエントリ数の上限。
+            semantic: 埋め込み類似度層を有効にするか。
+            similarity_threshold: 類似度層でヒットとみなすコサイン類似度の下限。
+            embed_fn: テキストを埋め込みベクトルへ変換する関数（未指定時はRAG用の埋め込みモデルを使用）。
+        """
+        self.max_entries = max_entries or settings.RESPONSE_CACHE_MAX_ENTRIES
+        self.ttl = ttl if ttl is not None else settings.RESPONSE_CACHE_TTL
+        self.max_persistent_entries = max_persistent_entries or settings.RESPONSE_CACHE_MAX_PERSISTENT_ENTRIES
+        self.semantic = semantic if semantic is not None else settings.RESPONSE_CACHE_SEMANTIC_ENABLED
+        self.similarity_threshold = (
+            similarity_threshold if similarity_threshold is not None else settings.RESPONSE_CACHE_SIMILARITY_THRESHOLD
+        )
+        self._embed_fn = embed_fn
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+        persist_path = persist_path if persist_path is not None else settings.RESPONSE_CACHE_PATH
+        self._db: Optional[sqlite3.Connection] = None
+        # 永続ストレージの件数（保存のたびにテーブルを数えないよう、開いた時点の件数から増分で管理する）
+        self._db_count = 0
+        if persist_path:
+            self._db = self._open_db(Path(persist_path))
+            if self._db is not None:
+                self._db_count = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def _open_db(self, path: Path) -> Optional[sqlite3.Connection]:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, context_key TEXT NOT NULL, prompt TEXT NOT NULL, response TEXT NOT NULL, "
+                "embedding BLOB, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_responses_context ON responses (context_key)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+            return db
+        except sqlite3.Error as e:
+            logger.error(f"応答キャッシュのストレージ '{path}' を開けませんでした。メモリのみで動作します: {e}")
+            return None
+
+    # --- キー生成 ---
+
+    def make_key(self, prompt: str, context: Dict[str, Any]) -> Optional[CacheKey]:
+        """
+        プロンプトと実行条件（モード、プロバイダー、モデルパラメータ等）からキーを生成する。
+        条件にJSONへ変換できない値（感情ステアリングのベクトル等）が含まれる場合はキャッシュ対象外としてNoneを返す。
+        """
+        context = _strip_non_generation_keys(context)
+        kb_path = context.get("knowledge_base_path")
+        if kb_path and os.path.isfile(kb_path):
+            # ナレッジベースが更新された場合に古い応答を返さないよう、ファイルの更新情報も条件に含める
+            stat = os.stat(kb_path)
+            context["knowledge_base_stat"] = [stat.st_size, stat.st_mtime_ns]
+        try:
+            context_json = json.dumps(context, sort_keys=True, ensure_ascii=False)
+        except (TypeError, ValueError):
+            logger.debug("実行条件にシリアライズできない値が含まれるため、応答キャッシュを使用しません。")
+            return None
+        normalized = normalize_prompt(prompt)
+        context_key = hashlib.sha256(context_json.encode("utf-8")).hexdigest()
+        key = hashlib.sha256(f"{context_key}\n{normalized}".encode("utf-8")).hexdigest()
+        return CacheKey(key=key, context_key=context_key, prompt=normalized)
+
+    # --- 参照 ---
+
+    def get(self, cache_key: CacheKey) -> Optional[Dict[str, Any]]:
+        """キャッシュされた応答を返す。完全一致が無ければ、類似度層が有効な場合に限り近傍のプロンプトを探す。"""
+        with self._lock:
+            entry = self._get_exact(cache_key.key)
+            if entry is not None:
+                self._stats["exact_hits"] += 1
+                return self._to_response(entry, "exact")
+
+        if self.semantic:
+            match = self._get_semantic(cache_key)
+            if match is not None:
+                entry, similarity = match
+                with self._lock:
+                    self._stats["semantic_hits"] += 1
+                response = self._to_response(entry, "semantic")
+                response["cache"]["similarity"] = round(similarity, 4)
+                return response
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def _get_exact(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is None and self._db is not None:
+            row = self._db.execute(
+                "SELECT key, context_key, prompt, response, embedding, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                entry = self._row_to_entry(row)
+                self._remember(entry)
+        if entry is None:
+            return None
+        if self._is_expired(entry["created_at"], now):
+            self._stats["expired"] += 1
+            self._delete(key)
+            return None
+        self._entries.move_to_end(key)
+        if self._db is not None:
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        return entry
+
+    def _get_semantic(self, cache_key: CacheKey) -> Optional[Tuple[Dict[str, Any], float]]:
+        import numpy as np
+
+        query = self._embed(cache_key.prompt)
+        if query is None:
+            return None
+        now = time.time()
+        with self._lock:
+            if self._db is not None:
+                rows = self._db.execute(
+                    "SELECT key, context_key, prompt, response, embedding, created_at FROM responses "
+                    "WHERE context_key = ? AND embedding IS NOT NULL ORDER BY last_access DESC LIMIT ?",
+                    (cache_key.context_key, self.max_entries)
+                ).fetchall()
+                candidates = [self._row_to_entry(row) for row in rows]
+            else:
+                candidates = [e for e in self._entries.values()
+                              if e["context_key"] == cache_key.context_key and e.get("embedding") is not None]
+            candidates = [e for e in candidates if not self._is_expired(e["created_at"], now)]
+            if not candidates:
+                return None
+
+            matrix = np.stack([e["embedding"] for e in candidates])
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.similarity_threshold:
+                return None
+            entry = candidates[best]
+            self._remember(entry)
+            if self._db is not None:
+                self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, entry["key"]))
+            return entry, similarity
+
+    def _embed(self, text: str) -> Optional[Any]:
+        import numpy as np
+
+        try:
+            if self._embed_fn is None:
+                self._embed_fn = _default_embed_fn()
+            vector = np.asarray(self._embed_fn(text), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"応答キャッシュの埋め込み計算に失敗したため、類似度層を無効化します: {e}")
+            self.semantic = False
+            return None
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else vector
+
+    @staticmethod
+    def _to_response(entry: Dict[str, Any], tier: str) -> Dict[str, Any]:
+        # 呼び出し側での変更がキャッシュへ波及しないよう、保存済みのJSONから毎回復元する
+        response = json.loads(entry["response"])
+        response["cache"] = {"hit": tier, "age": round(time.time() - entry["created_at"], 3)}
+        return response
+
+    # --- 登録 ---
+
+    def put(self, cache_key: CacheKey, response: Dict[str, Any]) -> None:
+        """応答を保存する。呼び出し側で成功した応答のみを渡すこと。"""
+        payload = {k: v for k, v in response.items() if k != "cache"}
+        serialized = json.dumps(payload, ensure_ascii=False, default=str)
+        embedding = self._embed(cache_key.prompt) if self.semantic else None
+        now = time.time()
+        entry = {
+            "key": cache_key.key, "context_key": cache_key.context_key, "prompt": cache_key.prompt,
+            "response": serialized, "embedding": embedding, "created_at": now,
+        }
+        with self._lock:
+            self._remember(entry)
+            self._stats["stores"] += 1
+            if self._db is not None:
+                if self._db.execute("SELECT 1 FROM responses WHERE key = ?", (entry["key"],)).fetchone() is None:
+                    self._db_count += 1
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, context_key, prompt, response, embedding, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (entry["key"], entry["context_key"], entry["prompt"], serialized,
+                     embedding.tobytes() if embedding is not None else None, now, now)
+                )
+                self._trim_db()
+
+    def _remember(self, entry: Dict[str, Any]) -> None:
+        self._entries[entry["key"]] = entry
+        self._entries.move_to_end(entry["key"])
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _trim_db(self) -> None:
+        """
+        永続ストレージの件数が上限を超えた場合、最終参照が古いものから削除する。
+        件数はメモリ上の値で判定し、上限を超えた場合にのみ実際の件数を数え直す。
+        """
+        assert self._db is not None
+        if self._db_count <= self.max_persistent_entries:
+            return
+        (count,) = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()
+        overflow = count - self.max_persistent_entries
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+            self._stats["evictions"] += overflow
+        self._db_count = min(count, self.max_persistent_entries)
+
+    def _delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+        if self._db is not None:
+            deleted = self._db.execute("DELETE FROM responses WHERE key = ?", (key,)).rowcount
+            self._db_count = max(self._db_count - max(deleted, 0), 0)
+
+    @staticmethod
+    def _row_to_entry(row: Tuple[Any, ...]) -> Dict[str, Any]:
+        key, context_key, prompt, response, embedding, created_at = row
+        if embedding is not None:
+            import numpy as np
+            embedding = np.frombuffer(embedding, dtype=np.float32)
+        return {
+            "key": key, "context_key": context_key, "prompt": prompt,
+            "response": response, "embedding": embedding, "created_at": created_at,
+        }
+
+    # --- 管理 ---
+
+    def clear(self) -> None:
+        """メモリ上と永続ストレージ上の全エントリを削除する。"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db_count = 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """ヒット数（完全一致・類似度別）、ミス数、保存数、追い出し数、期限切れ数、ヒット率を返す。"""
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            if self._db is not None:
+                stats["persistent_entries"] = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["exact_hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+        return stats
@@ -2,15 +2,17 @@
 # タイトル: Emotion Space Builder (Enhanced and Fixed)
 # 役割: 感情空間を構築・管理する。エラーハンドリングとロバストネスを強化。
 
+import hashlib
 import json
 import logging
+import warnings
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Any # Added Any
+from typing import Dict, List, Optional, Sequence, Tuple, Union, Any # Added Any
 
 import torch
-from torch.nn.functional import cosine_similarity
+from torch.nn.functional import normalize
 
-from .sae_manager import SAEManager
+from .sae_manager import SAEManager, SparseFeatures
 from .types import EmotionCategory
 
 # 循環参照を避けるための型チェック用インポート
@@ -20,6 +22,10 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+# バイナリ形式のマッピングファイルのバージョン（形式を変更した場合は更新し、古いファイルを読み込まないようにする）
+MAPPING_FORMAT_VERSION = "1"
+BINARY_MAPPING_SUFFIX = ".safetensors"
+
 class EmotionSpace:
     """
     感情とSAE特徴のマッピングを管理する「感情空間」を構築するクラス。
@@ -29,9 +35,141 @@ class EmotionSpace:
         self.llm_engine = llm_inference_engine
         self.sae_manager = sae_manager
         self.device = sae_manager.device
-        self.emotion_to_features: Dict[str, List[int]] = {}
+        # バイナリ形式のマッピングをロードした場合は、初回参照時に感情×特徴行列から復元する
+        self._emotion_to_features: Optional[Dict[str, List[int]]] = {}
+        # マッピングを変換した疎な感情×特徴行列（初回参照時に構築し、マッピングの置き換えで破棄する）
+        self._emotion_matrix: Optional[torch.Tensor] = None
+        self._emotion_categories: List[EmotionCategory] = []
+        self._feature_weights: Optional[torch.Tensor] = None
+        self._fingerprint: Optional[str] = None
+        # マッピングファイルに記録されたd_sae。SAEをロードせずに次元数が分からない場合に仮に使用し、
+        # SAEのロード後の初回参照時に実際の次元数と照合する
+        self._declared_feature_dim: Optional[int] = None
+        # 構築時に抽出した単語ごとのSAE特徴（マッピングファイルに保存し、再構築時に再利用する）
+        self._word_features: Dict[str, torch.Tensor] = {}
         self._validation_stats: Dict[str, int] = {"successful_mappings": 0, "failed_mappings": 0}
 
+    @property
+    def emotion_to_features(self) -> Dict[str, List[int]]:
+        """感情名からSAE特徴IDのリストへのマッピング"""
+        if self._emotion_to_features is None:
+            matrix = self.emotion_matrix
+            crow_indices = matrix.crow_indices().tolist()
+            col_indices = matrix.col_indices().tolist()
+            self._emotion_to_features = {
+                category.value: col_indices[crow_indices[row]:crow_indices[row + 1]]
+                for row, category in enumerate(self._emotion_categories)
+            }
+        return self._emotion_to_features
+
+    @emotion_to_features.setter
+    def emotion_to_features(self, mapping: Dict[str, List[int]]) -> None:
+        self._emotion_to_features = mapping
+        self._emotion_matrix = None
+        self._fingerprint = None
+        self._declared_feature_dim = None
+
+    @property
+    def emotion_matrix(self) -> torch.Tensor:
+        """
+        マッピングを表す疎な感情×特徴行列（CSR形式、形状: (感情数, d_sae)、値は全て1）。
+        行の順序は emotion_categories に対応する。
+        """
+        if self._emotion_matrix is None:
+            self.compile_mapping()
+        elif self._declared_feature_dim is not None and self.sae_manager.is_loaded:
+            self._verify_declared_feature_dim()
+        assert self._emotion_matrix is not None
+        return self._emotion_matrix
+
+    def _feature_dim(self) -> int:
+        """マッピングの次元数（SAEをロードせずに分からない場合は、マッピングファイルに記録されたd_sae）"""
+        dims = self.sae_manager.known_dims
+        if dims is not None:
+            return dims[1]
+        if self._declared_feature_dim is not None:
+            return self._declared_feature_dim
+        return self.sae_manager.feature_dim
+
+    def _verify_declared_feature_dim(self) -> None:
+        """マッピングファイルに記録されたd_saeをロード済みのSAEと照合し、異なる場合は範囲外の特徴IDを除いて再構築する"""
+        declared, self._declared_feature_dim = self._declared_feature_dim, None
+        feature_dim = self.sae_manager.feature_dim
+        if declared != feature_dim:
+            logger.warning(
+                f"感情マッピングの次元数 ({declared}) がSAEの次元数 ({feature_dim}) と異なります。範囲外の特徴IDを除外して再構築します。"
+            )
+            self._emotion_to_features = self.emotion_to_features
+            self.compile_mapping()
+            # 除外後の行列からマッピングを復元する
+            self._emotion_to_features = None
+
+    @property
+    def emotion_categories(self) -> List[EmotionCategory]:
+        """emotion_matrix の各行に対応する感情カテゴリ"""
+        if self._emotion_matrix is None:
+            self.compile_mapping()
+        return self._emotion_categories
+
+    @property
+    def feature_weights(self) -> torch.Tensor:
+        """
+        emotion_matrix を転置した密な特徴×感情行列（形状: (d_sae, 感情数)）。
+        疎なSAE特徴（上位k個の特徴ID）から感情スコアを計算する際に、特徴IDで行を引くために使用する。
+        """
+        matrix = self.emotion_matrix
+        if self._feature_weights is None:
+            self._feature_weights = matrix.to_dense().T.contiguous()
+        return self._feature_weights
+
+    def mapping_fingerprint(self) -> str:
+        """マッピングの内容を識別するハッシュ（マッピングから導出したキャッシュの有効性の確認に使用する）"""
+        # 行列が破棄されている場合は再構築し、キャッシュされたハッシュも破棄させる
+        matrix = self.emotion_matrix
+        if self._fingerprint is None:
+            digest = hashlib.sha256(",".join(c.value for c in self._emotion_categories).encode("utf-8"))
+            digest.update(str(matrix.shape[1]).encode("utf-8"))
+            # インデックスの型（JSONからの構築はint64、バイナリ形式はint32）に依存しないようにする
+            digest.update(matrix.crow_indices().to(device="cpu", dtype=torch.int64).numpy().tobytes())
+            digest.update(matrix.col_indices().to(device="cpu", dtype=torch.int64).numpy().tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def compile_mapping(self) -> None:
+        """
+        現在のマッピングを疎な感情×特徴行列に変換する。
+        感情スコアは、この行列とSAE特徴の一度の疎行列積で全感情・全トークン位置分をまとめて計算できる。
+        """
+        feature_dim = self._feature_dim()
+        categories: List[EmotionCategory] = []
+        crow_indices = [0]
+        col_indices: List[int] = []
+        for emotion_key, feature_ids in self.emotion_to_features.items():
+            try:
+                category = EmotionCategory(emotion_key)
+            except ValueError:
+                logger.warning(f"未知の感情 '{emotion_key}' のマッピングは無視します。")
+                continue
+            col_indices.extend(sorted({f for f in feature_ids if 0 <= f < feature_dim}))
+            crow_indices.append(len(col_indices))
+            categories.append(category)
+
+        with warnings.catch_warnings():
+            # CSR形式がベータ版であることの警告は抑制する
+            warnings.simplefilter("ignore", UserWarning)
+            self._emotion_matrix = torch.sparse_csr_tensor(
+                torch.tensor(crow_indices, dtype=torch.int64),
+                torch.tensor(col_indices, dtype=torch.int64),
+                torch.ones(len(col_indices), dtype=torch.float32),
+                size=(len(categories), feature_dim),
+                device=self.device,
+                check_invariants=True
+            )
+        self._emotion_categories = categories
+        self._feature_weights = None
+        self._fingerprint = None
+        logger.debug(f"感情×特徴行列を構築しました: {len(categories)}感情, 非ゼロ要素 {len(col_indices)}個")
+
     def get_emotion_feature_ids(self, emotion: EmotionCategory) -> List[int]:
         """
         指定された感情に対応するSAE特徴のIDリストを返します。
@@ -43,12 +181,15 @@ class EmotionSpace:
 
     def load_mapping(self, mapping_path: str) -> bool:
         """
-        事前計算された感情-特徴マッピングをJSONファイルからロードします。
+        事前計算された感情-特徴マッピングをロードします。
+        拡張子が .safetensors の場合はバイナリ形式、それ以外はJSONファイルとして扱います。
         """
         path = Path(mapping_path)
         if not path.exists():
             logger.warning(f"感情マッピングファイルが見つかりません: {mapping_path}")
             return False
+        if path.suffix == BINARY_MAPPING_SUFFIX:
+            return self._load_binary_mapping(path)
         
         try:
             with open(path, 'r', encoding='utf-8') as f:
@@ -58,13 +199,21 @@ class EmotionSpace:
             if not isinstance(loaded_mapping, dict):
                 logger.error("マッピングファイルの形式が不正です（辞書型である必要があります）。")
                 return False
+            # save_mappingが出力する、メタデータを含む形式
+            declared_feature_dim = None
+            if isinstance(loaded_mapping.get("emotion_mappings"), dict):
+                declared_feature_dim = (loaded_mapping.get("metadata") or {}).get("sae_feature_dim")
+                loaded_mapping = loaded_mapping["emotion_mappings"]
             
-            # 特徴IDの検証
+            # 特徴IDの検証（SAEの次元数がロードせずに分からない場合は、記録された次元数で検証する）
+            if self.sae_manager.known_dims is not None or not isinstance(declared_feature_dim, int):
+                declared_feature_dim = None
+            feature_dim = declared_feature_dim or self.sae_manager.feature_dim
             validated_mapping = {}
             for emotion_key, feature_list in loaded_mapping.items():
                 if isinstance(feature_list, list) and all(isinstance(f, int) for f in feature_list):
                     # 特徴IDがSAEの次元範囲内かチェック
-                    valid_features = [f for f in feature_list if 0 <= f < self.sae_manager.feature_dim]
+                    valid_features = [f for f in feature_list if 0 <= f < feature_dim]
                     if len(valid_features) != len(feature_list):
                         logger.warning(f"感情 '{emotion_key}' の一部の特徴IDが範囲外です。有効な特徴のみ保持します。")
                     validated_mapping[emotion_key] = valid_features
@@ -72,6 +221,8 @@ class EmotionSpace:
                     logger.warning(f"感情 '{emotion_key}' の特徴リストが不正な形式です。スキップします。")
             
             self.emotion_to_features = validated_mapping
+            self._declared_feature_dim = declared_feature_dim
+            self.compile_mapping()
             logger.info(f"感情マッピングを正常にロードしました: {mapping_path} ({len(validated_mapping)}件)")
             return True
             
@@ -79,9 +230,101 @@ class EmotionSpace:
             logger.error(f"感情マッピングのロード中にエラーが発生しました: {e}")
             return False
 
+    def _read_binary_mapping(self, path: Path) -> Optional[Tuple[Dict[str, str], Dict[str, torch.Tensor]]]:
+        """
+        バイナリ形式のマッピングファイルを開き、形式・SAEが現在のものと一致する場合にメタデータと
+        感情×特徴行列のインデックス配列（メモリマップされたテンソル）を返す。
+        SAEの次元数がロードせずに分からない場合は、次元数の照合はSAEのロード後に行う。
+        """
+        from safetensors import safe_open
+
+        try:
+            with safe_open(str(path), framework="pt", device="cpu") as f:
+                metadata = f.metadata() or {}
+                if metadata.get("format_version") != MAPPING_FORMAT_VERSION:
+                    logger.error(f"感情マッピングファイル '{path}' の形式バージョンが異なります: {metadata.get('format_version')}")
+                    return None
+                known_dims = self.sae_manager.known_dims
+                if metadata.get("sae") != self.sae_manager.identity or (
+                    known_dims is not None and int(metadata.get("feature_dim", -1)) != known_dims[1]
+                ):
+                    logger.error(
+                        f"感情マッピングファイル '{path}' は別のSAE ({metadata.get('sae')}, d_sae={metadata.get('feature_dim')}) "
+                        f"で作成されています。"
+                    )
+                    return None
+                tensors = {key: f.get_tensor(key) for key in f.keys()}
+        except Exception as e:
+            logger.error(f"感情マッピングのロード中にエラーが発生しました: {e}")
+            return None
+        return metadata, tensors
+
+    def _load_binary_mapping(self, path: Path) -> bool:
+        """バイナリ形式のマッピングをロードする。検証はインデックス配列に対するテンソル演算のみで行う。"""
+        loaded = self._read_binary_mapping(path)
+        if loaded is None:
+            return False
+        metadata, tensors = loaded
+        try:
+            categories = [EmotionCategory(value) for value in json.loads(metadata["emotions"])]
+            crow_indices, col_indices = tensors["crow_indices"], tensors["col_indices"]
+            feature_dim = int(metadata["feature_dim"])
+            if (
+                crow_indices.numel() != len(categories) + 1 or int(crow_indices[0]) != 0
+                or int(crow_indices[-1]) != col_indices.numel() or bool((crow_indices.diff() < 0).any())
+                or (col_indices.numel() > 0 and (int(col_indices.min()) < 0 or int(col_indices.max()) >= feature_dim))
+            ):
+                logger.error(f"感情マッピングファイル '{path}' のインデックス配列が不正です。")
+                return False
+            with warnings.catch_warnings():
+                # CSR形式がベータ版であることの警告は抑制する
+                warnings.simplefilter("ignore", UserWarning)
+                matrix = torch.sparse_csr_tensor(
+                    crow_indices, col_indices, torch.ones(col_indices.numel(), dtype=torch.float32),
+                    size=(len(categories), feature_dim)
+                ).to(self.device)
+        except (KeyError, ValueError, RuntimeError) as e:
+            logger.error(f"感情マッピングファイル '{path}' の内容が不正です: {e}")
+            return False
+
+        self._emotion_to_features = None
+        self._emotion_matrix = matrix
+        self._emotion_categories = categories
+        self._feature_weights = None
+        self._fingerprint = None
+        self._declared_feature_dim = feature_dim if self.sae_manager.known_dims is None else None
+        logger.info(f"感情マッピングを正常にロードしました: {path} ({len(categories)}件)")
+        return True
+
+    def load_word_features(self, mapping_path: str) -> int:
+        """
+        バイナリ形式のマッピングファイルに保存された単語ごとのSAE特徴を読み込み、次回の build_space で再利用します。
+        読み込んだ単語数を返します（現在のSAEで作成されたファイルでない場合は0）。
+        """
+        path = Path(mapping_path)
+        if path.suffix != BINARY_MAPPING_SUFFIX or not path.exists():
+            return 0
+        loaded = self._read_binary_mapping(path)
+        if loaded is None:
+            return 0
+        metadata, tensors = loaded
+        words = json.loads(metadata.get("words", "[]"))
+        if not words or "word_crow_indices" not in tensors:
+            return 0
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            features = torch.sparse_csr_tensor(
+                tensors["word_crow_indices"], tensors["word_col_indices"], tensors["word_values"],
+                size=(len(words), int(metadata["feature_dim"]))
+            ).to_dense()
+        self._word_features.update(zip(words, features))
+        logger.info(f"マッピングファイルから {len(words)} 語の特徴を読み込みました: {mapping_path}")
+        return len(words)
+
     def save_mapping(self, output_path: str) -> bool:
         """
-        構築した感情-特徴マッピングをJSONファイルに保存します。
+        構築した感情-特徴マッピングを保存します。
+        拡張子が .safetensors の場合はバイナリ形式（抽出した単語ごとの特徴を含む）、それ以外はJSONファイルとして保存します。
         """
         if not self.emotion_to_features:
             logger.warning("保存する感情マッピングがありません。")
@@ -89,6 +332,8 @@ class EmotionSpace:
         
         path = Path(output_path)
         path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix == BINARY_MAPPING_SUFFIX:
+            return self._save_binary_mapping(path)
         
         try:
             # メタデータを含むデータ構造で保存
@@ -111,14 +356,65 @@ class EmotionSpace:
             logger.error(f"感情マッピングの保存中にエラーが発生しました: {e}")
             return False
 
-    def build_space(self, concept_sets_path: str, top_k_words: int = 10, similarity_threshold: float = 0.1) -> bool:
+    def _save_binary_mapping(self, path: Path) -> bool:
+        """
+        感情×特徴行列のインデックス配列（int32）と単語ごとの特徴（CSR形式）をsafetensorsファイルに保存する。
+        SAEの識別子と次元数をメタデータに記録し、ロード時の検証に使用する。
+        """
+        from safetensors.torch import save_file
+
+        matrix = self.emotion_matrix.cpu()
+        tensors = {
+            "crow_indices": matrix.crow_indices().to(torch.int32),
+            "col_indices": matrix.col_indices().to(torch.int32),
+        }
+        metadata = {
+            "format_version": MAPPING_FORMAT_VERSION,
+            "sae": self.sae_manager.identity,
+            "feature_dim": str(self.sae_manager.feature_dim),
+            "emotions": json.dumps([category.value for category in self.emotion_categories]),
+            "validation_stats": json.dumps(self._validation_stats),
+        }
+        if self._word_features:
+            words = list(self._word_features)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", UserWarning)
+                word_matrix = torch.stack([self._word_features[word] for word in words]).float().cpu().to_sparse_csr()
+            tensors.update({
+                "word_crow_indices": word_matrix.crow_indices(),
+                "word_col_indices": word_matrix.col_indices(),
+                "word_values": word_matrix.values(),
+            })
+            metadata["words"] = json.dumps(words, ensure_ascii=False)
+
+        tmp_path = path.with_name(path.name + ".tmp")
+        try:
+            save_file(tensors, str(tmp_path), metadata=metadata)
+            tmp_path.replace(path)
+        except (OSError, ValueError) as e:
+            logger.error(f"感情マッピングの保存中にエラーが発生しました: {e}")
+            return False
+        logger.info(f"感情マッピングをファイルに保存しました: {path} ({len(self.emotion_categories)}感情, {len(self._word_features)}語の特徴)")
+        return True
+
+    def build_space(
+        self,
+        concept_sets_path: str,
+        top_k_words: int = 10,
+        similarity_threshold: float = 0.1,
+        batch_size: int = 32,
+        checkpoint_dir: Optional[str] = None
+    ) -> bool:
         """
         コンセプトセットに基づき、感情空間を構築します。
+        全感情の単語の特徴をバッチ単位でまとめて抽出し、ラベルと単語の類似度は一度の行列積で計算します。
         
         Args:
             concept_sets_path: コンセプトセットファイルのパス
             top_k_words: 各感情につき上位何語まで使用するか
             similarity_threshold: 類似度の最小閾値
+            batch_size: 一度に特徴を抽出する単語数
+            checkpoint_dir: 単語ごとの特徴を保存するディレクトリ。指定した場合、中断後の再実行では抽出済みの単語を再利用する
         """
         logger.info(f"'{concept_sets_path}' から感情空間の構築を開始します...")
         
@@ -133,43 +429,53 @@ class EmotionSpace:
             logger.error("コンセプトセットファイルの形式が不正です。")
             return False
 
-        successful_emotions = 0
         total_emotions = len(concept_sets)
-
+        valid_sets: Dict[str, List[str]] = {}
         for emotion_str, words in concept_sets.items():
-            if not words or not isinstance(words, list):
+            cleaned = [w.strip() for w in words if isinstance(w, str) and w.strip()] if isinstance(words, list) else []
+            if not cleaned:
                 logger.warning(f"感情 '{emotion_str}' の単語リストが無効です。スキップします。")
                 self._validation_stats["failed_mappings"] += 1
                 continue
-                
+            valid_sets[emotion_str] = cleaned
+
+        # 全感情の語彙（重複を除く）の特徴をまとめて抽出
+        vocabulary = list(dict.fromkeys(word for words in valid_sets.values() for word in words))
+        word_features = self._extract_word_features(vocabulary, batch_size=batch_size, checkpoint_dir=checkpoint_dir)
+        if not word_features:
+            logger.error("単語の特徴を抽出できませんでした。")
+            self._validation_stats["failed_mappings"] += len(valid_sets)
+            return False
+
+        feature_words = list(word_features)
+        word_index = {word: i for i, word in enumerate(feature_words)}
+        features = torch.stack([word_features[word] for word in feature_words]).float()
+
+        # 全ラベル×全単語のコサイン類似度を一度に計算
+        labels = [words[0] for words in valid_sets.values() if words[0] in word_index]
+        normalized = normalize(features, dim=-1)
+        label_rows = {label: row for row, label in enumerate(dict.fromkeys(labels))}
+        similarity = normalized[[word_index[label] for label in label_rows]] @ normalized.T if label_rows else None
+
+        successful_emotions = 0
+        for emotion_str, words in valid_sets.items():
             emotion_label = words[0]
-            associated_words = words[1:] if len(words) > 1 else []
-            logger.info(f"'{emotion_label}' ({emotion_str}) の処理中...")
+            if emotion_label not in label_rows or similarity is None:
+                logger.warning(f"ラベル '{emotion_label}' の特徴抽出に失敗しました。")
+                self._validation_stats["failed_mappings"] += 1
+                continue
 
             try:
-                # ラベル単語の特徴抽出
-                label_features = self._get_features_for_word(emotion_label)
-                if label_features is None:
-                    logger.warning(f"ラベル '{emotion_label}' の特徴抽出に失敗しました。")
-                    self._validation_stats["failed_mappings"] += 1
-                    continue
+                similar_words = self._calculate_similarities(
+                    similarity[label_rows[emotion_label]], word_index, words[1:], similarity_threshold
+                )
+                # ラベルの特徴と、類似度の高い上位K語の特徴を最終的な特徴セットとする
+                selected_rows = [word_index[emotion_label]] + [word_index[word] for word, _ in similar_words[:top_k_words]]
+                unique_feature_ids = self._extract_unique_feature_ids([features[selected_rows]])
 
-                # 関連単語の特徴抽出と類似度計算
-                valid_word_features = []
-                for word in associated_words:
-                    features = self._get_features_for_word(word)
-                    if features is not None:
-                        valid_word_features.append({'word': word, 'features': features})
-
-                # 類似度計算とランキング
-                similarities = self._calculate_similarities(label_features, valid_word_features, similarity_threshold)
-                
-                # 最終的な特徴セットの構築
-                final_features = self._build_final_feature_set(label_features, similarities, top_k_words)
-                
-                if final_features:
-                    unique_feature_ids = self._extract_unique_feature_ids(final_features)
+                if unique_feature_ids:
                     self.emotion_to_features[emotion_str] = unique_feature_ids
+                    self._emotion_matrix = None
                     successful_emotions += 1
                     self._validation_stats["successful_mappings"] += 1
                     logger.info(f"  - '{emotion_label}' に {len(unique_feature_ids)} 個のユニークなSAE特徴をマッピングしました。")
@@ -185,60 +491,143 @@ class EmotionSpace:
         logger.info(f"感情空間の構築が完了しました。成功: {successful_emotions}/{total_emotions}")
         return successful_emotions > 0
 
-    def _calculate_similarities(self, label_features: torch.Tensor, word_features: List[Dict], threshold: float) -> List[Tuple[str, float, torch.Tensor]]:
-        """単語特徴とラベル特徴の類似度を計算"""
+    def _calculate_similarities(
+        self, label_similarity: torch.Tensor, word_index: Dict[str, int], words: List[str], threshold: float
+    ) -> List[Tuple[str, float]]:
+        """ラベルとの類似度（全単語分を計算済み）から、閾値以上の単語を類似度の降順で返す"""
+        candidates = [word for word in dict.fromkeys(words) if word in word_index]
+        if not candidates:
+            return []
+        scores = label_similarity[[word_index[word] for word in candidates]].tolist()
         similarities = []
-        
-        for item in word_features:
-            try:
-                # コサイン類似度を計算（バッチ次元を追加）
-                sim = cosine_similarity(
-                    label_features.unsqueeze(0), 
-                    item['features'].unsqueeze(0), 
-                    dim=-1
-                )
-                sim_value = sim.item()
-                
-                # 閾値チェック
-                if sim_value >= threshold:
-                    similarities.append((item['word'], sim_value, item['features']))
-                else:
-                    logger.debug(f"単語 '{item['word']}' の類似度 {sim_value:.3f} が閾値 {threshold} を下回りました。")
-                    
-            except Exception as e:
-                logger.warning(f"単語 '{item['word']}' の類似度計算中にエラー: {e}")
-                continue
+        for word, sim_value in zip(candidates, scores):
+            if sim_value >= threshold:
+                similarities.append((word, sim_value))
+            else:
+                logger.debug(f"単語 '{word}' の類似度 {sim_value:.3f} が閾値 {threshold} を下回りました。")
         
         # 類似度で降順ソート
         similarities.sort(key=lambda x: x[1], reverse=True)
         return similarities
 
-    def _build_final_feature_set(self, label_features: torch.Tensor, similarities: List[Tuple[str, float, torch.Tensor]], top_k: int) -> List[torch.Tensor]:
-        """最終的な特徴セットを構築"""
-        final_features = [label_features]
-        
-        # 上位K個の類似単語の特徴を追加
-        for word, sim_score, features in similarities[:top_k]:
-            final_features.append(features)
-            logger.debug(f"  追加: '{word}' (類似度: {sim_score:.3f})")
-        
-        return final_features
+    def _extract_word_features(
+        self, words: List[str], batch_size: int = 32, checkpoint_dir: Optional[str] = None
+    ) -> Dict[str, torch.Tensor]:
+        """
+        単語ごとのSAE特徴ベクトル (d_sae) をバッチ単位で抽出します。
+        checkpoint_dirを指定した場合、バッチごとに結果を保存し、保存済みの単語は抽出しません。
+        """
+        # 以前の構築（またはマッピングファイル）で抽出済みの特徴と、チェックポイントを再利用する
+        cached = dict(self._word_features)
+        if checkpoint_dir:
+            cached.update(self._load_word_feature_checkpoints(checkpoint_dir))
+        word_features = {word: cached[word] for word in words if word in cached}
+        pending = [word for word in words if word not in word_features]
+        if word_features:
+            logger.info(f"チェックポイントから {len(word_features)} 語の特徴を再利用します（残り {len(pending)} 語）。")
+
+        for start in range(0, len(pending), max(batch_size, 1)):
+            batch = pending[start:start + max(batch_size, 1)]
+            try:
+                extracted_words, hidden_states = self._get_hidden_states_for_words(batch)
+                if not extracted_words:
+                    continue
+                with torch.no_grad():
+                    batch_features = self.sae_manager.extract_features(hidden_states).reshape(len(extracted_words), -1).float().cpu()
+            except Exception as e:
+                logger.error(f"単語 {batch} の特徴抽出中にエラー: {e}", exc_info=True)
+                continue
+            word_features.update(zip(extracted_words, batch_features))
+            if checkpoint_dir:
+                self._save_word_feature_checkpoint(checkpoint_dir, extracted_words, batch_features)
+            logger.info(f"  単語の特徴抽出: {len(word_features)}/{len(words)}")
+        self._word_features.update(word_features)
+        return word_features
+
+    def _get_hidden_states_for_words(self, words: List[str]) -> Tuple[List[str], torch.Tensor]:
+        """
+        単語ごとの最後のトークンの隠れ状態を (単語数, d_model) のテンソルとして取得します。
+        LLMエンジンが get_hidden_states_for_texts を提供する場合は、パディングした1回の順伝播でまとめて取得します
+        （パディングは左詰めで、最後の位置が各単語の最後のトークンである前提）。
+        隠れ状態を取得できた単語のリストも返します。
+        """
+        if self.llm_engine is None:
+            logger.debug(f"LLMエンジンがダミーのため、{len(words)}語の特徴取得はダミーデータです。")
+            return words, torch.randn(len(words), self.sae_manager.model_dim, device=self.device)
+
+        if hasattr(self.llm_engine, "get_hidden_states_for_texts"):
+            hidden_states = self.llm_engine.get_hidden_states_for_texts(words)
+            if hidden_states.dim() > 2:
+                hidden_states = hidden_states[:, -1, :]
+            return words, hidden_states
+
+        extracted_words, states = [], []
+        for word in words:
+            hidden_states = self.llm_engine.get_hidden_states_for_text(word)
+            if hidden_states is None:
+                logger.warning(f"単語 '{word}' の隠れ状態を取得できませんでした。")
+                continue
+            # 最後のトークンの隠れ状態を使用
+            if hidden_states.dim() > 2:
+                hidden_states = hidden_states[:, -1, :]
+            extracted_words.append(word)
+            states.append(hidden_states.reshape(-1, hidden_states.shape[-1])[-1])
+        if not states:
+            return [], torch.empty(0)
+        return extracted_words, torch.stack(states)
+
+    def _load_word_feature_checkpoints(self, checkpoint_dir: str) -> Dict[str, torch.Tensor]:
+        """チェックポイントから、現在のSAEで抽出した単語の特徴を読み込む"""
+        from safetensors import safe_open
 
-    def _extract_unique_feature_ids(self, feature_tensors: List[torch.Tensor]) -> List[int]:
-        """特徴テンソルから活性化している特徴IDを抽出"""
+        word_features: Dict[str, torch.Tensor] = {}
+        for shard in sorted(Path(checkpoint_dir).glob("word_features_*.safetensors")):
+            try:
+                with safe_open(str(shard), framework="pt", device="cpu") as f:
+                    metadata = f.metadata() or {}
+                    if metadata.get("sae") != self.sae_manager.identity:
+                        logger.debug(f"別のSAEで作成されたチェックポイントを無視します: {shard}")
+                        continue
+                    word_features.update(zip(json.loads(metadata["words"]), f.get_tensor("features")))
+            except Exception as e:
+                logger.warning(f"チェックポイント '{shard}' の読み込みに失敗しました: {e}")
+        return word_features
+
+    def _save_word_feature_checkpoint(self, checkpoint_dir: str, words: List[str], features: torch.Tensor) -> None:
+        """1バッチ分の単語の特徴を新しいファイルとして保存する（既存のファイルは書き換えない）"""
+        from safetensors.torch import save_file
+
+        directory = Path(checkpoint_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        shard = directory / f"word_features_{len(list(directory.glob('word_features_*.safetensors'))):05d}.safetensors"
+        tmp_path = shard.with_name(shard.name + ".tmp")
+        try:
+            save_file(
+                {"features": features.contiguous()}, str(tmp_path),
+                metadata={"sae": self.sae_manager.identity, "words": json.dumps(words, ensure_ascii=False)}
+            )
+            tmp_path.replace(shard)
+        except OSError as e:
+            logger.warning(f"単語の特徴のチェックポイントを保存できませんでした: {e}")
+
+    def _extract_unique_feature_ids(self, feature_tensors: Sequence[Union[torch.Tensor, SparseFeatures]]) -> List[int]:
+        """特徴テンソル（密な特徴、または上位k個の疎な特徴）から活性化している特徴IDを抽出"""
         if not feature_tensors:
             return []
         
         try:
-            # 全特徴をスタック
-            all_features = torch.stack(feature_tensors)
-            
             # 活性化閾値（0より大きい値）
             activation_threshold = 1e-6
-            active_indices = torch.where(all_features > activation_threshold)
+            active_ids = []
+            for features in feature_tensors:
+                if isinstance(features, SparseFeatures):
+                    # 疎な特徴は、値が閾値を超える特徴IDをそのまま使う
+                    active_ids.append(features.indices[features.values > activation_threshold].flatten())
+                else:
+                    active_ids.append(torch.where(features.reshape(-1, features.shape[-1]) > activation_threshold)[1])
             
             # ユニークな特徴IDを取得
-            unique_feature_ids = torch.unique(active_indices[1]).tolist()
+            unique_feature_ids = torch.unique(torch.cat(active_ids)).tolist()
             
             # SAEの次元範囲内かチェック
             valid_ids = [fid for fid in unique_feature_ids if 0 <= fid < self.sae_manager.feature_dim]
@@ -252,58 +641,6 @@ class EmotionSpace:
             logger.error(f"特徴ID抽出中にエラー: {e}", exc_info=True)
             return []
 
-    def _get_features_for_word(self, word: str) -> Optional[torch.Tensor]:
-        """
-        単一の単語からSAE特徴ベクトルを取得するヘルパー関数。
-        """
-        if not word or not word.strip():
-            logger.warning("空の単語が渡されました。")
-            return None
-            
-        word = word.strip()
-        
-        if self.llm_engine is None:
-            logger.debug(f"LLMエンジンがダミーのため、'{word}' の特徴取得はダミーデータです。")
-            # ダミーの隠れ状態から特徴を生成する
-            dummy_hidden_state = torch.randn(1, 1, self.sae_manager.model_dim, device=self.device)
-            dummy_features = self.sae_manager.extract_features(dummy_hidden_state)
-            # 適切に次元を調整
-            if dummy_features.dim() > 1:
-                squeezed_features = dummy_features.squeeze()
-                while squeezed_features.dim() > 1:
-                    squeezed_features = squeezed_features.mean(dim=0)
-                return squeezed_features
-            return dummy_features
-
-        try:
-            # LLMエンジンから隠れ状態を取得
-            hidden_states = self.llm_engine.get_hidden_states_for_text(word)
-            if hidden_states is None:
-                logger.warning(f"単語 '{word}' の隠れ状態を取得できませんでした。")
-                return None
-            
-            # 最後のトークンの隠れ状態を使用
-            if hidden_states.dim() > 2:
-                last_token_hidden_state = hidden_states[:, -1, :]
-            else:
-                last_token_hidden_state = hidden_states
-            
-            # SAE特徴を抽出
-            sae_features = self.sae_manager.extract_features(last_token_hidden_state)
-            
-            # バッチ次元を削除
-            if sae_features.dim() > 1:
-                final_features = sae_features.squeeze(0)
-                if final_features.dim() > 1:
-                    final_features = final_features.mean(dim=0)  # シーケンス次元がある場合は平均
-                return final_features
-            
-            return sae_features
-            
-        except Exception as e:
-            logger.error(f"単語 '{word}' の特徴抽出中にエラー: {e}", exc_info=True)
-            return None
-
     def get_mapping_statistics(self) -> Dict[str, Any]:
         """感情マッピングの統計情報を取得"""
         if not self.emotion_to_features:
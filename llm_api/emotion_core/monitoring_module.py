@@ -3,11 +3,11 @@
 # 役割: LLMの出力テキストや内部のSAE特徴を分析し、現在の感情状態を監視・評価する。
 
 import logging
-from typing import Dict, Optional
+from typing import Dict, Optional, Union
 
 import torch
 
-from .sae_manager import SAEManager
+from .sae_manager import SAEManager, SparseFeatures
 from .emotion_space import EmotionSpace
 from .types import EmotionCategory, EmotionAnalysisResult, ValenceArousal
 
@@ -33,35 +33,55 @@ class EmotionMonitor:
         # ここではまずSAE特徴ベースの実装に注力する。
         # self.text_classifier = load_text_emotion_classifier()
 
-    def analyze_emotions_from_features(self, sae_features: torch.Tensor) -> EmotionAnalysisResult:
+    def score_emotions(self, sae_features: Union[torch.Tensor, SparseFeatures]) -> torch.Tensor:
+        """
+        SAE特徴から、トークン位置ごとの全感情スコアを一度の行列演算で計算します。
+        各感情のスコアは、その感情に対応する特徴の値の合計です。
+
+        Args:
+            sae_features: 形状 (d_sae)、(seq, d_sae) または (batch, seq, d_sae) の特徴、
+                          または SAEManager.extract_sparse_features による上位k個の疎な特徴。
+
+        Returns:
+            torch.Tensor: 最後の次元を感情数に置き換えた形状のスコア。
+                          列の順序は emotion_space.emotion_categories に対応します。
+        """
+        matrix = self.emotion_space.emotion_matrix
+        leading_shape = sae_features.shape[:-1]
+        if sae_features.shape[-1] != matrix.shape[1]:
+            logger.error(f"SAE特徴の次元 ({sae_features.shape[-1]}) が感情マッピングの次元 ({matrix.shape[1]}) と一致しません。")
+            return torch.zeros(*leading_shape, matrix.shape[0], device=matrix.device)
+        if isinstance(sae_features, SparseFeatures):
+            # 上位k個の特徴IDで特徴×感情行列の行を引き、値で重み付けして合計する（O(トークン数×k×感情数)）
+            weights = self.emotion_space.feature_weights
+            indices = sae_features.indices.to(weights.device)
+            values = sae_features.values.to(device=weights.device, dtype=torch.float32)
+            return (weights[indices] * values.unsqueeze(-1)).sum(dim=-2)
+        flat = sae_features.reshape(-1, matrix.shape[1]).to(device=matrix.device, dtype=torch.float32)
+        scores = (matrix @ flat.T).T
+        return scores.reshape(*leading_shape, matrix.shape[0])
+
+    def _mean_scores(self, sae_features: Union[torch.Tensor, SparseFeatures]) -> torch.Tensor:
+        """バッチ・シーケンス全体で平均した感情スコア（スコアは特徴に対して線形のため、特徴の平均のスコアと等しい）"""
+        scores = self.score_emotions(sae_features)
+        if scores.dim() > 1:
+            scores = scores.mean(dim=list(range(scores.dim() - 1)))
+        return scores
+
+    def analyze_emotions_from_features(self, sae_features: Union[torch.Tensor, SparseFeatures]) -> EmotionAnalysisResult:
         """
         抽出されたSAE特徴ベクトルから、各感情の活性度を計算し、感情状態を分析します。
 
         Args:
-            sae_features (torch.Tensor): SAEManagerによって抽出された特徴ベクトル。
-                                         形状: (d_sae) または (batch, seq, d_sae)
+            sae_features: SAEManagerによって抽出された特徴ベクトル、または上位k個の疎な特徴。
+                          形状: (d_sae) または (batch, seq, d_sae)
 
         Returns:
             EmotionAnalysisResult: 分析結果を格納したデータクラス。
         """
-        if sae_features.dim() > 1:
-            # バッチやシーケンス次元がある場合は、平均化または最後のトークンを使用
-            sae_features = sae_features.mean(dim=list(range(sae_features.dim() - 1)))
-
-        emotion_scores: Dict[EmotionCategory, float] = {}
-        for emotion_cat_str, feature_ids in self.emotion_space.emotion_to_features.items():
-            if not feature_ids:
-                score = 0.0
-            else:
-                # 感情に対応する特徴の値の合計をスコアとする
-                try:
-                    score = sae_features[feature_ids].sum().item()
-                except IndexError as e:
-                    logger.error(f"特徴IDのインデックスエラー ({emotion_cat_str}): {e}")
-                    score = 0.0
-            
-            emotion_cat = EmotionCategory(emotion_cat_str)
-            emotion_scores[emotion_cat] = score
+        # 感情に対応する特徴の値の合計をスコアとする（全感情を一度に計算し、バッチやシーケンス次元は平均化）
+        scores = self._mean_scores(sae_features).tolist()
+        emotion_scores: Dict[EmotionCategory, float] = dict(zip(self.emotion_space.emotion_categories, scores))
 
         # 最もスコアの高い感情を特定 (より型安全なラムダ式を使用)
         dominant_emotion = max(emotion_scores, key=lambda e: emotion_scores.get(e, 0.0)) if emotion_scores else None
@@ -80,29 +100,29 @@ class EmotionMonitor:
             interest_score=interest_score
         )
     
-    def calculate_interest_score(self, sae_features: torch.Tensor) -> float:
+    def calculate_interest_score(self, sae_features: Union[torch.Tensor, SparseFeatures]) -> float:
         """
         自律行動トリガーのために「興味」の感情スコアのみを効率的に計算します。
 
         Args:
-            sae_features (torch.Tensor): SAE特徴ベクトル。
+            sae_features: SAE特徴ベクトル、または上位k個の疎な特徴。
 
         Returns:
-            float: 興味スコア。
+            float: 興味スコア（対応する特徴の値の平均）。
         """
         interest_feature_ids = self.emotion_space.get_emotion_feature_ids(EmotionCategory.INTEREST)
         if not interest_feature_ids:
             return 0.0
-            
-        if sae_features.dim() > 1:
-            sae_features = sae_features.mean(dim=list(range(sae_features.dim() - 1)))
-            
-        try:
-            score = sae_features[interest_feature_ids].mean().item()
-            return score
-        except IndexError as e:
-            logger.error(f"興味スコア計算中のインデックスエラー: {e}")
+
+        categories = self.emotion_space.emotion_categories
+        if EmotionCategory.INTEREST not in categories:
+            return 0.0
+        row = categories.index(EmotionCategory.INTEREST)
+        crow_indices = self.emotion_space.emotion_matrix.crow_indices()
+        feature_count = int(crow_indices[row + 1] - crow_indices[row])
+        if feature_count == 0:
             return 0.0
+        return float(self._mean_scores(sae_features)[row]) / feature_count
 
 
     def calculate_valence_arousal(self, sae_features: torch.Tensor) -> Optional[ValenceArousal]:
@@ -1,9 +1,15 @@
 # /llm_api/emotion_core/sae_manager.py
 # Title: Sparse Autoencoder (SAE) Manager (Enhanced and Fixed)
 # Role: sae-lensライブラリを使用してSAEモデルをロードし、特徴抽出を行う。エラーハンドリングとフォールバック機能を強化。
+#       ローカルのsafetensors重みはメモリマップで読み込み、モデルのロードは初回使用時まで遅延する。
 
+import hashlib
 import logging
-from typing import Optional, Dict, cast, Union, Any # Added Any
+import threading
+import warnings
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Optional, Dict, Tuple, cast, Union, Any # Added Any
 import os
 
 import torch
@@ -17,68 +23,253 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# 重みファイルのハッシュに含めるデータ領域の先頭・末尾のバイト数
+_WEIGHTS_SAMPLE_BYTES = 1 << 20
+
+@dataclass
+class SparseFeatures:
+    """
+    トークンごとの上位k個のSAE特徴（疎な表現）。メモリ使用量は O(トークン数×k)。
+    indices / values の形状は (..., k) で、先頭の次元は入力の隠れ状態に対応する。
+    上位k個に満たない場合、値が0の要素が含まれる。
+    """
+    indices: torch.Tensor
+    values: torch.Tensor
+    feature_dim: int
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """対応する密な特徴の形状"""
+        return (*self.indices.shape[:-1], self.feature_dim)
+
+    def to_dense(self) -> torch.Tensor:
+        dense = torch.zeros(self.shape, dtype=self.values.dtype, device=self.values.device)
+        return dense.scatter_(-1, self.indices, self.values)
+
+    def to_csr(self) -> torch.Tensor:
+        """先頭の次元を平坦化した (トークン数, d_sae) のCSRテンソル"""
+        k = self.indices.shape[-1]
+        indices = self.indices.reshape(-1, k)
+        values = self.values.reshape(-1, k)
+        order = indices.argsort(dim=-1)
+        crow_indices = torch.arange(0, indices.numel() + 1, k, device=indices.device)
+        with warnings.catch_warnings():
+            # CSR形式がベータ版であることの警告は抑制する
+            warnings.simplefilter("ignore", UserWarning)
+            return torch.sparse_csr_tensor(
+                crow_indices, indices.gather(-1, order).flatten(), values.gather(-1, order).flatten(),
+                size=(indices.shape[0], self.feature_dim)
+            )
+
+
+_DTYPES: Dict[str, torch.dtype] = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+}
+
+
+def resolve_dtype(dtype: Optional[Union[str, torch.dtype]]) -> Optional[torch.dtype]:
+    """"float16" などの名前をtorch.dtypeに変換する。Noneや空文字の場合はNone（保存時の型を使用）。"""
+    if dtype is None or isinstance(dtype, torch.dtype):
+        return dtype
+    if not dtype:
+        return None
+    if dtype not in _DTYPES:
+        raise ValueError(f"未対応のdtypeです: {dtype} (対応: {', '.join(_DTYPES)})")
+    return _DTYPES[dtype]
+
+
 class SAEManager:
     """
     sae-lensライブラリを介してSAEモデルを管理し、特徴抽出と再構成を行うクラス。
+    ローカルのsafetensorsファイルが指定された場合はそれをメモリマップして使用する。
+    モデルは特徴抽出・デコーダーの重みの初回参照時にロードされる。
     ライブラリが利用できない場合のフォールバック機能付き。
     """
-    def __init__(self, release: str, sae_id: str, fallback_mode: bool = True):
+    def __init__(
+        self,
+        release: str,
+        sae_id: str,
+        fallback_mode: bool = True,
+        weights_path: Optional[str] = None,
+        dtype: Optional[Union[str, torch.dtype]] = None
+    ):
         """
-        SAEManagerを初期化します。
+        SAEManagerを初期化します。モデルはここではロードしません。
         
         Args:
             release: SAEモデルのリリース名
             sae_id: SAEモデルのID
             fallback_mode: sae-lensが利用できない場合にダミーモードで動作するか
+            weights_path: ローカルのSAE重み（safetensors形式）。存在する場合はsae-lensより優先して使用する
+            dtype: 重みを保持する型（"float32" / "float16" / "bfloat16"）。Noneの場合はファイルに保存された型のまま使用する
         """
         self.release = release
         self.sae_id = sae_id
         self.fallback_mode = fallback_mode
+        self.weights_path = weights_path
+        self.dtype = resolve_dtype(dtype)
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         
-        self.sae: Optional[Union[SAE, 'DummySAE']] = None
+        self._sae: Optional[Union[SAE, 'LocalSAE', 'DummySAE']] = None
+        self._load_lock = threading.Lock()
         self.is_dummy = False
         self._feature_dim = 16384  # デフォルトのSAE特徴次元
         self._model_dim = 2048     # デフォルトのモデル次元
+        self._local_dims: Optional[Tuple[int, int]] = None
+        self._weights_digest: Optional[str] = None
         
-        if not SAE_AVAILABLE:
-            if fallback_mode:
+        if not SAE_AVAILABLE and not fallback_mode and not self._has_local_weights():
+            raise ImportError("sae-lensライブラリがインストールされていません。`pip install sae-lens`を実行してください。")
+
+    @property
+    def sae(self) -> Optional[Union[SAE, 'LocalSAE', 'DummySAE']]:
+        """SAEモデル（初回参照時にロードする）"""
+        self._ensure_loaded()
+        return self._sae
+
+    @property
+    def identity(self) -> str:
+        """
+        SAEを識別する文字列（SAEから導出したキャッシュのキーに使用する）。
+        ローカルの重みを使用する場合は重みファイルのハッシュを含め、同じ名前で重みを差し替えた場合も区別する。
+        """
+        if self._weights_digest is None and self._has_local_weights():
+            self._weights_digest = self._hash_local_weights()
+        if self._weights_digest:
+            return f"{self.release}/{self.sae_id}@{self._weights_digest}"
+        return f"{self.release}/{self.sae_id}"
+
+    def _hash_local_weights(self) -> str:
+        """
+        safetensorsのヘッダー（テンソル名・型・形状・オフセット）と、データ領域の先頭・末尾のハッシュ。
+        重み全体は読まずに、形状が同じで値だけが異なる重みも区別する。
+        """
+        path = cast(str, self.weights_path)
+        digest = hashlib.sha256()
+        try:
+            with open(path, "rb") as f:
+                header_size_bytes = f.read(8)
+                header_size = int.from_bytes(header_size_bytes, "little")
+                digest.update(header_size_bytes)
+                digest.update(f.read(header_size))
+                data_start = f.tell()
+                data_size = os.path.getsize(path) - data_start
+                digest.update(f.read(min(_WEIGHTS_SAMPLE_BYTES, data_size)))
+                if data_size > _WEIGHTS_SAMPLE_BYTES:
+                    f.seek(max(data_start + _WEIGHTS_SAMPLE_BYTES, data_start + data_size - _WEIGHTS_SAMPLE_BYTES))
+                    digest.update(f.read())
+        except OSError as e:
+            logger.warning(f"SAE重みファイルのハッシュを計算できませんでした: {e}")
+            return ""
+        return digest.hexdigest()[:16]
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._sae is not None
+
+    def _has_local_weights(self) -> bool:
+        return bool(self.weights_path) and os.path.isfile(self.weights_path) and os.path.getsize(self.weights_path) > 0
+
+    def _ensure_loaded(self) -> None:
+        if self._sae is not None:
+            return
+        with self._load_lock:
+            if self._sae is not None:
+                return
+            if self._has_local_weights():
+                try:
+                    self._load_local_weights()
+                    return
+                except Exception as e:
+                    logger.error(f"ローカルのSAE重み '{self.weights_path}' のロードに失敗しました: {e}", exc_info=True)
+            if SAE_AVAILABLE:
+                self._load_model()
+            elif self.fallback_mode:
                 logger.warning("sae-lensライブラリが利用できません。ダミーモードで動作します。")
                 self._initialize_dummy_sae()
             else:
                 raise ImportError("sae-lensライブラリがインストールされていません。`pip install sae-lens`を実行してください。")
-        else:
-            self._load_model()
 
     @property
     def decoder_weights(self) -> Optional[torch.Tensor]: # Corrected return type
         """デコーダーの重みを取得"""
-        if self.sae:
-            if hasattr(self.sae, 'W_dec'):
-                return cast(torch.Tensor, self.sae.W_dec)
-            elif hasattr(self.sae, 'decoder_weights'):
-                return cast(torch.Tensor, self.sae.decoder_weights)
+        sae = self.sae
+        if sae:
+            if hasattr(sae, 'W_dec'):
+                return cast(torch.Tensor, sae.W_dec)
+            elif hasattr(sae, 'decoder_weights'):
+                return cast(torch.Tensor, sae.decoder_weights)
         return None
 
+    def _read_local_dims(self) -> Optional[Tuple[int, int]]:
+        """ローカルの重みファイルのヘッダーから (d_model, d_sae) を読み取る（重み自体は読み込まない）"""
+        if self._local_dims is None and self._has_local_weights():
+            try:
+                from safetensors import safe_open
+
+                with safe_open(cast(str, self.weights_path), framework="pt", device="cpu") as f:
+                    d_model, d_sae = f.get_slice("W_enc").get_shape()
+                self._local_dims = (int(d_model), int(d_sae))
+            except Exception as e:
+                logger.warning(f"SAE重みファイルのヘッダーを読み取れませんでした: {e}")
+        return self._local_dims
+
+    @property
+    def known_dims(self) -> Optional[Tuple[int, int]]:
+        """
+        SAEをロードせずに分かる (d_model, d_sae)。
+        sae-lensからロードするSAEが未ロードの場合は、重みを取得しない限り分からないためNoneを返す。
+        """
+        sae = self._sae
+        if sae is not None:
+            if not self.is_dummy and hasattr(sae, 'cfg'):
+                return (
+                    cast(int, getattr(sae.cfg, 'd_model', self._model_dim)),
+                    cast(int, getattr(sae.cfg, 'd_sae', self._feature_dim))
+                )
+            return self._model_dim, self._feature_dim
+        local_dims = self._read_local_dims()
+        if local_dims is not None:
+            return local_dims
+        if not SAE_AVAILABLE:
+            # ダミーSAEはデフォルトの次元で初期化される
+            return self._model_dim, self._feature_dim
+        return None
+
+    def _resolve_dims(self) -> Tuple[int, int]:
+        """ロードせずに分かる場合はロードせずに (d_model, d_sae) を返す。分からない場合はSAEをロードする。"""
+        dims = self.known_dims
+        if dims is None:
+            self._ensure_loaded()
+            dims = self.known_dims
+        assert dims is not None
+        return dims
+
     @property
     def feature_dim(self) -> int:
         """SAE特徴の次元数を取得"""
-        if self.is_dummy:
-            return self._feature_dim
-        elif self.sae and hasattr(self.sae, 'cfg') and hasattr(self.sae.cfg, 'd_sae'):
-            return cast(int, self.sae.cfg.d_sae) # Added cast
-        else:
-            return self._feature_dim
+        return self._resolve_dims()[1]
 
     @property
     def model_dim(self) -> int:
         """モデルの隠れ次元数を取得"""
-        if self.is_dummy:
-            return self._model_dim
-        elif self.sae and hasattr(self.sae, 'cfg') and hasattr(self.sae.cfg, 'd_model'):
-            return cast(int, self.sae.cfg.d_model) # Added cast
-        else:
-            return self._model_dim
+        return self._resolve_dims()[0]
+
+    def _load_local_weights(self):
+        """ローカルのsafetensorsファイルをメモリマップしてロード（CPUかつ型変換が無い場合はコピーしない）"""
+        from safetensors import safe_open
+
+        logger.info(f"ローカルのSAE重みをメモリマップしています: {self.weights_path}")
+        with safe_open(cast(str, self.weights_path), framework="pt", device="cpu") as f:
+            tensors = {key: f.get_tensor(key) for key in f.keys()}
+        if self.dtype is not None or self.device != "cpu":
+            tensors = {key: value.to(device=self.device, dtype=self.dtype or value.dtype) for key, value in tensors.items()}
+        self._sae = LocalSAE(tensors)
+        self.is_dummy = False
+        self._model_dim, self._feature_dim = self._sae.cfg.d_model, self._sae.cfg.d_sae
+        logger.info(f"✅ ローカルのSAE重みをロードしました (d_model={self._model_dim}, d_sae={self._feature_dim}, dtype={self._sae.dtype})。")
 
     def _load_model(self):
         """実際のSAEモデルをロード"""
@@ -89,16 +280,18 @@ class SAEManager:
                 sae_id=self.sae_id,
                 device=self.device
             )
-            self.sae = sae_model
-            self.sae.eval()
+            if self.dtype is not None:
+                sae_model = sae_model.to(dtype=self.dtype)
+            self._sae = sae_model
+            self._sae.eval()
             self.is_dummy = False
             
             # 実際のモデルから次元情報を取得
-            if hasattr(self.sae, 'cfg'):
-                if hasattr(self.sae.cfg, 'd_sae'):
-                    self._feature_dim = cast(int, self.sae.cfg.d_sae) # Added cast
-                if hasattr(self.sae.cfg, 'd_model'):
-                    self._model_dim = cast(int, self.sae.cfg.d_model) # Added cast
+            if hasattr(self._sae, 'cfg'):
+                if hasattr(self._sae.cfg, 'd_sae'):
+                    self._feature_dim = cast(int, self._sae.cfg.d_sae) # Added cast
+                if hasattr(self._sae.cfg, 'd_model'):
+                    self._model_dim = cast(int, self._sae.cfg.d_model) # Added cast
             
             logger.info("✅ SAEモデルのロードに成功しました。")
         except Exception as e:
@@ -111,15 +304,12 @@ class SAEManager:
 
     def _initialize_dummy_sae(self):
         """ダミーSAEモデルを初期化"""
-        self.sae = DummySAE(self._model_dim, self._feature_dim, self.device)
+        self._sae = DummySAE(self._model_dim, self._feature_dim, self.device)
         self.is_dummy = True
         logger.info("ダミーSAEモデルで初期化されました。")
 
-    def extract_features(self, hidden_states: torch.Tensor) -> torch.Tensor:
-        """隠れ状態からSAE特徴を抽出"""
-        if not self.sae:
-            raise RuntimeError("SAEモデルがロードされていません。")
-        
+    def _prepare_hidden_states(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        """入力の形状・デバイス・次元をSAEに合わせる"""
         # 入力の形状を検証
         if hidden_states.dim() < 2:
             hidden_states = hidden_states.unsqueeze(0)
@@ -139,13 +329,18 @@ class SAEManager:
                 padding_size = expected_dim - hidden_states.shape[-1]
                 padding = torch.zeros(*hidden_states.shape[:-1], padding_size, device=self.device)
                 hidden_states = torch.cat([hidden_states, padding], dim=-1)
+        return hidden_states
+
+    def extract_features(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        """隠れ状態からSAE特徴を抽出"""
+        if not self.sae:
+            raise RuntimeError("SAEモデルがロードされていません。")
+        
+        hidden_states = self._prepare_hidden_states(hidden_states)
         
         try:
             with torch.no_grad():
-                if self.is_dummy:
-                    features = self.sae.encode(hidden_states)
-                else:
-                    features = self.sae.encode(hidden_states)
+                features = self.sae.encode(hidden_states)
             
             return cast(torch.Tensor, features)
         except Exception as e:
@@ -155,6 +350,40 @@ class SAEManager:
             seq_len = hidden_states.shape[1] if hidden_states.dim() > 2 else 1
             return torch.zeros(batch_size, seq_len, self.feature_dim, device=self.device)
 
+    def extract_sparse_features(self, hidden_states: torch.Tensor, k: int = 64, chunk_size: int = 256) -> SparseFeatures:
+        """
+        隠れ状態からトークンごとの上位k個のSAE特徴を抽出します。
+        エンコードはchunk_sizeトークンずつ行い、密な (トークン数, d_sae) の特徴は一度に保持しません。
+        """
+        if not self.sae:
+            raise RuntimeError("SAEモデルがロードされていません。")
+
+        hidden_states = self._prepare_hidden_states(hidden_states)
+        leading_shape = hidden_states.shape[:-1]
+        flat = hidden_states.reshape(-1, hidden_states.shape[-1])
+        k = min(k, self.feature_dim)
+
+        try:
+            indices, values = [], []
+            with torch.no_grad():
+                for start in range(0, flat.shape[0], chunk_size):
+                    chunk_values, chunk_indices = self.sae.encode(flat[start:start + chunk_size]).topk(k, dim=-1)
+                    values.append(chunk_values.float())
+                    indices.append(chunk_indices)
+            return SparseFeatures(
+                indices=torch.cat(indices).reshape(*leading_shape, k),
+                values=torch.cat(values).reshape(*leading_shape, k),
+                feature_dim=self.feature_dim
+            )
+        except Exception as e:
+            logger.error(f"特徴抽出中にエラーが発生: {e}", exc_info=True)
+            # エラー時はゼロ特徴を返す
+            return SparseFeatures(
+                indices=torch.zeros(*leading_shape, k, dtype=torch.long, device=self.device),
+                values=torch.zeros(*leading_shape, k, device=self.device),
+                feature_dim=self.feature_dim
+            )
+
     def reconstruct(self, features: torch.Tensor) -> torch.Tensor:
         """SAE特徴から隠れ状態を再構成"""
         if not self.sae:
@@ -187,10 +416,46 @@ class SAEManager:
             "feature_dim": self.feature_dim,
             "model_dim": self.model_dim,
             "sae_available": SAE_AVAILABLE,
-            "model_loaded": self.sae is not None
+            "weights_path": self.weights_path,
+            "dtype": str(self.dtype) if self.dtype is not None else None,
+            "model_loaded": self._sae is not None
         }
 
 
+class LocalSAE:
+    """
+    ローカルのsafetensorsファイルから読み込んだSAE（sae-lens / Gemma Scope形式の重み名）。
+    W_enc: (d_model, d_sae), W_dec: (d_sae, d_model), b_enc: (d_sae,), b_dec: (d_model,), threshold: (d_sae,) [JumpReLUの場合のみ]
+    重みはメモリマップされたテンソルをそのまま保持する。
+    """
+
+    def __init__(self, tensors: Dict[str, torch.Tensor]):
+        missing = [key for key in ("W_enc", "W_dec", "b_enc", "b_dec") if key not in tensors]
+        if missing:
+            raise KeyError(f"SAE重みファイルに必要なテンソルがありません: {', '.join(missing)}")
+        self.weights = tensors
+        d_model, d_sae = tensors["W_enc"].shape
+        self.cfg = SimpleNamespace(d_model=int(d_model), d_sae=int(d_sae))
+        self.dtype = tensors["W_enc"].dtype
+
+    @property
+    def decoder_weights(self) -> torch.Tensor:
+        """デコーダーの重み (d_model, d_sae)。転置はビューでありコピーしない。"""
+        return self.weights["W_dec"].T
+
+    def encode(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        """特徴を抽出（計算は重みの型で行い、結果はfloat32で返す）"""
+        pre_acts = hidden_states.to(self.dtype) @ self.weights["W_enc"] + self.weights["b_enc"]
+        features = torch.relu(pre_acts)
+        if "threshold" in self.weights:
+            features = features * (pre_acts > self.weights["threshold"])
+        return features.float()
+
+    def decode(self, features: torch.Tensor) -> torch.Tensor:
+        """特徴から隠れ状態を再構成"""
+        return (features.to(self.dtype) @ self.weights["W_dec"] + self.weights["b_dec"]).float()
+
+
 class DummySAE:
     """SAEが利用できない場合のダミー実装"""
     
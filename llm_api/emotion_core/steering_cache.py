@@ -0,0 +1,99 @@
+# llm_api/emotion_core/steering_cache.py
+# タイトル: Steering Vector Cache
+# 役割: 感情ごとの正規化済みステアリングベクトルを (感情, 手法, NMFコンポーネント数, SAE) をキーに保持する。
+#       事前計算した結果はfloat16のsafetensorsファイルとして感情マッピングの隣に保存し、初回参照時にのみ読み込む。
+
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# ファイル形式のバージョン（形式を変更した場合は更新し、古いファイルを無視させる）
+CACHE_FORMAT_VERSION = "1"
+
+
+def steering_key(emotion: str, method: str, n_components: int, sae_id: str) -> str:
+    """キャッシュのキー。手法が "sum" の場合、コンポーネント数はキーに含めない。"""
+    return f"{emotion}|{method}|{n_components if method == 'nmf' else 0}|{sae_id}"
+
+
+class SteeringVectorCache:
+    """正規化済みステアリングベクトルのキャッシュ（任意でsafetensorsファイルに永続化）"""
+
+    def __init__(self, path: Optional[str] = None, mapping_fingerprint: Optional[str] = None):
+        """
+        Args:
+            path: safetensorsファイルのパス。Noneの場合はメモリ上にのみ保持する。
+            mapping_fingerprint: 現在の感情マッピングの識別子。ファイルに記録された値と異なる場合、
+                                 ファイルの内容は古いマッピングから計算されたものとして使用しない。
+        """
+        self.path = Path(path) if path else None
+        self.mapping_fingerprint = mapping_fingerprint
+        self._vectors: Dict[str, torch.Tensor] = {}
+        self._loaded = False
+        self._dirty = False
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            from safetensors import safe_open
+
+            with safe_open(str(self.path), framework="pt", device="cpu") as f:
+                metadata = f.metadata() or {}
+                if metadata.get("format_version") != CACHE_FORMAT_VERSION:
+                    logger.warning(f"ステアリングベクトルキャッシュ '{self.path}' の形式が異なるため使用しません。")
+                    return
+                if self.mapping_fingerprint and metadata.get("mapping_fingerprint") != self.mapping_fingerprint:
+                    logger.warning(f"ステアリングベクトルキャッシュ '{self.path}' は現在の感情マッピングと一致しないため使用しません。")
+                    return
+                for key in f.keys():
+                    self._vectors[key] = f.get_tensor(key)
+            logger.info(f"ステアリングベクトルキャッシュを読み込みました: {self.path} ({len(self._vectors)}件)")
+        except Exception as e:
+            logger.warning(f"ステアリングベクトルキャッシュ '{self.path}' の読み込みに失敗しました: {e}")
+            self._vectors.clear()
+
+    def get(self, key: str) -> Optional[torch.Tensor]:
+        """正規化済みのベクトル（float16）を返す。無い場合はNone。"""
+        self._ensure_loaded()
+        return self._vectors.get(key)
+
+    def put(self, key: str, unit_vector: torch.Tensor) -> None:
+        """正規化済みのベクトルをfloat16で保持する。永続化は save() で行う。"""
+        self._ensure_loaded()
+        self._vectors[key] = unit_vector.detach().to(device="cpu", dtype=torch.float16).contiguous()
+        self._dirty = True
+
+    def save(self) -> bool:
+        """保持している全ベクトルをファイルに書き出す。書き込み途中のファイルが読まれないよう、一時ファイル経由で置き換える。"""
+        if self.path is None:
+            return False
+        self._ensure_loaded()
+        from safetensors.torch import save_file
+
+        metadata = {"format_version": CACHE_FORMAT_VERSION}
+        if self.mapping_fingerprint:
+            metadata["mapping_fingerprint"] = self.mapping_fingerprint
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        try:
+            save_file(self._vectors, str(tmp_path), metadata=metadata)
+            os.replace(tmp_path, self.path)
+        except (OSError, ValueError) as e:
+            logger.error(f"ステアリングベクトルキャッシュの保存に失敗しました: {e}")
+            return False
+        self._dirty = False
+        logger.info(f"ステアリングベクトルキャッシュを保存しました: {self.path} ({len(self._vectors)}件)")
+        return True
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._vectors)
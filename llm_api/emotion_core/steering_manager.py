@@ -3,7 +3,7 @@
 # 役割: 感情空間のマッピングを利用し、LLMの感情表現を制御するためのステアリングベクトルを生成・管理する。
 
 import logging
-from typing import Optional
+from typing import Iterable, Optional
 
 import torch
 # scikit-learnはオプション依存とする
@@ -15,6 +15,7 @@ except ImportError:
 
 from .sae_manager import SAEManager
 from .emotion_space import EmotionSpace
+from .steering_cache import SteeringVectorCache, steering_key
 from .types import EmotionCategory
 
 logger = logging.getLogger(__name__)
@@ -24,22 +25,33 @@ class EmotionSteeringManager:
     SAE特徴を用いてLLMの感情表現をステアリング（操作）するためのベクトルを生成するクラス。
     """
 
-    def __init__(self, sae_manager: SAEManager, emotion_space: EmotionSpace):
+    def __init__(self, sae_manager: SAEManager, emotion_space: EmotionSpace, cache_path: Optional[str] = None):
         """
         EmotionSteeringManagerを初期化します。
 
         Args:
             sae_manager: ロード済みのSAEモデルを管理するマネージャー。
             emotion_space: 感情とSAE特徴のマッピング情報を持つ感情空間。
+            cache_path: 事前計算したステアリングベクトルのsafetensorsファイル。初回の要求時にのみ読み込まれます。
         """
         self.sae_manager = sae_manager
         self.emotion_space = emotion_space
         self.device = sae_manager.device
-        
-        # デコーダーの重みを取得 (d_model, d_sae)
-        self.decoder_weights = self.sae_manager.decoder_weights
-        if self.decoder_weights is None:
-            raise ValueError("SAEManagerからデコーダーの重み 'W_dec' を取得できませんでした。")
+        self.cache_path = cache_path
+        self._cache: Optional[SteeringVectorCache] = None
+
+    @property
+    def decoder_weights(self) -> Optional[torch.Tensor]:
+        """デコーダーの重み (d_model, d_sae)。キャッシュに無いベクトルを計算する場合にのみ参照します。"""
+        return self.sae_manager.decoder_weights
+
+    @property
+    def cache(self) -> SteeringVectorCache:
+        """ステアリングベクトルのキャッシュ（現在の感情マッピングに対応するもの）"""
+        fingerprint = self.emotion_space.mapping_fingerprint()
+        if self._cache is None or self._cache.mapping_fingerprint != fingerprint:
+            self._cache = SteeringVectorCache(self.cache_path, mapping_fingerprint=fingerprint)
+        return self._cache
 
     def get_steering_vector(
         self,
@@ -52,7 +64,8 @@ class EmotionSteeringManager:
         指定された感情のステアリングベクトルを生成します。
 
         ステアリングベクトルは、その感情に関連するSAE特徴のデコーダーベクトルの
-        合計または代表ベクトルとして計算されます。
+        合計または代表ベクトルとして計算されます。正規化済みのベクトルはキャッシュされ、
+        2回目以降（または事前計算済みの場合）は強度を掛けるだけで返されます。
 
         Args:
             emotion (EmotionCategory): 対象の感情。
@@ -64,25 +77,48 @@ class EmotionSteeringManager:
         Returns:
             torch.Tensor: 生成されたステアリングベクトル。対応する特徴がない場合はNone。
         """
+        method = "nmf" if use_nmf and NMF is not None else "sum"
+        key = steering_key(emotion.value, method, n_components, self.sae_manager.identity)
+        unit_vector = self.cache.get(key)
+        if unit_vector is None:
+            unit_vector = self._compute_unit_vector(emotion, method, n_components)
+            if unit_vector is None:
+                return None
+            self.cache.put(key, unit_vector)
+
+        final_vector: torch.Tensor = unit_vector.to(device=self.device, dtype=torch.float32) * intensity
+        logger.info(f"感情 '{emotion.value}' のステアリングベクトルを生成しました (強度: {intensity})。")
+        
+        return final_vector
+
+    def _compute_unit_vector(self, emotion: EmotionCategory, method: str, n_components: int) -> Optional[torch.Tensor]:
+        """デコーダーの重みから、正規化済みのステアリングベクトルを計算します。"""
         feature_ids = self.emotion_space.get_emotion_feature_ids(emotion)
         if not feature_ids:
             logger.warning(f"感情 '{emotion.value}' に対応するSAE特徴が見つかりません。")
             return None
 
-        if self.decoder_weights is None:
+        decoder_weights = self.decoder_weights
+        if decoder_weights is None:
             logger.error("デコーダーの重みが利用できません。")
             return None
 
+        # 感情スコアの計算（感情×特徴行列）と同様に、範囲外の特徴IDは除外する
+        feature_ids = [fid for fid in feature_ids if 0 <= fid < decoder_weights.shape[1]]
+        if not feature_ids:
+            logger.warning(f"感情 '{emotion.value}' の特徴IDがデコーダーの次元数の範囲外です。")
+            return None
+
         # 対応する特徴のデコーダーベクトルを取得
-        # self.decoder_weights の形状は (d_model, d_sae)
+        # decoder_weights の形状は (d_model, d_sae)
         # feature_ids は d_sae のインデックス
         try:
-            target_vectors = self.decoder_weights[:, feature_ids] # (d_model, num_features)
+            target_vectors = decoder_weights[:, feature_ids].float() # (d_model, num_features)
         except IndexError as e:
             logger.error(f"特徴IDのインデックスエラー: {e}. 特徴IDがデコーダーの次元数を超えている可能性があります。")
             return None
 
-        if use_nmf and NMF is not None and target_vectors.shape[1] > n_components:
+        if method == "nmf" and target_vectors.shape[1] > n_components:
             logger.info(f"NMFを使用して '{emotion.value}' の主要特徴を {n_components} 個抽出します。")
             # NMFは非負値を要求するため、データをシフト
             vectors_np = target_vectors.cpu().numpy()
@@ -90,31 +126,43 @@ class EmotionSteeringManager:
             vectors_non_negative = vectors_np - min_val
 
             model = NMF(n_components=n_components, init='random', random_state=0)
-            W = model.fit_transform(vectors_non_negative)
-            H = model.components_
+            model.fit_transform(vectors_non_negative)
 
             # 最も影響の大きいコンポーネントをステアリングベクトルとする
             # ここでは単純に、最初のコンポーネントの再構成を使用
             base_vector_non_negative = torch.tensor(model.components_[0], device=self.device)
-            base_vector = base_vector_non_negative + min_val
-            steering_vector = base_vector
+            steering_vector = base_vector_non_negative + min_val
 
         else:
             # 単純な合計ベクトル
             steering_vector = torch.sum(target_vectors, dim=1)
 
-        # 正規化と強度の適用
+        # 正規化
         norm = torch.norm(steering_vector)
         if norm > 0:
-            normalized_vector = steering_vector / norm
-        else:
-            logger.warning(f"'{emotion.value}' のステアリングベクトルノルムが0です。")
-            return None
+            return steering_vector / norm
+        logger.warning(f"'{emotion.value}' のステアリングベクトルノルムが0です。")
+        return None
 
-        final_vector: torch.Tensor = normalized_vector * intensity
-        logger.info(f"感情 '{emotion.value}' のステアリングベクトルを生成しました (強度: {intensity})。")
-        
-        return final_vector
+    def precompute_steering_vectors(
+        self,
+        emotions: Optional[Iterable[EmotionCategory]] = None,
+        use_nmf: bool = False,
+        n_components: int = 10,
+        save: bool = True
+    ) -> int:
+        """
+        マッピングされた全感情（またはemotionsで指定した感情）のステアリングベクトルを事前計算し、キャッシュファイルに保存します。
+        計算できたベクトルの数を返します。
+        """
+        targets = list(emotions) if emotions is not None else list(self.emotion_space.emotion_categories)
+        computed = 0
+        for emotion in targets:
+            if self.get_steering_vector(emotion, intensity=1.0, use_nmf=use_nmf, n_components=n_components) is not None:
+                computed += 1
+        if save:
+            self.cache.save()
+        return computed
 
     def apply_steering(
         self,
@@ -4,9 +4,11 @@
 
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import Dict, List, Any, Optional
+from typing import TYPE_CHECKING, Dict, List, Any, Optional
 
-import torch
+# torchは型注釈にのみ使用するため、実行時には読み込まない
+if TYPE_CHECKING:
+    import torch
 
 class EmotionCategory(Enum):
     """
@@ -54,7 +56,7 @@ class EmotionVector:
     特定の感情に対応するステアリングベクトルの情報を保持するデータクラス。
     """
     emotion: EmotionCategory
-    vector: torch.Tensor
+    vector: "torch.Tensor"
     intensity: float = 1.0
 
 @dataclass
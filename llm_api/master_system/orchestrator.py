@@ -3,7 +3,6 @@
 # 役割: 全システムの統合と協調を管理する。責務を専門クラスに委譲。
 
 import logging
-import asyncio
 from typing import Any, Dict, List, Optional, cast, TYPE_CHECKING
 
 from ..providers.base import LLMProvider
@@ -118,7 +117,7 @@ class MasterIntegrationOrchestrator:
         
         if "memory_consolidation" in self.subsystems:
             session_data = {"prompt": problem, "solution": solution.get('integrated_solution')}
-            asyncio.create_task(self.subsystems["memory_consolidation"].consolidate_memories(session_data))
+            self.subsystems["memory_consolidation"].enqueue(session_data)
             
         return solution
 
@@ -3,9 +3,11 @@
 # 役割: 記憶統合システムのパッケージ初期化。
 
 from .engine import ConsolidationEngine
+from .graph_store import KnowledgeGraphStore
 from .types import ConsolidationLogEntry
 
 __all__ = [
     "ConsolidationEngine",
+    "KnowledgeGraphStore",
     "ConsolidationLogEntry",
 ]
\ No newline at end of file
@@ -4,11 +4,17 @@
 
 import logging
 import asyncio
-from typing import Any, Dict, List, Optional, Union
+import sqlite3
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
 
+from ..config import settings
 from ..providers.base import LLMProvider
-from ..rag.knowledge_base import KnowledgeBase
 from . import logic
+from .graph_store import KnowledgeGraphStore
+from .worker_pool import ConsolidationWorkerPool, NOVELTY_THRESHOLD, session_novelty
+
+if TYPE_CHECKING:
+    from ..rag.knowledge_base import KnowledgeBase
 
 logger = logging.getLogger(__name__)
 
@@ -18,20 +24,61 @@ class ConsolidationEngine:
     短期的な学習経験を長期記憶（ナレッジグラフ）に統合するプロセスを管理する。
     """
 
-    def __init__(self, provider: LLMProvider, knowledge_graph: Optional[KnowledgeBase] = None):
+    def __init__(
+        self,
+        provider: LLMProvider,
+        knowledge_graph: Optional["KnowledgeBase"] = None,
+        graph_store: Optional[KnowledgeGraphStore] = None
+    ):
+        """
+        Args:
+            provider: 構造化情報の抽出に使用するLLMプロバイダー。
+            knowledge_graph: 関連するナレッジベース。
+            graph_store: 抽出した情報を保存するナレッジグラフ。未指定時は settings.KNOWLEDGE_GRAPH_PATH に作成する。
+        """
         self.provider = provider
         # --- ▼▼▼ ここから修正 ▼▼▼ ---
         # 変数名のタイポを修正 (knowledge_base -> knowledge_graph)
-        self.knowledge_graph = knowledge_graph or KnowledgeBase()
+        if knowledge_graph is None:
+            from ..rag.knowledge_base import KnowledgeBase
+            knowledge_graph = KnowledgeBase()
+        self.knowledge_graph = knowledge_graph
         # --- ▲▲▲ ここまで修正 ▲▲▲ ---
+        if graph_store is None and settings.KNOWLEDGE_GRAPH_PATH:
+            try:
+                graph_store = KnowledgeGraphStore(settings.KNOWLEDGE_GRAPH_PATH)
+            except sqlite3.Error as e:
+                logger.error(f"ナレッジグラフ '{settings.KNOWLEDGE_GRAPH_PATH}' を開けませんでした。抽出した情報は保存されません: {e}")
+        self.graph_store = graph_store
         self.session_memory_buffer: List[Dict[str, Any]] = []
         # 型を明示的に Dict[str, int] と定義
         self.consolidation_stats: Dict[str, int] = {
             "total_sessions_processed": 0, "successful_consolidations": 0, "failed_consolidations": 0,
-            "total_entities_extracted": 0, "total_relations_extracted": 0
+            "total_entities_extracted": 0, "total_relations_extracted": 0,
+            "batched_extraction_calls": 0, "fallback_extractions": 0
         }
+        # バックグラウンド統合用のワーカープール（最初のenqueue時に生成）
+        self.worker_pool: Optional[ConsolidationWorkerPool] = None
         logger.info("🧠 Memory Consolidation Engine 初期化完了。")
 
+    def enqueue(self, session_data: Dict[str, Any]) -> bool:
+        """
+        セッションをバックグラウンドでの記憶統合の待ち行列に追加する。呼び出し元をブロックしない。
+        待ち行列に追加されなかった場合（新規性が閾値未満、バックプレッシャーによる破棄など）はFalseを返す。
+        """
+        if self.worker_pool is None:
+            self.worker_pool = ConsolidationWorkerPool(self)
+        return self.worker_pool.submit(session_data)
+
+    async def shutdown(self, timeout: Optional[float] = None) -> None:
+        """待ち行列に残っているセッションを処理しきってから、バックグラウンド統合を停止する。"""
+        if self.worker_pool is not None:
+            await self.worker_pool.drain(timeout)
+
+    def get_queue_statistics(self) -> Dict[str, int]:
+        """バックグラウンド統合の待ち行列の状態（待ち件数、処理済み・破棄件数など）を返す。"""
+        return self.worker_pool.get_stats() if self.worker_pool is not None else {}
+
     async def consolidate_memories(self, session_data: Union[Dict[str, Any], List[Dict[str, Any]]]) -> Dict[str, Any]:
         """単一または複数のセッション記憶を処理し、長期記憶に統合します。"""
         sessions = [session_data] if isinstance(session_data, dict) else []
@@ -43,20 +90,25 @@ class ConsolidationEngine:
 
         logger.info(f"記憶統合プロセス開始: {len(sessions)}個のセッション")
         results: List[Dict[str, Any]] = []
-        
+
+        eligible: List[int] = []
         for i, session in enumerate(sessions):
+            # PCMのコアロジック：新規性スコアが閾値未満の場合、処理をスキップ
+            novelty_score = session_novelty(session)
+            if novelty_score < NOVELTY_THRESHOLD:
+                logger.info(f"セッション {session.get('session_id', i)} の新規性スコア({novelty_score:.2f})が閾値未満のため、統合をスキップします。")
+                continue
+            logger.info(f"セッション {session.get('session_id', i)} の新規性スコア({novelty_score:.2f})が閾値を超えたため、統合を実行します。")
+            eligible.append(i)
+
+        extracted = await self._extract_structured_info([sessions[i] for i in eligible])
+
+        for i, structured_info in zip(eligible, extracted):
+            session = sessions[i]
             try:
-                # PCMのコアロジック：新規性スコアが閾値未満の場合、処理をスキップ
-                novelty_score = float(session.get("novelty_score", 0.0))
-                if novelty_score < 40.0:
-                    logger.info(f"セッション {session.get('session_id', i)} の新規性スコア({novelty_score:.2f})が閾値未満のため、統合をスキップします。")
-                    continue
-                logger.info(f"セッション {session.get('session_id', i)} の新規性スコア({novelty_score:.2f})が閾値を超えたため、統合を実行します。")
-                
                 current_processed = self.consolidation_stats["total_sessions_processed"]
                 self.consolidation_stats["total_sessions_processed"] = current_processed + 1
 
-                structured_info = await logic.analyze_session_data(self.provider, session)
                 if not structured_info:
                     current_failed = self.consolidation_stats["failed_consolidations"]
                     self.consolidation_stats["failed_consolidations"] = current_failed + 1
@@ -90,22 +142,65 @@ class ConsolidationEngine:
         logger.info("✅ 記憶統合プロセス完了。")
         return {"status": "completed", "results": results, "stats": self.consolidation_stats}
 
+    async def _extract_structured_info(self, sessions: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """
+        各セッションから構造化情報を抽出する。複数のセッションはトークン予算の範囲でまとめて1回のLLM呼び出しで分析し、
+        応答から結果を取り出せなかったセッションのみ個別の呼び出しで分析し直す。
+        """
+        if len(sessions) <= 1:
+            return [await logic.analyze_session_data(self.provider, session) for session in sessions]
+
+        extracted: List[List[Dict[str, Any]]] = [[] for _ in sessions]
+        # 対話内容の無いセッションはLLMを呼ばずに空の結果とする
+        targets = [i for i, session in enumerate(sessions) if session.get("prompt") or session.get("solution")]
+        batches = logic.pack_sessions(
+            [sessions[i] for i in targets],
+            token_budget=settings.CONSOLIDATION_BATCH_TOKEN_BUDGET,
+            max_sessions=settings.CONSOLIDATION_BATCH_MAX_SESSIONS
+        )
+        for batch in batches:
+            indices = [targets[j] for j in batch]
+            if len(indices) == 1:
+                extracted[indices[0]] = await logic.analyze_session_data(self.provider, sessions[indices[0]])
+                continue
+
+            batch_results = await logic.analyze_sessions_batch(self.provider, [sessions[i] for i in indices])
+            self.consolidation_stats["batched_extraction_calls"] += 1
+            missing = [i for j, i in enumerate(indices) if j not in batch_results]
+            for j, i in enumerate(indices):
+                if j in batch_results:
+                    extracted[i] = batch_results[j]
+            if missing:
+                logger.warning(f"一括分析で {len(missing)}/{len(indices)} 件の結果を取得できなかったため、個別に分析します。")
+                self.consolidation_stats["fallback_extractions"] += len(missing)
+                for i in missing:
+                    extracted[i] = await logic.analyze_session_data(self.provider, sessions[i])
+        return extracted
+
     async def _update_knowledge_graph(self, structured_info: List[Dict[str, Any]]) -> bool:
         """抽出された情報をナレッジグラフに統合します。"""
         if not structured_info: return False
         
-        knowledge_items = []
-        updates_made = False
-        for item in structured_info:
-            if item.get("confidence", 0.5) < 0.3: continue
-            content = logic.format_item_as_knowledge(item)
-            if content:
-                knowledge_items.append(content)
-                updates_made = True
-        
-        if updates_made:
-             logger.info(f"{len(knowledge_items)}個の新しい情報を統合（シミュレーション）")
-        return updates_made
+        knowledge_items = [
+            item for item in structured_info
+            if item.get("confidence", 0.5) >= settings.KNOWLEDGE_GRAPH_MIN_CONFIDENCE and logic.format_item_as_knowledge(item)
+        ]
+        if not knowledge_items:
+            return False
+        if self.graph_store is None:
+            logger.info(f"{len(knowledge_items)}個の新しい情報を抽出しましたが、ナレッジグラフが無効のため保存しません。")
+            return False
+
+        try:
+            # SQLiteへの書き込みでイベントループを塞がないよう、別スレッドで実行する
+            counts = await asyncio.to_thread(self.graph_store.upsert_items, knowledge_items)
+        except sqlite3.Error as e:
+            logger.error(f"ナレッジグラフの更新に失敗しました: {e}", exc_info=True)
+            return False
+        logger.info(
+            f"ナレッジグラフを更新しました (エンティティ: {counts['entities']}, 関係性: {counts['relations']}, 事実・概念: {counts['facts']})"
+        )
+        return True
         
     def get_consolidation_statistics(self) -> Dict[str, Any]:
         return self.consolidation_stats
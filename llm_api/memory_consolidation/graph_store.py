@@ -0,0 +1,285 @@
+# /llm_api/memory_consolidation/graph_store.py
+# タイトル: Knowledge Graph Store
+# 役割: 記憶統合で抽出したエンティティ・関係性・事実をSQLiteに永続化する。
+#       同一エンティティ・関係性はマージし、信頼度は観測のたびに集約する（noisy-OR）。
+#       エンティティ名と関係性の主語・目的語にインデックスを張り、近傍の探索とRAG用コンテキストの生成を高速に行う。
+
+import hashlib
+import logging
+import json
+import sqlite3
+import string
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from . import logic
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS entities ("
+    "name_key TEXT PRIMARY KEY, name TEXT NOT NULL, description TEXT NOT NULL DEFAULT '', "
+    "category TEXT NOT NULL DEFAULT '', confidence REAL NOT NULL, mention_count INTEGER NOT NULL, "
+    "first_seen REAL NOT NULL, last_seen REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_entities_last_seen ON entities (last_seen)",
+    "CREATE TABLE IF NOT EXISTS relations ("
+    "subject_key TEXT NOT NULL, predicate TEXT NOT NULL, object_key TEXT NOT NULL, "
+    "strength REAL, confidence REAL NOT NULL, mention_count INTEGER NOT NULL, "
+    "first_seen REAL NOT NULL, last_seen REAL NOT NULL, PRIMARY KEY (subject_key, predicate, object_key))",
+    "CREATE INDEX IF NOT EXISTS idx_relations_object ON relations (object_key)",
+    "CREATE INDEX IF NOT EXISTS idx_relations_last_seen ON relations (last_seen)",
+    "CREATE TABLE IF NOT EXISTS facts ("
+    "key TEXT PRIMARY KEY, type TEXT NOT NULL, name TEXT NOT NULL DEFAULT '', content TEXT NOT NULL, "
+    "domain TEXT NOT NULL DEFAULT '', confidence REAL NOT NULL, mention_count INTEGER NOT NULL, "
+    "first_seen REAL NOT NULL, last_seen REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_facts_last_seen ON facts (last_seen)",
+)
+
+# 信頼度はnoisy-ORで集約する: 1 - (1 - 既存) * (1 - 新規)
+_ENTITY_UPSERT = (
+    "INSERT INTO entities (name_key, name, description, category, confidence, mention_count, first_seen, last_seen) "
+    "VALUES (?, ?, ?, ?, ?, 1, ?, ?) "
+    "ON CONFLICT(name_key) DO UPDATE SET "
+    "description = CASE WHEN entities.description = '' OR (excluded.description != '' AND excluded.confidence >= entities.confidence) "
+    "THEN excluded.description ELSE entities.description END, "
+    "category = CASE WHEN entities.category = '' THEN excluded.category ELSE entities.category END, "
+    "confidence = 1.0 - (1.0 - entities.confidence) * (1.0 - excluded.confidence), "
+    "mention_count = entities.mention_count + 1, last_seen = excluded.last_seen"
+)
+# 関係性の端点として現れたエンティティは、説明の無いノードとして登録する（既存の情報は変更しない）
+_ENTITY_ENSURE = (
+    "INSERT OR IGNORE INTO entities (name_key, name, description, category, confidence, mention_count, first_seen, last_seen) "
+    "VALUES (?, ?, '', '', 0.0, 0, ?, ?)"
+)
+_RELATION_UPSERT = (
+    "INSERT INTO relations (subject_key, predicate, object_key, strength, confidence, mention_count, first_seen, last_seen) "
+    "VALUES (?, ?, ?, ?, ?, 1, ?, ?) "
+    "ON CONFLICT(subject_key, predicate, object_key) DO UPDATE SET "
+    "strength = COALESCE(excluded.strength, relations.strength), "
+    "confidence = 1.0 - (1.0 - relations.confidence) * (1.0 - excluded.confidence), "
+    "mention_count = relations.mention_count + 1, last_seen = excluded.last_seen"
+)
+_FACT_UPSERT = (
+    "INSERT INTO facts (key, type, name, content, domain, confidence, mention_count, first_seen, last_seen) "
+    "VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?) "
+    "ON CONFLICT(key) DO UPDATE SET "
+    "confidence = 1.0 - (1.0 - facts.confidence) * (1.0 - excluded.confidence), "
+    "mention_count = facts.mention_count + 1, last_seen = excluded.last_seen"
+)
+
+
+def normalize_name(name: str) -> str:
+    """エンティティ名の同一性判定に用いるキー（前後の空白を除き、空白を詰めて小文字化）"""
+    return " ".join(str(name).split()).lower()
+
+
+# n-gramの端から取り除く句読点（"python?" のような語もエンティティ名と一致させる）
+_EDGE_PUNCTUATION = string.punctuation + "、。，．！？「」『』（）［］【】・：；"
+
+
+def _candidate_keys(text: str, max_words: int, max_chars: int) -> Set[str]:
+    """
+    テキストからエンティティ名のキーになり得るn-gramを列挙する。
+    空白区切りの語はmax_words語までの単語n-gram、非ASCII文字を含む語（日本語など空白で区切られない語）は
+    max_chars文字までの文字n-gramを候補とする。
+    """
+    tokens = normalize_name(text).split()
+    candidates: Set[str] = set()
+    for i in range(len(tokens)):
+        for n in range(1, min(max_words, len(tokens) - i) + 1):
+            gram = " ".join(tokens[i:i + n])
+            candidates.update((gram, gram.strip(_EDGE_PUNCTUATION)))
+    for token in tokens:
+        if token.isascii():
+            continue
+        for start in range(len(token)):
+            for end in range(start + 2, min(start + max_chars, len(token)) + 1):
+                candidates.add(token[start:end])
+    return {key for key in candidates if len(key) > 1 and len(key) <= max_chars}
+
+
+def _confidence(item: Dict[str, Any]) -> float:
+    try:
+        return min(max(float(item.get("confidence", 0.5)), 0.0), 1.0)
+    except (TypeError, ValueError):
+        return 0.5
+
+
+def _strength(item: Dict[str, Any]) -> Optional[float]:
+    try:
+        return float(item["strength"]) if item.get("strength") is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class KnowledgeGraphStore:
+    """SQLiteに永続化されるナレッジグラフ"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: SQLiteファイルのパス。":memory:" を指定するとメモリ上にのみ保持する。
+        """
+        self.path = path
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        # 候補n-gramの長さの上限として、登録済みキーの最大語数・最大文字数を保持する
+        row = self._db.execute(
+            "SELECT MAX(length(name_key) - length(replace(name_key, ' ', '')) + 1), MAX(length(name_key)) FROM entities"
+        ).fetchone()
+        self._max_key_words = row[0] or 0
+        self._max_key_chars = row[1] or 0
+
+    def _note_key(self, key: str) -> None:
+        self._max_key_words = max(self._max_key_words, key.count(" ") + 1)
+        self._max_key_chars = max(self._max_key_chars, len(key))
+
+    def upsert_items(self, items: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        抽出された項目（entity / relation / fact / concept）を1つのトランザクションで登録・マージする。
+        種類ごとの登録件数を返す。
+        """
+        now = time.time()
+        counts = {"entities": 0, "relations": 0, "facts": 0}
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                for item in items:
+                    item_type = item.get("type")
+                    if item_type == "entity" and normalize_name(item.get("name", "")):
+                        self._note_key(normalize_name(item["name"]))
+                        self._db.execute(_ENTITY_UPSERT, (
+                            normalize_name(item["name"]), str(item["name"]).strip(), str(item.get("description") or ""),
+                            str(item.get("category") or ""), _confidence(item), now, now
+                        ))
+                        counts["entities"] += 1
+                    elif item_type == "relation":
+                        subject, obj = str(item.get("subject", "")).strip(), str(item.get("object", "")).strip()
+                        predicate = " ".join(str(item.get("predicate", "")).split())
+                        if not (normalize_name(subject) and predicate and normalize_name(obj)):
+                            continue
+                        for name in (subject, obj):
+                            self._note_key(normalize_name(name))
+                            self._db.execute(_ENTITY_ENSURE, (normalize_name(name), name, now, now))
+                        self._db.execute(_RELATION_UPSERT, (
+                            normalize_name(subject), predicate, normalize_name(obj), _strength(item), _confidence(item), now, now
+                        ))
+                        counts["relations"] += 1
+                    elif item_type in ("fact", "concept"):
+                        content = str(item.get("content") or item.get("summary") or "").strip()
+                        if not content:
+                            continue
+                        name = str(item.get("name") or "").strip()
+                        key = hashlib.sha256(f"{item_type}\x00{normalize_name(name)}\x00{normalize_name(content)}".encode("utf-8")).hexdigest()
+                        self._db.execute(_FACT_UPSERT, (
+                            key, item_type, name, content, str(item.get("domain") or ""), _confidence(item), now, now
+                        ))
+                        counts["facts"] += 1
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return counts
+
+    def get_entity(self, name: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM entities WHERE name_key = ?", (normalize_name(name),)).fetchone()
+        return dict(row) if row else None
+
+    def neighbourhood(self, names: Iterable[str], depth: int = 1, max_relations: int = 50) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        指定したエンティティからdepthホップ以内の関係性と、それに含まれるエンティティを返す。
+        各ホップは主語・目的語のインデックスを使った検索のみで行う。
+        """
+        frontier: Set[str] = {normalize_name(name) for name in names if normalize_name(name)}
+        visited: Set[str] = set(frontier)
+        relations: Dict[tuple, Dict[str, Any]] = {}
+        with self._lock:
+            for _ in range(max(depth, 0)):
+                if not frontier or len(relations) >= max_relations:
+                    break
+                placeholders = ",".join("?" * len(frontier))
+                rows = self._db.execute(
+                    f"SELECT * FROM relations WHERE subject_key IN ({placeholders}) "
+                    f"UNION SELECT * FROM relations WHERE object_key IN ({placeholders}) "
+                    "ORDER BY confidence DESC, last_seen DESC LIMIT ?",
+                    (*frontier, *frontier, max_relations - len(relations))
+                ).fetchall()
+                next_frontier: Set[str] = set()
+                for row in rows:
+                    relations[(row["subject_key"], row["predicate"], row["object_key"])] = dict(row)
+                    next_frontier.update({row["subject_key"], row["object_key"]} - visited)
+                visited |= next_frontier
+                frontier = next_frontier
+
+            placeholders = ",".join("?" * len(visited))
+            entity_rows = self._db.execute(
+                f"SELECT * FROM entities WHERE name_key IN ({placeholders}) ORDER BY confidence DESC", tuple(visited)
+            ).fetchall() if visited else []
+        return {"entities": [dict(row) for row in entity_rows], "relations": list(relations.values())}
+
+    def find_entities_in_text(self, text: str, limit: int = 5) -> List[str]:
+        """
+        テキスト中に名前が現れるエンティティを、信頼度の高い順に返す。
+        テキストから候補n-gramを列挙し、主キー（name_key）の検索のみで照合する。
+        """
+        if not text:
+            return []
+        with self._lock:
+            candidates = _candidate_keys(text, self._max_key_words, self._max_key_chars)
+            if not candidates:
+                return []
+            rows = self._db.execute(
+                "SELECT name FROM entities WHERE name_key IN (SELECT value FROM json_each(?)) "
+                "ORDER BY confidence DESC, mention_count DESC LIMIT ?",
+                (json.dumps(sorted(candidates), ensure_ascii=False), limit)
+            ).fetchall()
+        return [row["name"] for row in rows]
+
+    def graph_context(self, query: str, max_entities: int = 5, depth: int = 1, max_relations: int = 20) -> str:
+        """
+        クエリに現れるエンティティの近傍を、RAGのコンテキストとして使えるテキストに変換する。
+        該当するエンティティが無い場合は空文字を返す。
+        """
+        names = self.find_entities_in_text(query, limit=max_entities)
+        if not names:
+            return ""
+        graph = self.neighbourhood(names, depth=depth, max_relations=max_relations)
+        display_names = {entity["name_key"]: entity["name"] for entity in graph["entities"]}
+        lines: List[str] = []
+        for entity in graph["entities"]:
+            line = logic.format_item_as_knowledge({"type": "entity", **entity})
+            if line:
+                lines.append(line)
+        for relation in graph["relations"]:
+            line = logic.format_item_as_knowledge({
+                "type": "relation",
+                "subject": display_names.get(relation["subject_key"], relation["subject_key"]),
+                "predicate": relation["predicate"],
+                "object": display_names.get(relation["object_key"], relation["object_key"]),
+                "strength": relation["strength"] if relation["strength"] is not None else "N/A",
+                "confidence": relation["confidence"],
+            })
+            if line:
+                lines.append(line)
+        return "\n".join(lines)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                table: self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("entities", "relations", "facts")
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
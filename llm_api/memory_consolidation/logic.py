@@ -9,7 +9,7 @@ from typing import Any, Dict, List, Optional
 from datetime import datetime
 
 from ..providers.base import LLMProvider
-from .prompts import create_analysis_prompt
+from .prompts import create_analysis_prompt, create_batch_analysis_prompt, format_session_block
 from .types import ConsolidationLogEntry
 
 logger = logging.getLogger(__name__)
@@ -72,6 +72,75 @@ async def analyze_session_data(provider: LLMProvider, session_data: Dict[str, An
         logger.error(f"セッションデータ分析中にエラーが発生: {e}", exc_info=True)
         return []
 
+def estimate_tokens(text: str) -> int:
+    """トークン数の簡易推定。ASCII文字は約4文字で1トークン、それ以外（日本語など）は1文字で約1トークンとみなす。"""
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+def pack_sessions(sessions: List[Dict[str, Any]], token_budget: int, max_sessions: int) -> List[List[int]]:
+    """
+    セッションを、推定トークン数の合計がtoken_budgetを超えない範囲でまとめ、各バッチのインデックスのリストを返す。
+    単独で予算を超えるセッションは1件のみのバッチとする。
+    """
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for index, session in enumerate(sessions):
+        tokens = estimate_tokens(format_session_block(session))
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_sessions):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+async def analyze_sessions_batch(provider: LLMProvider, sessions: List[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    複数のセッションを1回のLLM呼び出しでまとめて分析する。
+    戻り値は {セッションのインデックス: 抽出結果} で、応答から結果を取り出せなかったセッションは含まれない。
+    """
+    if not sessions:
+        return {}
+    try:
+        response = await provider.call(create_batch_analysis_prompt(sessions), "")
+    except Exception as e:
+        logger.error(f"セッションデータの一括分析中にエラーが発生: {e}", exc_info=True)
+        return {}
+    if response.get("error"):
+        logger.warning(f"セッションデータの一括分析に失敗しました: {response.get('error')}")
+        return {}
+    parsed = _parse_json_object(response.get("text", ""))
+    if parsed is None:
+        logger.warning("一括分析の応答からJSONオブジェクトを取り出せませんでした。")
+        return {}
+
+    results: Dict[int, List[Dict[str, Any]]] = {}
+    for key, items in parsed.items():
+        try:
+            index = int(key)
+        except (TypeError, ValueError):
+            continue
+        if 0 <= index < len(sessions) and isinstance(items, list):
+            results[index] = _validate_extracted_data(items)
+    return results
+
+def _parse_json_object(response_text: str) -> Optional[Dict[str, Any]]:
+    """応答テキストからJSONオブジェクトを取り出す。"""
+    candidates = [m.group(1) for m in re.finditer(r'```(?:json)?\s*(\{.*?\})\s*```', response_text, re.DOTALL)]
+    start, end = response_text.find("{"), response_text.rfind("}")
+    if start != -1 and end > start:
+        candidates.append(response_text[start:end + 1])
+    for candidate in candidates:
+        try:
+            data = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
 def _validate_extracted_data(data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """抽出されたデータの検証とクリーニング"""
     if not isinstance(data, list): return []
@@ -2,13 +2,9 @@
 # タイトル: Memory Consolidation Prompts
 # 役割: 記憶統合エンジンで使用されるプロンプトテンプレートを定義する。
 
-from typing import Dict, Any
+from typing import Dict, Any, List
 
-def create_analysis_prompt(session_data: Dict[str, Any]) -> str:
-    """セッションデータ分析用のプロンプトを生成する。"""
-    prompt = session_data.get("prompt", "")
-    solution = session_data.get("solution", "")
-    
+def _additional_context(session_data: Dict[str, Any]) -> str:
     additional_context = ""
     if "v2_improvements" in session_data:
         additional_context += f"\n改善点: {session_data['v2_improvements']}"
@@ -16,6 +12,19 @@ def create_analysis_prompt(session_data: Dict[str, Any]) -> str:
         additional_context += f"\n思考過程: {session_data['thought_process']}"
     if "metadata" in session_data:
         additional_context += f"\nメタデータ: {session_data['metadata']}"
+    return additional_context
+
+def format_session_block(session_data: Dict[str, Any]) -> str:
+    """プロンプトに埋め込む1セッション分の対話データを整形する。"""
+    return f"""問題: {session_data.get("prompt", "")}
+    解決策: {session_data.get("solution", "")}
+    {_additional_context(session_data)}"""
+
+def create_analysis_prompt(session_data: Dict[str, Any]) -> str:
+    """セッションデータ分析用のプロンプトを生成する。"""
+    prompt = session_data.get("prompt", "")
+    solution = session_data.get("solution", "")
+    additional_context = _additional_context(session_data)
 
     return f"""
     以下のAIの対話（問題と解決策）から、主要なエンティティ（人物、組織、概念、技術名など）と、それらの間の関係性を特定してください。
@@ -65,4 +74,38 @@ def create_analysis_prompt(session_data: Dict[str, Any]) -> str:
     - 各項目にconfidenceスコア(0.0-1.0)を含めてください
     - 明確で具体的な情報のみを抽出してください
     - 推測や不確実な情報は含めないでください
-    """
\ No newline at end of file
+    """
+
+def create_batch_analysis_prompt(sessions: List[Dict[str, Any]]) -> str:
+    """複数のセッションをまとめて分析するためのプロンプトを生成する。"""
+    session_blocks = "\n\n".join(
+        f"    ## 対話 {index}\n    {format_session_block(session)}" for index, session in enumerate(sessions)
+    )
+    return f"""
+    以下の{len(sessions)}件のAIの対話（問題と解決策）のそれぞれについて、主要なエンティティ（人物、組織、概念、技術名など）と、それらの間の関係性を特定してください。
+    また、各対話から得られる新しい事実や知識、重要な洞察を抽出してください。
+
+    重要: 応答は必ず1つのJSONオブジェクトで返してください。キーは対話の番号（"0"〜"{len(sessions) - 1}"）、
+    値はその対話から抽出した情報のJSON配列です。抽出する情報が無い対話には空の配列を返してください。
+
+    # 対話データ
+{session_blocks}
+
+    # 応答形式の例:
+    {{
+        "0": [
+            {{"type": "entity", "name": "人工知能", "description": "人間の知能を模倣する技術", "category": "Technology", "confidence": 0.9}},
+            {{"type": "relation", "subject": "人工知能", "predicate": "影響を与える", "object": "社会", "strength": 0.8, "confidence": 0.85}}
+        ],
+        "1": [
+            {{"type": "fact", "content": "AIの倫理的課題には公平性、透明性、説明責任がある。", "confidence": 0.9, "domain": "AI Ethics"}},
+            {{"type": "concept", "name": "予測的符号化", "summary": "脳が次の感覚入力を予測し、誤差のみを処理する理論。", "confidence": 0.8, "domain": "Neuroscience"}}
+        ]
+    }}
+
+    注意事項:
+    - 必ず全ての対話の番号をキーに含めてください
+    - 各項目にconfidenceスコア(0.0-1.0)を含めてください
+    - 明確で具体的な情報のみを抽出してください
+    - 推測や不確実な情報は含めないでください
+    """
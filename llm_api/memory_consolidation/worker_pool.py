@@ -0,0 +1,229 @@
+# /llm_api/memory_consolidation/worker_pool.py
+# タイトル: Consolidation Worker Pool
+# 役割: 記憶統合を上限付きの待ち行列と固定数のワーカーで実行する。新規性スコアの高いセッションを優先し、
+#       待ち行列が満杯の場合は新規性の低いセッションを破棄またはまとめて処理する。終了時には残りを処理しきってから停止する。
+
+import asyncio
+import heapq
+import itertools
+import logging
+import weakref
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from ..config import settings
+
+if TYPE_CHECKING:
+    from .engine import ConsolidationEngine
+
+logger = logging.getLogger(__name__)
+
+# 記憶統合の対象とする新規性スコアの下限（これ未満のセッションは統合されない）
+NOVELTY_THRESHOLD = 40.0
+
+BACKPRESSURE_POLICIES = ("drop", "coalesce")
+
+# 待ち行列の要素: (-優先度, 投入順, セッションのリスト)
+_QueueEntry = Tuple[float, int, List[Dict[str, Any]]]
+
+_pools: "weakref.WeakSet[ConsolidationWorkerPool]" = weakref.WeakSet()
+
+
+def session_novelty(session_data: Dict[str, Any]) -> float:
+    """セッションの新規性スコアを返す。未設定・不正な値の場合は0。"""
+    try:
+        return float(session_data.get("novelty_score", 0.0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class ConsolidationWorkerPool:
+    """新規性スコアを優先度とする、上限付きの記憶統合ワーカープール"""
+
+    def __init__(
+        self,
+        engine: "ConsolidationEngine",
+        num_workers: Optional[int] = None,
+        max_queue_size: Optional[int] = None,
+        policy: Optional[str] = None,
+        max_coalesce: Optional[int] = None
+    ):
+        """
+        Args:
+            engine: セッションを実際に統合するConsolidationEngine。
+            num_workers: 同時に実行する統合処理の数。
+            max_queue_size: 待ち行列に保持する要素数の上限。
+            policy: 待ち行列が満杯の場合の方針 ("drop" または "coalesce")。
+            max_coalesce: "coalesce" の場合に1つの要素へまとめるセッション数の上限。
+        """
+        self.engine = engine
+        self.num_workers = max(1, num_workers or settings.CONSOLIDATION_WORKERS)
+        self.max_queue_size = max(1, max_queue_size or settings.CONSOLIDATION_QUEUE_SIZE)
+        self.policy = policy or settings.CONSOLIDATION_BACKPRESSURE
+        if self.policy not in BACKPRESSURE_POLICIES:
+            logger.warning(f"不明なバックプレッシャー方針 '{self.policy}' のため 'drop' を使用します。")
+            self.policy = "drop"
+        self.max_coalesce = max(1, max_coalesce or settings.CONSOLIDATION_COALESCE_MAX)
+
+        self._heap: List[_QueueEntry] = []
+        self._seq = itertools.count()
+        self._workers: List["asyncio.Task[None]"] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._in_flight = 0
+        self._closing = False
+        self._stats: Dict[str, int] = {
+            "submitted": 0, "processed": 0, "failed": 0, "skipped": 0,
+            "dropped": 0, "coalesced": 0, "rejected": 0, "abandoned": 0, "max_queue_depth": 0,
+        }
+        _pools.add(self)
+
+    def submit(self, session_data: Dict[str, Any]) -> bool:
+        """
+        セッションを待ち行列に追加する。呼び出し元をブロックしない。
+        新規性が閾値未満、終了処理中、またはバックプレッシャーで破棄された場合はFalseを返す。
+        """
+        if self._closing:
+            self._stats["rejected"] += 1
+            logger.warning("記憶統合ワーカープールは終了処理中のため、セッションを受け付けません。")
+            return False
+        novelty = session_novelty(session_data)
+        if novelty < NOVELTY_THRESHOLD:
+            self._stats["skipped"] += 1
+            logger.info(f"新規性スコア({novelty:.2f})が閾値未満のため、記憶統合の待ち行列に追加しません。")
+            return False
+
+        self._ensure_workers()
+        self._stats["submitted"] += 1
+        if len(self._heap) >= self.max_queue_size:
+            accepted = self._apply_backpressure(session_data, novelty)
+        else:
+            heapq.heappush(self._heap, (-novelty, next(self._seq), [session_data]))
+            accepted = True
+        self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self.queue_depth)
+        if accepted:
+            assert self._wakeup is not None
+            self._wakeup.set()
+        return accepted
+
+    def _apply_backpressure(self, session_data: Dict[str, Any], novelty: float) -> bool:
+        """
+        待ち行列が満杯の場合の処理。新しいセッションを受け入れた場合はTrueを返す
+        （"coalesce" で既存の要素にまとめた場合も含む。いずれの場合も待ち行列の要素数は増えない）。
+        """
+        lowest_index = max(range(len(self._heap)), key=lambda i: self._heap[i][:2])
+        neg_priority, seq, sessions = self._heap[lowest_index]
+
+        if self.policy == "coalesce" and len(sessions) < self.max_coalesce:
+            # 最も優先度の低い要素にまとめ、優先度はまとめたセッションの最大値とする
+            sessions.append(session_data)
+            self._heap[lowest_index] = (min(neg_priority, -novelty), seq, sessions)
+            heapq.heapify(self._heap)
+            self._stats["coalesced"] += 1
+            logger.info(f"記憶統合の待ち行列が満杯のため、セッションをまとめて処理します（{len(sessions)}件）。")
+            return True
+
+        if novelty <= -neg_priority:
+            self._stats["dropped"] += 1
+            logger.warning(f"記憶統合の待ち行列が満杯のため、新規性スコア {novelty:.2f} のセッションを破棄しました。")
+            return False
+        # 新しいセッションの方が新規性が高い場合は、最も優先度の低い要素を破棄して入れ替える
+        self._heap[lowest_index] = (-novelty, next(self._seq), [session_data])
+        heapq.heapify(self._heap)
+        self._stats["dropped"] += len(sessions)
+        logger.warning(f"記憶統合の待ち行列が満杯のため、新規性スコア {-neg_priority:.2f} のセッション {len(sessions)} 件を破棄しました。")
+        return True
+
+    def _ensure_workers(self) -> None:
+        """実行中のイベントループ上でワーカーを起動する（初回の投入時、またはループが変わった場合）。"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._workers = []
+        self._workers = [task for task in self._workers if not task.done()]
+        while len(self._workers) < self.num_workers:
+            self._workers.append(loop.create_task(self._worker()))
+
+    async def _worker(self) -> None:
+        assert self._wakeup is not None
+        wakeup = self._wakeup
+        while True:
+            if not self._heap:
+                if self._closing:
+                    return
+                wakeup.clear()
+                await wakeup.wait()
+                continue
+            _, _, sessions = heapq.heappop(self._heap)
+            self._in_flight += 1
+            try:
+                result = await self.engine.consolidate_memories(sessions[0] if len(sessions) == 1 else sessions)
+                failed = sum(1 for r in result.get("results", []) if not r.get("success"))
+                self._stats["processed"] += len(sessions) - failed
+                self._stats["failed"] += failed
+            except asyncio.CancelledError:
+                self._stats["abandoned"] += len(sessions)
+                raise
+            except Exception as e:
+                logger.error(f"記憶統合ワーカーでエラーが発生しました: {e}", exc_info=True)
+                self._stats["failed"] += len(sessions)
+            finally:
+                self._in_flight -= 1
+
+    async def drain(self, timeout: Optional[float] = None) -> Dict[str, int]:
+        """
+        新規の受け付けを停止し、待ち行列が空になるまで処理を続ける。
+        timeout秒を過ぎた場合は実行中の処理を中断し、未処理のセッションを破棄する。
+        """
+        timeout = timeout if timeout is not None else settings.CONSOLIDATION_DRAIN_TIMEOUT
+        self._closing = True
+        loop = asyncio.get_running_loop()
+        workers = [task for task in self._workers if not task.done() and task.get_loop() is loop]
+        if self._heap and not workers:
+            # ワーカーが存在しない（別のイベントループで停止済み等）場合は、このループで処理しきる
+            self._loop = None
+            self._ensure_workers()
+            workers = list(self._workers)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if workers:
+            logger.info(f"未処理の記憶統合 {self.queue_depth} 件の完了を待機します (最大 {timeout} 秒)...")
+            _, pending = await asyncio.wait(workers, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        abandoned = sum(len(sessions) for _, _, sessions in self._heap)
+        if abandoned:
+            self._stats["abandoned"] += abandoned
+            logger.warning(f"タイムアウトのため、未処理の記憶統合 {abandoned} 件を破棄しました。")
+        self._heap.clear()
+        return self.get_stats()
+
+    @property
+    def queue_depth(self) -> int:
+        """待ち行列に残っているセッション数（まとめられたセッションも個別に数える）"""
+        return sum(len(sessions) for _, _, sessions in self._heap)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            **self._stats,
+            "queue_depth": self.queue_depth,
+            "queue_entries": len(self._heap),
+            "in_flight": self._in_flight,
+            "workers": len([task for task in self._workers if not task.done()]),
+        }
+
+
+async def drain_all_consolidation_pools(timeout: Optional[float] = None) -> None:
+    """
+    生成済みの全ワーカープールの未処理セッションを処理しきってから停止する。
+    プロバイダーを使用するため、close_all_providersより前に呼び出す。
+    """
+    pools = [pool for pool in list(_pools) if not pool._closing]
+    if not pools:
+        return
+    results = await asyncio.gather(*(pool.drain(timeout) for pool in pools), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"記憶統合ワーカープールの停止中にエラー: {result}")
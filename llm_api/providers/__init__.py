@@ -4,7 +4,8 @@
 
 import logging
 import asyncio 
-from typing import Any, Dict, Optional, cast, List, Awaitable
+import importlib
+from typing import Any, Dict, Optional, cast, List, Awaitable, Tuple
 
 from .base import LLMProvider, EnhancedLLMProvider, ProviderCapability 
 from ..config import settings
@@ -14,6 +15,31 @@ logger = logging.getLogger(__name__)
 
 _provider_cache: Dict[str, LLMProvider] = {}
 
+# プロバイダー名 -> (モジュール名, クラス名)。各SDK（openai, anthropic, google, llama_cpp等）は
+# 該当プロバイダーが初めて要求された時点でのみインポートする。
+_PROVIDER_CLASSES: Dict[str, Tuple[str, str]] = {
+    "openai": (".openai", "OpenAIProvider"),
+    "claude": (".claude", "ClaudeProvider"),
+    "gemini": (".gemini", "GeminiProvider"),
+    "huggingface": (".huggingface", "HuggingFaceProvider"),
+    "ollama": (".ollama", "OllamaProvider"),
+    "llamacpp": (".llamacpp", "LlamaCppProvider"),
+}
+
+_ENHANCED_PROVIDER_CLASSES: Dict[str, Tuple[str, str]] = {
+    "openai": (".enhanced_openai_v2", "EnhancedOpenAIProviderV2"),
+    "claude": (".enhanced_claude_v2", "EnhancedClaudeProviderV2"),
+    "gemini": (".enhanced_gemini_v2", "EnhancedGeminiProviderV2"),
+    "huggingface": (".enhanced_huggingface_v2", "EnhancedHuggingFaceProviderV2"),
+    "ollama": (".enhanced_ollama_v2", "EnhancedOllamaProviderV2"),
+    "llamacpp": (".enhanced_llamacpp_v2", "EnhancedLlamaCppProviderV2"),
+}
+
+def _load_provider_class(module_name: str, class_name: str) -> Any:
+    """プロバイダークラスを含むモジュールを必要になった時点でインポートする。"""
+    module = importlib.import_module(module_name, package=__name__)
+    return getattr(module, class_name)
+
 async def check_provider_health(provider_name: str, enhanced: bool) -> Dict[str, Any]:
     """
     指定されたプロバイダーの健全性をチェックします。
@@ -76,43 +102,11 @@ def get_provider(
     指定されたプロバイダーのインスタンスを取得します。
     インスタンスはキャッシュされ、同じ設定での再呼び出し時には再利用されます。
     """
-    from .openai import OpenAIProvider
-    from .claude import ClaudeProvider
-    from .gemini import GeminiProvider
-    from .huggingface import HuggingFaceProvider
-    from .ollama import OllamaProvider
-    from .llamacpp import LlamaCppProvider
-    
-    from .enhanced_openai_v2 import EnhancedOpenAIProviderV2
-    from .enhanced_claude_v2 import EnhancedClaudeProviderV2
-    from .enhanced_gemini_v2 import EnhancedGeminiProviderV2
-    from .enhanced_huggingface_v2 import EnhancedHuggingFaceProviderV2
-    from .enhanced_ollama_v2 import EnhancedOllamaProviderV2
-    from .enhanced_llamacpp_v2 import EnhancedLlamaCppProviderV2
-
-    provider_map = {
-        "openai": OpenAIProvider,
-        "claude": ClaudeProvider,
-        "gemini": GeminiProvider,
-        "huggingface": HuggingFaceProvider,
-        "ollama": OllamaProvider,
-        "llamacpp": LlamaCppProvider,
-    }
-
-    enhanced_provider_map = {
-        "openai": EnhancedOpenAIProviderV2,
-        "claude": EnhancedClaudeProviderV2,
-        "gemini": EnhancedGeminiProviderV2,
-        "huggingface": EnhancedHuggingFaceProviderV2,
-        "ollama": EnhancedOllamaProviderV2,
-        "llamacpp": EnhancedLlamaCppProviderV2,
-    }
-
     base_provider_name = provider_name.lower()
-    if base_provider_name not in provider_map:
+    if base_provider_name not in _PROVIDER_CLASSES:
         raise ValueError(f"不明なプロバイダー: {provider_name}")
 
-    target_map = enhanced_provider_map if enhanced else provider_map
+    target_map = _ENHANCED_PROVIDER_CLASSES if enhanced else _PROVIDER_CLASSES
     cache_key_suffix = "_enhanced" if enhanced else "_standard"
     
     # kwargsの内容に基づいてキャッシュキーを生成
@@ -126,11 +120,11 @@ def get_provider(
         return _provider_cache[cache_key]
 
     logger.info(f"プロバイダー '{cache_key}' の新しいインスタンスを生成します。")
-    provider_class = target_map[base_provider_name]
+    provider_class = _load_provider_class(*target_map[base_provider_name])
 
     try:
         if enhanced:
-            standard_provider_kwargs = {k: v for k, v in kwargs.items() if k in ['model', 'model_path', 'n_gpu_layers', 'api_key']}
+            standard_provider_kwargs = {k: v for k, v in kwargs.items() if k in ['model', 'model_path', 'n_gpu_layers', 'n_replicas', 'api_key']}
             standard_provider = get_provider(base_provider_name, enhanced=False, **standard_provider_kwargs)
             enhanced_kwargs = {k:v for k,v in kwargs.items() if k not in standard_provider_kwargs}
             instance = provider_class(standard_provider=standard_provider, **enhanced_kwargs)
@@ -138,7 +132,8 @@ def get_provider(
             if base_provider_name == 'llamacpp':
                 init_kwargs = {
                     'model_path': kwargs.get('model_path') or settings.LLAMACPP_DEFAULT_MODEL_PATH,
-                    'n_gpu_layers': kwargs.get('n_gpu_layers')
+                    'n_gpu_layers': kwargs.get('n_gpu_layers'),
+                    'n_replicas': kwargs.get('n_replicas')
                 }
                 init_kwargs = {k: v for k, v in init_kwargs.items() if v is not None}
                 instance = provider_class(**init_kwargs)
@@ -158,6 +153,18 @@ def get_provider(
     _provider_cache[cache_key] = instance
     return cast(LLMProvider, instance)
 
+async def close_all_providers() -> None:
+    """
+    キャッシュされた全プロバイダーのリソース（共有HTTPクライアントなど）を解放し、
+    キャッシュをクリアします。プロセス終了前に一度だけ呼び出すことを想定しています。
+    """
+    providers = list(_provider_cache.values())
+    _provider_cache.clear()
+    results = await asyncio.gather(*(p.aclose() for p in providers), return_exceptions=True)
+    for provider, result in zip(providers, results):
+        if isinstance(result, Exception):
+            logger.warning(f"プロバイダー '{provider.provider_name}' のクローズ中にエラー: {result}")
+
 def list_providers() -> List[str]:
     """設定されているプロバイダー名をリストアップする。"""
     return list({
@@ -5,7 +5,7 @@
 import logging
 from abc import ABC, abstractmethod
 from enum import Enum
-from typing import Any, Dict, Optional, cast, Awaitable # Awaitableはそのまま
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, cast # Awaitableはそのまま
 
 logger = logging.getLogger(__name__)
 
@@ -53,6 +53,41 @@ class LLMProvider(ABC):
             logger.error(f"Provider '{self.provider_name}' call failed: {e}", exc_info=True)
             return {"error": str(e), "text": ""}
 
+    async def stream(self, prompt: str, system_prompt: str = "", **kwargs: Any) -> AsyncIterator[str]:
+        """
+        生成されたテキストをトークン（チャンク）単位で逐次返す非同期イテレータ。
+        ストリーミング非対応のプロバイダーでは、standard_callの結果を一括で返す。
+        """
+        result = await self.standard_call(prompt, system_prompt, **kwargs)
+        if result.get('error'):
+            raise RuntimeError(result['error'])
+        text = result.get('text', '')
+        if text:
+            yield text
+
+    async def call_streaming(
+        self,
+        prompt: str,
+        system_prompt: str = "",
+        stream_callback: Optional[Callable[[str], Awaitable[None]]] = None,
+        **kwargs: Any
+    ) -> Dict[str, Any]:
+        """
+        stream()で生成しながら各チャンクをstream_callbackに渡し、
+        最終的にcall()と同じ形式の辞書を返す。
+        """
+        if stream_callback is None:
+            return await self.call(prompt, system_prompt, **kwargs)
+        chunks = []
+        try:
+            async for chunk in self.stream(prompt, system_prompt, **kwargs):
+                chunks.append(chunk)
+                await stream_callback(chunk)
+        except Exception as e:
+            logger.error(f"Provider '{self.provider_name}' stream failed: {e}", exc_info=True)
+            return {"error": str(e), "text": "".join(chunks)}
+        return {"text": "".join(chunks), "error": None}
+
     @abstractmethod
     # standard_callの戻り値の型はDict[str, Any]のまま
     async def standard_call(self, prompt: str, system_prompt: str, **kwargs: Any) -> Dict[str, Any]:
@@ -67,6 +102,13 @@ class LLMProvider(ABC):
         """
         pass
 
+    async def aclose(self) -> None:
+        """
+        プロバイダーが保持する接続などのリソースを解放する。
+        長寿命のクライアントを持つプロバイダーはオーバーライドすること。
+        """
+        return None
+
 class EnhancedLLMProvider(LLMProvider):
     """
     標準プロバイダーをラップし、V2モード用のパラメータ最適化機能などを提供する拡張プロバイダー。
@@ -79,6 +121,19 @@ class EnhancedLLMProvider(LLMProvider):
         super().__init__()
         self.provider_name = standard_provider.provider_name
 
+    async def stream(self, prompt: str, system_prompt: str = "", **kwargs: Any) -> AsyncIterator[str]:
+        """
+        ストリーミングはラップしている標準プロバイダーに委譲する。
+        一括で返す呼び出しと同じく、モードに応じて最適化したパラメータを渡す。
+        """
+        params = self._get_optimized_params(kwargs.get('mode', 'simple'), kwargs)
+        async for chunk in self.standard_provider.stream(prompt, system_prompt, **params):
+            yield chunk
+
+    async def aclose(self) -> None:
+        """ラップしている標準プロバイダーのリソースを解放する。"""
+        await self.standard_provider.aclose()
+
     @abstractmethod
     def _get_optimized_params(self, mode: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
         """
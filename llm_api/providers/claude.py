@@ -3,7 +3,7 @@
 # 役割: Claude APIと対話する。重複メソッド定義を修正。
 
 import logging
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict
 
 from anthropic import AsyncAnthropic
 from .base import LLMProvider, ProviderCapability
@@ -68,4 +68,20 @@ class ClaudeProvider(LLMProvider):
             }
         except Exception as e:
             logger.error(f"Claude API呼び出し中にエラー: {e}", exc_info=True)
-            return {"text": "", "error": str(e)}
\ No newline at end of file
+            return {"text": "", "error": str(e)}
+
+    async def stream(self, prompt: str, system_prompt: str = "", **kwargs: Any) -> AsyncIterator[str]:
+        """Messages APIのストリーミングを利用し、テキスト差分を逐次返す。"""
+        extra_params = {}
+        if system_prompt:
+            extra_params['system'] = system_prompt
+
+        async with self.client.messages.stream(
+            model=kwargs.get("model", self.default_model),
+            messages=[{"role": "user", "content": prompt}],
+            temperature=kwargs.get("temperature", 0.7),
+            max_tokens=kwargs.get("max_tokens", 4096),
+            **extra_params
+        ) as message_stream:
+            async for text in message_stream.text_stream:
+                yield text
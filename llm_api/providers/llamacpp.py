@@ -1,13 +1,17 @@
 # /llm_api/providers/llamacpp.py
 # タイトル: Llama.cpp Provider with GPU Offload Support
 # 役割: Llama.cppサーバーまたはローカルGGUFモデルと連携する。n_gpu_layers引数をサポート。
+#       推論は専用エグゼキューターのキューを経由して実行し、イベントループをブロックしない。
 
+import asyncio
 import logging
-from typing import Any, Dict, Optional, cast
+import threading
+from typing import Any, AsyncIterator, Dict, List, Optional, cast
 from llama_cpp import Llama
 
 from ..config import settings
-from .base import LLMProvider
+from .base import LLMProvider, ProviderCapability
+from .llamacpp_executor import LlamaCppInferenceExecutor
 
 logger = logging.getLogger(__name__)
 
@@ -19,8 +23,9 @@ class LlamaCppProvider(LLMProvider):
         api_key: str = "",
         model_path: Optional[str] = None,
         # --- ▼▼▼ ここから変更 ▼▼▼ ---
-        n_gpu_layers: Optional[int] = None
+        n_gpu_layers: Optional[int] = None,
         # --- ▲▲▲ ここまで変更 ▲▲▲ ---
+        n_replicas: Optional[int] = None
     ):
         """
         Llama.cppプロバイダーを初期化します。
@@ -29,30 +34,39 @@ class LlamaCppProvider(LLMProvider):
             api_key: (未使用)
             model_path: 使用するローカルGGUFモデルへのパス。
             n_gpu_layers: GPUにオフロードするレイヤー数。-1は全レイヤーを意味する。
+            n_replicas: 同時推論用にロードするモデルレプリカ数。GGUFの重みはmmapで共有され、
+                レプリカごとに増えるのは主にKVキャッシュ分のメモリ。
         """
         self.api_key = api_key
         self.model_path = model_path
         # --- ▼▼▼ ここから変更 ▼▼▼ ---
         self.n_gpu_layers = n_gpu_layers if n_gpu_layers is not None else -1 # デフォルトは全レイヤーオフロード
         # --- ▲▲▲ ここまで変更 ▲▲▲ ---
-        self.client = None
+        self.n_replicas = max(1, n_replicas if n_replicas is not None else settings.LLAMACPP_NUM_REPLICAS)
+        self.client: Optional[Llama] = None
+        self.executor: Optional[LlamaCppInferenceExecutor] = None
         self.provider_name = "llamacpp"
         self._initialize_client()
 
     def _initialize_client(self):
-        """モデルパスに基づいてLlama.cppクライアントを初期化する。"""
+        """モデルパスに基づいてLlama.cppのモデルレプリカと推論エグゼキューターを初期化する。"""
         if self.model_path:
             try:
-                logger.info(f"Llama.cppモデルをロード中: {self.model_path}")
+                logger.info(f"Llama.cppモデルをロード中: {self.model_path} (レプリカ数: {self.n_replicas})")
                 # --- ▼▼▼ ここから変更 ▼▼▼ ---
                 logger.info(f"GPUにオフロードするレイヤー数: {self.n_gpu_layers}")
-                self.client = Llama(
-                    model_path=self.model_path,
-                    n_gpu_layers=self.n_gpu_layers,
-                    n_ctx=settings.LLAMACPP_N_CTX,
-                    verbose=settings.LLAMACPP_VERBOSE
-                )
+                replicas = [
+                    Llama(
+                        model_path=self.model_path,
+                        n_gpu_layers=self.n_gpu_layers,
+                        n_ctx=settings.LLAMACPP_N_CTX,
+                        verbose=settings.LLAMACPP_VERBOSE
+                    )
+                    for _ in range(self.n_replicas)
+                ]
                 # --- ▲▲▲ ここまで変更 ▲▲▲ ---
+                self.client = replicas[0]
+                self.executor = LlamaCppInferenceExecutor(replicas, max_queue_size=settings.LLAMACPP_MAX_QUEUE_SIZE)
             except Exception as e:
                 logger.error(f"Llama.cppモデルのロードに失敗しました: {e}", exc_info=True)
                 raise ValueError(f"指定されたパスのLlama.cppモデルのロードに失敗しました: {self.model_path}")
@@ -60,10 +74,42 @@ class LlamaCppProvider(LLMProvider):
             logger.warning("Llama.cppのモデルパスが設定されていません。")
             raise ValueError("LlamaCppProviderには `model_path` が必須です。")
 
+    def get_capabilities(self) -> Dict[ProviderCapability, bool]:
+        """このプロバイダーのケイパビリティを返す。"""
+        return {
+            ProviderCapability.STANDARD_CALL: True,
+            ProviderCapability.ENHANCED_CALL: False,
+            ProviderCapability.STREAMING: True,
+            ProviderCapability.SYSTEM_PROMPT: True,
+            ProviderCapability.TOOLS: False,
+            ProviderCapability.JSON_MODE: False,
+        }
+
+    def should_use_enhancement(self, prompt: str, **kwargs) -> bool:
+        """標準プロバイダーは拡張機能を使用しない。"""
+        return False
+
+    def get_queue_metrics(self) -> Dict[str, Any]:
+        """推論キューの深度や待機時間などのメトリクスを返す。"""
+        return self.executor.get_metrics() if self.executor else {}
+
+    async def aclose(self) -> None:
+        """推論エグゼキューターのワーカーとスレッドプールを停止する。"""
+        if self.executor:
+            await self.executor.shutdown()
+
     async def call(self, prompt: str, system_prompt: str = "", **kwargs: Any) -> Dict[str, Any]: # system_promptを追加
         """標準化された `call` メソッドの実装"""
         return await self.standard_call(prompt, system_prompt, **kwargs) # system_promptを渡す
 
+    def _build_messages(self, prompt: str, system_prompt: str) -> List[Dict[str, str]]:
+        """チャット補完用のメッセージリストを構築する。"""
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
     async def standard_call(
         self,
         prompt: str,
@@ -72,8 +118,12 @@ class LlamaCppProvider(LLMProvider):
         max_tokens: Optional[int] = None,
         **kwargs: Any
     ) -> Dict[str, Any]:
-        """Llama.cppモデルにリクエストを送信する。"""
-        if not self.client:
+        """
+        Llama.cppモデルにリクエストを送信する。
+        推論は推論キューに投入され、空いているレプリカ上で別スレッドとして実行される。
+        kwargsの `priority` (小さいほど優先) でキュー内の順序を指定できる。
+        """
+        if not self.client or not self.executor:
             return {"error": "Llama.cppクライアントが初期化されていません。"}
 
         final_temperature = temperature if temperature is not None else settings.LLM_TEMPERATURE
@@ -82,15 +132,15 @@ class LlamaCppProvider(LLMProvider):
         try:
             logger.info(f"Llama.cppモデル '{self.model_path}' へのリクエストを送信中...")
             
-            messages = []
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            messages.append({"role": "user", "content": prompt})
-
-            response = self.client.create_chat_completion(
-                messages=messages,
-                temperature=final_temperature,
-                max_tokens=final_max_tokens,
+            messages = self._build_messages(prompt, system_prompt)
+
+            response = await self.executor.submit(
+                lambda llm: llm.create_chat_completion(
+                    messages=messages,
+                    temperature=final_temperature,
+                    max_tokens=final_max_tokens,
+                ),
+                priority=kwargs.get('priority', 0),
             )
 
             completion = response['choices'][0]['message']['content']
@@ -108,4 +158,70 @@ class LlamaCppProvider(LLMProvider):
             }
         except Exception as e:
             logger.error(f"Llama.cpp API呼び出し中にエラー: {e}", exc_info=True)
-            return {"error": f"Llama.cpp API呼び出し中にエラー: {str(e)}"}
\ No newline at end of file
+            return {"error": f"Llama.cpp API呼び出し中にエラー: {str(e)}"}
+
+    async def stream(
+        self,
+        prompt: str,
+        system_prompt: str = "",
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs: Any
+    ) -> AsyncIterator[str]:
+        """
+        stream=True でチャット補完を実行し、生成されたトークンを逐次返す。
+        生成は推論キュー経由で一つのレプリカを占有して行い、チャンクはスレッドから
+        イベントループへ受け渡す。呼び出し側が途中で読み出しをやめた場合は生成を打ち切る。
+        """
+        if not self.client or not self.executor:
+            raise RuntimeError("Llama.cppクライアントが初期化されていません。")
+
+        final_temperature = temperature if temperature is not None else settings.LLM_TEMPERATURE
+        final_max_tokens = max_tokens if max_tokens is not None else settings.LLM_MAX_TOKENS
+        messages = self._build_messages(prompt, system_prompt)
+
+        loop = asyncio.get_running_loop()
+        chunks: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+        stop_requested = threading.Event()
+
+        def generate(llm: Llama) -> None:
+            try:
+                for chunk in llm.create_chat_completion(
+                    messages=messages,
+                    temperature=final_temperature,
+                    max_tokens=final_max_tokens,
+                    stream=True,
+                ):
+                    if stop_requested.is_set():
+                        break
+                    content = chunk['choices'][0].get('delta', {}).get('content')
+                    if content:
+                        loop.call_soon_threadsafe(chunks.put_nowait, content)
+            finally:
+                loop.call_soon_threadsafe(chunks.put_nowait, None)
+
+        job = asyncio.ensure_future(self.executor.submit(generate, priority=kwargs.get('priority', 0)))
+        try:
+            while True:
+                # ジョブがキュー待ちのまま失敗した場合にも抜けられるよう、両方を待つ
+                get_chunk = asyncio.ensure_future(chunks.get())
+                await asyncio.wait({get_chunk, job}, return_when=asyncio.FIRST_COMPLETED)
+                if not get_chunk.done():
+                    get_chunk.cancel()
+                    job.result()  # 例外があればここで送出される
+                    # 正常終了時は、スレッドから受け渡し済みの残りのチャンクを返す
+                    while not chunks.empty():
+                        remaining = chunks.get_nowait()
+                        if remaining is None:
+                            break
+                        yield remaining
+                    break
+                content = get_chunk.result()
+                if content is None:
+                    break
+                yield content
+            await job
+        finally:
+            stop_requested.set()
+            if not job.done():
+                job.cancel()
@@ -0,0 +1,139 @@
+# /llm_api/providers/llamacpp_executor.py
+# タイトル: Llama.cpp Inference Executor with Request Queue
+# 役割: 同期的なLlama.cpp推論を専用スレッドプールで実行し、優先度付きキューで複数のモデルレプリカに割り振る。
+
+import asyncio
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(order=True)
+class _InferenceJob:
+    """キューに積まれる推論ジョブ。priorityが小さいほど先に実行され、同順位はFIFO。"""
+    priority: int
+    sequence: int
+    fn: Callable[[Any], Any] = field(compare=False)
+    future: "asyncio.Future[Any]" = field(compare=False)
+    enqueued_at: float = field(compare=False)
+
+
+class LlamaCppInferenceExecutor:
+    """
+    Llama.cppモデルのレプリカ群と、それらを駆動する有界スレッドプールを管理するクラス。
+    各レプリカは同時に一つのジョブのみを処理し、イベントループはブロックされない。
+    """
+
+    def __init__(self, replicas: List[Any], max_queue_size: int = 0):
+        if not replicas:
+            raise ValueError("LlamaCppInferenceExecutorには少なくとも1つのモデルレプリカが必要です。")
+        self.replicas = replicas
+        self.max_queue_size = max_queue_size
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._sequence = itertools.count()
+        self._queue: Optional["asyncio.PriorityQueue[_InferenceJob]"] = None
+        self._workers: List["asyncio.Task[None]"] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._busy_replicas = 0
+        self._metrics: Dict[str, float] = {
+            "submitted": 0, "completed": 0, "failed": 0,
+            "total_wait_time": 0.0, "max_wait_time": 0.0,
+        }
+
+    def _ensure_workers(self) -> "asyncio.PriorityQueue[_InferenceJob]":
+        """実行中のイベントループ上にキューとレプリカごとのワーカーを用意する。"""
+        loop = asyncio.get_running_loop()
+        if self._queue is None or self._loop is not loop:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=len(self.replicas), thread_name_prefix="llamacpp")
+            self._queue = asyncio.PriorityQueue(maxsize=self.max_queue_size)
+            self._loop = loop
+            self._workers = [
+                loop.create_task(self._worker(replica, index))
+                for index, replica in enumerate(self.replicas)
+            ]
+            logger.info(f"Llama.cpp推論ワーカーを {len(self.replicas)} 個起動しました。")
+        return self._queue
+
+    async def _worker(self, replica: Any, index: int) -> None:
+        """キューからジョブを取り出し、担当レプリカでスレッドプール上に実行する。"""
+        assert self._queue is not None
+        queue = self._queue
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await queue.get()
+            try:
+                if job.future.cancelled():
+                    continue
+                wait_time = time.monotonic() - job.enqueued_at
+                self._metrics["total_wait_time"] += wait_time
+                self._metrics["max_wait_time"] = max(self._metrics["max_wait_time"], wait_time)
+                logger.debug(f"レプリカ {index} がジョブを開始 (待機時間: {wait_time:.3f}s, 残りキュー: {queue.qsize()})")
+
+                self._busy_replicas += 1
+                try:
+                    result = await loop.run_in_executor(self._executor, job.fn, replica)
+                    if not job.future.done():
+                        job.future.set_result(result)
+                    self._metrics["completed"] += 1
+                except asyncio.CancelledError:
+                    job.future.cancel()
+                    raise
+                except Exception as e:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                    self._metrics["failed"] += 1
+                finally:
+                    self._busy_replicas -= 1
+            finally:
+                queue.task_done()
+
+    async def submit(self, fn: Callable[[Any], Any], priority: int = 0) -> Any:
+        """
+        レプリカを引数に取る同期関数をキューに投入し、その結果を待つ。
+
+        Args:
+            fn: 割り当てられたLlamaインスタンスを受け取り、推論を実行する同期関数。
+            priority: 小さいほど優先される。同じ優先度ではFIFO。
+        """
+        queue = self._ensure_workers()
+        future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+        job = _InferenceJob(priority, next(self._sequence), fn, future, time.monotonic())
+        self._metrics["submitted"] += 1
+        await queue.put(job)
+        return await future
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """キュー深度や待機時間などのメトリクスを返す。"""
+        started = self._metrics["completed"] + self._metrics["failed"]
+        return {
+            "replicas": len(self.replicas),
+            "busy_replicas": self._busy_replicas,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "submitted": int(self._metrics["submitted"]),
+            "completed": int(self._metrics["completed"]),
+            "failed": int(self._metrics["failed"]),
+            "avg_wait_time": self._metrics["total_wait_time"] / started if started else 0.0,
+            "max_wait_time": self._metrics["max_wait_time"],
+        }
+
+    async def shutdown(self) -> None:
+        """ワーカーを停止し、未処理のジョブをキャンセルしてスレッドプールを解放する。"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        if self._queue is not None:
+            while not self._queue.empty():
+                self._queue.get_nowait().future.cancel()
+        self._workers = []
+        self._queue = None
+        self._loop = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        logger.info("Llama.cpp推論エグゼキューターを停止しました。")
@@ -0,0 +1,222 @@
+# /llm_api/providers/memoization.py
+# タイトル: LLM Call Memoization
+# 役割: 決定的な補助プロンプト（分類・判定・クエリ抽出など）に対するLLMProvider.callの結果を再利用する。
+#       temperatureが0の呼び出し、またはcacheable=Trueが指定された呼び出しのみを対象とし、
+#       メモリ上のLRUと任意のSQLite永続化層の二段で保持し、有効期間と永続化層の件数の上限を設ける。
+
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from ..config import settings
+from .base import LLMProvider
+
+logger = logging.getLogger(__name__)
+
+
+def _model_id(provider: LLMProvider, kwargs: Dict[str, Any]) -> Optional[str]:
+    """呼び出しで実際に使われるモデルを特定する。拡張プロバイダーの場合はラップしている標準プロバイダーを参照する。"""
+    if kwargs.get("model"):
+        return str(kwargs["model"])
+    for target in (provider, getattr(provider, "standard_provider", None)):
+        for attr in ("default_model", "model_path"):
+            value = getattr(target, attr, None)
+            if isinstance(value, str) and value:
+                return value
+    return None
+
+
+class CallMemoizer:
+    """(プロバイダー, モデル, プロンプト, システムプロンプト, サンプリングパラメータ) をキーにした呼び出し結果のキャッシュ"""
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        persist_path: Optional[str] = None,
+        ttl: Optional[float] = None,
+        max_persistent_entries: Optional[int] = None
+    ):
+        """
+        Args:
+            max_entries: メモリ上に保持するエントリ数の上限。
+            persist_path: SQLiteファイルのパス。空文字の場合はメモリのみで保持する。
+            ttl: エントリの有効期間（秒）。0以下の場合は期限なし。
+            max_persistent_entries: SQLiteに保持するエントリ数の上限。
+        """
+        self.max_entries = max_entries or settings.LLM_CALL_MEMO_MAX_ENTRIES
+        self.ttl = ttl if ttl is not None else settings.LLM_CALL_MEMO_TTL
+        self.max_persistent_entries = max_persistent_entries or settings.LLM_CALL_MEMO_MAX_PERSISTENT_ENTRIES
+        # キー -> (シリアライズした応答, 保存時刻)
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+        persist_path = persist_path if persist_path is not None else settings.LLM_CALL_MEMO_PATH
+        self._db: Optional[sqlite3.Connection] = None
+        # 永続ストレージの件数（保存のたびにテーブルを数えないよう、開いた時点の件数から増分で管理する）
+        self._db_count = 0
+        if persist_path:
+            try:
+                Path(persist_path).parent.mkdir(parents=True, exist_ok=True)
+                self._db = sqlite3.connect(persist_path, check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_calls (key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS idx_llm_calls_created_at ON llm_calls (created_at)")
+                self._db_count = self._db.execute("SELECT COUNT(*) FROM llm_calls").fetchone()[0]
+            except sqlite3.Error as e:
+                logger.error(f"LLM呼び出しキャッシュのストレージ '{persist_path}' を開けませんでした。メモリのみで動作します: {e}")
+                self._db = None
+
+    @property
+    def is_persistent(self) -> bool:
+        """SQLite永続化層を使用しているか（参照・保存でブロッキングI/Oが発生するか）"""
+        return self._db is not None
+
+    @staticmethod
+    def make_key(provider: LLMProvider, prompt: str, system_prompt: str, kwargs: Dict[str, Any]) -> Optional[str]:
+        """キーを生成する。パラメータにJSONへ変換できない値（ステアリングベクトル等）が含まれる場合はNoneを返す。"""
+        try:
+            material = json.dumps(
+                [type(provider).__name__, getattr(provider, "provider_name", None), _model_id(provider, kwargs),
+                 prompt, system_prompt, kwargs],
+                sort_keys=True, ensure_ascii=False
+            )
+        except (TypeError, ValueError):
+            return None
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute("SELECT response, created_at FROM llm_calls WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = (row[0], row[1])
+                    self._remember(key, entry)
+            if entry is not None and self.ttl > 0 and time.time() - entry[1] > self.ttl:
+                self._stats["expired"] += 1
+                self._delete(key)
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+        return json.loads(entry[0])
+
+    def put(self, key: str, response: Dict[str, Any]) -> None:
+        serialized = json.dumps(response, ensure_ascii=False, default=str)
+        now = time.time()
+        with self._lock:
+            self._remember(key, (serialized, now))
+            self._stats["stores"] += 1
+            if self._db is not None:
+                if self._db.execute("SELECT 1 FROM llm_calls WHERE key = ?", (key,)).fetchone() is None:
+                    self._db_count += 1
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_calls (key, response, created_at) VALUES (?, ?, ?)",
+                    (key, serialized, now)
+                )
+                self._trim_db()
+
+    def _remember(self, key: str, entry: Tuple[str, float]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _trim_db(self) -> None:
+        """
+        永続ストレージの件数が上限を超えた場合、保存が古いものから削除する。
+        件数はメモリ上の値で判定し、上限を超えた場合にのみ実際の件数を数え直す。
+        """
+        assert self._db is not None
+        if self._db_count <= self.max_persistent_entries:
+            return
+        (count,) = self._db.execute("SELECT COUNT(*) FROM llm_calls").fetchone()
+        overflow = count - self.max_persistent_entries
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM llm_calls WHERE key IN (SELECT key FROM llm_calls ORDER BY created_at ASC LIMIT ?)",
+                (overflow,)
+            )
+            self._stats["evictions"] += overflow
+        self._db_count = min(count, self.max_persistent_entries)
+
+    def _delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+        if self._db is not None:
+            deleted = self._db.execute("DELETE FROM llm_calls WHERE key = ?", (key,)).rowcount
+            self._db_count = max(self._db_count - max(deleted, 0), 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_calls")
+                self._db_count = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries)}
+
+
+_call_memoizer: Optional[CallMemoizer] = None
+_memoizer_lock = threading.Lock()
+
+
+def get_call_memoizer() -> Optional[CallMemoizer]:
+    """プロセス内で共有するメモ化キャッシュを返す。LLM_CALL_MEMO_ENABLEDがFalseの場合はNone。"""
+    global _call_memoizer
+    if not settings.LLM_CALL_MEMO_ENABLED:
+        return None
+    with _memoizer_lock:
+        if _call_memoizer is None:
+            _call_memoizer = CallMemoizer()
+        return _call_memoizer
+
+
+def reset_call_memoizer() -> None:
+    """共有キャッシュを破棄する。次回の取得時に現在の設定で再生成される。"""
+    global _call_memoizer
+    with _memoizer_lock:
+        _call_memoizer = None
+
+
+async def memoized_call(
+    provider: LLMProvider, prompt: str, system_prompt: str = "", cacheable: bool = False, **kwargs: Any
+) -> Dict[str, Any]:
+    """
+    provider.callのメモ化版。temperatureが0、またはcacheable=Trueの場合に限り、同一条件の過去の成功結果を返す。
+    それ以外の呼び出しはそのままprovider.callへ委譲する。
+    SQLite永続化層の参照・保存はイベントループを止めないよう別スレッドで行う。
+    """
+    memoizer = get_call_memoizer()
+    key = None
+    if memoizer is not None and (cacheable or kwargs.get("temperature") == 0):
+        key = memoizer.make_key(provider, prompt, system_prompt, kwargs)
+    if key is not None:
+        assert memoizer is not None
+        cached = await asyncio.to_thread(memoizer.get, key) if memoizer.is_persistent else memoizer.get(key)
+        if cached is not None:
+            logger.debug(f"プロバイダー '{getattr(provider, 'provider_name', '')}' の呼び出し結果をキャッシュから返します。")
+            return cached
+
+    response = await provider.call(prompt, system_prompt, **kwargs)
+    if key is not None and not response.get("error"):
+        assert memoizer is not None
+        if memoizer.is_persistent:
+            await asyncio.to_thread(memoizer.put, key, response)
+        else:
+            memoizer.put(key, response)
+    return response
@@ -4,7 +4,7 @@
 
 import logging
 import asyncio
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict, Set
 import json
 
 import httpx
@@ -22,9 +22,66 @@ class OllamaProvider(LLMProvider):
         self.api_base_url = settings.OLLAMA_API_BASE_URL
         self.default_model = settings.OLLAMA_DEFAULT_MODEL
         self.timeout = settings.OLLAMA_TIMEOUT
+        # 全呼び出しで共有する長寿命のHTTPクライアント（イベントループごとに初回呼び出し時に生成）
+        self._clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+        # 終了したループのクライアントを閉じるタスク（完了まで参照を保持する）
+        self._closing: Set["asyncio.Task[None]"] = set()
         super().__init__()
         logger.info(f"Ollama provider initialized with API URL: {self.api_base_url} and default model: {self.default_model}")
 
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        接続プールを共有するAsyncClientを返す。
+        クライアントはイベントループごとに生成し、閉じられている場合は作り直す。
+        生成時に、終了したイベントループのクライアントを閉じる。
+        """
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            self._close_stale_clients(loop)
+            limits = httpx.Limits(
+                max_connections=settings.OLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.OLLAMA_KEEPALIVE_EXPIRY,
+            )
+            http2 = settings.OLLAMA_HTTP2
+            if http2:
+                try:
+                    import h2  # noqa: F401
+                except ImportError:
+                    logger.warning("OLLAMA_HTTP2が有効ですが `h2` パッケージが見つかりません。HTTP/1.1で接続します。")
+                    http2 = False
+            client = httpx.AsyncClient(
+                base_url=self.api_base_url, timeout=self.timeout, limits=limits, http2=http2
+            )
+            self._clients[loop] = client
+            logger.debug(f"Ollama用の共有HTTPクライアントを生成しました (max_connections={settings.OLLAMA_MAX_CONNECTIONS}, http2={http2})")
+        return client
+
+    def _close_stale_clients(self, loop: asyncio.AbstractEventLoop) -> None:
+        """終了したイベントループで生成されたクライアントを、現在のループ上のタスクで閉じる。"""
+        for stale_loop in [other for other in self._clients if other is not loop and other.is_closed()]:
+            task = loop.create_task(self._clients.pop(stale_loop).aclose())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    async def aclose(self) -> None:
+        """全イベントループの共有HTTPクライアントを閉じ、保持している接続を解放する。"""
+        loop = asyncio.get_running_loop()
+        clients, self._clients = self._clients, {}
+        for client_loop, client in clients.items():
+            if client.is_closed:
+                continue
+            if client_loop is not loop and client_loop.is_running():
+                # 別スレッドで動作中のループのクライアントは、そのループ上で閉じる
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(client.aclose(), client_loop))
+            else:
+                await client.aclose()
+            logger.debug("Ollama用の共有HTTPクライアントを閉じました。")
+        pending = [task for task in self._closing if task.get_loop() is loop]
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
     def get_capabilities(self) -> Dict[ProviderCapability, bool]:
         return {
             ProviderCapability.STANDARD_CALL: True,
@@ -45,25 +102,23 @@ class OllamaProvider(LLMProvider):
         except Exception as e:
             return {"text": "", "error": str(e)}
 
-    async def standard_call(self, prompt: str, system_prompt: str = "", **kwargs: Any) -> Dict[str, Any]: # 戻り値はDict[str, Any]
-        """
-        Ollama APIを呼び出し、標準化された辞書形式で結果を返す。
-        """
-        simulated_preface = ""
+    def _simulated_preface(self, **kwargs: Any) -> str:
+        """感情ステアリング指定時に、その効果をシミュレートする前置き文を返す。"""
         if kwargs.get('steering_vector') is not None and kwargs.get('steer_emotion'):
             steered_emotion_str = kwargs['steer_emotion']
             logger.info(f"OllamaProviderが感情 '{steered_emotion_str}' のステアリングを検知しました。効果をシミュレートします。")
             try:
                 if EmotionCategory(steered_emotion_str) == EmotionCategory.JOY:
-                    simulated_preface = "素晴らしい一日ですね！喜んでお答えします。\n\n"
+                    return "素晴らしい一日ですね！喜んでお答えします。\n\n"
             except ValueError:
                 logger.warning(f"不明な感情 '{steered_emotion_str}'")
+        return ""
 
-        api_url = f"{self.api_base_url}/api/chat"
+    def _build_payload(self, prompt: str, system_prompt: str, stream: bool, **kwargs: Any) -> Dict[str, Any]:
+        """/api/chat へ送信するペイロードを構築する。"""
         messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
         messages.append({"role": "user", "content": prompt})
 
-        # --- ▼▼▼ ここから修正 ▼▼▼ ---
         # modelパラメータを確実に取得する
         model_to_use = kwargs.get("model") or self.default_model
         if not model_to_use:
@@ -72,7 +127,7 @@ class OllamaProvider(LLMProvider):
         payload: Dict[str, Any] = {
             "model": model_to_use,
             "messages": messages,
-            "stream": False,
+            "stream": stream,
         }
         
         allowed_options = ['temperature', 'top_p', 'top_k', 'num_ctx', 'repeat_penalty']
@@ -82,18 +137,28 @@ class OllamaProvider(LLMProvider):
             
         if kwargs.get('json_mode'):
             payload['format'] = 'json'
-        # --- ▲▲▲ ここまで修正 ▲▲▲ ---
+        return payload
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(api_url, json=payload)
-            if 400 <= response.status_code < 500:
-                try:
-                    error_detail = response.json().get('error', response.text)
-                    logger.error(f"Ollama APIから4xxエラー: {response.status_code} - {error_detail}")
-                except json.JSONDecodeError:
-                    logger.error(f"Ollama APIから4xxエラー: {response.status_code} - {response.text}")
-            response.raise_for_status()
-            response_data = response.json()
+    def _log_client_error(self, response: httpx.Response, body: str) -> None:
+        """4xxエラーの詳細をログに出力する。"""
+        if 400 <= response.status_code < 500:
+            try:
+                error_detail = json.loads(body).get('error', body)
+                logger.error(f"Ollama APIから4xxエラー: {response.status_code} - {error_detail}")
+            except json.JSONDecodeError:
+                logger.error(f"Ollama APIから4xxエラー: {response.status_code} - {body}")
+
+    async def standard_call(self, prompt: str, system_prompt: str = "", **kwargs: Any) -> Dict[str, Any]: # 戻り値はDict[str, Any]
+        """
+        Ollama APIを呼び出し、標準化された辞書形式で結果を返す。
+        """
+        simulated_preface = self._simulated_preface(**kwargs)
+        payload = self._build_payload(prompt, system_prompt, stream=False, **kwargs)
+
+        response = await self._get_client().post("/api/chat", json=payload)
+        self._log_client_error(response, response.text)
+        response.raise_for_status()
+        response_data = response.json()
 
         full_response = simulated_preface + response_data.get('message', {}).get('content', '')
         prompt_tokens = response_data.get("prompt_eval_count", 0)
@@ -104,4 +169,30 @@ class OllamaProvider(LLMProvider):
             "model": response_data.get("model"),
             "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
             "error": None
-        }
\ No newline at end of file
+        }
+
+    async def stream(self, prompt: str, system_prompt: str = "", **kwargs: Any) -> AsyncIterator[str]:
+        """
+        "stream": True で /api/chat を呼び出し、NDJSONの各行からトークンを逐次返す。
+        """
+        simulated_preface = self._simulated_preface(**kwargs)
+        if simulated_preface:
+            yield simulated_preface
+        payload = self._build_payload(prompt, system_prompt, stream=True, **kwargs)
+
+        async with self._get_client().stream("POST", "/api/chat", json=payload) as response:
+            if response.status_code >= 400:
+                body = (await response.aread()).decode('utf-8', errors='replace')
+                self._log_client_error(response, body)
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if data.get('error'):
+                    raise RuntimeError(f"Ollama APIがストリーミング中にエラーを返しました: {data['error']}")
+                content = data.get('message', {}).get('content', '')
+                if content:
+                    yield content
+                if data.get('done'):
+                    break
@@ -1,6 +1,6 @@
 # /llm_api/providers/openai.py
 import logging
-from typing import Any, Dict, cast 
+from typing import Any, AsyncIterator, Dict, List, cast 
 
 from openai import AsyncOpenAI, APIConnectionError, RateLimitError, APIStatusError
 from .base import LLMProvider, ProviderCapability, Awaitable # Awaitableをインポート
@@ -37,15 +37,20 @@ class OpenAIProvider(LLMProvider):
         """標準プロバイダーは拡張機能を使用しない。"""
         return False
 
+    def _build_messages(self, prompt: str, system_prompt: str) -> List[Dict[str, str]]:
+        """Chat Completions API用のメッセージリストを構築する。"""
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
     @async_retry() # 汎用リトライデコレータを適用
     # standard_call のシグネチャを親クラスの期待する型に合わせる
     # async def は自動的に Coroutine を返すため、ここでは解決される型を直接指定
     async def standard_call(self, prompt: str, system_prompt: str = "", **kwargs: Any) -> Dict[str, Any]:
         """OpenAI APIを呼び出し、標準化された辞書形式で結果を返す。"""
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        messages.append({"role": "user", "content": prompt})
+        messages = self._build_messages(prompt, system_prompt)
 
         model_to_use = kwargs.get("model", self.default_model)
 
@@ -70,4 +75,20 @@ class OpenAIProvider(LLMProvider):
                 "total_tokens": usage.total_tokens if usage else 0,
             },
             "error": None,
-        }
\ No newline at end of file
+        }
+
+    async def stream(self, prompt: str, system_prompt: str = "", **kwargs: Any) -> AsyncIterator[str]:
+        """stream=True でOpenAI APIを呼び出し、差分テキストを逐次返す。"""
+        response_stream = await self.client.chat.completions.create(
+            model=kwargs.get("model", self.default_model),
+            messages=self._build_messages(prompt, system_prompt),
+            temperature=kwargs.get("temperature", 0.7),
+            max_tokens=kwargs.get("max_tokens", 1024),
+            stream=True,
+        )
+        async for chunk in response_stream:
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                yield content
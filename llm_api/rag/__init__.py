@@ -2,6 +2,17 @@
 """
 RAG (Retrieval-Augmented Generation) パッケージ
 """
-from .manager import RAGManager
+from typing import TYPE_CHECKING, Any
 
-__all__ = ["RAGManager"]
\ No newline at end of file
+if TYPE_CHECKING:
+    from .manager import RAGManager
+
+__all__ = ["RAGManager"]
+
+
+def __getattr__(name: str) -> Any:
+    # langchain/FAISS/HuggingFaceの読み込みは、RAGが実際に使われるまで遅延させる
+    if name == "RAGManager":
+        from .manager import RAGManager
+        return RAGManager
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,10 +1,20 @@
 # /llm_api/rag/knowledge_base.py
 # パス: /llm_api/rag/knowledge_base.py
-# タイトル: KnowledgeBase with updated LangChain components
-# 役割: LangChainの非推奨警告に対応し、新しい推奨コンポーネントを使用する。
+# タイトル: KnowledgeBase with Persistent FAISS Index Store
+# 役割: LangChainの推奨コンポーネントでベクトルストアを構築する。
+#       構築済みインデックスはソースの内容ハッシュをキーにディスクへ保存し、プロセス内でも共有して再利用する。
 
+import hashlib
+import json
 import logging
-from typing import List, Optional, Any
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Any, Tuple
 
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, WebBaseLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -12,41 +22,212 @@ from langchain_community.vectorstores import FAISS
 # 新しい推奨ライブラリからインポート
 from langchain_huggingface import HuggingFaceEmbeddings
 
+from ..config import settings
+
 logger = logging.getLogger(__name__)
 
+INDEX_FORMAT_VERSION = 1
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# プロセス内で共有するキャッシュ（埋め込みモデル、ロード済みベクトルストアとそのインデックス作成時刻、ファイル内容ハッシュ）
+_embeddings_cache: Dict[str, HuggingFaceEmbeddings] = {}
+_vector_store_cache: Dict[str, Tuple[FAISS, float]] = {}
+_content_hash_cache: Dict[Tuple[str, int, int], str] = {}
+_cache_lock = threading.Lock()
+
+
+def _get_embeddings(model_name: str) -> HuggingFaceEmbeddings:
+    """埋め込みモデルをプロセス内で一度だけロードして返す。"""
+    with _cache_lock:
+        if model_name not in _embeddings_cache:
+            logger.info(f"埋め込みモデル '{model_name}' をロードします。")
+            _embeddings_cache[model_name] = HuggingFaceEmbeddings(model_name=model_name)
+        return _embeddings_cache[model_name]
+
+
+def _is_url(source: str) -> bool:
+    return source.lower().startswith("http://") or source.lower().startswith("https://")
+
+
+def _file_content_hash(path: str) -> str:
+    """ファイル内容のSHA-256を返す。サイズとmtimeが変わらない限り再計算しない。"""
+    stat = os.stat(path)
+    stat_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    cached = _content_hash_cache.get(stat_key)
+    if cached:
+        return cached
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    _content_hash_cache[stat_key] = digest.hexdigest()
+    return _content_hash_cache[stat_key]
+
+
+def clear_knowledge_base_cache() -> None:
+    """プロセス内にロード済みのベクトルストアを破棄する（ディスク上のインデックスは残る）。"""
+    with _cache_lock:
+        _vector_store_cache.clear()
+        _content_hash_cache.clear()
+
+
 class KnowledgeBase:
     """ナレッジベースを管理するクラス"""
-    def __init__(self, embedding_model_name: str = 'sentence-transformers/all-MiniLM-L6-v2'):
+    def __init__(self, embedding_model_name: Optional[str] = None, index_cache_dir: Optional[str] = None):
+        self.embedding_model_name = embedding_model_name or settings.RAG_EMBEDDING_MODEL
+        self.index_cache_dir = Path(index_cache_dir or settings.RAG_INDEX_CACHE_DIR)
         self.vector_store: Optional[FAISS] = None
-        # 新しいクラスを使用
-        self.embeddings = HuggingFaceEmbeddings(model_name=embedding_model_name)
-        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+        # 埋め込みモデルはプロセス内で共有する
+        self.embeddings = _get_embeddings(self.embedding_model_name)
+        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
 
-    def load_documents(self, source: str) -> None:
-        """ファイルパスまたはURLからドキュメントを読み込み、ベクトルストアを構築する"""
-        logger.info(f"'{source}' からドキュメントを読み込んでいます...")
+    def _index_key(self, source: str) -> str:
+        """
+        ソース・埋め込みモデル・分割設定からインデックスのキーを生成する。
+        ローカルファイルは内容ハッシュを含めるため、内容が変わればキーも変わる。
+        URLは内容を取得しない限りハッシュできないため、URL自体をキーとし、
+        インデックス作成からRAG_URL_INDEX_TTL秒が経過したものは再構築する（_is_expired）。
+        """
+        if _is_url(source):
+            source_id = source
+            content_id = "url"
+        else:
+            source_id = os.path.abspath(source)
+            content_id = _file_content_hash(source)
+        key_material = json.dumps({
+            "version": INDEX_FORMAT_VERSION,
+            "source": source_id,
+            "content": content_id,
+            "embedding_model": self.embedding_model_name,
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+        }, sort_keys=True)
+        return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+    def _is_expired(self, source: str, indexed_at: float) -> bool:
+        """URLソースのインデックスが有効期間を過ぎているか（ローカルファイルは内容ハッシュで判定するため常にFalse）"""
+        ttl = settings.RAG_URL_INDEX_TTL
+        return _is_url(source) and ttl > 0 and time.time() - indexed_at > ttl
+
+    @staticmethod
+    def _indexed_at(index_dir: Path) -> float:
+        """保存済みインデックスの作成時刻（記録が無い古いインデックスはファイルの更新時刻を使う）"""
+        try:
+            return float(json.loads((index_dir / "source.json").read_text(encoding="utf-8"))["indexed_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return (index_dir / "index.faiss").stat().st_mtime
+
+    def _load_index(self, index_dir: Path) -> Optional[FAISS]:
+        """
+        ディスク上のインデックスをロードする。FAISSインデックス本体はmmapで読み込み、
+        複数プロセスで同じインデックスを使う場合もページキャッシュを共有する。
+        """
+        if not (index_dir / "index.faiss").exists() or not (index_dir / "index.pkl").exists():
+            return None
+        try:
+            import faiss
+            index = faiss.read_index(str(index_dir / "index.faiss"), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            # インデックスは本クラス自身が書き出したものに限って読み込む
+            with open(index_dir / "index.pkl", "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+            return FAISS(self.embeddings, index, docstore, index_to_docstore_id)
+        except Exception as e:
+            logger.warning(f"保存済みインデックス '{index_dir}' の読み込みに失敗したため再構築します: {e}")
+            return None
+
+    def _save_index(self, vector_store: FAISS, index_dir: Path, source: str, indexed_at: float) -> None:
+        """
+        一時ディレクトリに書き出してからリネームし、不完全なインデックスが見えないようにする。
+        期限切れのインデックスが残っている場合は、退避してから置き換える。
+        """
+        try:
+            self.index_cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_dir = Path(tempfile.mkdtemp(dir=self.index_cache_dir, prefix=".tmp-"))
+            vector_store.save_local(str(tmp_dir))
+            (tmp_dir / "source.json").write_text(
+                json.dumps(
+                    {"source": source, "embedding_model": self.embedding_model_name, "indexed_at": indexed_at},
+                    ensure_ascii=False
+                ),
+                encoding="utf-8"
+            )
+            if index_dir.exists():
+                stale_dir = Path(tempfile.mkdtemp(dir=self.index_cache_dir, prefix=".stale-"))
+                try:
+                    os.replace(index_dir, stale_dir / "index")
+                except OSError:
+                    pass
+                shutil.rmtree(stale_dir, ignore_errors=True)
+            try:
+                os.replace(tmp_dir, index_dir)
+            except OSError:
+                # 別プロセスが先に同じインデックスを保存した場合
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            logger.info(f"ベクトルストアを '{index_dir}' に保存しました。")
+        except Exception as e:
+            logger.warning(f"ベクトルストアの保存に失敗しました: {e}")
+
+    def _build_vector_store(self, source: str) -> FAISS:
+        """ソースを読み込み、チャンク分割して埋め込みを計算する。"""
         loader: Any = None
+        if _is_url(source):
+            logger.info("URLとしてソースを処理します。")
+            loader = WebBaseLoader(source)
+        elif source.lower().endswith(".pdf"):
+            logger.info("PDFファイルとしてソースを処理します。")
+            loader = PyPDFLoader(source)
+        else:
+            logger.info("テキストファイルとしてソースを処理します。")
+            loader = TextLoader(source, encoding='utf-8')
+
+        if not loader:
+            raise ValueError("対応していないソースタイプです。")
+
+        documents = loader.load()
+        chunks = self.text_splitter.split_documents(documents)
+
+        logger.info(f"{len(chunks)}個のチャンクを作成し、ベクトルストアを構築します...")
+        vector_store = FAISS.from_documents(chunks, self.embeddings)
+        logger.info("ベクトルストアの構築が完了しました。")
+        return vector_store
+
+    def load_documents(self, source: str, use_cache: bool = True) -> None:
+        """
+        ファイルパスまたはURLからドキュメントを読み込み、ベクトルストアを用意する。
+        同じ内容のソースは、プロセス内キャッシュ → ディスク上のインデックス → 新規構築 の順で解決する。
+        """
+        logger.info(f"'{source}' からドキュメントを読み込んでいます...")
         try:
-            if source.lower().startswith("http://") or source.lower().startswith("https://"):
-                logger.info("URLとしてソースを処理します。")
-                loader = WebBaseLoader(source)
-            elif source.lower().endswith(".pdf"):
-                logger.info("PDFファイルとしてソースを処理します。")
-                loader = PyPDFLoader(source)
-            else:
-                logger.info("テキストファイルとしてソースを処理します。")
-                loader = TextLoader(source, encoding='utf-8')
-
-            if loader:
-                documents = loader.load()
-                chunks = self.text_splitter.split_documents(documents)
-                
-                logger.info(f"{len(chunks)}個のチャンクを作成し、ベクトルストアを構築します...")
-                self.vector_store = FAISS.from_documents(chunks, self.embeddings)
-                logger.info("ベクトルストアの構築が完了しました。")
+            if not use_cache:
+                self.vector_store = self._build_vector_store(source)
+                return
+
+            key = self._index_key(source)
+            with _cache_lock:
+                cached = _vector_store_cache.get(key)
+            if cached is not None and not self._is_expired(source, cached[1]):
+                logger.info("プロセス内にロード済みのベクトルストアを再利用します。")
+                self.vector_store = cached[0]
+                return
+
+            index_dir = self.index_cache_dir / key
+            vector_store = self._load_index(index_dir)
+            indexed_at = self._indexed_at(index_dir) if vector_store is not None else time.time()
+            if vector_store is not None and self._is_expired(source, indexed_at):
+                logger.info(f"URL '{source}' のインデックスが有効期間を過ぎたため再構築します。")
+                vector_store = None
+            if vector_store is not None:
+                logger.info(f"保存済みのベクトルストアを '{index_dir}' から読み込みました。")
             else:
-                raise ValueError("対応していないソースタイプです。")
-            
+                indexed_at = time.time()
+                vector_store = self._build_vector_store(source)
+                self._save_index(vector_store, index_dir, source, indexed_at)
+
+            with _cache_lock:
+                _vector_store_cache[key] = (vector_store, indexed_at)
+            self.vector_store = vector_store
+
         except Exception as e:
             logger.error(f"ドキュメントの読み込みまたはベクトル化中にエラー: {e}", exc_info=True)
             raise
@@ -55,4 +236,4 @@ class KnowledgeBase:
         """Retrieverを取得する際に、検索するドキュメント数を指定できるように変更"""
         if not self.vector_store:
             return None
-        return self.vector_store.as_retriever(search_kwargs={'k': top_k})
\ No newline at end of file
+        return self.vector_store.as_retriever(search_kwargs={'k': top_k})
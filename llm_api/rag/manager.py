@@ -2,15 +2,20 @@
 # タイトル: RAG Manager with Robust Query Extraction
 # 役割: RAGプロセスを管理する。LLMから検索クエリを抽出するプロンプトを強化し、出力のサニタイズ処理を追加する。
 
+import asyncio
 import logging
 import re # reモジュールをインポート
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 from .knowledge_base import KnowledgeBase
 from .retriever import Retriever
 from langchain_community.document_loaders import WikipediaLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from ..providers.base import LLMProvider
+from ..providers.memoization import memoized_call
+
+if TYPE_CHECKING:
+    from ..memory_consolidation.graph_store import KnowledgeGraphStore
 
 logger = logging.getLogger(__name__)
 
@@ -19,11 +24,14 @@ class RAGManager:
     def __init__(self,
                  provider: LLMProvider,
                  use_wikipedia: bool = False,
-                 knowledge_base_path: Optional[str] = None):
+                 knowledge_base_path: Optional[str] = None,
+                 graph_store: Optional["KnowledgeGraphStore"] = None):
         
         self.provider = provider
         self.use_wikipedia = use_wikipedia
         self.knowledge_base_path = knowledge_base_path
+        # 記憶統合で蓄積したナレッジグラフ（指定時は関連するエンティティの近傍をコンテキストに加える）
+        self.graph_store = graph_store
         self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
 
     async def _extract_search_query(self, prompt: str) -> str:
@@ -43,7 +51,7 @@ class RAGManager:
 ---
 出力："""
         try:
-            response = await self.provider.call(extraction_prompt, "")
+            response = await memoized_call(self.provider, extraction_prompt, "", cacheable=True)
             query = response.get('text', prompt).strip()
             
             query = re.sub(r'^(出力|検索キーワード)[:：\s]*', '', query).strip()
@@ -76,14 +84,32 @@ class RAGManager:
         if not self.knowledge_base_path:
             return ""
         try:
+            # 構築済みインデックスはKnowledgeBase側でプロセス内・ディスク上にキャッシュされる。
+            # 初回構築時の埋め込み計算でイベントループを塞がないよう、別スレッドで実行する。
             kb = KnowledgeBase()
-            kb.load_documents(self.knowledge_base_path)
+            await asyncio.to_thread(kb.load_documents, self.knowledge_base_path)
             retriever = Retriever(kb)
             return "\n\n".join(retriever.search(query))
         except Exception as e:
             logger.error(f"ナレッジベースからの検索中にエラー: {e}", exc_info=True)
             return ""
 
+    async def _retrieve_from_knowledge_graph(self, query: str) -> str:
+        """ナレッジグラフから、クエリに現れるエンティティの近傍をテキストとして取り出す"""
+        if self.graph_store is None:
+            return ""
+        from ..config import settings
+        try:
+            return await asyncio.to_thread(
+                self.graph_store.graph_context, query,
+                max_entities=settings.KNOWLEDGE_GRAPH_RAG_MAX_ENTITIES,
+                depth=settings.KNOWLEDGE_GRAPH_RAG_DEPTH,
+                max_relations=settings.KNOWLEDGE_GRAPH_RAG_MAX_RELATIONS
+            )
+        except Exception as e:
+            logger.error(f"ナレッジグラフからの検索中にエラー: {e}", exc_info=True)
+            return ""
+
     async def retrieve_and_augment(self, original_prompt: str) -> str:
         """情報を検索し、プロンプトを拡張する"""
         retrieved_context = ""
@@ -92,6 +118,12 @@ class RAGManager:
             retrieved_context = await self._retrieve_from_wikipedia(search_query)
         elif self.knowledge_base_path:
             retrieved_context = await self._retrieve_from_knowledge_base(original_prompt)
+
+        graph_context = await self._retrieve_from_knowledge_graph(original_prompt)
+        if graph_context:
+            logger.info("ナレッジグラフから関連する知識を取得しました。")
+            graph_section = f"# ナレッジグラフ（過去の対話から蓄積した知識）\n{graph_context}"
+            retrieved_context = f"{retrieved_context}\n\n{graph_section}" if retrieved_context else graph_section
         
         if not retrieved_context:
             logger.info("関連情報が見つからなかったため、プロンプトは拡張されません。")
@@ -4,6 +4,7 @@
 
 import asyncio
 import logging
+import sys
 from functools import wraps
 from typing import Any, Callable, Coroutine, Type, Tuple, Optional, Dict, TypeVar, List
 
@@ -13,38 +14,37 @@ from ..config import settings
 
 T = TypeVar('T')
 
-RETRYABLE_EXCEPTIONS_LIST: List[Type[Exception]] = []
 _HTTPX_AVAILABLE = False
 _HTTPStatusError: Optional[Type[Exception]] = None
+_HTTPX_EXCEPTIONS: List[Type[Exception]] = []
 
 try:
     from httpx import RequestError, HTTPStatusError
-    RETRYABLE_EXCEPTIONS_LIST.extend([RequestError, HTTPStatusError])
+    _HTTPX_EXCEPTIONS.extend([RequestError, HTTPStatusError])
     _HTTPX_AVAILABLE = True
     _HTTPStatusError = HTTPStatusError
 except ImportError:
     logger.debug("httpx is not installed. Retry logic for httpx errors will be skipped.")
 
-try:
-    from openai import APIConnectionError
-    RETRYABLE_EXCEPTIONS_LIST.append(APIConnectionError)
-except ImportError:
-    logger.debug("openai is not installed. Retry logic for openai errors will be skipped.")
-
-try:
-    from anthropic import APIConnectionError as AnthropicAPIConnectionError
-    RETRYABLE_EXCEPTIONS_LIST.append(AnthropicAPIConnectionError)
-except ImportError:
-    logger.debug("anthropic is not installed. Retry logic for anthropic errors will be skipped.")
-
-try:
-    from google.api_core.exceptions import ServiceUnavailable, DeadlineExceeded
-    RETRYABLE_EXCEPTIONS_LIST.extend([ServiceUnavailable, DeadlineExceeded])
-except ImportError:
-    logger.debug("google-api-core is not installed. Retry logic for google errors will be skipped.")
+# SDK固有の例外は (モジュール名, 例外クラス名) で保持し、SDKが既にインポートされている場合にのみ解決する。
+# SDKが未インポートならその例外が送出されることもないため、リトライ判定のためだけにSDKを読み込む必要はない。
+_SDK_RETRYABLE_EXCEPTIONS: List[Tuple[str, str]] = [
+    ("openai", "APIConnectionError"),
+    ("anthropic", "APIConnectionError"),
+    ("google.api_core.exceptions", "ServiceUnavailable"),
+    ("google.api_core.exceptions", "DeadlineExceeded"),
+]
 
 
-RETRYABLE_EXCEPTIONS: Tuple[Type[Exception], ...] = tuple(RETRYABLE_EXCEPTIONS_LIST)
+def get_retryable_exceptions() -> Tuple[Type[Exception], ...]:
+    """現在読み込まれているライブラリに基づいて、リトライ対象の例外クラスを返す。"""
+    exceptions: List[Type[Exception]] = list(_HTTPX_EXCEPTIONS)
+    for module_name, class_name in _SDK_RETRYABLE_EXCEPTIONS:
+        module = sys.modules.get(module_name)
+        exc_class = getattr(module, class_name, None) if module else None
+        if isinstance(exc_class, type) and issubclass(exc_class, Exception):
+            exceptions.append(exc_class)
+    return tuple(exceptions)
 
 
 def async_retry(
@@ -52,10 +52,11 @@ def async_retry(
     initial_wait: float = settings.RETRY_INITIAL_WAIT,
     backoff_factor: float = settings.RETRY_BACKOFF_FACTOR,
     max_wait: float = settings.RETRY_MAX_WAIT,
-    retryable_exceptions: Tuple[Type[Exception], ...] = RETRYABLE_EXCEPTIONS
+    retryable_exceptions: Optional[Tuple[Type[Exception], ...]] = None
 ) -> Callable[[Callable[..., Coroutine[Any, Any, T]]], Callable[..., Coroutine[Any, Any, T]]]:
     """
     非同期関数が一時的なエラーで失敗した場合に、指数関数的バックオフでリトライするデコレータ。
+    retryable_exceptionsを省略した場合は、例外発生時点で読み込まれているSDKの接続エラーを対象とする。
     """
     def decorator(func: Callable[..., Coroutine[Any, Any, T]]) -> Callable[..., Coroutine[Any, Any, T]]:
         @wraps(func)
@@ -79,7 +80,7 @@ def async_retry(
                             is_retryable = True
                     
                     # ステップB: 上記でリトライ対象外だった場合に、他のリトライ可能例外リストと照合
-                    if not is_retryable and isinstance(e, retryable_exceptions):
+                    if not is_retryable and isinstance(e, retryable_exceptions or get_retryable_exceptions()):
                         is_retryable = True
 
                     if is_retryable and attempt < max_attempts - 1:
@@ -0,0 +1,13 @@
+# /tests/conftest.py
+# タイトル: Shared Test Fixtures
+# 役割: テスト全体で共有するフィクスチャを定義する。
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def _isolated_learner_storage(tmp_path, monkeypatch):
+    """既定のComplexityLearnerの保存先をテストごとの一時ディレクトリに向け、リポジトリ直下にファイルを作らない。"""
+    from llm_api.core_engine import learner
+
+    monkeypatch.setattr(learner, "STORAGE_FILE", tmp_path / "complexity_learning.json")
@@ -60,4 +60,140 @@ async def test_cli_main_flow(mock_process):
     provider_arg = mock_process.await_args[0][0]
     prompt_arg = mock_process.await_args[0][1]
     assert provider_arg == "openai"
-    assert prompt_arg == "Test prompt"
\ No newline at end of file
+    assert prompt_arg == "Test prompt"
+
+@pytest.mark.asyncio
+async def test_resident_server_roundtrip_with_thin_client(tmp_path):
+    """常駐サーバーが通常応答・ストリーミング応答を返し、正常にシャットダウンできることをテストする。"""
+    import asyncio
+    from cli.server import MetaIntelligenceServer
+    from cli.client import forward_request
+
+    class FakeHandler:
+        async def process_request(self, provider_name, prompt, stream_callback=None, **kwargs):
+            if stream_callback:
+                for chunk in ["Hel", "lo"]:
+                    await stream_callback(chunk)
+            await asyncio.sleep(0.05)
+            return {"text": f"{provider_name}:{prompt}:{kwargs.get('mode')}", "error": None}
+
+    server = MetaIntelligenceServer(handler=FakeHandler(), shutdown_timeout=5.0)
+    socket_path = str(tmp_path / "server.sock")
+    await server.start(host="127.0.0.1", port=0, unix_socket=socket_path)
+    port = next(sock.getsockname()[1] for sock in server.sockets if isinstance(sock.getsockname(), tuple))
+    url = f"http://127.0.0.1:{port}"
+
+    results = await asyncio.gather(*(forward_request(url, "ollama", f"q{i}", mode="efficient") for i in range(3)))
+    assert [r["text"] for r in results] == ["ollama:q0:efficient", "ollama:q1:efficient", "ollama:q2:efficient"]
+
+    chunks = []
+    async def on_chunk(chunk):
+        chunks.append(chunk)
+    streamed = await forward_request(f"unix://{socket_path}", "ollama", "hi", stream_callback=on_chunk)
+    assert chunks == ["Hel", "lo"]
+    assert streamed["text"] == "ollama:hi:None"
+
+    # シャットダウン開始時に処理中だったリクエストは完了まで処理される
+    in_flight = asyncio.ensure_future(forward_request(url, "ollama", "last"))
+    while server.get_status()["active_requests"] == 0:
+        await asyncio.sleep(0.005)
+    with patch('llm_api.providers.close_all_providers', new_callable=AsyncMock) as mock_close:
+        await server.shutdown()
+        mock_close.assert_awaited_once()
+    assert (await in_flight)["text"] == "ollama:last:None"
+    assert "接続できません" in (await forward_request(url, "ollama", "after"))["error"]
+
+
+@pytest.mark.asyncio
+async def test_request_processor_does_not_fall_back_after_streaming_started():
+    """V2拡張モードが回答の一部を出力した後に失敗した場合、標準プロバイダーで2つ目の回答を出力しないことをテストする。"""
+    from cli.request_processor import RequestProcessor
+    from llm_api.providers.base import EnhancedLLMProvider
+
+    async def failing_solve(prompt, system_prompt="", stream_callback=None, **kwargs):
+        await stream_callback("Partial")
+        return {"success": False, "final_solution": "Partial", "error": "connection dropped"}
+
+    engine = MagicMock()
+    engine.solve_problem = failing_solve
+    registry = MagicMock()
+    registry.get_engine.return_value = engine
+    enhanced = MagicMock(spec=EnhancedLLMProvider)
+    enhanced.standard_provider = MagicMock()
+    enhanced._get_optimized_params.return_value = {}
+    standard = MagicMock()
+    standard.call_streaming = AsyncMock(return_value={"text": "Second answer", "error": None})
+
+    chunks = []
+    async def on_chunk(chunk):
+        chunks.append(chunk)
+
+    processor = RequestProcessor(None, None, None, None, None, engine_registry=registry)
+    providers = {True: enhanced, False: standard}
+    with patch('cli.request_processor.get_provider', side_effect=lambda name, enhanced=False: providers[enhanced]):
+        response = await processor.process_request("ollama", "hi", mode="adaptive", stream_callback=on_chunk)
+
+    assert chunks == ["Partial"]
+    assert response["error"] and "connection dropped" in response["all_errors"][0]
+    standard.call_streaming.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_batch_runner_limits_concurrency_and_resumes(tmp_path):
+    """バッチ実行がプロバイダー単位の同時実行数を守り、完了順に出力し、再開時に完了済みIDをスキップすることをテストする。"""
+    import asyncio
+    import json
+    from cli.batch_runner import BatchRunner
+
+    input_path = tmp_path / "batch.jsonl"
+    lines = [{"id": f"r{i}", "prompt": f"p{i}", "provider": "openai" if i % 2 else "ollama"} for i in range(6)]
+    lines[0]["delay"] = 0.1  # 先頭のリクエストは後から完了させる
+    lines.append({"id": "bad", "prompt": "fail", "provider": "openai"})
+    input_path.write_text("\n".join(json.dumps(line) for line in lines) + "\nnot json\n", encoding="utf-8")
+    output_path = tmp_path / "out.jsonl"
+
+    active = {"openai": 0, "ollama": 0}
+    peak = {"openai": 0, "ollama": 0}
+    calls = []
+
+    async def fake_process(provider_name, prompt, **options):
+        calls.append(prompt)
+        active[provider_name] += 1
+        peak[provider_name] = max(peak[provider_name], active[provider_name])
+        await asyncio.sleep(options.get("delay", 0.01))
+        active[provider_name] -= 1
+        if prompt == "fail":
+            return {"text": "", "error": "boom"}
+        return {"text": prompt.upper(), "mode": options.get("mode")}
+
+    runner = BatchRunner(fake_process, default_options={"mode": "efficient"}, provider_limits={"openai": 2, "ollama": 1})
+    summary = await runner.run(str(input_path), str(output_path))
+    assert summary["total"] == 8 and summary["succeeded"] == 6 and summary["failed"] == 2
+    assert peak == {"openai": 2, "ollama": 1}
+
+    records = [json.loads(line) for line in output_path.read_text(encoding="utf-8").splitlines()]
+    ok_ids = [r["id"] for r in records if r["status"] == "ok"]
+    assert ok_ids[0] in ("r1", "r3") and ok_ids.index("r0") > ok_ids.index("r3")  # 入力順ではなく完了順に書き出される
+    assert records[-1]["response"]["mode"] == "efficient"
+
+    # 再開時は成功したIDのみスキップし、失敗したものだけを再実行する
+    calls.clear()
+    summary = await runner.run(str(input_path), str(output_path))
+    assert summary["skipped"] == 6
+    assert calls == ["fail"]
+
+
+def test_batch_runner_defaults_to_provider_concurrency_settings():
+    """バッチ実行の同時実行数が、指定が無い場合はプロバイダーごとの設定に従い、明示的な指定で上書きできることをテストする。"""
+    from cli.batch_runner import BatchRunner
+    from llm_api.config import settings
+
+    with patch.dict(settings.PROVIDER_CONCURRENCY_LIMITS, {"openai": 5}), \
+            patch.object(settings, "LLAMACPP_NUM_REPLICAS", 3):
+        runner = BatchRunner(AsyncMock())
+        assert runner._semaphore_for("openai")._value == 5
+        assert runner._semaphore_for("llamacpp")._value == 3
+
+        runner = BatchRunner(AsyncMock(), concurrency_per_provider=2, provider_limits={"llamacpp": 1})
+        assert runner._semaphore_for("openai")._value == 2
+        assert runner._semaphore_for("llamacpp")._value == 1
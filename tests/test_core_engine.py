@@ -2,11 +2,15 @@
 # タイトル: MetaIntelligence Core Engine Tests
 # 役割: MetaIntelligenceの中核エンジンとその関連コンポーネントの動作を検証する。
 
+import json
+import time
+
 import pytest
 from unittest.mock import patch, AsyncMock, MagicMock
 from llm_api.core_engine.analyzer import AdaptiveComplexityAnalyzer, ComplexityRegime
 from llm_api.core_engine.engine import MetaIntelligenceEngine
 from llm_api.core_engine.pipelines.adaptive import AdaptivePipeline
+from llm_api.core_engine.pipelines.context import ExecutionContext
 from llm_api.providers.base import LLMProvider, EnhancedLLMProvider, ProviderCapability
 
 
@@ -79,6 +83,42 @@ class TestAdaptiveComplexityAnalyzer:
                 # pytestの実行結果に合わせて期待値を修正
                 assert score == pytest.approx(35.75)
 
+    def test_analysis_results_are_cached_per_prompt_and_mode(self):
+        """同じプロンプトとモードの再分析では、言語検出や解析を再実行しないこと"""
+        analyzer = AdaptiveComplexityAnalyzer(cache_size=2)
+        with patch.object(analyzer, '_get_spacy_model', return_value=None), \
+             patch.object(analyzer, '_detect_language', return_value='en') as mock_detect:
+            first = analyzer.analyze_complexity("Analyze and compare these two plans carefully")
+            second = analyzer.analyze_complexity("Analyze and compare these two plans carefully")
+            analyzer.analyze_complexity("Analyze and compare these two plans carefully", mode='parallel')
+        assert first == second
+        assert mock_detect.call_count == 2
+        assert analyzer.cache_stats["hits"] == 1
+
+    def test_analyze_many_groups_by_language_and_uses_pipe(self):
+        """analyze_manyが言語ごとにnlp.pipeで一括解析し、入力順に結果を返すこと"""
+        analyzer = AdaptiveComplexityAnalyzer()
+        fake_doc = MagicMock()
+        fake_doc.__len__.return_value = 10
+        nlp = MagicMock()
+        nlp.pipe.side_effect = lambda texts, n_process, batch_size: [fake_doc for _ in texts]
+        long_en = "Please analyze the following long English prompt about planning"
+        long_ja = "次の計画について詳しく分析し、比較した上で評価してください。お願いします。"
+        prompts = [long_en, "short", long_ja, long_en]
+
+        with patch.object(analyzer, '_detect_language', side_effect=lambda p: 'ja' if p == long_ja else 'en'), \
+             patch.object(analyzer, '_get_spacy_model', side_effect=lambda lang: nlp if lang == 'en' else None), \
+             patch.object(analyzer, '_nlp_enhanced_analysis', return_value=80.0):
+            results = analyzer.analyze_many(prompts, n_process=2, batch_size=16)
+
+        assert len(results) == 4 and results[0] == results[3]
+        # 重複を除いた英語の長文のみがpipeに渡される
+        nlp.pipe.assert_called_once_with([long_en], n_process=2, batch_size=16)
+        nlp.assert_not_called()
+        assert results[0][0] == pytest.approx(80.0 * 0.5 + min(len(long_en) / 500.0, 1.0) * 25)
+        # 結果はキャッシュされ、以降の個別分析で再利用される
+        assert analyzer.analyze_complexity(long_ja) == results[2]
+
 class TestMetaIntelligenceEngine:
     """Tests for the main MetaIntelligenceEngine class and its dispatch logic."""
 
@@ -111,3 +151,474 @@ class TestMetaIntelligenceEngine:
             await engine_system.solve_problem(prompt, mode='speculative_thought')
             mock_speculative.assert_called_once()
 
+    @pytest.mark.asyncio
+    async def test_solve_problem_streams_final_solution(self, engine_system):
+        """逐次生成に対応しないパイプラインでは、最終解がstream_callbackへ一括で通知されること"""
+        chunks = []
+        async def on_chunk(chunk: str) -> None:
+            chunks.append(chunk)
+
+        with patch.object(engine_system.parallel_pipeline, 'execute') as mock_parallel:
+            mock_parallel.return_value = {"success": True, "final_solution": "Parallel"}
+            await engine_system.solve_problem("test prompt", mode='parallel', stream_callback=on_chunk)
+
+        assert chunks == ["Parallel"]
+
+    @pytest.mark.asyncio
+    async def test_refinement_stream_failing_midway_is_not_cached(self):
+        """改善後の解の出力が途中で失敗した場合、不完全な解を成功として返さず、キャッシュ対象にもしないこと"""
+        from llm_api.core_engine.logic.finalization import finalize_and_learn
+
+        class _DroppingProvider(LLMProvider):
+            def get_capabilities(self):
+                return {ProviderCapability.STREAMING: True}
+
+            def should_use_enhancement(self, prompt, **kwargs):
+                return False
+
+            async def standard_call(self, prompt, system_prompt="", **kwargs):
+                return {"text": "unused", "error": None}
+
+            async def stream(self, prompt, system_prompt="", **kwargs):
+                yield "Partial"
+                raise ConnectionError("connection dropped")
+
+        chunks = []
+        async def on_chunk(chunk: str) -> None:
+            chunks.append(chunk)
+
+        result = await finalize_and_learn(
+            MagicMock(), _DroppingProvider(), {}, {"solution": "Draft answer"}, "prompt", "",
+            ComplexityRegime.MEDIUM, ComplexityRegime.MEDIUM, 0.5, None, "adaptive", stream_callback=on_chunk
+        )
+
+        assert chunks == ["Partial"]
+        assert result["final_solution"] == "Partial"
+        assert result["success"] is False and "connection dropped" in result["error"]
+        assert not MetaIntelligenceEngine._is_cacheable(result)
+
+
+
+class TestEngineRegistry:
+    """EngineRegistryによるエンジン再利用のテスト"""
+
+    def test_reuses_engine_for_same_provider_and_params(self, mock_standard_provider, tmp_path):
+        from llm_api.core_engine.learner import ComplexityLearner
+        from llm_api.core_engine.registry import EngineRegistry
+
+        registry = EngineRegistry(max_engines=2, learner=ComplexityLearner(str(tmp_path / "learning.json")))
+        first = registry.get_engine("mock", mock_standard_provider, {"model": "a", "temperature": 0.2})
+        second = registry.get_engine("mock", mock_standard_provider, {"temperature": 0.2, "model": "a"})
+        assert first is second
+        # 学習器はレジストリ内で共有され、投機的パイプラインも同じ適応型パイプラインを使う
+        assert first.adaptive_pipeline.learner is registry.learner
+        assert first.speculative_pipeline.adaptive_pipeline is first.adaptive_pipeline
+
+        other = registry.get_engine("mock", mock_standard_provider, {"model": "b"})
+        assert other is not first
+
+        # プロバイダーインスタンスが入れ替わった場合は再構築される
+        replaced_provider = MagicMock(spec=LLMProvider)
+        rebuilt = registry.get_engine("mock", replaced_provider, {"model": "a", "temperature": 0.2})
+        assert rebuilt is not first and rebuilt.provider is replaced_provider
+
+        assert registry.get_stats() == {"hits": 1, "misses": 3, "evictions": 0, "engines": 2}
+        assert registry.invalidate("other_provider") == 0
+        assert registry.invalidate("mock") == 2
+        assert registry.get_stats()["engines"] == 0
+
+
+class TestHighComplexityIntegration:
+    """高複雑性推論における部分解の統合方式のテスト"""
+
+    @staticmethod
+    def _staged(n):
+        return [{'sub_problem': f"sp{i}", 'solution': f"S{i}", 'error': None} for i in range(n)]
+
+    @pytest.mark.asyncio
+    async def test_tree_integration_merges_in_log_depth(self, mock_standard_provider):
+        import asyncio
+        from llm_api.core_engine.reasoning_strategies.high_complexity import _integrate_staged_solutions
+
+        in_flight, max_in_flight = 0, 0
+        async def fake_call(prompt, **kwargs):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            if prompt.startswith("Polish"):
+                return {'text': "polished", 'error': None}
+            return {'text': "merged", 'error': None}
+        mock_standard_provider.call.side_effect = fake_call
+
+        with patch.dict('llm_api.core_engine.reasoning_strategies.high_complexity.settings.PROVIDER_CONCURRENCY_LIMITS', {'mock_standard_provider': 4}):
+            result = await _integrate_staged_solutions(
+                mock_standard_provider, self._staged(8), "q", "", {}, mode="tree", fan_in=2
+            )
+
+        assert result == "polished"
+        # 8件の2分木統合は 4+2+1 = 7回の統合呼び出しと1回の仕上げ
+        assert mock_standard_provider.call.await_count == 8
+        assert max_in_flight == 4
+
+    @pytest.mark.asyncio
+    async def test_tree_integration_respects_fan_in_and_failures(self, mock_standard_provider):
+        from llm_api.core_engine.reasoning_strategies.high_complexity import _integrate_staged_solutions
+
+        prompts = []
+        async def fake_call(prompt, **kwargs):
+            prompts.append(prompt)
+            if prompt.startswith("Polish"):
+                return {'text': prompt, 'error': None}
+            return {'text': "", 'error': "merge failed"}
+        mock_standard_provider.call.side_effect = fake_call
+
+        result = await _integrate_staged_solutions(
+            mock_standard_provider, self._staged(5), "q", "", {}, mode="tree", fan_in=3
+        )
+        # 5件をfan_in=3で統合: [S0,S1,S2],[S3,S4] → 1グループ → 仕上げ
+        assert len(prompts) == 4
+        # 統合に失敗しても部分解は失われない
+        assert all(f"S{i}" in result for i in range(5))
+
+    @pytest.mark.asyncio
+    async def test_sequential_integration_is_still_available(self, mock_standard_provider):
+        from llm_api.core_engine.reasoning_strategies.high_complexity import _integrate_staged_solutions
+
+        mock_standard_provider.call.return_value = {'text': "merged", 'error': None}
+        result = await _integrate_staged_solutions(
+            mock_standard_provider, self._staged(4), "q", "", {}, mode="sequential"
+        )
+        assert result == "merged"
+        assert mock_standard_provider.call.await_count == 4
+        assert "Previous Integrated Result" in mock_standard_provider.call.await_args_list[0].kwargs['prompt']
+
+
+class TestHighComplexityDependencyScheduling:
+    """分解されたサブ問題の依存関係に基づくDAG実行のテスト"""
+
+    def test_build_dependency_graph_normalizes_and_breaks_cycles(self):
+        from llm_api.core_engine.reasoning_strategies.high_complexity import _build_dependency_graph
+
+        sub_problems, dependencies = _build_dependency_graph([
+            {"id": "a", "problem": "P1", "depends_on": []},
+            {"id": "b", "problem": "P2", "depends_on": ["a", "missing", "b"]},
+            "P3",
+            {"id": "d", "problem": "P4", "depends_on": ["e"]},
+            {"id": "e", "problem": "P5", "depends_on": ["d", "b"]},
+        ])
+        assert sub_problems == ["P1", "P2", "P3", "P4", "P5"]
+        # 不明な依存・自己依存は無視され、d<->e の循環は除去される（bへの依存は残る）
+        assert dependencies == [[], [0], [], [], [1]]
+
+    @pytest.mark.asyncio
+    async def test_dag_feeds_parent_solutions_and_runs_ready_nodes_in_parallel(self, mock_standard_provider):
+        import asyncio
+        from llm_api.core_engine.reasoning_strategies.high_complexity import _solve_decomposed_problems
+
+        started, prompts = [], {}
+        async def fake_call(prompt, **kwargs):
+            name = prompt.split('sub-problem: "')[1].split('"')[0]
+            started.append(name)
+            prompts[name] = prompt
+            await asyncio.sleep(0.01)
+            return {'text': f"answer-{name}", 'error': None}
+        mock_standard_provider.call.side_effect = fake_call
+
+        with patch.dict('llm_api.core_engine.reasoning_strategies.high_complexity.settings.PROVIDER_CONCURRENCY_LIMITS', {'mock_standard_provider': 4}):
+            results = await _solve_decomposed_problems(
+                mock_standard_provider, ["A", "B", "C"], "q", "", {}, dependencies=[[], [], [0, 1]]
+            )
+
+        assert [r['solution'] for r in results] == ["answer-A", "answer-B", "answer-C"]
+        assert set(started[:2]) == {"A", "B"} and started[2] == "C"
+        assert "answer-A" in prompts["C"] and "answer-B" in prompts["C"]
+        assert "Prerequisite" not in prompts["A"]
+        assert results[2]['depends_on'] == [0, 1]
+
+
+class TestResponseCache:
+    """solve_problemの応答キャッシュのテスト"""
+
+    def test_exact_tier_normalizes_prompt_and_separates_contexts(self, tmp_path):
+        from llm_api.core_engine.response_cache import ResponseCache
+
+        cache = ResponseCache(persist_path="", max_entries=2, ttl=0)
+        key = cache.make_key("What is  AI?\n", {"mode": "efficient", "provider": "ollama"})
+        cache.put(key, {"success": True, "final_solution": "answer"})
+
+        hit = cache.get(cache.make_key("What is AI?", {"provider": "ollama", "mode": "efficient"}))
+        assert hit["final_solution"] == "answer" and hit["cache"]["hit"] == "exact"
+        assert cache.get(cache.make_key("What is AI?", {"mode": "parallel", "provider": "ollama"})) is None
+        # シリアライズできない条件（ステアリングベクトル等）はキャッシュ対象外
+        assert cache.make_key("What is AI?", {"steering_vector": object()}) is None
+
+        for i in range(2):
+            cache.put(cache.make_key(f"q{i}", {}), {"final_solution": str(i)})
+        assert cache.get(key) is None  # LRUで追い出されている
+        stats = cache.get_stats()
+        assert stats["exact_hits"] == 1 and stats["misses"] == 2 and stats["evictions"] == 1
+
+    def test_non_generation_options_in_model_kwargs_do_not_change_key(self):
+        from llm_api.core_engine.response_cache import ResponseCache
+
+        cache = ResponseCache(persist_path="", ttl=0)
+        plain = cache.make_key("q", {"mode": "adaptive", "model_kwargs": {"model": "m", "temperature": 0.2}})
+        with_flags = cache.make_key("q", {"mode": "adaptive", "model_kwargs": {
+            "model": "m", "temperature": 0.2, "feedback": True, "use_response_cache": True,
+        }})
+        assert with_flags == plain
+        assert cache.make_key("q", {"mode": "adaptive", "model_kwargs": {"model": "m", "temperature": 0.9}}) != plain
+
+    def test_persistent_entries_are_trimmed_to_limit(self, tmp_path):
+        from llm_api.core_engine.response_cache import ResponseCache
+
+        cache = ResponseCache(persist_path=str(tmp_path / "cache.sqlite3"), max_persistent_entries=2, ttl=0)
+        statements = []
+        cache._db.set_trace_callback(statements.append)
+        for i in range(2):
+            cache.put(cache.make_key(f"q{i}", {}), {"final_solution": str(i)})
+        assert not any("COUNT(*)" in statement for statement in statements)
+
+        cache.put(cache.make_key("q2", {}), {"final_solution": "2"})
+        assert cache.get_stats()["persistent_entries"] == 2
+
+    def test_ttl_and_persistence(self, tmp_path):
+        from llm_api.core_engine.response_cache import ResponseCache
+
+        db_path = str(tmp_path / "cache.sqlite3")
+        cache = ResponseCache(persist_path=db_path, ttl=60)
+        key = cache.make_key("persist me", {"mode": "adaptive"})
+        cache.put(key, {"final_solution": "stored"})
+        cache.close()
+
+        reopened = ResponseCache(persist_path=db_path, ttl=60)
+        assert reopened.get(key)["final_solution"] == "stored"
+        with patch("llm_api.core_engine.response_cache.time.time", return_value=time.time() + 120):
+            assert reopened.get(key) is None
+        assert reopened.get_stats()["expired"] == 1
+        assert reopened.get_stats()["persistent_entries"] == 0
+
+    def test_semantic_tier_uses_similarity_threshold(self, tmp_path):
+        from llm_api.core_engine.response_cache import ResponseCache
+
+        vectors = {"how do i reset my password": [1.0, 0.0], "how can i reset my password": [0.99, 0.05],
+                   "what is the refund policy": [0.0, 1.0]}
+        cache = ResponseCache(persist_path=str(tmp_path / "c.sqlite3"), semantic=True,
+                              similarity_threshold=0.9, embed_fn=lambda text: vectors[text.lower()])
+        cache.put(cache.make_key("How do I reset my password", {}), {"final_solution": "Use the reset link."})
+
+        hit = cache.get(cache.make_key("How can I reset my password", {}))
+        assert hit["final_solution"] == "Use the reset link." and hit["cache"]["hit"] == "semantic"
+        assert hit["cache"]["similarity"] >= 0.9
+        assert cache.get(cache.make_key("What is the refund policy", {})) is None
+
+    @pytest.mark.asyncio
+    async def test_engine_reuses_cached_response(self, mock_enhanced_provider, tmp_path):
+        from llm_api.core_engine.response_cache import ResponseCache
+
+        cache = ResponseCache(persist_path="")
+        engine = MetaIntelligenceEngine(provider=mock_enhanced_provider, base_model_kwargs={"model": "m"},
+                                        response_cache=cache)
+        with patch.object(engine.parallel_pipeline, 'execute') as mock_parallel:
+            mock_parallel.return_value = {"success": True, "final_solution": "Parallel"}
+            first = await engine.solve_problem("cache me", mode='parallel')
+            chunks = []
+            async def on_chunk(chunk):
+                chunks.append(chunk)
+            second = await engine.solve_problem("cache me", mode='parallel', stream_callback=on_chunk)
+            await engine.solve_problem("cache me", mode='parallel', use_cache=False)
+
+        assert first["final_solution"] == second["final_solution"] == "Parallel"
+        assert second["cache"]["hit"] == "exact" and chunks == ["Parallel"]
+        assert mock_parallel.call_count == 2
+
+
+def _record_outcomes_in_subprocess(db_path: str, worker: int, count: int) -> None:
+    from llm_api.core_engine.learner import ComplexityLearner
+    learner = ComplexityLearner(db_path)
+    for i in range(count):
+        learner.record_outcome(f"worker {worker} prompt {i}", ComplexityRegime.HIGH)
+    learner.close()
+
+
+class TestComplexityLearner:
+    """SQLiteベースのComplexityLearnerのテスト"""
+
+    def test_full_prompt_keys_and_legacy_import(self, tmp_path):
+        from llm_api.core_engine.learner import ComplexityLearner
+
+        prefix = "x" * 100
+        legacy = tmp_path / "learning.json"
+        legacy.write_text(json.dumps({"legacy prompt": "high"}), encoding="utf-8")
+
+        learner = ComplexityLearner(str(legacy))
+        assert learner.storage_path == tmp_path / "learning.sqlite3"
+        assert learner.get_suggestion("legacy prompt") == ComplexityRegime.HIGH
+
+        learner.record_outcome(prefix + " first", ComplexityRegime.LOW)
+        learner.record_outcome(prefix + " second", ComplexityRegime.MEDIUM)
+        # 先頭100文字が同じでも別のプロンプトとして扱う
+        assert learner.get_suggestion(prefix + " first") == ComplexityRegime.LOW
+        assert learner.get_suggestion(prefix + " second") == ComplexityRegime.MEDIUM
+        assert learner.get_suggestion(prefix + " third") is None
+
+        # 別インスタンス（別プロセス相当）からも参照でき、JSONは再取り込みされない
+        legacy.write_text(json.dumps({"another": "low"}), encoding="utf-8")
+        other = ComplexityLearner(str(legacy))
+        assert other.get_suggestion(prefix + " second") == ComplexityRegime.MEDIUM
+        assert other.get_suggestion("another") is None
+        assert other.get_stats() == {"prefix": 1, "prompt": 2}
+
+    def test_concurrent_writers_from_multiple_processes(self, tmp_path):
+        import multiprocessing
+        from llm_api.core_engine.learner import ComplexityLearner
+
+        db_path = str(tmp_path / "learning.sqlite3")
+        ComplexityLearner(db_path).close()
+        ctx = multiprocessing.get_context("fork")
+        workers = [ctx.Process(target=_record_outcomes_in_subprocess, args=(db_path, w, 50)) for w in range(3)]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join(timeout=60)
+            assert p.exitcode == 0
+
+        learner = ComplexityLearner(db_path)
+        assert learner.get_stats() == {"prompt": 150}
+        assert learner.get_suggestion("worker 2 prompt 49") == ComplexityRegime.HIGH
+
+    def test_trim_keeps_newest_entries_without_counting_every_write(self, tmp_path, monkeypatch):
+        from llm_api.core_engine import learner as learner_module
+        from llm_api.core_engine.learner import ComplexityLearner
+
+        monkeypatch.setattr(learner_module.settings, "COMPLEXITY_LEARNER_MAX_ENTRIES", 3)
+        learner = ComplexityLearner(str(tmp_path / "l.sqlite3"))
+        statements = []
+        learner._db.set_trace_callback(statements.append)
+        for i in range(3):
+            learner.record_outcome(f"prompt {i}", ComplexityRegime.LOW)
+        # 同じプロンプトの更新は件数を増やさない
+        learner.record_outcome("prompt 0", ComplexityRegime.HIGH)
+        assert not any("COUNT(*)" in statement for statement in statements)
+
+        learner.record_outcome("prompt 3", ComplexityRegime.MEDIUM)
+        assert learner.get_stats() == {"prompt": 3}
+        assert learner.get_suggestion("prompt 1") is None
+        assert learner.get_suggestion("prompt 0") == ComplexityRegime.HIGH
+
+    def test_default_registry_does_not_open_learner_until_used(self, tmp_path):
+        from llm_api.core_engine import learner as learner_module
+        from llm_api.core_engine.registry import EngineRegistry
+
+        registry = EngineRegistry()
+        registry.clear()
+        assert registry._learner is None
+        assert not learner_module.STORAGE_FILE.with_suffix(".sqlite3").exists()
+        assert registry.learner.storage_path.parent == tmp_path
+
+    def test_nearest_neighbour_fallback(self, tmp_path):
+        from llm_api.core_engine.learner import ComplexityLearner
+
+        vectors = {"plan a product launch": [1.0, 0.0, 0.0], "design a launch plan for a product": [0.95, 0.1, 0.0],
+                   "what time is it": [0.0, 0.0, 1.0]}
+        learner = ComplexityLearner(str(tmp_path / "l.sqlite3"), semantic=True, similarity_threshold=0.9,
+                                    embed_fn=lambda text: vectors[text])
+        learner.record_outcome("plan a product launch", ComplexityRegime.HIGH)
+        assert learner.get_suggestion("design a launch plan for a product") == ComplexityRegime.HIGH
+        assert learner.get_suggestion("what time is it") is None
+
+
+class TestParallelPipelineRacing:
+    """ParallelPipelineのrace戦略のテスト"""
+
+    @staticmethod
+    def _pipeline(mock_standard_provider, delays, texts):
+        import asyncio
+        from llm_api.core_engine.pipelines.parallel import ParallelPipeline
+
+        adaptive = MagicMock()
+        cancelled = []
+
+        async def fake_execute(prompt, system_prompt, force_regime, **kwargs):
+            try:
+                await asyncio.sleep(delays[force_regime.value])
+            except asyncio.CancelledError:
+                cancelled.append(force_regime.value)
+                raise
+            return {"success": True, "final_solution": texts[force_regime.value],
+                    "v2_improvements": {"regime": force_regime.value}}
+        adaptive.execute.side_effect = fake_execute
+        adaptive.prepare_context = AsyncMock(return_value=ExecutionContext(
+            original_prompt="q", prompt="q", rag_source=None,
+            complexity_score=0.5, initial_regime=ComplexityRegime.MEDIUM
+        ))
+        return ParallelPipeline(mock_standard_provider, {}, shared_adaptive_pipeline=adaptive), cancelled
+
+    @pytest.mark.asyncio
+    async def test_race_accepts_first_candidate_passing_gate_and_cancels_others(self, mock_standard_provider):
+        texts = {"low": "too short", "medium": "m" * 80, "high": "h" * 500}
+        pipeline, cancelled = self._pipeline(mock_standard_provider, {"low": 0.0, "medium": 0.05, "high": 5.0}, texts)
+
+        with patch('llm_api.core_engine.pipelines.parallel.settings.PROVIDER_CONCURRENCY_LIMITS',
+                   {"mock_standard_provider": 3}):
+            result = await pipeline.execute("q", strategy="race")
+
+        # LOWは品質ゲート（最小文字数）を通過せず、MEDIUMが採用されHIGHはキャンセルされる
+        assert result["final_solution"] == texts["medium"]
+        assert result["thought_process"]["reasoning_approach"] == "parallel_race"
+        assert result["thought_process"]["cancelled_regimes"] == ["高複雑性"]
+        assert cancelled == ["high"]
+
+    @pytest.mark.asyncio
+    async def test_best_of_waits_for_all_regimes_with_provider_concurrency(self, mock_standard_provider):
+        texts = {"low": "l" * 60, "medium": "m" * 300, "high": "h" * 3000}
+        pipeline, cancelled = self._pipeline(mock_standard_provider, {"low": 0.0, "medium": 0.01, "high": 0.02}, texts)
+
+        with patch('llm_api.core_engine.pipelines.parallel.settings.PROVIDER_CONCURRENCY_LIMITS',
+                   {"mock_standard_provider": 1}):
+            result = await pipeline.execute("q", strategy="best_of")
+
+        assert result["final_solution"] == texts["medium"]
+        assert result["v2_improvements"]["regimes_tested"] == 3
+        assert cancelled == []
+
+
+class TestParallelPipelineSharedContext:
+    """ParallelPipelineの分岐間で実行コンテキストを共有するテスト"""
+
+    @pytest.mark.asyncio
+    async def test_branches_share_analysis_and_side_effects_run_once(self, mock_standard_provider, tmp_path):
+        from llm_api.core_engine.learner import ComplexityLearner
+        from llm_api.core_engine.pipelines.parallel import ParallelPipeline
+
+        learner = ComplexityLearner(storage_path=str(tmp_path / "learning.sqlite3"))
+        adaptive = AdaptivePipeline(mock_standard_provider, {}, learner=learner)
+        consolidation_engine = MagicMock()
+        adaptive.set_consolidation_engine(consolidation_engine)
+        mock_standard_provider.call.return_value = {"text": "refined " * 20}
+        seen_prompts = []
+
+        async def fake_reasoning_loop(**kwargs):
+            seen_prompts.append((kwargs["current_prompt"], kwargs["original_prompt"]))
+            return {"solution": "s" * 100, "reasoning_approach": "test"}, kwargs["initial_regime"]
+
+        with patch.object(adaptive.complexity_analyzer, 'analyze_complexity',
+                          return_value=(0.4, ComplexityRegime.LOW)) as analyze, \
+             patch('llm_api.core_engine.pipelines.adaptive.self_adjustment.run_reasoning_loop',
+                   side_effect=fake_reasoning_loop), \
+             patch.object(learner, 'record_outcome', wraps=learner.record_outcome) as record_outcome:
+            pipeline = ParallelPipeline(mock_standard_provider, {}, shared_adaptive_pipeline=adaptive)
+            result = await pipeline.execute("question", strategy="best_of")
+
+        assert result["success"] is True
+        assert result["v2_improvements"]["regimes_tested"] == 3
+        # 複雑性分析はリクエストにつき一度だけ、各分岐は元のプロンプトを保持する
+        analyze.assert_called_once_with("question", mode='parallel')
+        assert seen_prompts == [("question", "question")] * 3
+        # 記憶統合と学習の記録は採用された解について一度だけ行われる
+        consolidation_engine.enqueue.assert_called_once()
+        selected = ComplexityRegime(result["v2_improvements"]["selected_regime"])
+        record_outcome.assert_called_once_with("question", selected)
+        learner.close()
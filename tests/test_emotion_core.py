@@ -0,0 +1,412 @@
+# /tests/test_emotion_core.py
+# タイトル: Emotion Core Tests
+# 役割: SAEの遅延ロード、感情空間の構築とマッピング、それを用いた感情監視・ステアリングベクトルの計算結果を検証する。
+
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import json
+
+import pytest
+import torch
+
+from llm_api.emotion_core.emotion_space import EmotionSpace
+from llm_api.emotion_core.sae_manager import SAEManager
+from llm_api.emotion_core.monitoring_module import EmotionMonitor
+from llm_api.emotion_core.steering_manager import EmotionSteeringManager
+from llm_api.emotion_core.types import EmotionCategory
+
+D_SAE = 64
+D_MODEL = 8
+
+
+@pytest.fixture
+def sae_manager():
+    """小さな次元を持つSAEManagerの代替"""
+    manager = MagicMock()
+    manager.device = "cpu"
+    manager.feature_dim = D_SAE
+    manager.known_dims = (D_MODEL, D_SAE)
+    manager.model_dim = D_MODEL
+    manager.release = "test-release"
+    manager.sae_id = "layer_0"
+    manager.identity = "test-release/layer_0"
+    manager.decoder_weights = torch.randn(D_MODEL, D_SAE)
+    return manager
+
+
+@pytest.fixture
+def emotion_space(sae_manager):
+    space = EmotionSpace(None, sae_manager)
+    space.emotion_to_features = {"joy": [1, 3, 5], "interest": [2, 3, 10, 999], "not_an_emotion": [4]}
+    return space
+
+
+@pytest.fixture
+def sae_weights(tmp_path):
+    """Gemma Scope形式の小さなSAE重みファイル（float16）"""
+    from safetensors.torch import save_file
+
+    tensors = {
+        "W_enc": torch.randn(D_MODEL, D_SAE),
+        "W_dec": torch.randn(D_SAE, D_MODEL),
+        "b_enc": torch.zeros(D_SAE),
+        "b_dec": torch.zeros(D_MODEL),
+        "threshold": torch.full((D_SAE,), 0.5),
+    }
+    path = tmp_path / "sae.safetensors"
+    save_file({key: value.half() for key, value in tensors.items()}, str(path))
+    return str(path), {key: value.half().float() for key, value in tensors.items()}
+
+
+class TestSAEManager:
+
+    def test_local_weights_are_loaded_on_first_use(self, sae_weights):
+        path, tensors = sae_weights
+        manager = SAEManager("release", "sae", weights_path=path)
+
+        # 次元はファイルのヘッダーから取得し、重みはまだ読み込まない
+        assert (manager.model_dim, manager.feature_dim) == (D_MODEL, D_SAE)
+        assert not manager.is_loaded
+
+        hidden = torch.randn(2, 3, D_MODEL)
+        features = manager.extract_features(hidden)
+
+        assert manager.is_loaded
+        assert features.dtype == torch.float32
+        pre_acts = hidden.half().float() @ tensors["W_enc"] + tensors["b_enc"]
+        expected = torch.relu(pre_acts) * (pre_acts > 0.5)
+        assert torch.allclose(features, expected, atol=0.05)
+        # デコーダーの重みは (d_model, d_sae) のビューとして保存時の型のまま返す
+        decoder = manager.decoder_weights
+        assert decoder.shape == (D_MODEL, D_SAE)
+        assert decoder.dtype == torch.float16
+        assert decoder.data_ptr() == manager.decoder_weights.data_ptr()
+
+    def test_sparse_features_keep_top_k_per_token(self, sae_weights):
+        path, _ = sae_weights
+        manager = SAEManager("release", "sae", weights_path=path)
+        hidden = torch.randn(2, 5, D_MODEL)
+
+        sparse = manager.extract_sparse_features(hidden, k=4, chunk_size=3)
+
+        assert sparse.indices.shape == sparse.values.shape == (2, 5, 4)
+        assert sparse.shape == (2, 5, D_SAE)
+        dense = manager.extract_features(hidden)
+        assert torch.allclose(sparse.values, dense.topk(4, dim=-1).values)
+        assert torch.allclose(sparse.to_dense().gather(-1, sparse.indices), sparse.values)
+        assert torch.equal(sparse.to_csr().to_dense(), sparse.to_dense().reshape(10, D_SAE))
+
+    def test_dtype_conversion(self, sae_weights):
+        path, _ = sae_weights
+        manager = SAEManager("release", "sae", weights_path=path, dtype="bfloat16")
+
+        assert manager.decoder_weights.dtype == torch.bfloat16
+        assert manager.extract_features(torch.randn(1, D_MODEL)).shape == (1, D_SAE)
+        with pytest.raises(ValueError):
+            SAEManager("release", "sae", dtype="int8")
+
+    def test_missing_weights_file_does_not_load_at_construction(self, tmp_path):
+        manager = SAEManager("release", "sae", weights_path=str(tmp_path / "missing.safetensors"))
+
+        assert not manager.is_loaded
+        assert manager.get_model_info()["model_loaded"] is False
+
+
+class _WordEngine:
+    """単語ごとに固定の隠れ状態を返すLLMエンジンの代替"""
+
+    def __init__(self, batched: bool = True):
+        generator = torch.Generator().manual_seed(0)
+        self.embeddings = {}
+        self.generator = generator
+        self.batch_calls = []
+        if batched:
+            self.get_hidden_states_for_texts = self._batched
+
+    def _embedding(self, word):
+        if word not in self.embeddings:
+            self.embeddings[word] = torch.randn(D_MODEL, generator=self.generator)
+        return self.embeddings[word]
+
+    def get_hidden_states_for_text(self, text):
+        return self._embedding(text).reshape(1, 1, D_MODEL)
+
+    def _batched(self, texts):
+        self.batch_calls.append(list(texts))
+        return torch.stack([self._embedding(text) for text in texts]).unsqueeze(1)
+
+
+class TestBuildSpace:
+
+    @pytest.fixture
+    def concept_sets(self, tmp_path):
+        path = tmp_path / "concepts.json"
+        path.write_text(json.dumps({
+            "joy": ["joy", "happy", "glee", "delight"],
+            "interest": ["interest", "curiosity", "delight"],
+            "sadness": [],
+        }), encoding="utf-8")
+        return str(path)
+
+    def _space(self, sae_weights, engine):
+        manager = SAEManager("release", "sae", weights_path=sae_weights[0])
+        return EmotionSpace(engine, manager)
+
+    def test_vocabulary_is_extracted_in_batches(self, sae_weights, concept_sets):
+        engine = _WordEngine()
+        space = self._space(sae_weights, engine)
+
+        assert space.build_space(concept_sets, batch_size=4, similarity_threshold=-1.0)
+
+        # 重複を除いた6語を4語ずつ抽出する
+        assert engine.batch_calls == [["joy", "happy", "glee", "delight"], ["interest", "curiosity"]]
+        assert set(space.emotion_to_features) == {"joy", "interest"}
+        assert space.get_mapping_statistics()["validation_stats"] == {"successful_mappings": 2, "failed_mappings": 1}
+
+        # 逐次取得のエンジンでも同じマッピングになる
+        sequential = self._space(sae_weights, _WordEngine(batched=False))
+        sequential.llm_engine.embeddings = engine.embeddings
+        assert sequential.build_space(concept_sets, batch_size=4, similarity_threshold=-1.0)
+        assert sequential.emotion_to_features == space.emotion_to_features
+
+    def test_threshold_limits_features_to_label(self, sae_weights, concept_sets):
+        engine = _WordEngine()
+        space = self._space(sae_weights, engine)
+
+        assert space.build_space(concept_sets, similarity_threshold=1.1)
+
+        label_features = space.sae_manager.extract_features(engine.embeddings["joy"].unsqueeze(0))
+        assert space.emotion_to_features["joy"] == label_features.flatten().nonzero().flatten().tolist()
+
+    def test_build_resumes_from_checkpoint(self, sae_weights, concept_sets, tmp_path):
+        checkpoint_dir = str(tmp_path / "checkpoints")
+        engine = _WordEngine()
+        first = self._space(sae_weights, engine)
+        assert first.build_space(concept_sets, batch_size=4, similarity_threshold=-1.0, checkpoint_dir=checkpoint_dir)
+
+        resumed_engine = _WordEngine()
+        resumed = self._space(sae_weights, resumed_engine)
+        assert resumed.build_space(concept_sets, batch_size=4, similarity_threshold=-1.0, checkpoint_dir=checkpoint_dir)
+
+        assert resumed_engine.batch_calls == []
+        assert resumed.emotion_to_features == first.emotion_to_features
+
+
+class TestMappingFiles:
+
+    def _built_space(self, sae_weights, concept_sets):
+        space = EmotionSpace(_WordEngine(), SAEManager("release", "sae", weights_path=sae_weights[0]))
+        assert space.build_space(concept_sets, similarity_threshold=-1.0)
+        return space
+
+    @pytest.fixture
+    def concept_sets(self, tmp_path):
+        path = tmp_path / "concepts.json"
+        path.write_text(json.dumps({"joy": ["joy", "happy", "glee"], "interest": ["interest", "curiosity"]}), encoding="utf-8")
+        return str(path)
+
+    def test_binary_mapping_round_trip_and_word_feature_reuse(self, sae_weights, concept_sets, tmp_path):
+        built = self._built_space(sae_weights, concept_sets)
+        path = str(tmp_path / "mapping.safetensors")
+        assert built.save_mapping(path)
+
+        loaded = EmotionSpace(None, SAEManager("release", "sae", weights_path=sae_weights[0]))
+        assert loaded.load_mapping(path)
+        # SAEの重みを読み込まずにロードでき、マッピングは感情×特徴行列から復元される
+        assert not loaded.sae_manager.is_loaded
+        assert loaded.emotion_categories == built.emotion_categories
+        assert loaded.mapping_fingerprint() == built.mapping_fingerprint()
+        assert loaded.emotion_to_features == built.emotion_to_features
+
+        # 再構築では保存された単語の特徴を再利用する
+        engine = _WordEngine()
+        rebuilt = EmotionSpace(engine, SAEManager("release", "sae", weights_path=sae_weights[0]))
+        assert rebuilt.load_word_features(path) == 5
+        assert rebuilt.build_space(concept_sets, similarity_threshold=-1.0)
+        assert engine.batch_calls == []
+        assert rebuilt.emotion_to_features == built.emotion_to_features
+
+    def test_fingerprint_follows_rebuilt_mapping(self, sae_weights, concept_sets, tmp_path):
+        space = self._built_space(sae_weights, concept_sets)
+        before = space.mapping_fingerprint()
+
+        other_sets = tmp_path / "other_concepts.json"
+        other_sets.write_text(json.dumps({"sadness": ["sadness", "grief"]}), encoding="utf-8")
+        assert space.build_space(str(other_sets), similarity_threshold=-1.0)
+
+        expected = EmotionSpace(None, space.sae_manager)
+        expected.emotion_to_features = dict(space.emotion_to_features)
+        assert space.mapping_fingerprint() != before
+        assert space.mapping_fingerprint() == expected.mapping_fingerprint()
+
+    def test_binary_mapping_for_another_sae_is_rejected(self, sae_weights, concept_sets, tmp_path):
+        path = str(tmp_path / "mapping.safetensors")
+        self._built_space(sae_weights, concept_sets).save_mapping(path)
+
+        other = EmotionSpace(None, SAEManager("release", "other", weights_path=sae_weights[0]))
+        assert not other.load_mapping(path)
+        assert other.load_word_features(path) == 0
+
+    def test_mapping_loads_without_fetching_sae_and_is_checked_on_first_use(self, sae_weights, concept_sets, tmp_path, monkeypatch):
+        from llm_api.emotion_core import sae_manager as sae_module
+
+        path = str(tmp_path / "mapping.safetensors")
+        built = self._built_space(sae_weights, concept_sets)
+        # sae-lensからロードしたSAE（識別子に重みのハッシュを含まない）で作成したマッピングとして保存する
+        built.sae_manager._weights_digest = ""
+        built.save_mapping(path)
+        # sae-lensからロードするSAE（ローカルの重みは空のプレースホルダー）
+        placeholder = tmp_path / "placeholder.safetensors"
+        placeholder.touch()
+        fake_sae = MagicMock()
+        fake_sae.from_pretrained.side_effect = lambda **_: pytest.fail("SAE was fetched while loading the mapping")
+        monkeypatch.setattr(sae_module, "SAE_AVAILABLE", True)
+        monkeypatch.setattr(sae_module, "SAE", fake_sae)
+
+        loaded = EmotionSpace(None, SAEManager("release", "sae", weights_path=str(placeholder)))
+        assert loaded.load_mapping(path)
+        assert loaded.emotion_categories == built.emotion_categories
+        assert loaded.mapping_fingerprint() == built.mapping_fingerprint()
+
+        # SAEのロード後の初回参照で実際の次元数と照合し、範囲外の特徴IDを除外する
+        half = D_SAE // 2
+        fake_sae.from_pretrained.side_effect = None
+        fake_sae.from_pretrained.return_value = (MagicMock(cfg=SimpleNamespace(d_model=D_MODEL, d_sae=half)), None, None)
+        assert loaded.sae_manager.feature_dim == half
+        assert loaded.emotion_matrix.shape[1] == half
+        assert loaded.emotion_to_features == {
+            emotion: [f for f in features if f < half] for emotion, features in built.emotion_to_features.items()
+        }
+
+    def test_artifacts_for_replaced_weights_are_rejected(self, sae_weights, concept_sets, tmp_path):
+        from safetensors.torch import save_file
+
+        path = str(tmp_path / "mapping.safetensors")
+        checkpoint_dir = str(tmp_path / "checkpoints")
+        space = EmotionSpace(_WordEngine(), SAEManager("release", "sae", weights_path=sae_weights[0]))
+        assert space.build_space(concept_sets, similarity_threshold=-1.0, checkpoint_dir=checkpoint_dir)
+        space.save_mapping(path)
+
+        # 同じ名前・同じ形状で値だけが異なる重みに差し替える
+        replacement = str(tmp_path / "replacement.safetensors")
+        save_file({key: (value + 1.0).half() for key, value in sae_weights[1].items()}, replacement)
+        replaced = EmotionSpace(None, SAEManager("release", "sae", weights_path=replacement))
+
+        assert replaced.sae_manager.identity != space.sae_manager.identity
+        assert not replaced.sae_manager.is_loaded
+        assert not replaced.load_mapping(path)
+        assert replaced.load_word_features(path) == 0
+        assert replaced._load_word_feature_checkpoints(checkpoint_dir) == {}
+        # 同じ重みであれば別のパスでも同じSAEとして扱う
+        copy = tmp_path / "copy.safetensors"
+        copy.write_bytes(Path(sae_weights[0]).read_bytes())
+        assert SAEManager("release", "sae", weights_path=str(copy)).identity == space.sae_manager.identity
+
+    def test_json_mapping_written_by_save_mapping_can_be_loaded(self, sae_weights, concept_sets, tmp_path):
+        built = self._built_space(sae_weights, concept_sets)
+        path = str(tmp_path / "mapping.json")
+        assert built.save_mapping(path)
+
+        loaded = EmotionSpace(None, SAEManager("release", "sae", weights_path=sae_weights[0]))
+        assert loaded.load_mapping(path)
+        assert loaded.emotion_to_features == built.emotion_to_features
+
+
+class TestEmotionMatrix:
+
+    def test_mapping_is_compiled_into_sparse_matrix(self, emotion_space):
+        matrix = emotion_space.emotion_matrix
+
+        assert matrix.layout == torch.sparse_csr
+        assert matrix.shape == (2, D_SAE)
+        # 未知の感情と範囲外の特徴IDは除外される
+        assert emotion_space.emotion_categories == [EmotionCategory.JOY, EmotionCategory.INTEREST]
+        dense = matrix.to_dense()
+        assert dense[0].nonzero().flatten().tolist() == [1, 3, 5]
+        assert dense[1].nonzero().flatten().tolist() == [2, 3, 10]
+
+    def test_replacing_mapping_invalidates_matrix(self, emotion_space):
+        assert emotion_space.emotion_matrix.shape[0] == 2
+        emotion_space.emotion_to_features = {"sadness": [0]}
+        assert emotion_space.emotion_categories == [EmotionCategory.SADNESS]
+
+
+class TestEmotionMonitor:
+
+    def test_score_emotions_matches_per_emotion_sum_for_batched_input(self, sae_manager, emotion_space):
+        monitor = EmotionMonitor(sae_manager, emotion_space)
+        features = torch.rand(2, 5, D_SAE)
+
+        scores = monitor.score_emotions(features)
+
+        assert scores.shape == (2, 5, 2)
+        assert torch.allclose(scores[..., 0], features[..., [1, 3, 5]].sum(-1))
+        assert torch.allclose(scores[..., 1], features[..., [2, 3, 10]].sum(-1))
+        assert monitor.score_emotions(features[0, 0]).shape == (2,)
+
+    def test_sparse_features_give_same_scores_and_feature_ids_as_dense(self, sae_manager, emotion_space):
+        from llm_api.emotion_core.sae_manager import SparseFeatures
+
+        monitor = EmotionMonitor(sae_manager, emotion_space)
+        dense = torch.relu(torch.randn(2, 5, D_SAE))
+        values, indices = dense.topk(6, dim=-1)
+        sparse = SparseFeatures(indices=indices, values=values, feature_dim=D_SAE)
+        truncated = sparse.to_dense()
+
+        assert torch.allclose(monitor.score_emotions(sparse), monitor.score_emotions(truncated), atol=1e-6)
+        assert monitor.calculate_interest_score(sparse) == pytest.approx(monitor.calculate_interest_score(truncated))
+        assert emotion_space._extract_unique_feature_ids([sparse]) == emotion_space._extract_unique_feature_ids([truncated])
+
+    def test_analyze_emotions_from_features(self, sae_manager, emotion_space):
+        monitor = EmotionMonitor(sae_manager, emotion_space)
+        features = torch.zeros(1, 3, D_SAE)
+        features[..., 10] = 6.0
+        features[..., 1] = 1.0
+
+        result = monitor.analyze_emotions_from_features(features)
+
+        assert result.dominant_emotion == EmotionCategory.INTEREST
+        assert result.emotion_scores == {EmotionCategory.JOY: pytest.approx(1.0), EmotionCategory.INTEREST: pytest.approx(6.0)}
+        assert result.interest_score == pytest.approx(6.0)
+        assert monitor.calculate_interest_score(features) == pytest.approx(2.0)
+
+
+class TestSteeringVectorCache:
+
+    def test_vector_is_normalised_and_scaled_by_intensity(self, sae_manager, emotion_space):
+        steering = EmotionSteeringManager(sae_manager, emotion_space)
+
+        vector = steering.get_steering_vector(EmotionCategory.JOY, intensity=3.0)
+
+        expected = sae_manager.decoder_weights[:, [1, 3, 5]].sum(dim=1)
+        expected = expected / expected.norm() * 3.0
+        assert vector.dtype == torch.float32
+        assert torch.allclose(vector, expected, atol=1e-2)
+        assert steering.get_steering_vector(EmotionCategory.SADNESS) is None
+
+    def test_precomputed_vectors_are_reused_without_decoder_access(self, sae_manager, emotion_space, tmp_path):
+        cache_path = str(tmp_path / "steering.safetensors")
+        builder = EmotionSteeringManager(sae_manager, emotion_space, cache_path=cache_path)
+        assert builder.precompute_steering_vectors() == 2
+        expected = builder.get_steering_vector(EmotionCategory.INTEREST, intensity=2.0)
+
+        # 推論側: デコーダーの重みに触れずにキャッシュから読み込む
+        type(sae_manager).decoder_weights = property(lambda _: pytest.fail("decoder weights were loaded"))
+        try:
+            steering = EmotionSteeringManager(sae_manager, emotion_space, cache_path=cache_path)
+            assert torch.equal(steering.get_steering_vector(EmotionCategory.INTEREST, intensity=2.0), expected)
+        finally:
+            del type(sae_manager).decoder_weights
+
+    def test_cache_built_for_another_mapping_is_ignored(self, sae_manager, emotion_space, tmp_path):
+        cache_path = str(tmp_path / "steering.safetensors")
+        EmotionSteeringManager(sae_manager, emotion_space, cache_path=cache_path).precompute_steering_vectors()
+
+        emotion_space.emotion_to_features = {"joy": [7, 8]}
+        steering = EmotionSteeringManager(sae_manager, emotion_space, cache_path=cache_path)
+        vector = steering.get_steering_vector(EmotionCategory.JOY, intensity=1.0)
+
+        expected = sae_manager.decoder_weights[:, [7, 8]].sum(dim=1)
+        assert torch.allclose(vector, expected / expected.norm(), atol=1e-2)
@@ -0,0 +1,64 @@
+# /tests/test_import_time.py
+# タイトル: Import Time Regression Tests
+# 役割: `python -X importtime` の出力を解析し、CLIや軽量な経路の起動時に重い依存ライブラリが読み込まれないことを検証する。
+
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).parent.parent
+
+# 初回使用時まで読み込みを遅延させるべき重いトップレベルパッケージ
+HEAVY_MODULES = {
+    "torch", "spacy", "langchain", "langchain_community", "langchain_huggingface", "transformers",
+    "sentence_transformers", "sae_lens", "llama_cpp", "openai", "anthropic", "google.generativeai",
+}
+
+
+def _import_times(code: str) -> Dict[str, int]:
+    """新しいインタプリタで code を実行し、{モジュール名: 累積インポート時間(μs)} を返す。"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, timeout=300,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    times: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def _heavy_modules_loaded(times: Dict[str, int]) -> Dict[str, int]:
+    return {name: us for name, us in times.items() if name in HEAVY_MODULES}
+
+
+@pytest.mark.parametrize("code", [
+    "import llm_api",
+    "import cli.main",
+    "import cli.handler",
+    "import llm_api.core_engine",
+    "from llm_api.providers import get_provider; get_provider('ollama', enhanced=True)",
+])
+def test_startup_does_not_import_heavy_dependencies(code):
+    """CLIの起動・Ollamaプロバイダーの生成・コアエンジンのインポートで重い依存が読み込まれないこと"""
+    times = _import_times(code)
+    assert times, "importtimeの出力を取得できませんでした。"
+    assert _heavy_modules_loaded(times) == {}
+
+
+def test_provider_sdk_is_imported_only_for_requested_provider():
+    """特定のプロバイダーを要求しても、他のプロバイダーのSDKは読み込まれないこと"""
+    pytest.importorskip("openai")
+    times = _import_times(
+        "import os; os.environ['OPENAI_API_KEY'] = 'test'\n"
+        "from llm_api.providers import get_provider; get_provider('openai')"
+    )
+    assert "openai" in times
+    assert not {"anthropic", "google.generativeai", "llama_cpp", "torch"} & set(times)
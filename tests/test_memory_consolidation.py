@@ -0,0 +1,281 @@
+# /tests/test_memory_consolidation.py
+# タイトル: Memory Consolidation Tests
+# 役割: 記憶統合エンジンとバックグラウンド統合用ワーカープールの動作を検証する。
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from llm_api.memory_consolidation.engine import ConsolidationEngine
+from llm_api.memory_consolidation.graph_store import KnowledgeGraphStore
+from llm_api.memory_consolidation.worker_pool import ConsolidationWorkerPool, drain_all_consolidation_pools
+
+
+class _RecordingEngine:
+    """consolidate_memoriesに渡されたセッションを記録するだけのエンジン"""
+
+    def __init__(self, delay: float = 0.0):
+        self.calls = []
+        self.delay = delay
+
+    async def consolidate_memories(self, session_data):
+        await asyncio.sleep(self.delay)
+        sessions = session_data if isinstance(session_data, list) else [session_data]
+        self.calls.append([s["session_id"] for s in sessions])
+        return {"status": "completed", "results": [{"session_index": i, "success": True} for i in range(len(sessions))]}
+
+
+@pytest.fixture
+def graph_store(tmp_path):
+    store = KnowledgeGraphStore(str(tmp_path / "graph.sqlite3"))
+    yield store
+    store.close()
+
+
+def _session(session_id: str, novelty: float):
+    return {"session_id": session_id, "prompt": "p", "solution": "s", "novelty_score": novelty}
+
+
+class TestConsolidationWorkerPool:
+
+    @pytest.mark.asyncio
+    async def test_processes_sessions_in_novelty_order_and_drains(self):
+        engine = _RecordingEngine()
+        pool = ConsolidationWorkerPool(engine, num_workers=1, max_queue_size=10)
+
+        for session_id, novelty in [("a", 45.0), ("b", 90.0), ("c", 60.0)]:
+            assert pool.submit(_session(session_id, novelty))
+        # 新規性が閾値未満のセッションは待ち行列に入らない
+        assert pool.submit(_session("low", 10.0)) is False
+
+        stats = await pool.drain(timeout=5)
+
+        assert engine.calls == [["b"], ["c"], ["a"]]
+        assert stats["processed"] == 3
+        assert stats["skipped"] == 1
+        assert stats["queue_depth"] == 0
+        # 停止後の投入は受け付けない
+        assert pool.submit(_session("late", 80.0)) is False
+        assert pool.get_stats()["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_drop_policy_keeps_most_novel_sessions(self):
+        engine = _RecordingEngine()
+        pool = ConsolidationWorkerPool(engine, num_workers=1, max_queue_size=2, policy="drop")
+
+        assert pool.submit(_session("a", 50.0))
+        assert pool.submit(_session("b", 70.0))
+        # 満杯: より新規性の低いセッションは破棄され、高いセッションは最も低い要素と入れ替わる
+        assert pool.submit(_session("c", 45.0)) is False
+        assert pool.submit(_session("d", 95.0))
+
+        stats = await pool.drain(timeout=5)
+
+        assert engine.calls == [["d"], ["b"]]
+        assert stats["dropped"] == 2
+        assert stats["max_queue_depth"] == 2
+
+    @pytest.mark.asyncio
+    async def test_coalesce_policy_merges_low_novelty_sessions(self):
+        engine = _RecordingEngine()
+        pool = ConsolidationWorkerPool(engine, num_workers=1, max_queue_size=2, policy="coalesce", max_coalesce=3)
+
+        for session_id, novelty in [("a", 80.0), ("b", 50.0), ("c", 45.0), ("d", 41.0), ("e", 42.0)]:
+            pool.submit(_session(session_id, novelty))
+
+        stats = await pool.drain(timeout=5)
+
+        # 最も優先度の低い要素に上限(3件)までまとめ、それを超えた分は破棄する
+        assert engine.calls == [["a"], ["b", "c", "d"]]
+        assert stats["coalesced"] == 2
+        assert stats["dropped"] == 1
+        assert stats["processed"] == 4
+
+    @pytest.mark.asyncio
+    async def test_drain_timeout_abandons_remaining_sessions(self):
+        engine = _RecordingEngine(delay=5.0)
+        pool = ConsolidationWorkerPool(engine, num_workers=1, max_queue_size=10)
+        pool.submit(_session("a", 60.0))
+        pool.submit(_session("b", 50.0))
+        await asyncio.sleep(0)
+
+        stats = await pool.drain(timeout=0.05)
+
+        assert engine.calls == []
+        assert stats["abandoned"] == 2
+        assert stats["in_flight"] == 0
+
+
+class TestConsolidationEngineQueue:
+
+    @pytest.mark.asyncio
+    async def test_enqueue_runs_in_background_and_drains_on_shutdown(self, graph_store):
+        provider = MagicMock()
+        engine = ConsolidationEngine(provider, knowledge_graph=MagicMock(), graph_store=graph_store)
+        processed = []
+
+        async def fake_consolidate(session_data):
+            processed.append(session_data["session_id"])
+            return {"status": "completed", "results": [{"session_index": 0, "success": True}]}
+        engine.consolidate_memories = fake_consolidate  # type: ignore[method-assign]
+
+        assert engine.enqueue(_session("s1", 75.0))
+        assert engine.get_queue_statistics()["queue_depth"] == 1
+
+        await drain_all_consolidation_pools(timeout=5)
+
+        assert processed == ["s1"]
+        assert engine.get_queue_statistics()["processed"] == 1
+
+
+class TestBatchedExtraction:
+
+    @pytest.fixture(autouse=True)
+    def _store(self, graph_store):
+        self.graph_store = graph_store
+
+    def _engine(self, responses):
+        provider = MagicMock()
+        provider.call = AsyncMock(side_effect=responses)
+        return ConsolidationEngine(provider, knowledge_graph=MagicMock(), graph_store=self.graph_store), provider
+
+    @pytest.mark.asyncio
+    async def test_multiple_sessions_are_extracted_in_one_call(self):
+        batch_response = {"text": '```json\n{"0": [{"type": "fact", "content": "Fact about session zero.", "confidence": 0.9}], '
+                                  '"1": [{"type": "entity", "name": "X", "description": "d", "confidence": 0.8}], '
+                                  '"2": [{"type": "relation", "subject": "A", "predicate": "p", "object": "B"}]}\n```'}
+        engine, provider = self._engine([batch_response])
+
+        result = await engine.consolidate_memories([_session(f"s{i}", 60.0) for i in range(3)])
+
+        assert provider.call.await_count == 1
+        assert [r["success"] for r in result["results"]] == [True, True, True]
+        stats = engine.get_consolidation_statistics()
+        assert stats["successful_consolidations"] == 3
+        assert stats["total_entities_extracted"] == 1
+        assert stats["total_relations_extracted"] == 1
+        assert stats["batched_extraction_calls"] == 1
+        assert stats["fallback_extractions"] == 0
+
+    @pytest.mark.asyncio
+    async def test_missing_or_unparseable_results_fall_back_to_per_session_calls(self):
+        single = {"text": '[{"type": "fact", "content": "Recovered by per-session call.", "confidence": 0.7}]'}
+        # 1回目: 一括分析の応答にセッション1の結果が無い / 2回目: セッション1の個別分析
+        engine, provider = self._engine([
+            {"text": '{"0": [{"type": "fact", "content": "Fact about session zero.", "confidence": 0.9}]}'},
+            single,
+        ])
+
+        result = await engine.consolidate_memories([_session("s0", 60.0), _session("s1", 60.0)])
+
+        assert provider.call.await_count == 2
+        assert [r["success"] for r in result["results"]] == [True, True]
+        assert engine.get_consolidation_statistics()["fallback_extractions"] == 1
+
+        # 応答がJSONとして解釈できない場合は全セッションを個別に分析し直す
+        engine, provider = self._engine([{"text": "not json"}, single, single])
+        await engine.consolidate_memories([_session("s0", 60.0), _session("s1", 60.0)])
+        assert provider.call.await_count == 3
+
+    def test_pack_sessions_respects_token_budget(self):
+        from llm_api.memory_consolidation import logic
+
+        sessions = [{"prompt": "p" * 400, "solution": "s" * 400} for _ in range(5)]
+        per_session = logic.estimate_tokens(logic.format_session_block(sessions[0]))
+
+        batches = logic.pack_sessions(sessions, token_budget=per_session * 2, max_sessions=16)
+        assert batches == [[0, 1], [2, 3], [4]]
+        assert logic.pack_sessions(sessions, token_budget=10 ** 6, max_sessions=3) == [[0, 1, 2], [3, 4]]
+        # 単独で予算を超えるセッションも1件のバッチとして処理する
+        assert logic.pack_sessions(sessions[:2], token_budget=1, max_sessions=16) == [[0], [1]]
+
+
+class TestKnowledgeGraphStore:
+
+    def test_upsert_merges_duplicates_and_aggregates_confidence(self, graph_store):
+        graph_store.upsert_items([
+            {"type": "entity", "name": "Neural Network", "description": "", "category": "Technology", "confidence": 0.5},
+            {"type": "relation", "subject": "neural network", "predicate": "uses", "object": "Backpropagation", "confidence": 0.5},
+        ])
+        counts = graph_store.upsert_items([
+            {"type": "entity", "name": "  neural   network ", "description": "A layered model", "confidence": 0.6},
+            {"type": "relation", "subject": "Neural Network", "predicate": "uses", "object": "backpropagation", "confidence": 0.5},
+            {"type": "fact", "content": "Backpropagation computes gradients.", "confidence": 0.9},
+        ])
+
+        assert counts == {"entities": 1, "relations": 1, "facts": 1}
+        entity = graph_store.get_entity("NEURAL NETWORK")
+        assert entity["name"] == "Neural Network"
+        assert entity["description"] == "A layered model"
+        assert entity["category"] == "Technology"
+        assert entity["mention_count"] == 2
+        assert entity["confidence"] == pytest.approx(1 - 0.5 * 0.4)
+        # 関係性の端点もノードとして登録され、同じ関係性は1件にマージされる
+        assert graph_store.get_stats() == {"entities": 2, "relations": 1, "facts": 1}
+        relation = graph_store.neighbourhood(["backpropagation"])["relations"][0]
+        assert relation["mention_count"] == 2
+        assert relation["confidence"] == pytest.approx(0.75)
+
+    def test_neighbourhood_and_graph_context(self, graph_store):
+        graph_store.upsert_items([
+            {"type": "entity", "name": "Python", "description": "A programming language", "confidence": 0.9},
+            {"type": "entity", "name": "NumPy", "description": "Array library", "confidence": 0.8},
+            {"type": "relation", "subject": "NumPy", "predicate": "is written for", "object": "Python", "confidence": 0.9},
+            {"type": "relation", "subject": "SciPy", "predicate": "builds on", "object": "NumPy", "confidence": 0.8},
+        ])
+
+        one_hop = graph_store.neighbourhood(["python"], depth=1)
+        assert [(r["subject_key"], r["object_key"]) for r in one_hop["relations"]] == [("numpy", "python")]
+        two_hops = graph_store.neighbourhood(["python"], depth=2)
+        assert {e["name_key"] for e in two_hops["entities"]} == {"python", "numpy", "scipy"}
+
+        context = graph_store.graph_context("How do I use python for data analysis?")
+        assert "[ENTITY] Python: A programming language" in context
+        assert "[RELATION] NumPy is written for Python" in context
+        assert graph_store.graph_context("unrelated question") == ""
+
+    def test_find_entities_in_text_looks_up_candidate_ngrams(self, graph_store):
+        graph_store.upsert_items([
+            {"type": "entity", "name": "Data Analysis", "description": "", "confidence": 0.7},
+            {"type": "entity", "name": "Python", "description": "", "confidence": 0.9},
+            {"type": "entity", "name": "機械学習", "description": "", "confidence": 0.8},
+            {"type": "entity", "name": "R", "description": "", "confidence": 0.95},
+        ])
+
+        assert graph_store.find_entities_in_text("Use python for DATA  analysis?") == ["Python", "Data Analysis"]
+        # 空白で区切られない日本語も文字n-gramで照合する
+        assert graph_store.find_entities_in_text("Pythonで機械学習を始めたい") == ["Python", "機械学習"]
+        # 1文字の名前は誤一致が多いため対象にしない
+        assert graph_store.find_entities_in_text("R") == []
+
+        # 全件走査ではなく主キーの検索で照合する
+        plan = " ".join(str(row[-1]) for row in graph_store._db.execute(
+            "EXPLAIN QUERY PLAN SELECT name FROM entities WHERE name_key IN (SELECT value FROM json_each(?))", ("[]",)
+        ))
+        assert "SCAN entities" not in plan
+
+    @pytest.mark.asyncio
+    async def test_consolidation_persists_extracted_items(self, graph_store):
+        provider = MagicMock()
+        provider.call = AsyncMock(return_value={"text": '[{"type": "entity", "name": "Rust", "description": "Systems language", "confidence": 0.9},'
+                                                         ' {"type": "entity", "name": "Low", "description": "ignored", "confidence": 0.1}]'})
+        engine = ConsolidationEngine(provider, knowledge_graph=MagicMock(), graph_store=graph_store)
+
+        await engine.consolidate_memories(_session("s1", 60.0))
+
+        assert graph_store.get_entity("rust")["description"] == "Systems language"
+        # 信頼度が下限未満の項目は保存しない
+        assert graph_store.get_entity("low") is None
+
+    @pytest.mark.asyncio
+    async def test_rag_manager_adds_graph_context(self, graph_store):
+        from llm_api.rag.manager import RAGManager
+
+        graph_store.upsert_items([{"type": "entity", "name": "Luca", "description": "The assistant project", "confidence": 0.9}])
+        manager = RAGManager(provider=MagicMock(), graph_store=graph_store)
+
+        augmented = await manager.retrieve_and_augment("What is Luca?")
+
+        assert "[ENTITY] Luca: The assistant project" in augmented
+        assert "# 元の質問\nWhat is Luca?" in augmented
@@ -63,3 +63,213 @@ def test_provider_availability_check():
         importlib.reload(openai)
         provider = openai.OpenAIProvider()
         assert provider.is_available()
+
+@pytest.mark.asyncio
+async def test_ollama_shared_client_reuse_and_close():
+    """OllamaProviderが共有HTTPクライアントを再利用し、acloseで解放すること"""
+    from llm_api.providers.ollama import OllamaProvider
+
+    provider = OllamaProvider()
+    client1 = provider._get_client()
+    client2 = provider._get_client()
+    assert client1 is client2
+
+    await provider.aclose()
+    assert client1.is_closed
+
+    client3 = provider._get_client()
+    assert client3 is not client1
+    await provider.aclose()
+
+def test_ollama_client_of_finished_loop_is_closed():
+    """イベントループが変わった場合、終了したループのクライアントを閉じること"""
+    import asyncio
+    from llm_api.providers.ollama import OllamaProvider
+
+    provider = OllamaProvider()
+
+    async def get_client():
+        return provider._get_client()
+
+    async def replace_client():
+        client = provider._get_client()
+        await asyncio.sleep(0)
+        return client
+
+    old_client = asyncio.run(get_client())
+    assert not old_client.is_closed
+
+    new_client = asyncio.run(replace_client())
+    assert new_client is not old_client
+    assert old_client.is_closed
+    assert list(provider._clients.values()) == [new_client]
+    asyncio.run(provider.aclose())
+    assert new_client.is_closed
+
+@pytest.mark.asyncio
+async def test_close_all_providers_clears_cache():
+    """close_all_providersが全プロバイダーを閉じ、キャッシュをクリアすること"""
+    from llm_api.providers import close_all_providers
+
+    provider = get_provider("ollama", enhanced=False)
+    client = provider._get_client()
+    await close_all_providers()
+    assert client.is_closed
+    assert not _provider_cache
+
+@pytest.mark.asyncio
+async def test_ollama_stream_yields_chunks():
+    """OllamaProvider.streamがNDJSONの各行からトークンを逐次返すこと"""
+    import asyncio
+    import json
+    import httpx
+    from llm_api.providers.ollama import OllamaProvider
+
+    lines = [
+        {"message": {"content": "Hel"}, "done": False},
+        {"message": {"content": "lo"}, "done": False},
+        {"message": {"content": ""}, "done": True},
+    ]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert json.loads(request.content)["stream"] is True
+        body = "\n".join(json.dumps(line) for line in lines)
+        return httpx.Response(200, text=body)
+
+    provider = OllamaProvider()
+    provider._clients[asyncio.get_running_loop()] = httpx.AsyncClient(
+        base_url="http://ollama.test", transport=httpx.MockTransport(handler)
+    )
+
+    chunks = [chunk async for chunk in provider.stream("hi", model="test-model")]
+    assert chunks == ["Hel", "lo"]
+
+    collected = []
+    async def on_chunk(chunk: str) -> None:
+        collected.append(chunk)
+    result = await provider.call_streaming("hi", "", on_chunk, model="test-model")
+    assert result == {"text": "Hello", "error": None}
+    assert collected == ["Hel", "lo"]
+    await provider.aclose()
+
+@pytest.mark.asyncio
+async def test_enhanced_provider_stream_uses_optimized_params():
+    """拡張プロバイダーのstreamが、モードに応じて最適化したパラメータを標準プロバイダーに渡すこと"""
+    from llm_api.providers.enhanced_ollama_v2 import EnhancedOllamaProviderV2
+    from llm_api.providers.ollama import OllamaProvider
+
+    standard = OllamaProvider()
+    received = {}
+
+    async def fake_stream(prompt, system_prompt="", **kwargs):
+        received.update(kwargs)
+        yield "ok"
+
+    standard.stream = fake_stream
+    provider = EnhancedOllamaProviderV2(standard)
+
+    chunks = [chunk async for chunk in provider.stream("hi", mode="balanced")]
+    assert chunks == ["ok"]
+    assert received == provider._get_optimized_params("balanced", {"mode": "balanced"})
+    assert received["model"] == "gemma3:latest"
+    assert received["temperature"] == 0.5
+
+@pytest.mark.asyncio
+async def test_llamacpp_executor_runs_replicas_concurrently_in_priority_order():
+    """推論エグゼキューターがレプリカ数分だけ並列に実行し、キューを優先度順に処理することをテスト"""
+    import asyncio
+    import threading
+    import time
+    from llm_api.providers.llamacpp_executor import LlamaCppInferenceExecutor
+
+    executor = LlamaCppInferenceExecutor(replicas=["r0", "r1"])
+    active, peak = 0, 0
+    lock = threading.Lock()
+
+    def slow_job(replica):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.05)
+        with lock:
+            active -= 1
+        return replica
+
+    results = await asyncio.gather(*(executor.submit(slow_job) for _ in range(4)))
+    assert peak == 2
+    assert set(results) <= {"r0", "r1"}
+
+    # 単一レプリカでは、先行ジョブの実行中に積まれたジョブが優先度順に処理される
+    single = LlamaCppInferenceExecutor(replicas=["only"])
+    order = []
+    blocker = asyncio.ensure_future(single.submit(lambda r: time.sleep(0.05)))
+    await asyncio.sleep(0.01)
+    jobs = [
+        asyncio.ensure_future(single.submit(lambda r, n=name: order.append(n), priority=p))
+        for name, p in [("low", 5), ("high", 0), ("mid", 1)]
+    ]
+    await asyncio.gather(blocker, *jobs)
+    assert order == ["high", "mid", "low"]
+
+    metrics = executor.get_metrics()
+    assert metrics["replicas"] == 2
+    assert metrics["completed"] == 4
+    assert metrics["queue_depth"] == 0
+
+    await executor.shutdown()
+    await single.shutdown()
+    assert executor.get_metrics()["busy_replicas"] == 0
+
+
+@pytest.mark.asyncio
+async def test_memoized_call_reuses_deterministic_results(tmp_path):
+    """cacheable=True または temperature=0 の呼び出しのみメモ化され、SQLite層から再起動後も復元できること"""
+    from unittest.mock import AsyncMock
+    from llm_api.providers import memoization
+    from llm_api.providers.memoization import CallMemoizer, memoized_call
+
+    provider = MagicMock(spec=LLMProvider)
+    provider.provider_name = "ollama"
+    provider.default_model = "gemma3:latest"
+    provider.call = AsyncMock(return_value={"text": "yes", "error": None})
+    db_path = str(tmp_path / "calls.sqlite3")
+
+    with patch.object(memoization, "_call_memoizer", CallMemoizer(persist_path=db_path)):
+        assert (await memoized_call(provider, "trivial?", "", cacheable=True))["text"] == "yes"
+        assert (await memoized_call(provider, "trivial?", "", cacheable=True))["text"] == "yes"
+        await memoized_call(provider, "trivial?", "", temperature=0)
+        await memoized_call(provider, "trivial?", "", temperature=0)
+        # サンプリングを伴う呼び出しはメモ化しない
+        await memoized_call(provider, "trivial?", "", temperature=0.7)
+        await memoized_call(provider, "trivial?", "", temperature=0.7)
+        # モデルが異なればキーも異なる
+        await memoized_call(provider, "trivial?", "", cacheable=True, model="llama3")
+        assert provider.call.await_count == 5
+        assert memoization.get_call_memoizer().get_stats()["hits"] == 2
+
+    with patch.object(memoization, "_call_memoizer", CallMemoizer(persist_path=db_path)):
+        await memoized_call(provider, "trivial?", "", cacheable=True)
+        assert provider.call.await_count == 5
+
+
+def test_call_memoizer_expires_and_trims_persistent_entries(tmp_path):
+    """メモ化キャッシュのSQLite層が有効期間と件数の上限を守ること"""
+    import time
+    from llm_api.providers.memoization import CallMemoizer
+
+    db_path = str(tmp_path / "calls.sqlite3")
+    memoizer = CallMemoizer(persist_path=db_path, ttl=60, max_persistent_entries=2)
+    statements = []
+    memoizer._db.set_trace_callback(statements.append)
+    for i in range(3):
+        memoizer.put(f"k{i}", {"text": str(i)})
+    assert sum("COUNT(*)" in statement for statement in statements) == 1
+    assert memoizer._db.execute("SELECT key FROM llm_calls ORDER BY key").fetchall() == [("k1",), ("k2",)]
+
+    reopened = CallMemoizer(persist_path=db_path, ttl=60, max_persistent_entries=2)
+    assert reopened.get("k2") == {"text": "2"}
+    with patch("llm_api.providers.memoization.time.time", return_value=time.time() + 120):
+        assert reopened.get("k1") is None
+    assert reopened.get_stats()["expired"] == 1
+    assert reopened._db.execute("SELECT COUNT(*) FROM llm_calls").fetchone()[0] == 1
@@ -3,10 +3,12 @@
 # 役割: ナレッジベース、リトリーバー、RAGマネージャーの動作を検証する。
 
 import pytest
+import time
 from unittest.mock import patch, MagicMock, AsyncMock
 
 # テスト対象モジュール
-from llm_api.rag.knowledge_base import KnowledgeBase
+from llm_api.rag import knowledge_base as kb_module
+from llm_api.rag.knowledge_base import KnowledgeBase, clear_knowledge_base_cache
 from llm_api.rag.retriever import Retriever
 from llm_api.rag.manager import RAGManager
 from llm_api.providers.base import LLMProvider
@@ -18,6 +20,15 @@ def mock_provider() -> LLMProvider:
     provider.call = AsyncMock()
     return provider
 
+@pytest.fixture(autouse=True)
+def isolated_kb_cache(tmp_path, monkeypatch):
+    """プロセス内キャッシュを空にし、インデックスの保存先を一時ディレクトリに向けるフィクスチャ"""
+    monkeypatch.setattr(kb_module, "_embeddings_cache", {})
+    monkeypatch.setattr(kb_module.settings, "RAG_INDEX_CACHE_DIR", str(tmp_path / "rag_index"))
+    clear_knowledge_base_cache()
+    yield
+    clear_knowledge_base_cache()
+
 @pytest.fixture
 def temp_kb_file(tmp_path):
     """テスト用のナレッジベースファイルを作成するフィクスチャ"""
@@ -55,6 +66,64 @@ class TestKnowledgeBase:
         assert retriever == "retriever_instance"
         kb.vector_store.as_retriever.assert_called_with(search_kwargs={'k': 3})
 
+    @patch('llm_api.rag.knowledge_base.HuggingFaceEmbeddings')
+    def test_index_is_persisted_and_reused(self, mock_embeddings, temp_kb_file):
+        """構築したインデックスが再利用され、ソースの内容が変わった場合のみ再構築されるかをテストする。"""
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        mock_embeddings.return_value = DeterministicFakeEmbedding(size=16)
+
+        with patch.object(kb_module.FAISS, 'from_documents', wraps=kb_module.FAISS.from_documents) as spy:
+            kb = KnowledgeBase()
+            kb.load_documents(str(temp_kb_file))
+            assert spy.call_count == 1
+
+            # 同一プロセス内ではロード済みのベクトルストアを共有する
+            second = KnowledgeBase()
+            second.load_documents(str(temp_kb_file))
+            assert second.vector_store is kb.vector_store
+            assert spy.call_count == 1
+
+            # プロセス内キャッシュを破棄しても、ディスク上のインデックスから復元される
+            clear_knowledge_base_cache()
+            restored = KnowledgeBase()
+            restored.load_documents(str(temp_kb_file))
+            assert spy.call_count == 1
+            assert restored.vector_store is not kb.vector_store
+            assert "RAG" in restored.vector_store.similarity_search("RAG", k=1)[0].page_content
+
+            # 内容が変わればキーが変わり、再構築される
+            temp_kb_file.write_text("Completely different content.")
+            changed = KnowledgeBase()
+            changed.load_documents(str(temp_kb_file))
+            assert spy.call_count == 2
+
+        assert mock_embeddings.call_count == 1
+
+    @patch('llm_api.rag.knowledge_base.WebBaseLoader')
+    @patch('llm_api.rag.knowledge_base.HuggingFaceEmbeddings')
+    def test_url_index_is_rebuilt_after_ttl(self, mock_embeddings, mock_loader, monkeypatch):
+        """URLソースのインデックスは有効期間内は再利用し、期限切れ後は再取得して再構築するかをテストする。"""
+        from langchain_core.documents import Document
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        mock_embeddings.return_value = DeterministicFakeEmbedding(size=16)
+        mock_loader.return_value.load.return_value = [Document(page_content="Web page about RAG.")]
+        monkeypatch.setattr(kb_module.settings, "RAG_URL_INDEX_TTL", 60.0)
+        url = "https://example.com/rag"
+
+        KnowledgeBase().load_documents(url)
+        clear_knowledge_base_cache()
+        KnowledgeBase().load_documents(url)
+        assert mock_loader.call_count == 1
+
+        with patch('llm_api.rag.knowledge_base.time.time', return_value=time.time() + 120):
+            KnowledgeBase().load_documents(url)
+            assert mock_loader.call_count == 2
+            # 再構築したインデックスは新しい作成時刻で保存され、再び再利用される
+            clear_knowledge_base_cache()
+            KnowledgeBase().load_documents(url)
+        assert mock_loader.call_count == 2
+
+
 class TestRAGManager:
     """RAGManagerクラスのテストスイート"""
 